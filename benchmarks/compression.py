@@ -0,0 +1,104 @@
+"""
+Benchmark for block compression settings.
+
+This measures write throughput, read latency and on-disk size without
+compression, with Snappy, and with zstd at a few levels (if LevelDB was
+built with zstd support), for several value sizes.
+
+Usage: python benchmarks/compression.py
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import plyvel
+
+DATA_SIZE = 32 * 1024 * 1024
+VALUE_SIZES = (100, 1000, 10000)
+LOOKUPS = 20000
+SETTINGS = (
+    (None, None),
+    ('snappy', None),
+    ('zstd', 1),
+    ('zstd', 3),
+    ('zstd', 9),
+)
+
+WORDS = (b'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda '
+         b'mu nu xi omicron pi rho sigma tau upsilon phi chi psi omega '
+         b'0 1 2 3 4 5 6 7 8 9 user id name email created updated').split()
+
+
+def make_values(value_size, n):
+    """Generate text-like values, which compress reasonably well."""
+    rng = random.Random(42)
+    values = []
+    for _ in range(n):
+        words = []
+        length = 0
+        while length < value_size:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        values.append(b' '.join(words)[:value_size])
+    return values
+
+
+def disk_size(name):
+    return sum(
+        os.path.getsize(os.path.join(name, filename))
+        for filename in os.listdir(name)
+        if filename.endswith(('.ldb', '.sst')))
+
+
+def run(compression, compression_level, value_size):
+    n = DATA_SIZE // value_size
+    values = make_values(value_size, min(n, 1000))
+    keys = [b'key-%08d' % i for i in range(n)]
+    name = tempfile.mkdtemp()
+    try:
+        db = plyvel.DB(name, create_if_missing=True, compression=compression,
+                       compression_level=compression_level)
+        start = time.perf_counter()
+        db.put_many(
+            (key, values[i % len(values)]) for i, key in enumerate(keys))
+        db.compact_range()
+        write_time = time.perf_counter() - start
+
+        step = 7919  # prime, to avoid sequential access patterns
+        lookups = [keys[i * step % n] for i in range(LOOKUPS)]
+        start = time.perf_counter()
+        for key in lookups:
+            db.get(key)
+        read_time = time.perf_counter() - start
+
+        db.close()
+        return (DATA_SIZE / write_time / 1e6, read_time / LOOKUPS * 1e6,
+                disk_size(name))
+    finally:
+        shutil.rmtree(name)
+
+
+def main():
+    print('%-10s %6s  %10s %10s %10s' % (
+        'setting', 'value', 'write MB/s', 'read us', 'size MB'))
+    for value_size in VALUE_SIZES:
+        for compression, compression_level in SETTINGS:
+            setting = compression or 'none'
+            if compression_level is not None:
+                setting += '-%d' % compression_level
+            try:
+                write_mbps, read_us, size = run(
+                    compression, compression_level, value_size)
+            except ValueError:
+                print('%-10s %6d  (not supported)' % (setting, value_size))
+                continue
+            print('%-10s %6d  %10.1f %10.2f %10.1f' % (
+                setting, value_size, write_mbps, read_us, size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark for short prefix lookups.
+
+This measures the cost of many small prefix scans, each returning only a
+few entries, which is dominated by iterator creation and positioning
+rather than by the actual data transfer.
+
+Usage: python benchmarks/prefix_lookup.py
+"""
+
+import shutil
+import tempfile
+import timeit
+
+import plyvel
+
+N_PREFIXES = 10000
+ENTRIES_PER_PREFIX = 4
+LOOKUPS = 100000
+
+
+def fill(db):
+    with db.write_batch() as wb:
+        for i in range(N_PREFIXES):
+            for j in range(ENTRIES_PER_PREFIX):
+                wb.put(b'prefix-%06d/%02d' % (i, j), b'x' * 100)
+
+
+def prefixes():
+    step = 7919  # prime, to avoid sequential access patterns
+    return [b'prefix-%06d/' % (i * step % N_PREFIXES) for i in range(LOOKUPS)]
+
+
+def new_iterator(db, keys):
+    for prefix in keys:
+        with db.iterator(prefix=prefix) as it:
+            for _ in it:
+                pass
+
+
+def reset_iterator(db, keys):
+    with db.iterator() as it:
+        for prefix in keys:
+            it.reset(prefix=prefix)
+            for _ in it:
+                pass
+
+
+def main():
+    for iterator_pool_size in (0, 8):
+        name = tempfile.mkdtemp()
+        try:
+            db = plyvel.DB(name, create_if_missing=True,
+                           iterator_pool_size=iterator_pool_size)
+            fill(db)
+            keys = prefixes()
+            for func in (new_iterator, reset_iterator):
+                duration = min(timeit.repeat(
+                    lambda: func(db, keys), number=1, repeat=3))
+                print('%-16s pool=%d  %8.2f us/lookup' % (
+                    func.__name__, iterator_pool_size,
+                    duration / LOOKUPS * 1e6))
+            db.close()
+        finally:
+            shutil.rmtree(name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+"""
+Benchmark suite covering the hot paths of Plyvel.
+
+Each benchmark reports its throughput in operations per second (the best
+of a few repetitions). Results can be saved as JSON, and compared against
+a previously saved baseline; the comparison fails if a benchmark became
+slower than the baseline by more than the threshold.
+
+Usage:
+
+    python benchmarks/suite.py [-k FILTER] [--output results.json]
+                               [--baseline baseline.json] [--threshold 0.1]
+                               [--scale 1.0]
+
+See also the bench and bench-baseline targets in the Makefile.
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import plyvel
+
+N_KEYS = 50000
+VALUE = b'x' * 100
+STEP = 7919  # prime, to avoid sequential access patterns
+
+# Number of keys in the databases; run() scales this down for quick runs.
+n_keys = N_KEYS
+
+BENCHMARKS = []
+
+
+def benchmark(ops=None, database='default'):
+    """Register a benchmark performing `ops` operations per run.
+
+    The function is called with the database and the number of operations
+    to perform, which defaults to the number of keys.
+    """
+    def register(func):
+        BENCHMARKS.append((func.__name__, func, ops, database))
+        return func
+    return register
+
+
+def keys(n, prefix=b'key-'):
+    return [prefix + b'%08d' % (i * STEP % n_keys) for i in range(n)]
+
+
+def reverse_comparator(a, b):
+    if a < b:
+        return 1
+    if a > b:
+        return -1
+    return 0
+
+
+DATABASES = {
+    'default': {},
+    'hot_cache': {'hot_cache_size': 16 * 1024 * 1024},
+    'comparator': {'comparator': reverse_comparator,
+                   'comparator_name': b'Reverse'},
+}
+
+
+def fill(db):
+    with db.write_batch() as wb:
+        for key in keys(n_keys):
+            wb.put(key, VALUE)
+        for key in keys(n_keys, prefix=b'prefixed/key-'):
+            wb.put(key, VALUE)
+
+
+#
+# Point reads
+#
+
+@benchmark(ops=50000)
+def get_hit(db, n):
+    for key in keys(n):
+        db.get(key)
+
+
+@benchmark(ops=50000)
+def get_miss(db, n):
+    for key in keys(n, prefix=b'missing-'):
+        db.get(key)
+
+
+@benchmark(ops=50000)
+def get_no_fill_cache(db, n):
+    for key in keys(n):
+        db.get(key, fill_cache=False)
+
+
+@benchmark(ops=50000, database='hot_cache')
+def get_hot_cache(db, n):
+    for key in keys(n // 50) * 50:
+        db.get(key)
+
+
+@benchmark(ops=50000)
+def get_many(db, n):
+    all_keys = keys(n)
+    for i in range(0, len(all_keys), 100):
+        db.get_many(all_keys[i:i + 100])
+
+
+@benchmark(ops=50000)
+def lookup_sorted(db, n):
+    all_keys = keys(n)
+    for i in range(0, len(all_keys), 1000):
+        db.lookup_sorted(all_keys[i:i + 1000])
+
+
+@benchmark(ops=50000)
+def exists_many(db, n):
+    all_keys = keys(n)
+    for i in range(0, len(all_keys), 100):
+        db.exists_many(all_keys[i:i + 100])
+
+
+@benchmark(ops=50000)
+def snapshot_get(db, n):
+    with db.snapshot() as snapshot:
+        for key in keys(n):
+            snapshot.get(key)
+
+
+@benchmark(ops=50000)
+def prefixed_get(db, n):
+    prefixed_db = db.prefixed_db(b'prefixed/')
+    for key in keys(n):
+        prefixed_db.get(key)
+
+
+#
+# Writes
+#
+
+@benchmark(ops=50000)
+def put(db, n):
+    for key in keys(n):
+        db.put(key, VALUE)
+
+
+@benchmark(ops=200)
+def put_sync(db, n):
+    for key in keys(n):
+        db.put(key, VALUE, sync=True)
+
+
+@benchmark(ops=50000)
+def prefixed_put(db, n):
+    prefixed_db = db.prefixed_db(b'prefixed/')
+    for key in keys(n):
+        prefixed_db.put(key, VALUE)
+
+
+def write_batches(db, n, batch_size):
+    all_keys = keys(n)
+    for i in range(0, len(all_keys), batch_size):
+        with db.write_batch() as wb:
+            for key in all_keys[i:i + batch_size]:
+                wb.put(key, VALUE)
+
+
+@benchmark(ops=50000)
+def write_batch_10(db, n):
+    write_batches(db, n, 10)
+
+
+@benchmark(ops=50000)
+def write_batch_1000(db, n):
+    write_batches(db, n, 1000)
+
+
+@benchmark(ops=10000)
+def transaction(db, n):
+    for key in keys(n):
+        with db.transaction() as t:
+            t.put(key, t.get(key, b'')[:64] + b'.')
+
+
+@benchmark(ops=50000, database='comparator')
+def comparator_put(db, n):
+    for key in keys(n):
+        db.put(key, VALUE)
+
+
+#
+# Iteration
+#
+
+@benchmark()
+def iterate_forward(db, n):
+    for _ in db.iterator(stop=b'key.'):
+        pass
+
+
+@benchmark()
+def iterate_reverse(db, n):
+    for _ in db.iterator(reverse=True, stop=b'key.'):
+        pass
+
+
+@benchmark()
+def iterate_prefix(db, n):
+    for _ in db.iterator(prefix=b'prefixed/'):
+        pass
+
+
+@benchmark()
+def iterate_keys_only(db, n):
+    for _ in db.iterator(stop=b'key.', include_value=False):
+        pass
+
+
+@benchmark()
+def iterate_next_batch(db, n):
+    with db.iterator(stop=b'key.') as it:
+        while it.next_batch(1000):
+            pass
+
+
+@benchmark()
+def iterate_filtered(db, n):
+    key_filter = plyvel.Filter.suffix(b'7')
+    for _ in db.iterator(stop=b'key.', key_filter=key_filter):
+        pass
+
+
+@benchmark()
+def warm(db, n):
+    db.warm(b'key-').result()
+
+
+@benchmark()
+def iterate_readahead(db, n):
+    for _ in db.iterator(stop=b'key.', readahead=256):
+        pass
+
+
+@benchmark()
+def snapshot_iterate(db, n):
+    with db.snapshot() as snapshot:
+        for _ in snapshot.iterator(stop=b'key.'):
+            pass
+
+
+@benchmark()
+def prefixed_iterate(db, n):
+    for _ in db.prefixed_db(b'prefixed/').iterator():
+        pass
+
+
+@benchmark()
+def raw_iterator_step(db, n):
+    with db.raw_iterator() as it:
+        it.seek_to_first()
+        for _ in range(n):
+            it.key()
+            it.next()
+
+
+@benchmark(database='comparator')
+def comparator_iterate(db, n):
+    for _ in db.iterator(start=b'key.'):
+        pass
+
+
+@benchmark(ops=10000)
+def prefix_lookup(db, n):
+    with db.iterator() as it:
+        for key in keys(n):
+            it.reset(prefix=key[:-1])
+            for _ in it:
+                pass
+
+
+#
+# Multi-threaded contention
+#
+
+def run_threads(db, func, n, n_threads=4):
+    all_keys = keys(n)
+    threads = [threading.Thread(target=func, args=(db, all_keys[i::n_threads]))
+               for i in range(n_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def thread_gets(db, thread_keys):
+    for key in thread_keys:
+        db.get(key)
+
+
+def thread_puts(db, thread_keys):
+    for key in thread_keys:
+        db.put(key, VALUE)
+
+
+@benchmark(ops=12500)
+def threads_get(db, n):
+    run_threads(db, thread_gets, n)
+
+
+@benchmark(ops=12500)
+def threads_put(db, n):
+    run_threads(db, thread_puts, n)
+
+
+#
+# Running and comparing
+#
+
+def run(name_filter=None, repeat=3, scale=1.0):
+    """Run the benchmarks; return their throughput by name.
+
+    The number of keys and the number of operations of each benchmark are
+    multiplied by `scale`.
+    """
+    global n_keys
+    n_keys = max(int(N_KEYS * scale), 1)
+    results = {}
+    for database in DATABASES:
+        selected = [
+            (name, func, ops) for name, func, ops, db_name in BENCHMARKS
+            if db_name == database
+            and (not name_filter or name_filter in name)]
+        if not selected:
+            continue
+
+        path = tempfile.mkdtemp()
+        try:
+            db = plyvel.DB(path, create_if_missing=True,
+                           **DATABASES[database])
+            fill(db)
+            for name, func, ops in selected:
+                n = n_keys if ops is None else max(int(ops * scale), 1)
+                durations = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    func(db, n)
+                    durations.append(time.perf_counter() - start)
+                results[name] = n / min(durations)
+                print('%-22s %12.0f ops/s' % (name, results[name]))
+                sys.stdout.flush()
+            db.close()
+        finally:
+            shutil.rmtree(path)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print a comparison; return the names of regressed benchmarks."""
+    regressions = []
+    print()
+    print('%-22s %12s %12s %8s' % ('benchmark', 'baseline', 'current',
+                                   'change'))
+    for name, ops in results.items():
+        if name not in baseline:
+            continue
+        change = ops / baseline[name] - 1
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(name)
+        print('%-22s %12.0f %12.0f %+7.1f%%%s' % (
+            name, baseline[name], ops, change * 100,
+            '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-k', dest='filter',
+                        help="only run benchmarks containing this string")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="number of repetitions (default: 3)")
+    parser.add_argument('--output', help="save results to this JSON file")
+    parser.add_argument('--baseline',
+                        help="compare against results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="allowed slowdown relative to the baseline "
+                             "(default: 0.1)")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="factor for the number of keys and operations, "
+                             "e.g. 0.01 for a quick run (default: 1.0)")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if args.scale <= 0:
+        parser.error("--scale must be positive")
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline.get('scale', 1.0) != args.scale:
+            print('The baseline was recorded with --scale %g' % (
+                baseline.get('scale', 1.0)))
+            return 1
+
+    results = run(args.filter, args.repeat, args.scale)
+    if not results:
+        print('No benchmarks match %r' % args.filter)
+        return 1
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'leveldb': plyvel.__leveldb_version__,
+                'plyvel': plyvel.__version__,
+                'machine': platform.machine(),
+                'scale': args.scale,
+                'results': results,
+            }, fp, indent=2, sort_keys=True)
+
+    if args.baseline:
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print('\n%d benchmark(s) regressed by more than %.0f%%: %s' % (
+                len(regressions), args.threshold * 100,
+                ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
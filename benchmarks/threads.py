@@ -0,0 +1,78 @@
+"""
+Benchmark for multi-threaded throughput.
+
+This measures how well concurrent gets, puts, and short scans scale with
+the number of threads. On regular CPython builds the GIL is released
+during LevelDB calls, so some scaling is expected; on free-threaded
+builds (e.g. python3.13t) the Python-level work also runs in parallel.
+
+Usage: python benchmarks/threads.py
+"""
+
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import plyvel
+
+N_KEYS = 100000
+OPS_PER_THREAD = 50000
+THREAD_COUNTS = (1, 2, 4, 8)
+
+
+def fill(db):
+    with db.write_batch() as wb:
+        for i in range(N_KEYS):
+            wb.put(b'key-%08d' % i, b'x' * 100)
+
+
+def get(db, seed):
+    for i in range(OPS_PER_THREAD):
+        db.get(b'key-%08d' % ((seed + i * 7919) % N_KEYS))
+
+
+def put(db, seed):
+    for i in range(OPS_PER_THREAD):
+        db.put(b'key-%08d' % ((seed + i * 7919) % N_KEYS), b'y' * 100)
+
+
+def scan(db, seed):
+    with db.iterator() as it:
+        for i in range(OPS_PER_THREAD // 10):
+            it.reset(start=b'key-%08d' % ((seed + i * 7919) % N_KEYS))
+            for _, _ in zip(range(10), it):
+                pass
+
+
+def run(db, func, n_threads):
+    threads = [threading.Thread(target=func, args=(db, n * 1000))
+               for n in range(n_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return n_threads * OPS_PER_THREAD / (time.perf_counter() - start)
+
+
+def main():
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('GIL enabled: %s' % gil_enabled)
+
+    name = tempfile.mkdtemp()
+    try:
+        db = plyvel.DB(name, create_if_missing=True, iterator_pool_size=8)
+        fill(db)
+        for func in (get, put, scan):
+            for n_threads in THREAD_COUNTS:
+                print('%-5s threads=%d  %10.0f ops/s' % (
+                    func.__name__, n_threads, run(db, func, n_threads)))
+        db.close()
+    finally:
+        shutil.rmtree(name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark for the value codec.
+
+This compares small JSON-like records stored as is with records compressed
+by the value codec, using a block cache that is smaller than the data, so
+that the better cache efficiency of compressed values shows.
+
+Usage: python benchmarks/value_codec.py
+"""
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import plyvel
+
+N_RECORDS = 200000
+LOOKUPS = 100000
+CACHE_SIZE = 8 * 1024 * 1024
+
+
+def make_records():
+    rng = random.Random(42)
+    records = []
+    for i in range(N_RECORDS):
+        records.append(json.dumps({
+            'id': i,
+            'name': 'user %d' % rng.randrange(10 ** 6),
+            'email': 'user%d@example.com' % rng.randrange(10 ** 6),
+            'created': '2024-01-%02dT%02d:%02d:00Z' % (
+                rng.randrange(1, 29), rng.randrange(24), rng.randrange(60)),
+            'tags': rng.sample(['admin', 'beta', 'staff', 'trial', 'paid'], 2),
+            'score': round(rng.random(), 3),
+            'active': rng.random() < 0.5,
+        }).encode())
+    return records
+
+
+def disk_size(name):
+    return sum(
+        os.path.getsize(os.path.join(name, filename))
+        for filename in os.listdir(name)
+        if filename.endswith(('.ldb', '.sst')))
+
+
+def run(records, value_codec_prefix):
+    step = 7919  # prime, to avoid sequential access patterns
+    keys = [b'record-%08d' % (i * step % N_RECORDS)
+            for i in range(N_RECORDS)]
+    name = tempfile.mkdtemp()
+    try:
+        db = plyvel.DB(name, create_if_missing=True,
+                       lru_cache_size=CACHE_SIZE,
+                       value_codec_prefix=value_codec_prefix)
+        if value_codec_prefix is not None:
+            # Train on a small part of the data first.
+            db.put_many(zip(keys[:5000], records[:5000]))
+            db.train_value_codec()
+
+        start = time.perf_counter()
+        db.put_many(zip(keys, records))
+        put_time = time.perf_counter() - start
+        db.compact_range()
+
+        lookups = keys[:LOOKUPS]
+        for _ in range(2):  # the first round warms up the cache
+            start = time.perf_counter()
+            for key in lookups:
+                db.get(key)
+            get_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with db.iterator() as it:
+            while it.next_batch(1000):
+                pass
+        scan_time = time.perf_counter() - start
+
+        db.close()
+        return (put_time / N_RECORDS * 1e6, get_time / LOOKUPS * 1e6,
+                scan_time / N_RECORDS * 1e6, disk_size(name))
+    finally:
+        shutil.rmtree(name)
+
+
+def main():
+    records = make_records()
+    print('average record size: %.0f bytes' % (
+        sum(map(len, records)) / len(records)))
+    print('%-8s %10s %10s %10s %10s' % (
+        'codec', 'put us', 'get us', 'scan us', 'size MB'))
+    for value_codec_prefix in (None, b'\xff/codec/'):
+        put_us, get_us, scan_us, size = run(records, value_codec_prefix)
+        print('%-8s %10.2f %10.2f %10.2f %10.1f' % (
+            'off' if value_codec_prefix is None else 'on',
+            put_us, get_us, scan_us, size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
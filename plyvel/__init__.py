@@ -7,11 +7,20 @@ from ._plyvel import (  # noqa
     __leveldb_version__,
     DB,
     repair_db,
+    recompress_db,
     destroy_db,
+    get_include,
+    merge_iterators,
+    Filter,
     Error,
     IOError,
     CorruptionError,
     IteratorInvalidError,
+    TransactionConflictError,
 )
 
+from ._indexed import IndexedCollection  # noqa
+from ._remote import ProtocolError, RemoteDB  # noqa
+from ._sharding import ShardedDB  # noqa
+from ._ttl import TTLDB  # noqa
 from ._version import __version__  # noqa
@@ -0,0 +1,285 @@
+"""
+Collections of records with automatically maintained secondary indexes.
+"""
+
+import operator
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ._plyvel import PrefixedDB, uses_default_comparator
+
+# Records and index entries are stored under separate single byte
+# prefixes. Index entries have empty values, and keys consisting of
+# INDEX_PREFIX, the index name, a zero byte, the escaped index value, and
+# the primary key.
+RECORD_PREFIX = b'r'
+RECORD_STOP = b's'
+INDEX_PREFIX = b'i'
+
+# Number of index entries resolved to records at a time
+FETCH_SIZE = 1000
+
+
+def _escape(value):
+    # Zero bytes are escaped, and a terminator is appended, so that index
+    # values can be followed by the primary key without changing their
+    # sort order.
+    if not isinstance(value, bytes):
+        raise TypeError(
+            "Index values must be byte strings, not %s"
+            % type(value).__name__)
+    return value.replace(b'\x00', b'\x00\xff') + b'\x00\x00'
+
+
+def _primary_key(index_key, offset):
+    return index_key[index_key.index(b'\x00\x00', offset) + 2:]
+
+
+def _extractor(spec):
+    if isinstance(spec, slice):
+        # itemgetter() slices the value without running Python code.
+        return operator.itemgetter(spec)
+    if callable(spec):
+        return spec
+    raise TypeError("Index extractors must be callables or slices")
+
+
+class IndexedCollection:
+    def __init__(self, db, indexes, *, max_workers=None):
+        if not indexes:
+            raise ValueError("At least one index is required")
+        if max_workers is not None and max_workers < 1:
+            raise ValueError("'max_workers' must be positive")
+        if not uses_default_comparator(db):
+            # Index entries are ordered by the escaped index value.
+            raise ValueError(
+                "Indexed collections require the default comparator")
+
+        self.db = db
+        self._extractors = {}
+        self._bases = {}
+        for name, spec in indexes.items():
+            if not isinstance(name, str) or not name or '\x00' in name:
+                raise ValueError("Invalid index name: %r" % (name,))
+            self._extractors[name] = _extractor(spec)
+            self._bases[name] = INDEX_PREFIX + name.encode('utf-8') + b'\x00'
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+        # Serializes writes, which read the old records to find the index
+        # entries to delete.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<plyvel.IndexedCollection for %r with indexes %s at 0x%s>' % (
+            self.db,
+            ', '.join(self._extractors),
+            hex(id(self)),
+        )
+
+    @property
+    def indexes(self):
+        return tuple(self._extractors)
+
+    def _base(self, index):
+        try:
+            return self._bases[index]
+        except KeyError:
+            raise ValueError("Unknown index: %r" % (index,)) from None
+
+    def _index_keys(self, key, value, names):
+        index_keys = set()
+        for name in names:
+            extracted = self._extractors[name](value)
+            if extracted is None:
+                continue
+            if isinstance(extracted, bytes):
+                extracted = (extracted,)
+            base = self._bases[name]
+            for index_value in extracted:
+                index_keys.add(base + _escape(index_value) + key)
+        return index_keys
+
+    def get(self, key, default=None, **kwargs):
+        return self.db.get(RECORD_PREFIX + key, default, **kwargs)
+
+    def get_many(self, keys, default=None, **kwargs):
+        return self.db.get_many([RECORD_PREFIX + key for key in keys],
+                                default, **kwargs)
+
+    def put(self, key, value, *, sync=False):
+        self._write({key: value}, sync)
+
+    def delete(self, key, *, sync=False):
+        self._write({key: None}, sync)
+
+    def write_batch(self, *, transaction=False, sync=False):
+        return IndexedWriteBatch(self, transaction, sync)
+
+    def _write(self, changes, sync):
+        """Write records (or delete them, for None values)."""
+        keys = list(changes)
+        with self._lock:
+            old_values = self.db.get_many(
+                [RECORD_PREFIX + key for key in keys])
+            with self.db.write_batch(sync=sync) as wb:
+                for key, old_value in zip(keys, old_values):
+                    value = changes[key]
+                    old_index_keys = set()
+                    if old_value is not None:
+                        old_index_keys = self._index_keys(
+                            key, old_value, self._extractors)
+                    new_index_keys = set()
+                    if value is not None:
+                        new_index_keys = self._index_keys(
+                            key, value, self._extractors)
+
+                    for index_key in old_index_keys - new_index_keys:
+                        wb.delete(index_key)
+                    for index_key in new_index_keys - old_index_keys:
+                        wb.put(index_key, b'')
+                    if value is None:
+                        wb.delete(RECORD_PREFIX + key)
+                    else:
+                        wb.put(RECORD_PREFIX + key, value)
+
+    def __iter__(self):
+        return self.iterator()
+
+    def iterator(self, *, reverse=False):
+        """Iterate over all records, in primary key order."""
+        with self.db.iterator(reverse=reverse, start=RECORD_PREFIX,
+                              stop=RECORD_STOP) as it:
+            for key, value in it:
+                yield key[len(RECORD_PREFIX):], value
+
+    def lookup(self, index, value):
+        """Iterate over the records with the specified index value."""
+        start = self._base(index) + _escape(value)
+        return self._records(len(start) - 2, prefix=start)
+
+    def range(self, index, lo=None, hi=None, *, reverse=False):
+        """Iterate over the records with index values in [lo, hi)."""
+        base = self._base(index)
+        start = base if lo is None else base + _escape(lo)
+        stop = base[:-1] + b'\x01' if hi is None else base + _escape(hi)
+        return self._records(len(base), start=start, stop=stop,
+                             reverse=reverse)
+
+    def _records(self, offset, **kwargs):
+        # Index entries are resolved to records in chunks, using a single
+        # get_many() call per chunk. A snapshot makes sure that records
+        # match their index entries.
+        snapshot = self.db.snapshot()
+        try:
+            with snapshot.iterator(include_value=False, **kwargs) as it:
+                while True:
+                    index_keys = it.next_batch(FETCH_SIZE)
+                    if not index_keys:
+                        break
+                    keys = [_primary_key(index_key, offset)
+                            for index_key in index_keys]
+                    values = snapshot.get_many(
+                        [RECORD_PREFIX + key for key in keys])
+                    for key, value in zip(keys, values):
+                        if value is not None:
+                            yield key, value
+        finally:
+            snapshot.close()
+
+    def rebuild_indexes(self, *names):
+        """Rebuild the specified indexes (by default all of them).
+
+        The records are scanned in parallel threads, each handling a part
+        of the key space.
+        """
+        for name in names:
+            self._base(name)
+        names = names or tuple(self._extractors)
+
+        def scan(key_range):
+            start, stop = key_range
+            with self.db.iterator(start=start, stop=stop) as it:
+                while True:
+                    entries = it.next_batch(FETCH_SIZE)
+                    if not entries:
+                        break
+                    with self.db.write_batch() as wb:
+                        for record_key, value in entries:
+                            key = record_key[len(RECORD_PREFIX):]
+                            for index_key in self._index_keys(
+                                    key, value, names):
+                                wb.put(index_key, b'')
+
+        with self._lock:
+            for name in names:
+                base = self._bases[name]
+                with self.db.iterator(prefix=base,
+                                      include_value=False) as it:
+                    while True:
+                        index_keys = it.next_batch(FETCH_SIZE)
+                        if not index_keys:
+                            break
+                        with self.db.write_batch() as wb:
+                            for index_key in index_keys:
+                                wb.delete(index_key)
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                list(executor.map(scan, self._key_ranges()))
+
+    def _key_ranges(self):
+        """Split the records into ranges of similar size."""
+        if self.max_workers == 1:
+            return [(RECORD_PREFIX, RECORD_STOP)]
+
+        # Prefixed databases do not support sampling, so sample the
+        # underlying database instead.
+        if isinstance(self.db, PrefixedDB):
+            db = self.db.db
+            db_prefix = self.db.prefix
+        else:
+            db = self.db
+            db_prefix = b''
+        samples = db.sample_keys(self.max_workers,
+                                 start=db_prefix + RECORD_PREFIX,
+                                 stop=db_prefix + RECORD_STOP)
+        boundaries = sorted({
+            key[len(db_prefix):] for key in samples
+            if key > db_prefix + RECORD_PREFIX})
+        starts = [RECORD_PREFIX] + boundaries
+        stops = boundaries + [RECORD_STOP]
+        return list(zip(starts, stops))
+
+
+class IndexedWriteBatch:
+    def __init__(self, collection, transaction, sync):
+        self.collection = collection
+        self.transaction = transaction
+        self.sync = sync
+        self._changes = {}
+
+    def put(self, key, value):
+        self._changes[key] = value
+
+    def delete(self, key):
+        self._changes[key] = None
+
+    def clear(self):
+        self._changes.clear()
+
+    def write(self):
+        if self._changes:
+            self.collection._write(self._changes, self.sync)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.transaction and exc_type is not None:
+            # Exception occurred in transaction; do not write the batch
+            self.clear()
+            return
+
+        self.write()
+        self.clear()
@@ -0,0 +1,341 @@
+# distutils: language = c++
+
+#
+# Declarations of the Plyvel extension types, which other Cython
+# extensions can cimport to use Plyvel without Python call overhead:
+#
+#     from plyvel._plyvel cimport DB
+#     from plyvel.leveldb cimport Slice
+#
+# The methods with names starting with c_ form the C API; see the
+# "Cython API" section in doc/api.rst. Everything else in this file is
+# an implementation detail that may change without notice.
+#
+
+cimport cython
+
+from cpython cimport bool
+
+from libc.stdint cimport uint64_t
+from libcpp cimport bool as c_bool
+from libcpp.atomic cimport atomic
+from libcpp.string cimport string
+from libcpp.vector cimport vector
+
+cimport plyvel.leveldb as leveldb
+from plyvel.leveldb cimport (
+    Comparator,
+    Options,
+    ReadOptions,
+    Slice,
+    WriteOptions,
+)
+
+from plyvel.codec cimport PlyvelCodec
+from plyvel.filter cimport PlyvelFilter
+from plyvel.guard cimport PlyvelGuard
+from plyvel.readahead cimport PlyvelReadahead
+from plyvel.stats cimport PlyvelStats
+from plyvel.transaction cimport PlyvelWriteTracker
+
+
+@cython.final
+cdef class HotCache:
+    cdef readonly size_t capacity
+    cdef readonly size_t size
+    cdef readonly uint64_t hits
+    cdef readonly uint64_t misses
+    cdef readonly uint64_t evictions
+    cdef object entries
+    cdef uint64_t generation
+
+    # With a custom comparator, keys with different bytes may be equal,
+    # so invalidating a key clears the whole cache.
+    cdef bint clear_on_invalidate
+
+    # Protects all of the above, since the cache is shared by all
+    # threads using the database.
+    cdef cython.pymutex lock
+
+    cdef object lookup(self, bytes key, uint64_t* generation)
+    cdef void store(self, bytes key, bytes value, uint64_t generation)
+    cdef void discard(self, bytes key)
+    cdef void invalidate(self, bytes key)
+
+
+@cython.final
+cdef class MergeBuffer:
+    cdef readonly size_t max_keys
+    cdef readonly double flush_interval
+
+    # Maps keys to [op, combined operand] lists. The count is kept
+    # separately, so that it can be checked without taking the lock.
+    cdef dict pending
+    cdef atomic[size_t] count
+    cdef double last_flush
+    cdef cython.pymutex lock
+
+    # With a custom comparator, keys with different bytes can be equal,
+    # so pending operands are written before reading or writing any key.
+    cdef c_bool flush_on_access
+
+    cdef int add(self, bytes key, str op, object operand) except -1
+    cdef c_bool should_flush(self)
+
+
+cdef struct TraceState:
+    uint64_t start
+    uint64_t nogil_start
+
+
+@cython.final
+cdef class Instrumentation:
+    cdef PlyvelStats counters
+
+    # Tuple with the begin and end trace hooks, or None. It is replaced
+    # as a whole, so that threads always see a matching pair; begin()
+    # returns it to end() with the token, so each operation calls hooks
+    # of the same pair.
+    cdef object hooks
+
+    cdef object begin(self, int op, object key, TraceState* state)
+    cdef int end(self, int op, TraceState* state, object token,
+                 size_t nbytes, object error) except -1
+
+
+cdef struct IteratorHandle:
+    # The underlying LevelDB iterator (and read-ahead thread, if any) of
+    # an open iterator. The DB deletes these when it is closed, without
+    # touching the Python iterator object, which may concurrently be
+    # deallocated by another thread.
+    leveldb.Iterator* iter
+    PlyvelReadahead* readahead
+    IteratorHandle* prev
+    IteratorHandle* next
+
+
+@cython.final
+cdef class DB:
+    cdef leveldb.DB* _db
+    cdef Options options
+    cdef readonly object name
+    cdef readonly HotCache hot_cache
+
+    # Combines merge operands (see merge() and counter_add()) in memory,
+    # until they are written in a single batch.
+    cdef MergeBuffer merge_buffer
+
+    # Opt-in per-operation statistics and trace hooks. The statistics
+    # pointer is NULL if disabled, and is checked in code paths that run
+    # without the GIL.
+    cdef Instrumentation instrumentation
+    cdef PlyvelStats* counters
+
+    # Operations register themselves with the guard while they use the
+    # LevelDB database, so that close() can wait for them (see
+    # guard.h). This means operations never need to take a lock.
+    cdef PlyvelGuard guard
+
+    # Protects the iterator list and the iterator pool below, and the set
+    # of background tasks, and makes concurrent close() calls wait for
+    # each other.
+    cdef cython.pymutex lock
+
+    # Running background tasks (see BackgroundTask), which close()
+    # cancels and waits for.
+    cdef set background_tasks
+
+    # The handles of open iterators form an intrusive doubly linked list
+    # (see BaseIterator), and closed iterators may be kept around in a
+    # small pool for reuse.
+    cdef IteratorHandle* iterators
+    cdef vector[leveldb.Iterator*] iterator_pool
+    cdef size_t iterator_pool_size
+    cdef uint64_t iterator_pool_write_seq
+
+    # Incremented after each write, so that pooled iterators that no
+    # longer reflect the database contents can be detected.
+    cdef atomic[uint64_t] write_seq
+
+    # Change log (see changes()). The sequence number is only changed
+    # while holding the condition, which is notified after each write.
+    cdef c_bool log_changes
+    cdef readonly bytes change_log_prefix
+    cdef readonly uint64_t change_seq
+    cdef object change_condition
+
+    # Opt-in value codec (see train_value_codec()). All values are
+    # encoded when written and decoded when read, including in the C API.
+    # NULL if disabled.
+    cdef PlyvelCodec* codec
+    cdef readonly bytes value_codec_prefix
+
+    # Records the keys written while transactions are open, so that
+    # commits can detect conflicts (see transaction()). Writes go through
+    # it as well, which is a couple of atomic operations without open
+    # transactions.
+    cdef PlyvelWriteTracker write_tracker
+
+    cpdef close(self)
+
+    # C API. c_get() returns 1 if the key was found (and stores its value
+    # in `value`), or 0 if not. Like all C API methods, it raises
+    # RuntimeError if the database is closed, and plyvel.Error (or a
+    # subclass) for LevelDB errors.
+    cdef int c_get(self, Slice key, string* value,
+                   ReadOptions* read_options=*) except -1 nogil
+    cdef int c_put(self, Slice key, Slice value, c_bool sync=*) except -1 nogil
+    cdef int c_delete(self, Slice key, c_bool sync=*) except -1 nogil
+
+    cdef void link_iterator(self, IteratorHandle* handle) noexcept
+    cdef void unlink_iterator(self, IteratorHandle* handle) noexcept
+    cdef leveldb.Iterator* take_pooled_iterator(self, uint64_t write_seq)
+    cdef void release_pooled_iterator(self, leveldb.Iterator* it,
+                                      uint64_t write_seq)
+    cdef void clear_iterator_pool(self)
+
+
+@cython.final
+cdef class WriteBatch:
+    cdef leveldb.WriteBatch* _write_batch
+    cdef WriteOptions write_options
+    cdef DB db
+    cdef string key_prefix
+    cdef c_bool transaction
+
+    # Keys touched by this batch; only tracked if the database has a hot
+    # key cache that needs to be invalidated after writing the batch.
+    cdef list keys
+
+    # Change log entries for this batch; only tracked if the database
+    # has a change log.
+    cdef list changes
+
+    # C API. Keys are relative to the prefix of the PrefixedDB (if any)
+    # that created the batch. c_write() is only called with `locked` by
+    # transaction commits, which hold the write tracker lock already.
+    cdef int c_put(self, Slice key, Slice value) except -1 nogil
+    cdef int c_delete(self, Slice key) except -1 nogil
+    cdef int c_write(self, c_bool locked=*) except -1 nogil
+
+
+cdef enum IteratorState:
+    BEFORE_START
+    AFTER_STOP
+    IN_BETWEEN
+    IN_BETWEEN_ALREADY_POSITIONED
+    READING_AHEAD
+
+
+cdef enum IteratorDirection:
+    FORWARD
+    REVERSE
+
+
+@cython.no_gc_clear
+cdef class BaseIterator:
+    cdef DB db
+    cdef ReadOptions read_options
+    cdef c_bool pooled
+    cdef uint64_t write_seq
+
+    # The handle is linked into a list on the DB (needed when closing the
+    # db), and is unlinked when the iterator is closed or deallocated.
+    # The DB reference is never cleared by the garbage collector (see the
+    # no_gc_clear decorator above), since it is needed for that.
+    cdef IteratorHandle handle
+
+    # Set while a thread uses the iterator. Iterators cannot be used by
+    # multiple threads at the same time, just like generators.
+    cdef atomic[c_bool] busy
+
+    cdef object __weakref__
+
+    cdef int acquire(self) except -1
+    cdef void release(self) noexcept nogil
+    cdef void new_iterator(self)
+    cdef void delete_iterator(self)
+    cpdef close(self)
+
+
+@cython.final
+cdef class Iterator(BaseIterator):
+    cdef IteratorDirection direction
+    cdef IteratorState state
+    cdef Comparator* comparator
+    cdef bytes start
+    cdef bytes stop
+    cdef Slice start_slice
+    cdef Slice stop_slice
+    cdef c_bool include_start
+    cdef c_bool include_stop
+    cdef c_bool include_key
+    cdef c_bool include_value
+    cdef bytes db_prefix
+    cdef size_t db_prefix_len
+
+    # Background read-ahead (only used for forward iteration). While the
+    # read-ahead thread runs, the state is READING_AHEAD and the
+    # underlying iterator must not be touched.
+    cdef size_t readahead_size
+    cdef string readahead_key
+    cdef string readahead_value
+    cdef c_bool readahead_has_key
+
+    # Copy of the entry returned by c_prev() and friends, since moving
+    # backwards invalidates the entry of the underlying iterator. Also
+    # holds decoded values if the database has a value codec.
+    cdef string entry_key
+    cdef string entry_value
+
+    # Filters (if any); only matching entries are returned.
+    cdef PlyvelFilter* filter
+
+    # C API. c_next() and c_prev() work like next() and prev(): they
+    # return 1 and point `key` and `value` to the entry, or return 0 if
+    # there are no more entries. The entry stays valid until the next
+    # call on the iterator. Keys are relative to the prefix of the
+    # PrefixedDB (if any). With read-ahead, `value` is empty if the
+    # iterator was created with include_value=False.
+    cdef int c_next(self, Slice* key, Slice* value) except -1
+    cdef int c_prev(self, Slice* key, Slice* value) except -1
+    cdef int c_seek(self, Slice target) except -1
+
+    cdef int set_range(self, bool reverse, bytes start, bytes stop,
+                       bool include_start, bool include_stop,
+                       bytes prefix) except -1
+    cdef void start_readahead(self)
+    cdef void stop_readahead(self) noexcept
+    cdef int readahead_pop(self) except -1
+    cdef void entry(self, Slice* key, Slice* value) noexcept
+    cdef object current(self)
+    cdef list next_batch_decoded(self, Py_ssize_t size)
+    cdef int step(self, c_bool forward, Slice* key, Slice* value) except -1
+    cdef real_next(self)
+    cdef real_prev(self)
+    cdef int entry_matches(self) except -1
+    cdef int move_next(self) except -1
+    cdef int move_prev(self) except -1
+    cdef int move_next_any(self) except -1
+    cdef int move_prev_any(self) except -1
+    cdef int finish_prev(self) except -1
+    cdef int real_seek(self, Slice target) except -1
+
+
+@cython.final
+cdef class Snapshot:
+    cdef leveldb.Snapshot* _snapshot
+    cdef DB db
+    cdef bytes prefix
+    cdef string key_prefix
+
+    # Works like the database guard, so that closing the snapshot waits
+    # for reads that use it.
+    cdef PlyvelGuard guard
+
+    cpdef close(self)
+
+    # C API, see DB.c_get(). Keys are relative to the prefix of the
+    # PrefixedDB (if any) that created the snapshot.
+    cdef int c_get(self, Slice key, string* value,
+                   ReadOptions* read_options=*) except -1 nogil
@@ -1,4 +1,4 @@
-# cython: embedsignature=True, language_level=3
+# cython: embedsignature=True, language_level=3, freethreading_compatible=True
 
 #
 # Note about API documentation:
@@ -16,9 +16,13 @@ Plyvel, a Python LevelDB interface.
 Use plyvel.DB() to create or open a database.
 """
 
+import asyncio
+import concurrent.futures
+import heapq
 import sys
 import threading
-from weakref import ref as weakref_ref
+from collections import OrderedDict, deque
+from time import monotonic, sleep
 
 cimport cython
 
@@ -30,10 +34,11 @@ from cpython.buffer cimport (
     PyBUF_SIMPLE,
 )
 
-from libc.stdint cimport uint64_t
-from libc.stdlib cimport malloc, free
-from libc.string cimport const_char
+from libc.stdint cimport UINT64_MAX, uint64_t
+from libc.string cimport const_char, memcmp
+from libcpp.atomic cimport atomic
 from libcpp.string cimport string
+from libcpp.vector cimport vector
 from libcpp cimport bool as c_bool
 
 cimport plyvel.leveldb as leveldb
@@ -53,7 +58,33 @@ from plyvel.leveldb cimport (
     WriteOptions,
 )
 
-from plyvel.comparator cimport NewPlyvelCallbackComparator
+from plyvel.codec cimport PLYVEL_CODEC_MAX_VERSION, PlyvelCodec
+from plyvel.comparator cimport (
+    NewPlyvelCallbackComparator,
+    PlyvelInComparatorCallback,
+)
+from plyvel.compression cimport PlyvelSetZstdCompression
+from plyvel.filter cimport (
+    PLYVEL_FILTER_EQ,
+    PLYVEL_FILTER_GE,
+    PLYVEL_FILTER_GT,
+    PLYVEL_FILTER_LE,
+    PLYVEL_FILTER_LT,
+    PLYVEL_FILTER_MAX_REGEX_SIZE,
+    PLYVEL_FILTER_NE,
+    PlyvelFilter,
+)
+from plyvel.guard cimport PlyvelGuard
+from plyvel.lookup cimport PlyvelLookupSorted
+from plyvel.readahead cimport PlyvelReadahead
+from plyvel.stats cimport (
+    PLYVEL_STATS_BUCKETS,
+    PlyvelNogilTime,
+    PlyvelNow,
+    PlyvelTimerStart,
+    PlyvelTimerStop,
+)
+from plyvel.transaction cimport PlyvelReadSet
 
 
 __leveldb_version__ = '%d.%d' % (leveldb.kMajorVersion,
@@ -80,6 +111,10 @@ class IteratorInvalidError(Error):
     pass
 
 
+class TransactionConflictError(Error):
+    pass
+
+
 cdef int raise_for_status(Status st) except -1:
     if st.ok():
         return 0
@@ -98,21 +133,527 @@ cdef int raise_for_status(Status st) except -1:
 # Utilities
 #
 
+cdef inline int db_enter(DB db) except -1:
+    """Register an operation that uses the underlying LevelDB database.
+
+    DB.close() waits for registered operations to finish before deleting
+    the database. Each call must be paired with a db.guard.Exit() call,
+    which can be made without holding the GIL.
+    """
+    if not db.guard.Enter():
+        raise RuntimeError("Database is closed")
+    return 0
+
+
 cdef inline db_get(DB db, bytes key, object default, ReadOptions read_options):
     cdef string value
-    cdef Status st
+    cdef int found
     cdef Slice key_slice = Slice(key, len(key))
 
     with nogil:
-        st = db._db.Get(read_options, key_slice, &value)
+        found = db.c_get(key_slice, &value, &read_options)
 
-    if st.IsNotFound():
+    if not found:
         return default
-    raise_for_status(st)
 
     return value
 
 
+cdef list db_get_many(DB db, bytes db_prefix, object keys, object default,
+                      ReadOptions read_options):
+    cdef list key_list = []
+    cdef vector[Slice] key_slices
+    cdef vector[string] values
+    cdef vector[c_bool] found
+    cdef Status st
+    cdef size_t i
+    cdef bytes key
+    cdef uint64_t start
+
+    for key in keys:
+        if key is None:
+            raise TypeError("Keys must be byte strings")
+        if db_prefix is not None:
+            key = db_prefix + key
+        key_list.append(key)
+        key_slices.push_back(Slice(key, len(key)))
+    values.resize(key_slices.size())
+    found.resize(key_slices.size())
+
+    # Look up all keys in a single pass without the GIL
+    db_enter(db)
+    with nogil:
+        start = PlyvelTimerStart(db.counters)
+        for i in range(key_slices.size()):
+            st = db._db.Get(read_options, key_slices[i], &values[i])
+            if st.IsNotFound():
+                continue
+            if not st.ok():
+                break
+            found[i] = True
+        PlyvelTimerStop(start)
+        db.guard.Exit()
+
+    if not st.ok() and not st.IsNotFound():
+        raise_for_status(st)
+
+    if db.codec is not NULL:
+        # Decode all values in a single pass as well.
+        with nogil:
+            for i in range(values.size()):
+                if found[i]:
+                    codec_decode_in_place(db.codec, &values[i])
+
+    return [values[i] if found[i] else default for i in range(values.size())]
+
+
+cdef list db_lookup_sorted(DB db, bytes db_prefix, object keys, object default,
+                           ReadOptions read_options):
+    """Like db_get_many(), but sweeping a single iterator over the keys in
+    sorted order instead of looking up each key separately."""
+    cdef list key_list = []
+    cdef vector[Slice] key_slices
+    cdef vector[string] values
+    cdef vector[c_bool] found
+    cdef Comparator* comparator = <Comparator*>db.options.comparator
+    cdef Status st
+    cdef size_t i
+    cdef bytes key
+    cdef uint64_t start
+
+    for key in keys:
+        if key is None:
+            raise TypeError("Keys must be byte strings")
+        if db_prefix is not None:
+            key = db_prefix + key
+        key_list.append(key)
+        key_slices.push_back(Slice(key, len(key)))
+    values.resize(key_slices.size())
+    found.resize(key_slices.size())
+
+    db_enter(db)
+    with nogil:
+        start = PlyvelTimerStart(db.counters)
+        st = PlyvelLookupSorted(db._db, read_options, comparator, key_slices,
+                                &values, &found)
+        PlyvelTimerStop(start)
+        db.guard.Exit()
+
+    raise_for_status(st)
+
+    if db.codec is not NULL:
+        with nogil:
+            for i in range(values.size()):
+                if found[i]:
+                    codec_decode_in_place(db.codec, &values[i])
+
+    return [values[i] if found[i] else default for i in range(values.size())]
+
+
+cdef list db_exists_many(DB db, bytes db_prefix, object keys,
+                         ReadOptions read_options):
+    """Check which keys exist, without reading their values.
+
+    Instead of Get(), which copies each value, this seeks an iterator to
+    each key and only compares the key it ends up at.
+    """
+    cdef list key_list = []
+    cdef vector[Slice] key_slices
+    cdef vector[size_t] order
+    cdef vector[c_bool] found
+    cdef Comparator* comparator = <Comparator*>db.options.comparator
+    cdef leveldb.Iterator* it = NULL
+    cdef c_bool pooled
+    cdef uint64_t write_seq
+    cdef Status st
+    cdef size_t i, j
+    cdef bytes key
+    cdef uint64_t start
+
+    for key in keys:
+        if key is None:
+            raise TypeError("Keys must be byte strings")
+        if db_prefix is not None:
+            key = db_prefix + key
+        key_list.append(key)
+        key_slices.push_back(Slice(key, len(key)))
+    found.resize(key_slices.size())
+
+    if (db.merge_buffer.flush_on_access
+            and db.merge_buffer.count.load() > 0
+            and read_options.snapshot is NULL):
+        db_flush_merges(db, False)
+
+    # Seeking in key order lets consecutive seeks reuse the data block
+    # the iterator is already positioned in.
+    if key_slices.size() > 1 and comparator is BytewiseComparator():
+        for i in sorted(range(len(key_list)), key=key_list.__getitem__):
+            order.push_back(i)
+    else:
+        for i in range(key_slices.size()):
+            order.push_back(i)
+
+    # Only lookups with default read options can use pooled iterators.
+    pooled = (db.iterator_pool_size > 0 and read_options.snapshot is NULL
+              and not read_options.verify_checksums
+              and read_options.fill_cache)
+
+    db_enter(db)
+    write_seq = db.write_seq.load()
+    if pooled:
+        with db.lock:
+            it = db.take_pooled_iterator(write_seq)
+    with nogil:
+        start = PlyvelTimerStart(db.counters)
+        if it is NULL:
+            it = db._db.NewIterator(read_options)
+        for i in range(order.size()):
+            j = order[i]
+            it.Seek(key_slices[j])
+            if it.Valid():
+                found[j] = comparator.Compare(it.key(), key_slices[j]) == 0
+            elif not it.status().ok():
+                break
+        st = it.status()
+        PlyvelTimerStop(start)
+    if pooled and st.ok():
+        with db.lock:
+            db.release_pooled_iterator(it, write_seq)
+    else:
+        del it
+    db.guard.Exit()
+
+    raise_for_status(st)
+
+    if db.merge_buffer.count.load() > 0 and read_options.snapshot is NULL:
+        # Keys with pending merge operands will have a value once the
+        # operands are applied.
+        for i in range(found.size()):
+            if not found[i] and key_list[i] in db.merge_buffer.pending:
+                found[i] = True
+
+    return [found[i] for i in range(found.size())]
+
+
+cdef list db_distinct_prefixes(DB db, bytes db_prefix, ReadOptions read_options,
+                               bytes delimiter, int depth, bytes start,
+                               bytes stop):
+    if not delimiter:
+        raise ValueError("'delimiter' must not be empty")
+    if depth < 1:
+        raise ValueError("'depth' must be at least 1")
+
+    cdef Comparator* comparator = <Comparator*>db.options.comparator
+    cdef c_bool bytewise = comparator is BytewiseComparator()
+
+    cdef size_t db_prefix_len = 0
+    if db_prefix is not None:
+        # With a custom comparator, the keys having the db prefix are not
+        # necessarily between the prefix and the key after it.
+        db_prefix_len = len(db_prefix)
+        if start is not None:
+            start = db_prefix + start
+        elif bytewise:
+            start = db_prefix
+        if stop is not None:
+            stop = db_prefix + stop
+        elif bytewise:
+            stop = bytes_increment(db_prefix)
+    cdef set seen = set()
+    cdef const_char* c_delimiter = delimiter
+    cdef size_t delimiter_len = len(delimiter)
+    cdef Slice stop_slice
+    if stop is not None:
+        stop_slice = Slice(stop, len(stop))
+    cdef Slice key_slice
+    cdef const_char* data
+    cdef size_t size, pos, group_len
+    cdef int found
+    cdef bytes group
+    cdef bytes target
+    cdef Slice target_slice
+    cdef list result = []
+
+    cdef leveldb.Iterator* it
+    db_enter(db)
+    with nogil:
+        it = db._db.NewIterator(read_options)
+    try:
+        if start is None:
+            with nogil:
+                it.SeekToFirst()
+        else:
+            target_slice = Slice(start, len(start))
+            with nogil:
+                it.Seek(target_slice)
+
+        while it.Valid():
+            key_slice = it.key()
+            if stop is not None and comparator.Compare(key_slice, stop_slice) >= 0:
+                break
+
+            # Find the end of the group, i.e. the position right after
+            # the depth-th delimiter after the db prefix.
+            data = key_slice.data()
+            size = key_slice.size()
+            pos = db_prefix_len
+            found = 0
+            group_len = 0
+            if db_prefix_len > 0 and (size < db_prefix_len or memcmp(
+                    data, <const_char*>db_prefix, db_prefix_len) != 0):
+                # Only with a custom comparator (see below).
+                pos = size
+            while pos + delimiter_len <= size:
+                if memcmp(data + pos, c_delimiter, delimiter_len) == 0:
+                    found += 1
+                    pos += delimiter_len
+                    if found == depth:
+                        group_len = pos
+                        break
+                else:
+                    pos += 1
+
+            if group_len == 0 or not bytewise:
+                # Keys without enough delimiters are not in a group. With
+                # a custom comparator, the keys of a group are not
+                # necessarily next to each other, so all keys are checked.
+                if group_len > 0:
+                    group = data[:group_len]
+                    if group not in seen:
+                        seen.add(group)
+                        result.append(group[db_prefix_len:])
+                with nogil:
+                    it.Next()
+                continue
+
+            group = data[:group_len]
+            result.append(group[db_prefix_len:])
+
+            # Skip past all keys in this group
+            target = bytes_increment(group)
+            if target is None:
+                break
+            target_slice = Slice(target, len(target))
+            with nogil:
+                it.Seek(target_slice)
+
+        raise_for_status(it.status())
+    finally:
+        del it
+        db.guard.Exit()
+
+    return result
+
+
+cdef bytes db_edge_key(DB db, c_bool last):
+    """Return the first (or last) key of the database, or None."""
+    cdef ReadOptions read_options
+    cdef leveldb.Iterator* it
+    cdef Slice sl
+    cdef bytes key = None
+
+    db_enter(db)
+    with nogil:
+        it = db._db.NewIterator(read_options)
+        if last:
+            it.SeekToLast()
+        else:
+            it.SeekToFirst()
+    try:
+        if it.Valid():
+            sl = it.key()
+            key = sl.data()[:sl.size()]
+        raise_for_status(it.status())
+    finally:
+        del it
+        db.guard.Exit()
+    return key
+
+
+cdef bytes key_after(DB db, bytes key):
+    """Return a key right after `key` in the order of the comparator.
+
+    For custom comparators this may not exist; then `key` itself is
+    returned.
+    """
+    cdef Comparator* comparator = <Comparator*>db.options.comparator
+    cdef Slice key_slice = Slice(key, len(key))
+    candidates = [key + b'\x00']
+    if db.options.comparator is not BytewiseComparator():
+        if key:
+            candidates.append(key[:-1])
+        candidates.append(bytes_increment(key))
+    for candidate in candidates:
+        if candidate is not None and comparator.Compare(
+                Slice(candidate, len(candidate)), key_slice) > 0:
+            return candidate
+    return key
+
+
+cdef list db_key_ranges(DB db, bytes db_prefix, tuple ranges):
+    """Translate range arguments into (start, stop) byte string tuples.
+
+    Each range is either a (start, stop) tuple, or a byte string prefix.
+    A start or stop of None means the beginning or the end of the
+    database (or the db prefix, if any). Prefixes only make sense for
+    the default comparator.
+    """
+    cdef list result = []
+    cdef bytes begin = None
+    cdef bytes end = None
+    cdef c_bool bytewise = db.options.comparator is BytewiseComparator()
+
+    if db_prefix is not None and not bytewise:
+        raise ValueError(
+            "Ranges of prefixed databases require the default comparator")
+
+    for r in ranges:
+        if isinstance(r, bytes):
+            if not bytewise:
+                raise ValueError(
+                    "Prefix ranges require the default comparator")
+            start = r if db_prefix is None else db_prefix + r
+            stop = bytes_increment(start)
+        elif isinstance(r, tuple) and len(r) == 2:
+            start, stop = r
+            if not (start is None or isinstance(start, bytes)) or not (
+                    stop is None or isinstance(stop, bytes)):
+                raise TypeError(
+                    "Start and stop of range must be byte strings or None")
+            if db_prefix is None:
+                if start is None:
+                    if bytewise:
+                        start = b''
+                    else:
+                        if begin is None:
+                            begin = db_edge_key(db, False) or b''
+                        start = begin
+            else:
+                start = db_prefix if start is None else db_prefix + start
+                if stop is None:
+                    stop = bytes_increment(db_prefix)
+                else:
+                    stop = db_prefix + stop
+        else:
+            raise TypeError(
+                "Ranges must be (start, stop) tuples or byte string prefixes")
+
+        if stop is None:
+            # Unbounded range; use a key right after the last key.
+            if end is None:
+                end = db_edge_key(db, True)
+                end = b'' if end is None else key_after(db, end)
+            stop = end
+
+        result.append((start, stop))
+
+    return result
+
+
+cdef list db_approximate_sizes(DB db, list key_ranges):
+    cdef size_t n_ranges = len(key_ranges)
+    cdef vector[Range] c_ranges
+    cdef vector[uint64_t] sizes
+    cdef bytes start, stop
+    cdef size_t i
+
+    if n_ranges == 0:
+        return []
+
+    c_ranges.reserve(n_ranges)
+    for start, stop in key_ranges:
+        c_ranges.push_back(Range(
+            Slice(start, len(start)),
+            Slice(stop, len(stop))))
+    sizes.resize(n_ranges)
+
+    db_enter(db)
+    with nogil:
+        db._db.GetApproximateSizes(c_ranges.data(), n_ranges, sizes.data())
+        db.guard.Exit()
+
+    return [sizes[i] for i in range(n_ranges)]
+
+
+cdef list db_estimate_counts(DB db, list key_ranges, size_t sample_size):
+    cdef size_t n_ranges = len(key_ranges)
+    cdef Comparator* comparator = <Comparator*>db.options.comparator
+    cdef vector[Slice] starts
+    cdef vector[Slice] stops
+    cdef vector[string] sample_ends
+    cdef vector[uint64_t] sample_counts
+    cdef vector[uint64_t] sample_bytes
+    cdef vector[c_bool] exhausted
+    cdef vector[Range] c_ranges
+    cdef vector[uint64_t] sizes
+    cdef ReadOptions read_options
+    cdef leveldb.Iterator* it
+    cdef Status st
+    cdef bytes start, stop
+    cdef size_t i
+
+    if sample_size == 0:
+        raise ValueError("'sample_size' must be at least 1")
+    if n_ranges == 0:
+        return []
+
+    for start, stop in key_ranges:
+        starts.push_back(Slice(start, len(start)))
+        stops.push_back(Slice(stop, len(stop)))
+    sample_ends.resize(n_ranges)
+    sample_counts.resize(n_ranges)
+    sample_bytes.resize(n_ranges)
+    exhausted.resize(n_ranges)
+    sizes.resize(2 * n_ranges)
+    read_options.fill_cache = False
+
+    # Sample the first rows of each range, and obtain the sizes of both
+    # the complete ranges and the sampled parts, all in a single pass.
+    db_enter(db)
+    with nogil:
+        it = db._db.NewIterator(read_options)
+        for i in range(n_ranges):
+            it.Seek(starts[i])
+            while (sample_counts[i] < sample_size and it.Valid()
+                    and comparator.Compare(it.key(), stops[i]) < 0):
+                sample_counts[i] += 1
+                sample_bytes[i] += it.key().size() + it.value().size()
+                it.Next()
+            if it.Valid() and comparator.Compare(it.key(), stops[i]) < 0:
+                sample_ends[i] = it.key().ToString()
+            else:
+                exhausted[i] = True
+                sample_ends[i] = stops[i].ToString()
+        st = it.status()
+        del it
+
+        for i in range(n_ranges):
+            c_ranges.push_back(Range(starts[i], stops[i]))
+        for i in range(n_ranges):
+            c_ranges.push_back(Range(starts[i], Slice(sample_ends[i])))
+        db._db.GetApproximateSizes(c_ranges.data(), 2 * n_ranges, sizes.data())
+        db.guard.Exit()
+
+    raise_for_status(st)
+
+    cdef list result = []
+    for i in range(n_ranges):
+        count = sample_counts[i]
+        if not exhausted[i]:
+            # Extrapolate using the on-disk size of the sampled rows, or
+            # if that is unknown (e.g. all sampled rows are in a single
+            # block), using their uncompressed size.
+            if sizes[n_ranges + i] > 0:
+                estimate = sizes[i] * count // sizes[n_ranges + i]
+            elif sample_bytes[i] > 0:
+                estimate = sizes[i] * count // sample_bytes[i]
+            else:
+                estimate = 0
+            count = max(count, estimate)
+        result.append(count)
+    return result
+
+
 cdef bytes to_file_system_name(name):
     if isinstance(name, bytes):
         return name
@@ -155,8 +696,9 @@ cdef int parse_options(Options *options, c_bool create_if_missing,
                        object write_buffer_size, object max_open_files,
                        object lru_cache_size, object block_size,
                        object block_restart_interval, object max_file_size,
-                       object compression, int bloom_filter_bits,
-                       object comparator, bytes comparator_name) except -1:
+                       object compression, object compression_level,
+                       int bloom_filter_bits, object comparator,
+                       bytes comparator_name) except -1:
     cdef size_t c_lru_cache_size
 
     options.create_if_missing = create_if_missing
@@ -185,17 +727,25 @@ cdef int parse_options(Options *options, c_bool create_if_missing,
     if max_file_size is not None:
         options.max_file_size = max_file_size
 
+    if isinstance(compression, bytes):
+        compression = compression.decode('UTF-8')
+    if compression is not None and not isinstance(compression, unicode):
+        raise TypeError("'compression' must be None or a string")
+    if compression_level is not None and compression != u'zstd':
+        raise ValueError("'compression_level' requires 'zstd' compression")
+
     if compression is None:
         options.compression = leveldb.kNoCompression
+    elif compression == u'snappy':
+        options.compression = leveldb.kSnappyCompression
+    elif compression == u'zstd':
+        if not PlyvelSetZstdCompression(
+                options, 1 if compression_level is None else compression_level):
+            raise ValueError(
+                "'zstd' compression requires Plyvel to be built against a "
+                "LevelDB version that supports it")
     else:
-        if isinstance(compression, bytes):
-            compression = compression.decode('UTF-8')
-        if not isinstance(compression, unicode):
-            raise TypeError("'compression' must be None or a string")
-        if compression == u'snappy':
-            options.compression = leveldb.kSnappyCompression
-        else:
-            raise ValueError("'compression' must be None or 'snappy'")
+        raise ValueError("'compression' must be None, 'snappy', or 'zstd'")
 
     if bloom_filter_bits > 0:
         with nogil:
@@ -213,258 +763,2192 @@ cdef int parse_options(Options *options, c_bool create_if_missing,
             comparator_name, comparator)
 
 
+cdef object range_or_prefix(bytes start, bytes stop, bytes prefix):
+    if prefix is None:
+        return (start, stop)
+    if start is not None or stop is not None:
+        raise TypeError(
+            "'prefix' cannot be used together with 'start' or 'stop'")
+    return prefix
+
+
 def contains_is_unsupported():
     raise TypeError("__contains__ is not supported ('in' and 'not in' operators)")
 
 
 #
-# Database
+# Hot key cache
 #
 
 @cython.final
-cdef class DB:
-    cdef leveldb.DB* _db
-    cdef Options options
-    cdef readonly object name
-    cdef object lock
-    cdef dict iterators
+cdef class HotCache:
+    def __init__(self, size_t capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
 
-    def __init__(self, name, *, bool create_if_missing=False,
-                 bool error_if_exists=False, paranoid_checks=None,
-                 write_buffer_size=None, max_open_files=None,
-                 lru_cache_size=None, block_size=None,
-                 block_restart_interval=None, max_file_size=None,
-                 compression='snappy', int bloom_filter_bits=0,
-                 object comparator=None, bytes comparator_name=None):
-        cdef Status st
-        cdef string fsname
-        self.name = name
+    def __repr__(self):
+        return '<plyvel.HotCache with %d/%d bytes in use at 0x%s>' % (
+            self.size,
+            self.capacity,
+            hex(id(self)),
+        )
 
-        fsname = to_file_system_name(name)
-        parse_options(
-            &self.options, create_if_missing, error_if_exists, paranoid_checks,
-            write_buffer_size, max_open_files, lru_cache_size, block_size,
-            block_restart_interval, max_file_size, compression, bloom_filter_bits,
-            comparator, comparator_name)
-        with nogil:
-            st = leveldb.DB_Open(self.options, fsname, &self._db)
-        raise_for_status(st)
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
 
-        # Keep weak references to open iterators, since deleting a C++
-        # DB instance results in a segfault if associated Iterator
-        # instances are not deleted beforehand (as mentioned in
-        # leveldb/db.h). We don't use weakref.WeakValueDictionary here
-        # for performance reasons.
-        self.lock = threading.Lock()
-        self.iterators = dict()
+    cdef object lookup(self, bytes key, uint64_t* generation):
+        """Return the cached value for `key`, or None.
 
-    cpdef close(self):
-        # If the constructor raised an exception (and hence never
-        # completed), self.iterators can be None. In that case no
-        # iterators need to be cleaned anyway.
-        cdef BaseIterator iterator
-        if self.iterators is not None:
-            with self.lock:
-                while self.iterators:
-                    iterator = self.iterators.popitem()[1]()
-                    if iterator is not None:
-                        iterator.close()
+        On a cache miss, the current generation is stored in
+        `generation`, for passing to store() later on.
 
-        if self._db is not NULL:
-            del self._db
-            self._db = NULL
+        This is an internal helper function that is not exposed in the
+        external Python API.
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                generation[0] = self.generation
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
 
-        if self.options.block_cache is not NULL:
-            del self.options.block_cache
-            self.options.block_cache = NULL
+    cdef void store(self, bytes key, bytes value, uint64_t generation):
+        cdef size_t entry_size = len(key) + len(value)
+
+        with self.lock:
+            # A write happened since the caller started its read, so the
+            # value it obtained may already be stale; do not cache it.
+            if generation != self.generation:
+                return
+
+            if entry_size > self.capacity:
+                return
+
+            self.discard(key)
+            while self.size + entry_size > self.capacity:
+                old_key, old_value = self.entries.popitem(last=False)
+                self.size -= len(old_key) + len(old_value)
+                self.evictions += 1
+
+            self.entries[key] = value
+            self.size += entry_size
+
+    cdef void discard(self, bytes key):
+        # The caller must hold the lock.
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.size -= len(key) + len(value)
+
+    cdef void invalidate(self, bytes key):
+        with self.lock:
+            self.generation += 1
+            if self.clear_on_invalidate:
+                self.entries.clear()
+                self.size = 0
+            else:
+                self.discard(key)
 
-        if self.options.filter_policy is not NULL:
-            del self.options.filter_policy
-            self.options.filter_policy = NULL
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
 
-        if self.options.comparator is not NULL:
-            # The built-in BytewiseComparator must not be deleted
-            if self.options.comparator is not BytewiseComparator():
-                del self.options.comparator
-                self.options.comparator = NULL
 
-    property closed:
-        def __get__(self):
-            return self._db is NULL
+#
+# Instrumentation
+#
 
-    def __dealloc__(self):
-        self.close()
+cdef enum Operation:
+    OP_GET
+    OP_GET_MANY
+    OP_PUT
+    OP_DELETE
+    OP_WRITE
+    OP_ITERATOR
+    OP_SNAPSHOT
 
-    def __repr__(self):
-        return '<plyvel.DB with name %r%s at 0x%s>' % (
-            self.name,
-            ' (closed)' if self.closed else '',
-            hex(id(self)),
-        )
 
-    def get(self, bytes key not None, default=None, *,
-            bool verify_checksums=False, bool fill_cache=True):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+cdef tuple OPERATIONS = (
+    'get', 'get_many', 'put', 'delete', 'write', 'iterator', 'snapshot')
 
-        cdef ReadOptions read_options
-        read_options.verify_checksums = verify_checksums
-        read_options.fill_cache = fill_cache
 
-        return db_get(self, key, default, read_options)
+@cython.final
+cdef class Instrumentation:
+    cdef object begin(self, int op, object key, TraceState* state):
+        """Start measuring an operation; return a token for end().
+
+        Each call must be paired with an end() call. The token holds the
+        trace hooks and the begin hook result, so that end() calls the
+        end hook matching the begin hook, even if set_trace_hooks() was
+        called in between. This is an internal helper function that is
+        not exposed in the external Python API.
+        """
+        hooks = self.hooks
+        token = None
+        if hooks is not None:
+            token = (hooks, hooks[0](OPERATIONS[op], key))
+        state.nogil_start = PlyvelNogilTime()
+        state.start = PlyvelNow()
+        return token
+
+    cdef int end(self, int op, TraceState* state, object token,
+                 size_t nbytes, object error) except -1:
+        cdef uint64_t now = PlyvelNow()
+        self.counters.Record(op, now - state.start,
+                             PlyvelNogilTime() - state.nogil_start, nbytes,
+                             error is not None)
+        if token is not None:
+            hooks, context = token
+            hooks[1](context, error)
+        return 0
 
-    def put(self, bytes key not None, value not None, *, bool sync=False):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+    def stats(self):
+        cdef int op, i
+        cdef uint64_t n
+        cdef dict result = {}
+        for op in range(len(OPERATIONS)):
+            histogram = {}
+            for i in range(PLYVEL_STATS_BUCKETS):
+                n = self.counters.BucketCount(op, i)
+                if n == 0:
+                    continue
+                if i == PLYVEL_STATS_BUCKETS - 1:
+                    histogram[float('inf')] = n
+                else:
+                    histogram[(1 << i) / 1e6] = n
+            result[OPERATIONS[op]] = {
+                'count': self.counters.Count(op),
+                'errors': self.counters.Errors(op),
+                'bytes': self.counters.Bytes(op),
+                'time': self.counters.TimeNs(op) / 1e9,
+                'nogil_time': self.counters.NogilNs(op) / 1e9,
+                'histogram': histogram,
+            }
+        return result
 
-        cdef WriteOptions write_options = WriteOptions()
-        write_options.sync = sync
 
-        cdef Slice key_slice = Slice(key, len(key))
-        cdef Py_buffer value_buffer
-        cdef Status st
-        PyObject_GetBuffer(value, &value_buffer, PyBUF_SIMPLE)
-        try:
-            with nogil:
-                st = self._db.Put(
-                    write_options,
-                    key_slice,
-                    Slice(<const_char *>value_buffer.buf, value_buffer.len))
-        finally:
-            PyBuffer_Release(&value_buffer)
-        raise_for_status(st)
+#
+# Change log
+#
 
-    def delete(self, bytes key not None, *, bool sync=False):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+cdef bytes encode_change(bytes key, bytes value):
+    # Log entries hold the operation, the key length, the key, and (for
+    # puts) the value.
+    if value is None:
+        return b'd' + len(key).to_bytes(4, 'big') + key
+    return b'p' + len(key).to_bytes(4, 'big') + key + value
 
-        cdef Status st
-        cdef WriteOptions write_options
-        write_options.sync = sync
 
-        cdef Slice key_slice = Slice(key, len(key))
-        with nogil:
-            st = self._db.Delete(write_options, key_slice)
-        raise_for_status(st)
+cdef tuple decode_change(bytes prefix, bytes log_key, bytes entry):
+    cdef size_t n = int.from_bytes(entry[1:5], 'big')
+    seq = int.from_bytes(log_key[len(prefix):], 'big')
+    key = entry[5:5 + n]
+    if entry[:1] == b'd':
+        return (seq, key, None)
+    return (seq, key, entry[5 + n:])
 
-    def write_batch(self, *, bool transaction=False, bool sync=False):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
 
-        return WriteBatch(self, None, transaction, sync)
+cdef int db_write_raw(DB db, leveldb.WriteBatch* batch, c_bool sync,
+                      list keys) except -1:
+    """Write a batch directly, bypassing the merge buffer and the change
+    log. `keys` are the keys the batch writes or deletes."""
+    cdef WriteOptions write_options
+    cdef Status st
+    cdef uint64_t start
+    write_options.sync = sync
 
-    def __contains__(self, key):
-        contains_is_unsupported()
+    db_enter(db)
+    with nogil:
+        start = PlyvelTimerStart(db.counters)
+        st = db._db.Write(write_options, batch)
+        PlyvelTimerStop(start)
+        db.guard.Exit()
+    raise_for_status(st)
+
+    # Pooled iterators created before this write must not be reused.
+    db.write_seq.fetch_add(1)
+    if db.hot_cache is not None:
+        for key in keys:
+            db.hot_cache.invalidate(key)
+    return 0
+
+
+cdef int db_write_logged(DB db, leveldb.WriteBatch* batch, list changes,
+                         c_bool sync) except -1:
+    """Write a batch together with change log entries for its changes."""
+    cdef leveldb.WriteBatch logged
+    cdef bytes log_key
+    cdef bytes change
+    cdef uint64_t seq
+    cdef list log_keys = []
+
+    logged.Append(batch[0])
+    with db.change_condition:
+        # Sequence numbers are assigned and written under the lock, so
+        # readers never observe a gap that is filled later on.
+        seq = db.change_seq
+        for change in changes:
+            seq += 1
+            log_key = db.change_log_prefix + seq.to_bytes(8, 'big')
+            logged.Put(Slice(log_key, len(log_key)),
+                       Slice(change, len(change)))
+            log_keys.append(log_key)
+        db_write_raw(db, &logged, sync, log_keys)
+        db.change_seq = seq
+        db.change_condition.notify_all()
+    return 0
+
+
+cdef int db_open_change_log(DB db) except -1:
+    """Find the last sequence number of the change log."""
+    cdef bytes prefix = db.change_log_prefix
+    with db.iterator(reverse=True, start=prefix,
+                     stop=bytes_increment(prefix)) as it:
+        entry = next(it, None)
+    if entry is None:
+        return 0
+    key, value = entry
+    if key == prefix:
+        # Only the truncation marker is left
+        db.change_seq = int.from_bytes(value, 'big')
+    else:
+        db.change_seq = int.from_bytes(key[len(prefix):], 'big')
+    return 0
+
+
+class ChangeFeed:
+    """Iterator over the change log of a database."""
+
+    def __init__(self, DB db, since, wait, timeout, chunk_size):
+        self.db = db
+        self.seq = since
+        self.wait = wait
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.entries = deque()
 
     def __iter__(self):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+        return self
 
-        return self.iterator()
+    def __next__(self):
+        while not self.entries:
+            if not self.fill() and not (self.wait and self.wait_for_change(
+                    self.timeout)):
+                raise StopIteration
+        return self.entries.popleft()
 
-    def iterator(self, *, reverse=False, start=None, stop=None,
-                 include_start=True, include_stop=False, prefix=None,
-                 include_key=True, include_value=True,
-                 bool verify_checksums=False, bool fill_cache=True):
-        return Iterator(
-            self,  # db
-            None,  # db_prefix
-            reverse,
-            start,
-            stop,
-            include_start,
-            include_stop,
-            prefix,
-            include_key,
-            include_value,
-            verify_checksums,
-            fill_cache,
-            None,  # snapshot
-        )
+    def __aiter__(self):
+        return self
 
-    def raw_iterator(self, *, bool verify_checksums=False, bool fill_cache=True):
-        return RawIterator(
-            self,  # db
-            verify_checksums,
-            fill_cache,
-            None,  # snapshot
-        )
+    async def __anext__(self):
+        loop = asyncio.get_running_loop()
+        while not self.entries:
+            if self.fill():
+                break
+            if not self.wait:
+                raise StopAsyncIteration
+            # Block in a worker thread, in short periods, so that
+            # cancelling the task does not leave threads blocked for long.
+            waited = 0.0
+            while not await loop.run_in_executor(
+                    None, self.wait_for_change, 1.0):
+                waited += 1.0
+                if self.timeout is not None and waited >= self.timeout:
+                    raise StopAsyncIteration
+        return self.entries.popleft()
+
+    def fill(self):
+        """Read the next chunk of changes; return whether there were any."""
+        cdef DB db = self.db
+        cdef bytes prefix = db.change_log_prefix
+        with db.iterator(start=prefix + (self.seq + 1).to_bytes(8, 'big'),
+                         stop=bytes_increment(prefix)) as it:
+            chunk = it.next_batch(self.chunk_size)
+        for log_key, entry in chunk:
+            self.entries.append(decode_change(prefix, log_key, entry))
+        if chunk:
+            self.seq = self.entries[-1][0]
+        return bool(chunk)
+
+    def wait_for_change(self, timeout):
+        """Wait until there are changes after the last one read."""
+        cdef DB db = self.db
+        with db.change_condition:
+            return db.change_condition.wait_for(
+                lambda: db.change_seq > self.seq or db.closed, timeout) \
+                and not db.closed
 
-    def snapshot(self):
-        return Snapshot(db=self)
 
-    def get_property(self, bytes name not None):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+#
+# Merge buffer
+#
 
-        cdef Slice sl = Slice(name, len(name))
-        cdef string value
-        cdef c_bool result
+MERGE_OPS = ('add', 'max', 'min', 'append')
 
-        with nogil:
-            result = self._db.GetProperty(sl, &value)
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
 
-        return value if result else None
 
-    def compact_range(self, *, bytes start=None, bytes stop=None):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+cdef bytes merge_apply(str op, object operand, bytes value):
+    """Apply a combined merge operand to an existing value (or None)."""
+    if op == 'append':
+        if value is None:
+            return b''.join(operand)
+        return value + b''.join(operand)
 
-        cdef Slice start_slice
-        cdef Slice stop_slice
+    if value is None:
+        current = 0 if op == 'add' else operand
+    elif len(value) != 8:
+        raise ValueError("Existing value is not a 64-bit integer: %r" % value)
+    else:
+        current = int.from_bytes(value, 'little', signed=True)
 
-        if start is not None:
-            start_slice = Slice(start, len(start))
+    if op == 'add':
+        # Wrap around like 64-bit integer arithmetic in C.
+        result = (current + operand - INT64_MIN) % 2 ** 64 + INT64_MIN
+    elif op == 'max':
+        result = max(current, operand)
+    else:
+        result = min(current, operand)
+    return result.to_bytes(8, 'little', signed=True)
 
-        if stop is not None:
-            stop_slice = Slice(stop, len(stop))
 
-        with nogil:
-            self._db.CompactRange(&start_slice, &stop_slice)
+@cython.final
+cdef class MergeBuffer:
+    def __init__(self, size_t max_keys, double flush_interval):
+        self.max_keys = max_keys
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.last_flush = monotonic()
+
+    cdef int add(self, bytes key, str op, object operand) except -1:
+        """Combine an operand with the pending operands for `key`.
+
+        Returns 1 if it was added, or 0 if `key` has pending operands for
+        a different operation, in which case the buffer must be flushed
+        first.
+        """
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                if op == 'append':
+                    operand = [operand]
+                self.pending[key] = [op, operand]
+                self.count.fetch_add(1)
+                return 1
+
+            if entry[0] != op:
+                return 0
+            if op == 'add':
+                entry[1] += operand
+            elif op == 'max':
+                entry[1] = max(entry[1], operand)
+            elif op == 'min':
+                entry[1] = min(entry[1], operand)
+            else:
+                entry[1].append(operand)
+            return 1
 
-    def approximate_size(self, bytes start not None, bytes stop not None):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+    cdef c_bool should_flush(self):
+        if self.count.load() >= self.max_keys:
+            return True
+        return (self.flush_interval > 0
+                and monotonic() - self.last_flush >= self.flush_interval)
 
-        return self.approximate_sizes((start, stop))[0]
 
-    def approximate_sizes(self, *ranges):
-        if self._db is NULL:
-            raise RuntimeError("Database is closed")
+cdef int db_flush_merges(DB db, c_bool sync) except -1:
+    """Apply all pending merge operands in a single write batch."""
+    cdef MergeBuffer buffer = db.merge_buffer
+    cdef ReadOptions read_options
+    cdef WriteOptions write_options
+    cdef leveldb.WriteBatch batch
+    cdef Status st
+    cdef bytes key
+    cdef bytes value
+    cdef list keys
+    cdef list changes = []
+    cdef string encoded
+    cdef c_bool tracked
+    error = None
+
+    with buffer.lock:
+        buffer.last_flush = monotonic()
+        if not buffer.pending:
+            return 0
+
+        # A single read-modify-write for each key.
+        keys = list(buffer.pending)
+        for key, value in zip(keys, db_get_many(db, None, keys, None,
+                                                read_options)):
+            op, operand = buffer.pending[key]
+            try:
+                value = merge_apply(op, operand, value)
+            except ValueError as exc:
+                # Drop the operands, since applying them would fail for
+                # every following flush as well.
+                error = exc
+                continue
+            if db.codec is not NULL:
+                db.codec.Encode(Slice(value, len(value)), &encoded)
+                batch.Put(Slice(key, len(key)), Slice(encoded))
+            else:
+                batch.Put(Slice(key, len(key)), Slice(value, len(value)))
+            if db.log_changes:
+                changes.append(encode_change(key, value))
 
-        cdef int n_ranges = len(ranges)
-        cdef Range *c_ranges = <Range *>malloc(n_ranges * sizeof(Range))
-        cdef uint64_t *sizes = <uint64_t *>malloc(n_ranges * sizeof(uint64_t))
+        with nogil:
+            tracked = db.write_tracker.WriteBegin()
         try:
-            for i in xrange(n_ranges):
-                start, stop = ranges[i]
-                if not isinstance(start, bytes) or not isinstance(stop, bytes):
-                    raise TypeError(
-                        "Start and stop of range must be byte strings")
-                c_ranges[i] = Range(
-                    Slice(start, len(start)),
-                    Slice(stop, len(stop)))
+            if db.log_changes:
+                db_write_logged(db, &batch, changes, sync)
+            else:
+                write_options.sync = sync
+                db_enter(db)
+                with nogil:
+                    st = db._db.Write(write_options, &batch)
+                    db.guard.Exit()
+                raise_for_status(st)
+            if tracked:
+                db.write_tracker.RecordBatch(batch)
+        finally:
+            db.write_tracker.WriteEnd(tracked)
+
+        db.write_seq.fetch_add(1)
+        if db.hot_cache is not None:
+            for key in keys:
+                db.hot_cache.invalidate(key)
+
+        buffer.pending.clear()
+        buffer.count.store(0)
+
+    if error is not None:
+        raise error
+    return 0
+
+
+cdef int db_merge(DB db, bytes key, object operand, str op) except -1:
+    if db.guard.IsClosed():
+        raise RuntimeError("Database is closed")
+
+    if op not in MERGE_OPS:
+        raise ValueError("'op' must be one of %s" % ', '.join(MERGE_OPS))
+    if op == 'append':
+        if isinstance(operand, (int, str)):
+            # bytes() would create a string of zero bytes for integers
+            raise TypeError(
+                "'operand' must be a byte string for the 'append' operation")
+        operand = bytes(operand)
+    elif not isinstance(operand, int):
+        raise TypeError("'operand' must be an integer for the %r operation"
+                        % op)
+    elif not INT64_MIN <= operand <= INT64_MAX:
+        raise OverflowError("'operand' must be a 64-bit integer")
+
+    while not db.merge_buffer.add(key, op, operand):
+        db_flush_merges(db, False)
+
+    if db.merge_buffer.should_flush():
+        db_flush_merges(db, False)
+    return 0
+
+
+cdef int flush_merges_for_key(DB db, Slice key) except -1:
+    # Pending merge operands for a key that is about to be overwritten
+    # (or deleted) must be applied first.
+    if (db.merge_buffer.flush_on_access
+            or key.data()[:key.size()] in db.merge_buffer.pending):
+        db_flush_merges(db, False)
+    return 0
+
+
+cdef object NOT_PENDING = object()
+
+
+cdef object db_get_pending(DB db, bytes key, ReadOptions read_options):
+    """Return the value for a key with pending merge operands.
+
+    Returns NOT_PENDING if `key` has no pending merge operands.
+    """
+    cdef MergeBuffer buffer = db.merge_buffer
+    if buffer.flush_on_access:
+        db_flush_merges(db, False)
+        return NOT_PENDING
+    with buffer.lock:
+        # The lock prevents a concurrent flush from applying the
+        # operands between reading the value and applying them here.
+        entry = buffer.pending.get(key)
+        if entry is None:
+            return NOT_PENDING
+        return merge_apply(entry[0], entry[1],
+                           db_get(db, key, None, read_options))
+
+
+cdef list db_get_many_pending(DB db, bytes db_prefix, object keys,
+                              object default, ReadOptions read_options,
+                              c_bool sweep):
+    """Like db_get_many() (or db_lookup_sorted() if `sweep` is true), but
+    applying pending merge operands."""
+    cdef MergeBuffer buffer = db.merge_buffer
+    cdef list values
+    cdef Py_ssize_t i
+
+    if buffer.flush_on_access:
+        db_flush_merges(db, False)
+    keys = list(keys)
+    with buffer.lock:
+        if sweep:
+            values = db_lookup_sorted(db, db_prefix, keys, None, read_options)
+        else:
+            values = db_get_many(db, db_prefix, keys, None, read_options)
+        for i in range(len(values)):
+            key = keys[i] if db_prefix is None else db_prefix + keys[i]
+            entry = buffer.pending.get(key)
+            if entry is not None:
+                values[i] = merge_apply(entry[0], entry[1], values[i])
+            if values[i] is None:
+                values[i] = default
+    return values
+
+
+cdef object db_get_cached(DB db, bytes key, object default,
+                          ReadOptions read_options):
+    """Look up a key, taking merges and the hot key cache into account."""
+    if db.merge_buffer.count.load() > 0:
+        value = db_get_pending(db, key, read_options)
+        if value is not NOT_PENDING:
+            return value
 
-            with nogil:
-                self._db.GetApproximateSizes(c_ranges, n_ranges, sizes)
+    if db.hot_cache is None or read_options.verify_checksums:
+        return db_get(db, key, default, read_options)
 
-            return [sizes[i] for i in xrange(n_ranges)]
-        finally:
-            free(c_ranges)
-            free(sizes)
+    cdef uint64_t generation
+    value = db.hot_cache.lookup(key, &generation)
+    if value is not None:
+        return value
 
-    def prefixed_db(self, bytes prefix not None):
-        return PrefixedDB(db=self, prefix=prefix)
+    value = db_get(db, key, None, read_options)
+    if value is None:
+        return default
+    if read_options.fill_cache:
+        db.hot_cache.store(key, value, generation)
+    return value
 
-    def __enter__(self):
-        return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.close()
+cdef list db_get_many_traced(DB db, bytes db_prefix, object keys,
+                             object default, ReadOptions read_options,
+                             c_bool sweep=False):
+    """Like db_get_many() (or db_lookup_sorted() if `sweep` is true), but
+    taking merges and instrumentation into account."""
+    cdef TraceState trace
+    cdef size_t nbytes = 0
+    cdef list values
+    cdef Py_ssize_t i
+
+    if db.instrumentation is None:
+        if db.merge_buffer.count.load() > 0:
+            return db_get_many_pending(db, db_prefix, keys, default,
+                                       read_options, sweep)
+        if sweep:
+            return db_lookup_sorted(db, db_prefix, keys, default,
+                                    read_options)
+        return db_get_many(db, db_prefix, keys, default, read_options)
+
+    keys = list(keys)
+    token = db.instrumentation.begin(OP_GET_MANY, keys, &trace)
+    try:
+        if db.merge_buffer.count.load() > 0:
+            values = db_get_many_pending(db, db_prefix, keys, None,
+                                         read_options, sweep)
+        elif sweep:
+            values = db_lookup_sorted(db, db_prefix, keys, None,
+                                      read_options)
+        else:
+            values = db_get_many(db, db_prefix, keys, None, read_options)
+    except BaseException as exc:
+        db.instrumentation.end(OP_GET_MANY, &trace, token, 0, exc)
+        raise
+    for i in range(len(values)):
+        nbytes += len(keys[i])
+        if values[i] is None:
+            values[i] = default
+        else:
+            nbytes += len(values[i])
+    db.instrumentation.end(OP_GET_MANY, &trace, token, nbytes, None)
+    return values
 
 
-cdef class PrefixedDB:
-    cdef readonly DB db
+#
+# Compaction
+#
+
+cdef int db_compact_range(DB db, bytes start, bytes stop) except -1:
+    cdef Slice start_slice
+    cdef Slice stop_slice
+    cdef Slice* start_ptr = NULL
+    cdef Slice* stop_ptr = NULL
+
+    # LevelDB treats NULL as "before all keys" and "after all keys"; an
+    # empty stop key would mean an empty range instead.
+    if start is not None:
+        start_slice = Slice(start, len(start))
+        start_ptr = &start_slice
+
+    if stop is not None:
+        stop_slice = Slice(stop, len(stop))
+        stop_ptr = &stop_slice
+
+    db_enter(db)
+    with nogil:
+        db._db.CompactRange(start_ptr, stop_ptr)
+        db.guard.Exit()
+    return 0
+
+
+# Upper bound for the number of parts a compaction is split into.
+cdef enum:
+    MAX_COMPACTION_PARTS = 1024
+
+
+cdef bytes key_midpoint(bytes start, bytes stop):
+    """Return a key between `start` and `stop` (bytewise), or None."""
+    if start is None:
+        start = b''
+    cdef size_t n = len(start) + 1
+    if stop is not None:
+        n = max(n, len(stop) + 1)
+    lo = int.from_bytes(start.ljust(n, b'\x00'), 'big')
+    hi = (256 ** n if stop is None
+          else int.from_bytes(stop.ljust(n, b'\x00'), 'big'))
+    if hi - lo < 2:
+        return None
+    return ((lo + hi) // 2).to_bytes(n, 'big')
+
+
+cdef int check_prefix_compaction(DB db) except -1:
+    # With a custom comparator, the keys having a prefix are not a range.
+    if db.options.comparator is not BytewiseComparator():
+        raise ValueError("Compacting a prefix requires the default comparator")
+    return 0
+
+
+cdef list compaction_parts(DB db, bytes start, bytes stop, size_t part_size):
+    """Split a range into (start, stop, size) parts of about `part_size`.
+
+    Parts are compacted (or warmed) one at a time, so that progress can
+    be reported and cancellation takes effect between parts. Parts are bisected in
+    key space until their approximate size is small enough. Unlike
+    sample_keys(), this also works for ranges without any live keys,
+    e.g. after deleting them.
+    """
+    cdef list parts = [(start, stop)]
+    cdef list sizes = db.approximate_sizes(*parts)
+    cdef list new_parts
+    cdef bytes mid
+    cdef size_t n_parts = 1
+
+    # Key space bisection only works for the default key order.
+    if db.options.comparator is not BytewiseComparator():
+        return [(start, stop, sizes[0])]
+
+    while True:
+        new_parts = []
+        for (lo, hi), size in zip(parts, sizes):
+            mid = None
+            if size > part_size and n_parts < MAX_COMPACTION_PARTS:
+                mid = key_midpoint(lo, hi)
+            if mid is None:
+                new_parts.append((lo, hi))
+            else:
+                new_parts.append((lo, mid))
+                new_parts.append((mid, hi))
+                n_parts += 1
+        if len(new_parts) == len(parts):
+            break
+        parts = new_parts
+        sizes = db.approximate_sizes(*parts)
+
+    return [(lo, hi, size) for (lo, hi), size in zip(parts, sizes)]
+
+
+def run_callback(fn, task):
+    # Like concurrent.futures, a failing callback does not affect the
+    # task or the other callbacks.
+    try:
+        fn(task)
+    except Exception:
+        sys.excepthook(*sys.exc_info())
+
+
+class BackgroundTask:
+    """Base class for tasks that run in background threads.
+
+    Subclasses start their threads, and call _finish() when done. This
+    behaves like concurrent.futures.Future, except that running tasks can
+    be cancelled; subclasses check _cancel_requested between units of
+    work. Tasks register with the database, so that closing it cancels
+    them.
+    """
+
+    def __init__(self, DB db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._cancel_requested = False
+        self._cancelled = False
+        self._exception = None
+        self._callbacks = []
+        with db.lock:
+            db.background_tasks.add(self)
+
+    def _finish(self):
+        cdef DB db = self.db
+        with db.lock:
+            db.background_tasks.discard(self)
+        with self._lock:
+            self._cancelled = self._cancel_requested
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            run_callback(callback, self)
+
+    def _state(self):
+        return ('cancelled' if self._cancelled else
+                'done' if self._done.is_set() else 'running')
+
+    def cancel(self):
+        """Stop after the unit of work that is in progress.
+
+        Returns False if the task already finished without being
+        cancelled.
+        """
+        with self._lock:
+            if self._done.is_set():
+                return self._cancelled
+            self._cancel_requested = True
+            return True
+
+    def cancelled(self):
+        return self._cancelled
+
+    def running(self):
+        return not self._done.is_set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise concurrent.futures.TimeoutError()
+        if self._cancelled:
+            raise concurrent.futures.CancelledError()
+        return self._exception
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        run_callback(fn, self)
+
+
+class CompactionTask(BackgroundTask):
+    """Compaction of a key range in a background thread."""
+
+    def __init__(self, DB db, list parts):
+        super().__init__(db)
+        self._parts = parts
+        self.bytes_total = sum(size for _, _, size in parts)
+        self.bytes_done = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name='plyvel-compaction', daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return '<plyvel.CompactionTask (%s, %d/%d bytes) at 0x%s>' % (
+            self._state(),
+            self.bytes_done,
+            self.bytes_total,
+            hex(id(self)),
+        )
+
+    @property
+    def bytes_remaining(self):
+        return self.bytes_total - self.bytes_done
+
+    @property
+    def progress(self):
+        if self.bytes_total == 0:
+            return 1.0 if self._done.is_set() else 0.0
+        return self.bytes_done / self.bytes_total
+
+    def _run(self):
+        try:
+            for start, stop, size in self._parts:
+                with self._lock:
+                    if self._cancel_requested:
+                        break
+                db_compact_range(self.db, start, stop)
+                self.bytes_done += size
+        except BaseException as exc:
+            self._exception = exc
+        finally:
+            self._finish()
+
+
+#
+# Cache warming
+#
+
+# Number of bytes a warming thread reserves from the byte budget at a
+# time.
+WARM_CHUNK_SIZE = 1024 * 1024
+
+
+cdef tuple db_warm_range(DB db, bytes start, bytes stop, uint64_t max_bytes):
+    """Read a key range into the block cache.
+
+    Reading stops before the entry that would make the number of bytes
+    (keys and values) read exceed `max_bytes`. Returns the number of
+    bytes read, and the key and size of that entry, or None and 0 if the
+    whole range was read.
+
+    With a `max_bytes` of 0, this only seeks to the start of the range
+    without filling the block cache, which opens the tables containing it
+    (reading their index and filter blocks).
+    """
+    cdef ReadOptions read_options
+    cdef Comparator* comparator = <Comparator*>db.options.comparator
+    cdef Slice start_slice = Slice(start, len(start))
+    cdef Slice stop_slice = Slice(stop, len(stop))
+    cdef leveldb.Iterator* it
+    cdef uint64_t n = 0
+    cdef uint64_t size = 0
+    cdef c_bool more = False
+    cdef string next_key
+    cdef Status st
+    read_options.fill_cache = max_bytes > 0
+
+    db_enter(db)
+    with nogil:
+        it = db._db.NewIterator(read_options)
+        it.Seek(start_slice)
+        while (it.Valid()
+               and comparator.Compare(it.key(), stop_slice) < 0):
+            size = it.key().size() + it.value().size()
+            if size > max_bytes - n:
+                more = True
+                next_key = it.key().ToString()
+                break
+            n += size
+            it.Next()
+        st = it.status()
+        del it
+        db.guard.Exit()
+    raise_for_status(st)
+    if more:
+        return n, next_key, size
+    return n, None, 0
+
+
+cdef object db_warm(DB db, bytes db_prefix, tuple ranges, max_bytes,
+                    int threads, size_t part_size):
+    cdef list parts = []
+    if threads < 1:
+        raise ValueError("'threads' must be at least 1")
+    if max_bytes is not None and max_bytes < 0:
+        raise ValueError("'max_bytes' must not be negative")
+    if part_size == 0:
+        # Parts of about the size of a table.
+        part_size = db.options.max_file_size
+
+    for start, stop in db_key_ranges(db, db_prefix, ranges or ((None, None),)):
+        parts.extend(compaction_parts(db, start, stop, part_size))
+    return WarmTask(db, parts, max_bytes, threads)
+
+
+class WarmTask(BackgroundTask):
+    """Cache warming in background threads.
+
+    The threads take parts of the ranges in order, so earlier ranges are
+    warmed first. Once `max_bytes` have been read, the remaining parts
+    are only seeked to, which opens their tables without filling the
+    block cache, up to the number of tables that can be kept open.
+    """
+
+    def __init__(self, DB db, list parts, max_bytes, int threads):
+        super().__init__(db)
+        self._parts = deque(parts)
+        self.parts_total = len(parts)
+        self.parts_done = 0
+        self.bytes_read = 0
+        self.max_bytes = max_bytes
+        self._unreserved = max_bytes
+        self._reserved = 0
+        self._budget_returned = threading.Condition(self._lock)
+        self._seeks_left = db.options.max_open_files
+        self._threads_left = threads
+
+        self._threads = [
+            threading.Thread(target=self._run, name='plyvel-warm',
+                             daemon=True)
+            for _ in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def __repr__(self):
+        return '<plyvel.WarmTask (%s, %d/%d parts, %d bytes) at 0x%s>' % (
+            self._state(),
+            self.parts_done,
+            self.parts_total,
+            self.bytes_read,
+            hex(id(self)),
+        )
+
+    @property
+    def progress(self):
+        if self.parts_total == 0:
+            return 1.0 if self._done.is_set() else 0.0
+        return self.parts_done / self.parts_total
+
+    def _reserve(self, uint64_t needed):
+        # Take part of the budget before reading, so that the threads
+        # together never read more than it; unused bytes are returned.
+        # Waits while other threads hold the missing bytes, and returns 0
+        # if less than `needed` bytes (or nothing) are left.
+        needed = max(needed, 1)
+        with self._lock:
+            if self.max_bytes is None:
+                return UINT64_MAX
+            while self._unreserved < needed and self._reserved > 0:
+                self._budget_returned.wait()
+            if self._unreserved < needed:
+                return 0
+            budget = min(self._unreserved, max(WARM_CHUNK_SIZE, needed))
+            self._unreserved -= budget
+            self._reserved += budget
+            return budget
+
+    def _run(self):
+        cdef uint64_t budget = 0
+        cdef uint64_t n = 0
+        cdef uint64_t needed = 0
+        cdef c_bool seek = False
+        try:
+            while True:
+                with self._lock:
+                    if (self._cancel_requested or self._exception is not None
+                            or not self._parts):
+                        break
+                    start, stop, _ = self._parts.popleft()
+
+                budget = self._reserve(0)
+                if budget == 0:
+                    # The budget is used up, so only open the tables.
+                    with self._lock:
+                        seek = self._seeks_left > 0
+                        self._seeks_left -= seek
+                    if seek:
+                        db_warm_range(self.db, start, stop, 0)
+                    start = None
+
+                while start is not None:
+                    n = 0
+                    try:
+                        n, start, needed = db_warm_range(
+                            self.db, start, stop, budget)
+                    finally:
+                        with self._lock:
+                            self.bytes_read += n
+                            if self.max_bytes is not None:
+                                self._unreserved += budget - n
+                                self._reserved -= budget
+                                self._budget_returned.notify_all()
+                    if start is not None:
+                        budget = self._reserve(needed)
+                        if budget == 0:
+                            break
+
+                with self._lock:
+                    self.parts_done += 1
+        except BaseException as exc:
+            with self._lock:
+                if self._exception is None:
+                    self._exception = exc
+        finally:
+            with self._lock:
+                self._threads_left -= 1
+                last = self._threads_left == 0
+            if last:
+                self._finish()
+
+
+#
+# Write throttling
+#
+
+# LevelDB starts compacting level 0 when it has this many files, and
+# delays writes (and eventually stops them) once it has more than the
+# slowdown trigger. These are compile-time constants in LevelDB (see
+# db/dbformat.h in its sources), so they cannot be queried.
+cdef enum:
+    L0_COMPACTION_TRIGGER = 4
+    L0_SLOWDOWN_WRITES_TRIGGER = 8
+
+
+cdef double db_write_pressure(DB db) except -1:
+    cdef int files = int(db.get_property(b'leveldb.num-files-at-level0'))
+    cdef double pressure = (
+        <double>(files - L0_COMPACTION_TRIGGER)
+        / (L0_SLOWDOWN_WRITES_TRIGGER - L0_COMPACTION_TRIGGER))
+    return min(max(pressure, 0.0), 1.0)
+
+
+# Shortest delay between batches when throttling, and factor by which a
+# batch write must be slower than average to count as delayed.
+MIN_THROTTLE_DELAY = 0.001
+SLOW_WRITE_FACTOR = 4.0
+
+
+class WriteThrottle:
+    """Adaptive delay between the batches written by a bulk writer.
+
+    The delay doubles while the write pressure is at or above the target,
+    and halves otherwise. Batch writes that take much longer than usual
+    also count as pressure, since LevelDB may delay writes for other
+    reasons, e.g. when the memtable cannot be flushed fast enough.
+    """
+
+    def __init__(self, DB db, target_pressure, max_delay):
+        self.db = db
+        self.target_pressure = target_pressure
+        self.max_delay = max_delay
+        self.delay = 0.0
+        self.average_write_time = None
+
+    def after_write(self, write_time):
+        pressure = db_write_pressure(self.db)
+        if self.average_write_time is None:
+            self.average_write_time = write_time
+        else:
+            if write_time > SLOW_WRITE_FACTOR * self.average_write_time:
+                pressure = max(pressure, self.target_pressure)
+            self.average_write_time = (
+                0.9 * self.average_write_time + 0.1 * write_time)
+
+        if pressure >= self.target_pressure:
+            self.delay = min(max(2 * self.delay, MIN_THROTTLE_DELAY),
+                             self.max_delay)
+        else:
+            self.delay /= 2
+            if self.delay < MIN_THROTTLE_DELAY:
+                self.delay = 0.0
+
+        if self.delay > 0:
+            sleep(self.delay)
+
+
+cdef object db_put_many(DB db, bytes prefix, object items, c_bool sync,
+                        size_t batch_size, bool throttle,
+                        double target_pressure, double max_delay):
+    if batch_size < 1:
+        raise ValueError("'batch_size' must be at least 1")
+    if not 0.0 <= target_pressure <= 1.0:
+        raise ValueError("'target_pressure' must be between 0 and 1")
+    if not max_delay >= 0.0:
+        raise ValueError("'max_delay' must not be negative")
+
+    cdef WriteBatch wb = WriteBatch(db, prefix, False, sync)
+    cdef size_t pending = 0
+    cdef size_t count = 0
+    write_throttle = None
+    if throttle:
+        write_throttle = WriteThrottle(db, target_pressure, max_delay)
+
+    if hasattr(items, 'items'):
+        items = items.items()
+
+    for key, value in items:
+        wb.put(key, value)
+        pending += 1
+        if pending < batch_size:
+            continue
+
+        start = monotonic()
+        wb.write()
+        wb.clear()
+        count += pending
+        pending = 0
+        if write_throttle is not None:
+            write_throttle.after_write(monotonic() - start)
+
+    if pending > 0:
+        wb.write()
+        count += pending
+    return count
+
+
+#
+# Value codec
+#
+
+# Training samples are taken in runs of consecutive entries, starting at
+# evenly spread keys, and dictionaries are built from substrings of this
+# size that occur in more than one sample.
+cdef enum:
+    SAMPLE_RUN_LENGTH = 16
+    DICTIONARY_GRAM_SIZE = 8
+    DEFAULT_SAMPLE_SIZE = 1000
+    DEFAULT_DICTIONARY_SIZE = 8192
+    MAX_DICTIONARY_SIZE = 32768
+
+
+cdef bytes codec_decode(PlyvelCodec* codec, Slice value):
+    cdef string decoded
+    if not codec.Decode(value, &decoded):
+        raise CorruptionError("Value cannot be decoded by the value codec")
+    return decoded
+
+
+cdef int codec_decode_in_place(PlyvelCodec* codec,
+                               string* value) except -1 nogil:
+    cdef string decoded
+    if not codec.Decode(Slice(value[0]), &decoded):
+        with gil:
+            raise CorruptionError(
+                "Value cannot be decoded by the value codec")
+    value.swap(decoded)
+    return 0
+
+
+cdef int db_load_value_codec(DB db) except -1:
+    """Load the dictionaries of the value codec."""
+    cdef bytes prefix = db.value_codec_prefix
+    cdef bytes key
+    cdef bytes dictionary
+
+    # Dictionaries are stored as is (see db_train_value_codec()), so they
+    # can be read while no dictionaries are loaded yet.
+    with db.iterator(prefix=prefix) as it:
+        for key, dictionary in it:
+            if len(key) != len(prefix) + 1 or key[-1] == 0:
+                raise CorruptionError(
+                    "Invalid value codec dictionary key: %r" % key)
+            if not db.codec.AddDictionary(key[-1], dictionary,
+                                          len(dictionary)):
+                raise MemoryError()
+    return 0
+
+
+cdef list sample_values(DB db, bytes start, bytes stop, Py_ssize_t n,
+                        bytes reserved):
+    """Take about `n` values from a range, skipping reserved keys.
+
+    Values are taken in runs of consecutive entries, starting at evenly
+    spread keys (see DB.sample_keys()). Since those are approximate, more
+    values are taken from the start of the range if needed.
+    """
+    cdef dict values = {}
+    cdef bytes key
+    cdef bytes value
+
+    sample_keys = db.sample_keys(
+        max(1, n // SAMPLE_RUN_LENGTH), start=start, stop=stop)
+    with db.iterator(start=start, stop=stop, fill_cache=False) as it:
+        for sample_key in sample_keys:
+            it.seek(sample_key)
+            for _ in range(SAMPLE_RUN_LENGTH):
+                entry = next(it, None)
+                if entry is None:
+                    break
+                key, value = entry
+                if value and not key.startswith(reserved):
+                    values[key] = value
+            if len(values) >= n:
+                break
+
+        if len(values) < n:
+            it.seek_to_start()
+            for key, value in it:
+                if value and not key.startswith(reserved):
+                    values[key] = value
+                    if len(values) >= n:
+                        break
+    return list(values.values())
+
+
+cdef size_t sample_gain(set sample_grams, dict counts, set covered):
+    cdef size_t gain = 0
+    for gram in sample_grams:
+        n = counts[gram]
+        if n > 1 and gram not in covered:
+            gain += n
+    return gain
+
+
+cdef bytes build_dictionary(list samples, size_t size):
+    """Build a dictionary from content that samples have in common.
+
+    Samples are picked greedily by the number of samples sharing their
+    substrings (that earlier picks do not contain yet), until the
+    dictionary is full. The best samples go at the end of the dictionary,
+    since zlib encodes nearby matches more compactly.
+    """
+    cdef Py_ssize_t k = DICTIONARY_GRAM_SIZE
+    cdef list grams = []
+    cdef dict counts = {}
+    cdef set covered = set()
+    cdef list picked = []
+    cdef size_t total = 0
+    cdef bytes sample
+
+    for sample in samples:
+        sample_grams = {sample[i:i + k] for i in range(len(sample) - k + 1)}
+        grams.append(sample_grams)
+        for gram in sample_grams:
+            counts[gram] = counts.get(gram, 0) + 1
+
+    # Gains only decrease as more samples are picked, so a sample whose
+    # updated gain is still the best can be picked without recomputing
+    # all others.
+    heap = [(-sample_gain(grams[i], counts, covered), i)
+            for i in range(len(samples))]
+    heapq.heapify(heap)
+    while heap and total < size:
+        _, i = heapq.heappop(heap)
+        current = sample_gain(grams[i], counts, covered)
+        if current == 0:
+            break
+        if heap and current < -heap[0][0]:
+            heapq.heappush(heap, (-current, i))
+            continue
+        picked.append(samples[i])
+        covered.update(grams[i])
+        total += len(samples[i])
+
+    if not picked:
+        # Nothing in common; the dictionary will not help much either way.
+        picked = samples
+    return b''.join(reversed(picked))[-size:]
+
+
+cdef int db_train_value_codec(DB db, DB source, bytes start, bytes stop,
+                              size_t sample_size,
+                              size_t dictionary_size) except -1:
+    """Train a dictionary for the value codec of `db` on the values of
+    `source` (usually the same database)."""
+    if db.codec is NULL:
+        raise RuntimeError("Database was opened without a value codec")
+    if sample_size < 1:
+        raise ValueError("'sample_size' must be at least 1")
+    if not 1 <= dictionary_size <= MAX_DICTIONARY_SIZE:
+        raise ValueError("'dictionary_size' must be between 1 and %d"
+                         % MAX_DICTIONARY_SIZE)
+
+    samples = sample_values(source, start, stop, sample_size,
+                            db.value_codec_prefix)
+    if not samples:
+        raise ValueError("No values to train the value codec with")
+    cdef bytes dictionary = build_dictionary(samples, dictionary_size)
+
+    cdef leveldb.WriteBatch batch
+    cdef bytes key
+    cdef bytes value = b'\0' + dictionary
+    cdef int version
+    with db.lock:
+        version = db.codec.Version() + 1
+        if version > PLYVEL_CODEC_MAX_VERSION:
+            raise RuntimeError(
+                "The value codec cannot have more than %d dictionaries"
+                % PLYVEL_CODEC_MAX_VERSION)
+
+        # The dictionary is stored as is, without using the codec. Values
+        # compressed with it are written later, so they cannot survive a
+        # crash without the dictionary.
+        key = db.value_codec_prefix + bytes([version])
+        batch.Put(Slice(key, len(key)), Slice(value, len(value)))
+        db_write_raw(db, &batch, False, [key])
+
+        if not db.codec.AddDictionary(version, dictionary, len(dictionary)):
+            raise MemoryError()
+    return version
+
+
+#
+# Database
+#
+
+cdef void delete_iterator_handle(IteratorHandle* handle) noexcept:
+    if handle.readahead is not NULL:
+        # The read-ahead thread may need the GIL to finish (e.g. when
+        # using a custom comparator).
+        with nogil:
+            del handle.readahead
+        handle.readahead = NULL
+
+    if handle.iter is not NULL:
+        del handle.iter
+        handle.iter = NULL
+
+
+@cython.final
+cdef class DB:
+    def __init__(self, name, *, bool create_if_missing=False,
+                 bool error_if_exists=False, paranoid_checks=None,
+                 write_buffer_size=None, max_open_files=None,
+                 lru_cache_size=None, block_size=None,
+                 block_restart_interval=None, max_file_size=None,
+                 compression='snappy', compression_level=None,
+                 int bloom_filter_bits=0,
+                 object comparator=None, bytes comparator_name=None,
+                 hot_cache_size=None, size_t iterator_pool_size=0,
+                 size_t merge_buffer_size=1000,
+                 double merge_flush_interval=1.0,
+                 bytes change_log_prefix=None, bool instrument=False,
+                 bytes value_codec_prefix=None):
+        cdef Status st
+        cdef string fsname
+        self.name = name
+        self.background_tasks = set()
+        self.merge_buffer = MergeBuffer(merge_buffer_size,
+                                        merge_flush_interval)
+        self.merge_buffer.flush_on_access = comparator is not None
+
+        if hot_cache_size is not None:
+            self.hot_cache = HotCache(hot_cache_size)
+            self.hot_cache.clear_on_invalidate = comparator is not None
+
+        if instrument:
+            self.instrumentation = Instrumentation()
+            self.counters = &self.instrumentation.counters
+
+        self.iterator_pool_size = iterator_pool_size
+
+        if change_log_prefix is not None:
+            if not change_log_prefix:
+                raise ValueError("'change_log_prefix' must not be empty")
+            if comparator is not None:
+                # Changes are ordered by their big-endian sequence number.
+                raise ValueError(
+                    "'change_log_prefix' requires the default comparator")
+
+        if value_codec_prefix is not None:
+            if not value_codec_prefix:
+                raise ValueError("'value_codec_prefix' must not be empty")
+            if change_log_prefix is not None:
+                raise ValueError(
+                    "'value_codec_prefix' cannot be used together with "
+                    "'change_log_prefix'")
+            if comparator is not None:
+                # Dictionaries are loaded by iterating over the prefix.
+                raise ValueError(
+                    "'value_codec_prefix' requires the default comparator")
+
+        fsname = to_file_system_name(name)
+        parse_options(
+            &self.options, create_if_missing, error_if_exists, paranoid_checks,
+            write_buffer_size, max_open_files, lru_cache_size, block_size,
+            block_restart_interval, max_file_size, compression,
+            compression_level, bloom_filter_bits, comparator, comparator_name)
+        with nogil:
+            st = leveldb.DB_Open(self.options, fsname, &self._db)
+        raise_for_status(st)
+
+        self.guard.Open()
+
+        if change_log_prefix is not None:
+            self.change_log_prefix = change_log_prefix
+            self.change_condition = threading.Condition()
+            db_open_change_log(self)
+            self.log_changes = True
+
+        if value_codec_prefix is not None:
+            self.value_codec_prefix = value_codec_prefix
+            self.codec = new PlyvelCodec()
+            db_load_value_codec(self)
+
+    cpdef close(self):
+        cdef IteratorHandle* handle
+        cdef leveldb.DB* db
+
+        # Closing waits for the operation (or compaction) calling the
+        # comparator, which would never finish.
+        if PlyvelInComparatorCallback() and not self.guard.IsClosed():
+            raise RuntimeError(
+                "Cannot close a database from within a comparator")
+
+        flush_error = None
+        if (self.merge_buffer is not None
+                and self.merge_buffer.count.load() > 0):
+            try:
+                db_flush_merges(self, False)
+            except RuntimeError:
+                pass  # closed by another thread
+            except BaseException as exc:
+                # Close the database anyway, and report the error after.
+                flush_error = exc
+
+        # Background tasks hold the guard while working on a part, so
+        # stop them first.
+        if self.background_tasks:
+            with self.lock:
+                tasks = list(self.background_tasks)
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                task._done.wait()
+
+        # Refuse new operations, and wait until operations running in
+        # other threads (including iterator steps) have finished.
+        with nogil:
+            self.guard.Close()
+
+        with self.lock:
+            # Deleting a C++ DB instance results in a segfault if
+            # associated Iterator instances are not deleted beforehand
+            # (as mentioned in leveldb/db.h), so delete the underlying
+            # iterators of all open iterators first. The Python iterator
+            # objects stay around, but can no longer be used. If the
+            # constructor raised an exception (and hence never
+            # completed), no iterators exist.
+            while self.iterators is not NULL:
+                handle = self.iterators
+                self.unlink_iterator(handle)
+                delete_iterator_handle(handle)
+
+            self.clear_iterator_pool()
+
+            if self._db is not NULL:
+                # Deleting the DB waits for background compactions, which
+                # call back into Python when a custom comparator is used,
+                # so the GIL must be released.
+                db = self._db
+                self._db = NULL
+                with nogil:
+                    del db
+
+            if self.options.block_cache is not NULL:
+                del self.options.block_cache
+                self.options.block_cache = NULL
+
+            if self.options.filter_policy is not NULL:
+                del self.options.filter_policy
+                self.options.filter_policy = NULL
+
+            if self.options.comparator is not NULL:
+                # The built-in BytewiseComparator must not be deleted
+                if self.options.comparator is not BytewiseComparator():
+                    del self.options.comparator
+                    self.options.comparator = NULL
+
+        if self.hot_cache is not None:
+            self.hot_cache.clear()
+
+        if self.change_condition is not None:
+            # Wake up change feeds waiting for changes.
+            with self.change_condition:
+                self.change_condition.notify_all()
+
+        if flush_error is not None:
+            raise flush_error
+
+    property closed:
+        def __get__(self):
+            return self.guard.IsClosed()
+
+    def __dealloc__(self):
+        self.close()
+        del self.codec
+
+    def __repr__(self):
+        return '<plyvel.DB with name %r%s at 0x%s>' % (
+            self.name,
+            ' (closed)' if self.closed else '',
+            hex(id(self)),
+        )
+
+    def get(self, bytes key not None, default=None, *,
+            bool verify_checksums=False, bool fill_cache=True):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+
+        if self.instrumentation is None:
+            return db_get_cached(self, key, default, read_options)
+
+        cdef TraceState trace
+        token = self.instrumentation.begin(OP_GET, key, &trace)
+        try:
+            value = db_get_cached(self, key, None, read_options)
+        except BaseException as exc:
+            self.instrumentation.end(OP_GET, &trace, token, 0, exc)
+            raise
+        self.instrumentation.end(
+            OP_GET, &trace, token,
+            len(key) + (0 if value is None else len(value)), None)
+        return default if value is None else value
+
+    def get_many(self, keys, default=None, *, bool verify_checksums=False,
+                 bool fill_cache=True):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+        return db_get_many_traced(self, None, keys, default, read_options)
+
+    def lookup_sorted(self, keys, default=None, *,
+                      bool verify_checksums=False, bool fill_cache=True):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+        return db_get_many_traced(self, None, keys, default, read_options,
+                                  True)
+
+    def exists(self, bytes key not None, *, bool verify_checksums=False,
+               bool fill_cache=True):
+        return self.exists_many(
+            (key,), verify_checksums=verify_checksums,
+            fill_cache=fill_cache)[0]
+
+    def exists_many(self, keys, *, bool verify_checksums=False,
+                    bool fill_cache=True):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+        return db_exists_many(self, None, keys, read_options)
+
+    def put(self, bytes key not None, value not None, *, bool sync=False):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef Slice key_slice = Slice(key, len(key))
+        cdef c_bool c_sync = sync
+        cdef Py_buffer value_buffer
+        cdef Slice value_slice
+        cdef TraceState trace
+        PyObject_GetBuffer(value, &value_buffer, PyBUF_SIMPLE)
+        try:
+            value_slice = Slice(<const_char *>value_buffer.buf,
+                                value_buffer.len)
+            if self.instrumentation is None:
+                with nogil:
+                    self.c_put(key_slice, value_slice, c_sync)
+                return
+
+            token = self.instrumentation.begin(OP_PUT, key, &trace)
+            try:
+                with nogil:
+                    self.c_put(key_slice, value_slice, c_sync)
+            except BaseException as exc:
+                self.instrumentation.end(OP_PUT, &trace, token, 0, exc)
+                raise
+            self.instrumentation.end(OP_PUT, &trace, token,
+                                     key_slice.size() + value_slice.size(),
+                                     None)
+        finally:
+            PyBuffer_Release(&value_buffer)
+
+    def delete(self, bytes key not None, *, bool sync=False):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef Slice key_slice = Slice(key, len(key))
+        cdef c_bool c_sync = sync
+        cdef TraceState trace
+        if self.instrumentation is None:
+            with nogil:
+                self.c_delete(key_slice, c_sync)
+            return
+
+        token = self.instrumentation.begin(OP_DELETE, key, &trace)
+        try:
+            with nogil:
+                self.c_delete(key_slice, c_sync)
+        except BaseException as exc:
+            self.instrumentation.end(OP_DELETE, &trace, token, 0, exc)
+            raise
+        self.instrumentation.end(OP_DELETE, &trace, token, len(key), None)
+
+    def merge(self, bytes key not None, operand, *, str op):
+        db_merge(self, key, operand, op)
+
+    def counter_add(self, bytes key not None, delta=1):
+        db_merge(self, key, delta, 'add')
+
+    def flush_merges(self, *, bool sync=False):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        db_flush_merges(self, sync)
+
+    def stats(self):
+        if self.instrumentation is None:
+            raise RuntimeError("Database was opened without instrumentation")
+        return self.instrumentation.stats()
+
+    def reset_stats(self):
+        if self.instrumentation is None:
+            raise RuntimeError("Database was opened without instrumentation")
+        self.instrumentation.counters.Reset()
+
+    def set_trace_hooks(self, begin=None, end=None):
+        if self.instrumentation is None:
+            raise RuntimeError("Database was opened without instrumentation")
+        if begin is None and end is None:
+            self.instrumentation.hooks = None
+            return
+        if not callable(begin) or not callable(end):
+            raise TypeError("Trace hooks must be callables")
+        self.instrumentation.hooks = (begin, end)
+
+    def changes(self, since=0, *, bool wait=False, timeout=None,
+                size_t chunk_size=1000):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+        if not self.log_changes:
+            raise RuntimeError("Database was opened without a change log")
+        if since < 0:
+            raise ValueError("'since' must not be negative")
+        if timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must not be negative")
+        if chunk_size < 1:
+            raise ValueError("'chunk_size' must be at least 1")
+
+        return ChangeFeed(self, since, wait, timeout, chunk_size)
+
+    def truncate_changes(self, upto, *, bool sync=False):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+        if not self.log_changes:
+            raise RuntimeError("Database was opened without a change log")
+        if upto < 0:
+            raise ValueError("'upto' must not be negative")
+
+        cdef leveldb.WriteBatch batch
+        cdef bytes prefix = self.change_log_prefix
+        cdef bytes marker
+        cdef bytes key
+        cdef list keys
+        cdef size_t deleted = 0
+        cdef ReadOptions read_options
+
+        with self.change_condition:
+            upto = min(upto, self.change_seq)
+            if upto < 1:
+                return 0
+
+            # Record the truncated sequence number, so that numbering
+            # continues after it even if the whole log is deleted.
+            marker = db_get(self, prefix, None, read_options)
+            if marker is None or int.from_bytes(marker, 'big') < upto:
+                marker = upto.to_bytes(8, 'big')
+                batch.Put(Slice(prefix, len(prefix)),
+                          Slice(marker, len(marker)))
+                db_write_raw(self, &batch, sync, [prefix])
+                batch.Clear()
+
+        # Delete the entries in bounded batches.
+        with self.iterator(start=prefix + (1).to_bytes(8, 'big'),
+                           stop=prefix + (upto + 1).to_bytes(8, 'big'),
+                           include_value=False) as it:
+            while True:
+                keys = it.next_batch(1000)
+                if not keys:
+                    break
+                for key in keys:
+                    batch.Delete(Slice(key, len(key)))
+                db_write_raw(self, &batch, sync, keys)
+                batch.Clear()
+                deleted += len(keys)
+        return deleted
+
+    cdef int c_get(self, Slice key, string* value,
+                   ReadOptions* read_options=NULL) except -1 nogil:
+        cdef ReadOptions default_read_options
+        cdef Status st
+        cdef uint64_t start
+
+        if read_options is NULL:
+            read_options = &default_read_options
+
+        if not self.guard.Enter():
+            with gil:
+                raise RuntimeError("Database is closed")
+        start = PlyvelTimerStart(self.counters)
+        st = self._db.Get(read_options[0], key, value)
+        PlyvelTimerStop(start)
+        self.guard.Exit()
+
+        if st.IsNotFound():
+            return 0
+        if not st.ok():
+            with gil:
+                raise_for_status(st)
+        if self.codec is not NULL:
+            codec_decode_in_place(self.codec, value)
+        return 1
+
+    cdef int c_put(self, Slice key, Slice value, c_bool sync=False) except -1 nogil:
+        cdef WriteOptions write_options
+        cdef Status st
+        cdef uint64_t start
+        cdef leveldb.WriteBatch batch
+        cdef string encoded
+        cdef c_bool tracked
+        write_options.sync = sync
+
+        if self.merge_buffer.count.load() > 0:
+            with gil:
+                flush_merges_for_key(self, key)
+
+        if self.codec is not NULL:
+            self.codec.Encode(value, &encoded)
+            value = Slice(encoded)
+
+        tracked = self.write_tracker.WriteBegin()
+        try:
+            if self.log_changes:
+                batch.Put(key, value)
+                with gil:
+                    db_write_logged(self, &batch, [encode_change(
+                        key.data()[:key.size()],
+                        value.data()[:value.size()])], sync)
+            else:
+                if not self.guard.Enter():
+                    with gil:
+                        raise RuntimeError("Database is closed")
+                start = PlyvelTimerStart(self.counters)
+                st = self._db.Put(write_options, key, value)
+                PlyvelTimerStop(start)
+                self.guard.Exit()
+
+                if not st.ok():
+                    with gil:
+                        raise_for_status(st)
+            if tracked:
+                self.write_tracker.Record(key)
+        finally:
+            self.write_tracker.WriteEnd(tracked)
+
+        self.write_seq.fetch_add(1)
+        if self.hot_cache is not None:
+            with gil:
+                self.hot_cache.invalidate(key.data()[:key.size()])
+        return 0
+
+    cdef int c_delete(self, Slice key, c_bool sync=False) except -1 nogil:
+        cdef WriteOptions write_options
+        cdef Status st
+        cdef uint64_t start
+        cdef leveldb.WriteBatch batch
+        cdef c_bool tracked
+        write_options.sync = sync
+
+        if self.merge_buffer.count.load() > 0:
+            with gil:
+                flush_merges_for_key(self, key)
+
+        tracked = self.write_tracker.WriteBegin()
+        try:
+            if self.log_changes:
+                batch.Delete(key)
+                with gil:
+                    db_write_logged(self, &batch, [encode_change(
+                        key.data()[:key.size()], None)], sync)
+            else:
+                if not self.guard.Enter():
+                    with gil:
+                        raise RuntimeError("Database is closed")
+                start = PlyvelTimerStart(self.counters)
+                st = self._db.Delete(write_options, key)
+                PlyvelTimerStop(start)
+                self.guard.Exit()
+
+                if not st.ok():
+                    with gil:
+                        raise_for_status(st)
+            if tracked:
+                self.write_tracker.Record(key)
+        finally:
+            self.write_tracker.WriteEnd(tracked)
+
+        self.write_seq.fetch_add(1)
+        if self.hot_cache is not None:
+            with gil:
+                self.hot_cache.invalidate(key.data()[:key.size()])
+        return 0
+
+    def write_batch(self, *, bool transaction=False, bool sync=False):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return WriteBatch(self, None, transaction, sync)
+
+    def transaction(self, *, bool sync=False):
+        return Transaction(db=self, sync=sync)
+
+    def run_transaction(self, func, *, int max_attempts=10,
+                        bool sync=False):
+        return run_transaction(self, None, func, max_attempts, sync)
+
+    def __contains__(self, key):
+        contains_is_unsupported()
+
+    def __iter__(self):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return self.iterator()
+
+    def iterator(self, *, reverse=False, start=None, stop=None,
+                 include_start=True, include_stop=False, prefix=None,
+                 include_key=True, include_value=True,
+                 bool verify_checksums=False, bool fill_cache=True,
+                 size_t readahead=0, Filter key_filter=None,
+                 Filter value_filter=None):
+        return Iterator(
+            self,  # db
+            None,  # db_prefix
+            reverse,
+            start,
+            stop,
+            include_start,
+            include_stop,
+            prefix,
+            include_key,
+            include_value,
+            verify_checksums,
+            fill_cache,
+            None,  # snapshot
+            readahead,
+            key_filter,
+            value_filter,
+        )
+
+    def raw_iterator(self, *, bool verify_checksums=False, bool fill_cache=True):
+        return RawIterator(
+            self,  # db
+            verify_checksums,
+            fill_cache,
+            None,  # snapshot
+        )
+
+    def snapshot(self):
+        return Snapshot(db=self)
+
+    def get_property(self, bytes name not None):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef Slice sl = Slice(name, len(name))
+        cdef string value
+        cdef c_bool result
+
+        db_enter(self)
+        with nogil:
+            result = self._db.GetProperty(sl, &value)
+            self.guard.Exit()
+
+        return value if result else None
+
+    def write_pressure(self):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_write_pressure(self)
+
+    def put_many(self, items, *, bool sync=False, size_t batch_size=1000,
+                 bool throttle=False, double target_pressure=0.75,
+                 double max_delay=1.0):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_put_many(self, None, items, sync, batch_size, throttle,
+                           target_pressure, max_delay)
+
+    def train_value_codec(self, *, size_t sample_size=DEFAULT_SAMPLE_SIZE,
+                          size_t dictionary_size=DEFAULT_DICTIONARY_SIZE):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_train_value_codec(self, self, None, None, sample_size,
+                                    dictionary_size)
+
+    def compact_range(self, *, bytes start=None, bytes stop=None):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        db_compact_range(self, start, stop)
+
+    def compact_range_async(self, *, bytes start=None, bytes stop=None,
+                            size_t part_size=64 * 1024 * 1024):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+        if part_size < 1:
+            raise ValueError("'part_size' must be at least 1")
+
+        return CompactionTask(
+            self, compaction_parts(self, start, stop, part_size))
+
+    def warm(self, *ranges, max_bytes=None, int threads=2,
+             size_t part_size=0):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_warm(self, None, ranges, max_bytes, threads, part_size)
+
+    def approximate_size(self, bytes start=None, bytes stop=None, *,
+                         bytes prefix=None):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return self.approximate_sizes(range_or_prefix(start, stop, prefix))[0]
+
+    def approximate_sizes(self, *ranges):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_approximate_sizes(self, db_key_ranges(self, None, ranges))
+
+    def estimate_count(self, bytes start=None, bytes stop=None, *,
+                       bytes prefix=None, size_t sample_size=256):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return self.estimate_counts(
+            range_or_prefix(start, stop, prefix), sample_size=sample_size)[0]
+
+    def estimate_counts(self, *ranges, size_t sample_size=256):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_estimate_counts(
+            self, db_key_ranges(self, None, ranges), sample_size)
+
+    def prefixed_db(self, bytes prefix not None):
+        return PrefixedDB(db=self, prefix=prefix)
+
+    def distinct_prefixes(self, bytes delimiter not None=b'/', int depth=1, *,
+                          bytes start=None, bytes stop=None):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        return db_distinct_prefixes(
+            self, None, read_options, delimiter, depth, start, stop)
+
+    def sample_keys(self, int n, *, bytes start=None, bytes stop=None):
+        if self.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        if n < 1:
+            raise ValueError("'n' must be at least 1")
+
+        cdef ReadOptions read_options
+        read_options.fill_cache = False
+        cdef leveldb.Iterator* it
+        cdef Slice sl
+        cdef bytes first
+        cdef bytes last
+        cdef vector[Slice] targets
+        cdef vector[string] found
+        cdef size_t i
+        cdef Slice last_slice
+        cdef Comparator* comparator = <Comparator*>self.options.comparator
+
+        db_enter(self)
+        with nogil:
+            it = self._db.NewIterator(read_options)
+        try:
+            # Find the first and last keys in the range
+            if start is None:
+                with nogil:
+                    it.SeekToFirst()
+            else:
+                sl = Slice(start, len(start))
+                with nogil:
+                    it.Seek(sl)
+            if not it.Valid():
+                raise_for_status(it.status())
+                return []
+            sl = it.key()
+            first = sl.data()[:sl.size()]
+
+            if stop is None:
+                with nogil:
+                    it.SeekToLast()
+            else:
+                sl = Slice(stop, len(stop))
+                with nogil:
+                    it.Seek(sl)
+                    if it.Valid():
+                        it.Prev()
+                    else:
+                        it.SeekToLast()
+            if not it.Valid():
+                raise_for_status(it.status())
+                return []
+            sl = it.key()
+            last = sl.data()[:sl.size()]
+            if comparator.Compare(Slice(last, len(last)),
+                                  Slice(first, len(first))) < 0:
+                return []
+
+            if comparator is not BytewiseComparator():
+                # Seek targets are computed by interpolating keys, which
+                # only works for the default key order.
+                return [first]
+
+            # Compute evenly spread seek targets. Keys are mapped to
+            # numbers so that they can be interpolated. If the range has a
+            # size on disk, the targets are searched for (by bisection)
+            # such that the ranges between them have similar sizes.
+            # Otherwise (e.g. data is only in the memtable), the targets
+            # are spread evenly over the key space.
+            width = max(len(first), len(last)) + 1
+            lo = int.from_bytes(first.ljust(width, b'\0'), 'big')
+            hi = int.from_bytes(last.ljust(width, b'\0'), 'big')
+            quantiles = [(2 * j + 1, 2 * n) for j in range(n)]
+            candidates = [lo + (hi - lo) * a // b for a, b in quantiles]
+
+            total = self.approximate_sizes((first, last))[0]
+            if total > 0:
+                lower = [lo] * n
+                upper = [hi] * n
+                for _ in range(32):
+                    mids = [(l + u) // 2 for l, u in zip(lower, upper)]
+                    sizes = self.approximate_sizes(*[
+                        (first, m.to_bytes(width, 'big')) for m in mids])
+                    for j, (a, b) in enumerate(quantiles):
+                        if sizes[j] * b < total * a:
+                            lower[j] = mids[j] + 1
+                        else:
+                            upper[j] = mids[j]
+                candidates = upper
+
+            target_keys = [c.to_bytes(width, 'big').rstrip(b'\0')
+                           for c in candidates]
+            for target in target_keys:
+                targets.push_back(Slice(target, len(target)))
+
+            last_slice = Slice(last, len(last))
+            with nogil:
+                for i in range(targets.size()):
+                    it.Seek(targets[i])
+                    if not it.Valid() or comparator.Compare(
+                            it.key(), last_slice) > 0:
+                        break
+                    found.push_back(it.key().ToString())
+            raise_for_status(it.status())
+        finally:
+            del it
+            self.guard.Exit()
+
+        cdef list result = []
+        cdef bytes key
+        for i in range(found.size()):
+            key = found[i]
+            if not result or result[-1] != key:
+                result.append(key)
+        return result
+
+    cdef void link_iterator(self, IteratorHandle* handle) noexcept:
+        """Add an iterator handle to the list of open iterators.
+
+        The caller must hold the lock. This is an internal helper
+        function that is not exposed in the external Python API.
+        """
+        handle.prev = NULL
+        handle.next = self.iterators
+        if self.iterators is not NULL:
+            self.iterators.prev = handle
+        self.iterators = handle
+
+    cdef void unlink_iterator(self, IteratorHandle* handle) noexcept:
+        """Remove an iterator handle from the list of open iterators.
+
+        The caller must hold the lock.
+        """
+        if handle.prev is not NULL:
+            handle.prev.next = handle.next
+        elif self.iterators == handle:
+            self.iterators = handle.next
+        if handle.next is not NULL:
+            handle.next.prev = handle.prev
+        handle.prev = NULL
+        handle.next = NULL
+
+    cdef leveldb.Iterator* take_pooled_iterator(self, uint64_t write_seq):
+        """Return a pooled iterator, or NULL if none is available.
+
+        The caller must hold the lock.
+        """
+        cdef leveldb.Iterator* it
+        if self.iterator_pool.empty():
+            return NULL
+        if self.iterator_pool_write_seq != write_seq:
+            # The database changed since these iterators were created.
+            self.clear_iterator_pool()
+            return NULL
+        it = self.iterator_pool.back()
+        self.iterator_pool.pop_back()
+        return it
+
+    cdef void release_pooled_iterator(self, leveldb.Iterator* it,
+                                      uint64_t write_seq):
+        """Return an iterator to the pool, or delete it.
+
+        The caller must hold the lock.
+        """
+        cdef uint64_t current_write_seq = self.write_seq.load()
+        if self.iterator_pool_write_seq != current_write_seq:
+            self.clear_iterator_pool()
+
+        if (self.guard.IsClosed() or write_seq != current_write_seq
+                or self.iterator_pool.size() >= self.iterator_pool_size):
+            del it
+            return
+
+        self.iterator_pool_write_seq = write_seq
+        self.iterator_pool.push_back(it)
+
+    cdef void clear_iterator_pool(self):
+        cdef leveldb.Iterator* it
+        while not self.iterator_pool.empty():
+            it = self.iterator_pool.back()
+            self.iterator_pool.pop_back()
+            del it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+cdef class PrefixedDB:
+    cdef readonly DB db
     cdef readonly bytes prefix
 
     def __init__(self, *, DB db not None, bytes prefix not None):
@@ -477,13 +2961,51 @@ cdef class PrefixedDB:
             hex(id(self)),
         )
 
-    def get(self, bytes key not None, default=None, *,
-            bool verify_checksums=False, bool fill_cache=True):
-        return self.db.get(
-            self.prefix + key,
-            default=default,
-            verify_checksums=verify_checksums,
-            fill_cache=fill_cache)
+    def get(self, bytes key not None, default=None, *,
+            bool verify_checksums=False, bool fill_cache=True):
+        return self.db.get(
+            self.prefix + key,
+            default=default,
+            verify_checksums=verify_checksums,
+            fill_cache=fill_cache)
+
+    def get_many(self, keys, default=None, *, bool verify_checksums=False,
+                 bool fill_cache=True):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+        return db_get_many_traced(self.db, self.prefix, keys, default,
+                                  read_options)
+
+    def lookup_sorted(self, keys, default=None, *,
+                      bool verify_checksums=False, bool fill_cache=True):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+        return db_get_many_traced(self.db, self.prefix, keys, default,
+                                  read_options, True)
+
+    def exists(self, bytes key not None, *, bool verify_checksums=False,
+               bool fill_cache=True):
+        return self.exists_many(
+            (key,), verify_checksums=verify_checksums,
+            fill_cache=fill_cache)[0]
+
+    def exists_many(self, keys, *, bool verify_checksums=False,
+                    bool fill_cache=True):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+        return db_exists_many(self.db, self.prefix, keys, read_options)
 
     def put(self, bytes key not None, value not None, *,
             bool sync=False):
@@ -492,9 +3014,41 @@ cdef class PrefixedDB:
     def delete(self, bytes key not None, *, bool sync=False):
         return self.db.delete(self.prefix + key, sync=sync)
 
+    def put_many(self, items, *, bool sync=False, size_t batch_size=1000,
+                 bool throttle=False, double target_pressure=0.75,
+                 double max_delay=1.0):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_put_many(self.db, self.prefix, items, sync, batch_size,
+                           throttle, target_pressure, max_delay)
+
+    def train_value_codec(self, *, size_t sample_size=DEFAULT_SAMPLE_SIZE,
+                          size_t dictionary_size=DEFAULT_DICTIONARY_SIZE):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_train_value_codec(
+            self.db, self.db, self.prefix, bytes_increment(self.prefix),
+            sample_size, dictionary_size)
+
+    def merge(self, bytes key not None, operand, *, str op):
+        db_merge(self.db, self.prefix + key, operand, op)
+
+    def counter_add(self, bytes key not None, delta=1):
+        db_merge(self.db, self.prefix + key, delta, 'add')
+
     def write_batch(self, *, transaction=False, bool sync=False):
         return WriteBatch(self.db, self.prefix, transaction, sync)
 
+    def transaction(self, *, bool sync=False):
+        return Transaction(db=self.db, prefix=self.prefix, sync=sync)
+
+    def run_transaction(self, func, *, int max_attempts=10,
+                        bool sync=False):
+        return run_transaction(self.db, self.prefix, func, max_attempts,
+                               sync)
+
     def __contains__(self, key):
         contains_is_unsupported()
 
@@ -504,7 +3058,9 @@ cdef class PrefixedDB:
     def iterator(self, *, reverse=False, start=None, stop=None,
                  include_start=True, include_stop=False, prefix=None,
                  include_key=True, include_value=True,
-                 bool verify_checksums=False, bool fill_cache=True):
+                 bool verify_checksums=False, bool fill_cache=True,
+                 size_t readahead=0, Filter key_filter=None,
+                 Filter value_filter=None):
         return Iterator(
             self.db,
             self.prefix,
@@ -519,6 +3075,9 @@ cdef class PrefixedDB:
             verify_checksums,
             fill_cache,
             None,  # snapshot
+            readahead,
+            key_filter,
+            value_filter,
         )
 
     def snapshot(self):
@@ -527,11 +3086,72 @@ cdef class PrefixedDB:
     def prefixed_db(self, bytes prefix not None):
         return PrefixedDB(db=self.db, prefix=self.prefix + prefix)
 
+    def compact(self):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+        check_prefix_compaction(self.db)
+
+        # LevelDB compactions include their stop key, which is the first
+        # possible key after the prefix. Compacting that single key as
+        # well does no harm.
+        db_compact_range(self.db, self.prefix, bytes_increment(self.prefix))
+
+    def compact_async(self, *, size_t part_size=64 * 1024 * 1024):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+        if part_size < 1:
+            raise ValueError("'part_size' must be at least 1")
+        check_prefix_compaction(self.db)
+
+        return CompactionTask(self.db, compaction_parts(
+            self.db, self.prefix, bytes_increment(self.prefix), part_size))
+
+    def warm(self, *ranges, max_bytes=None, int threads=2,
+             size_t part_size=0):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_warm(self.db, self.prefix, ranges, max_bytes, threads,
+                       part_size)
+
+    def distinct_prefixes(self, bytes delimiter not None=b'/', int depth=1, *,
+                          bytes start=None, bytes stop=None):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        cdef ReadOptions read_options
+        return db_distinct_prefixes(
+            self.db, self.prefix, read_options, delimiter, depth, start, stop)
+
+    def approximate_size(self, bytes start=None, bytes stop=None, *,
+                         bytes prefix=None):
+        return self.approximate_sizes(range_or_prefix(start, stop, prefix))[0]
+
+    def approximate_sizes(self, *ranges):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_approximate_sizes(
+            self.db, db_key_ranges(self.db, self.prefix, ranges))
+
+    def estimate_count(self, bytes start=None, bytes stop=None, *,
+                       bytes prefix=None, size_t sample_size=256):
+        return self.estimate_counts(
+            range_or_prefix(start, stop, prefix), sample_size=sample_size)[0]
+
+    def estimate_counts(self, *ranges, size_t sample_size=256):
+        if self.db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        return db_estimate_counts(
+            self.db, db_key_ranges(self.db, self.prefix, ranges), sample_size)
+
 
 def repair_db(name, *, paranoid_checks=None, write_buffer_size=None,
               max_open_files=None, lru_cache_size=None, block_size=None,
               block_restart_interval=None, max_file_size=None,
-              compression='snappy', int bloom_filter_bits=0, comparator=None,
+              compression='snappy', compression_level=None,
+              int bloom_filter_bits=0, comparator=None,
               bytes comparator_name=None):
     cdef Options options = Options()
     cdef Status st
@@ -543,13 +3163,63 @@ def repair_db(name, *, paranoid_checks=None, write_buffer_size=None,
     parse_options(
         &options, create_if_missing, error_if_exists, paranoid_checks,
         write_buffer_size, max_open_files, lru_cache_size, block_size,
-        block_restart_interval, max_file_size, compression, bloom_filter_bits,
-        comparator, comparator_name)
+        block_restart_interval, max_file_size, compression, compression_level,
+        bloom_filter_bits, comparator, comparator_name)
     with nogil:
         st = RepairDB(fsname, options)
     raise_for_status(st)
 
 
+def recompress_db(name, new_name, *, compression='snappy',
+                  compression_level=None, comparator=None,
+                  bytes comparator_name=None, size_t batch_size=1000,
+                  **options):
+    # Check the options before opening the source database.
+    cdef Options new_options
+    parse_options(
+        &new_options, True, True, None, None, None, None, None, None, None,
+        compression, compression_level, 0, None, None)
+    if batch_size < 1:
+        raise ValueError("'batch_size' must be at least 1")
+
+    with DB(name, comparator=comparator,
+            comparator_name=comparator_name) as db:
+        new_db = DB(new_name, create_if_missing=True, error_if_exists=True,
+                    compression=compression,
+                    compression_level=compression_level,
+                    comparator=comparator, comparator_name=comparator_name,
+                    **options)
+        try:
+            recompress_into(db, new_db, batch_size)
+        except BaseException:
+            # Do not leave a partial copy behind.
+            new_db.close()
+            destroy_db(new_name)
+            raise
+        new_db.close()
+
+
+cdef recompress_into(DB db, DB new_db, size_t batch_size):
+    reserved = new_db.value_codec_prefix
+    if reserved is not None:
+        with db.iterator(include_value=False) as it:
+            empty = next(it, None) is None
+        if not empty:
+            # Compress the values while copying them.
+            db_train_value_codec(
+                new_db, db, None, None, DEFAULT_SAMPLE_SIZE,
+                DEFAULT_DICTIONARY_SIZE)
+    with db.snapshot() as snapshot:
+        items = snapshot.iterator(fill_cache=False)
+        if reserved is not None:
+            items = ((key, value) for key, value in items
+                     if not key.startswith(reserved))
+        new_db.put_many(items, batch_size=batch_size)
+    # Rewrite everything into fully compacted (and thus fully
+    # compressed) tables.
+    new_db.compact_range()
+
+
 def destroy_db(name):
     cdef Options options = Options()
     cdef Status st
@@ -561,23 +3231,39 @@ def destroy_db(name):
     raise_for_status(st)
 
 
+def get_include():
+    import os.path
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def uses_default_comparator(db):
+    """Return whether a DB or PrefixedDB uses the default comparator.
+
+    Used by the Python modules that rely on the byte order of keys.
+    """
+    cdef DB base = db.db if isinstance(db, PrefixedDB) else db
+    if base.guard.IsClosed():
+        raise RuntimeError("Database is closed")
+    return base.options.comparator is BytewiseComparator()
+
+
 #
 # Write batch
 #
 
 @cython.final
 cdef class WriteBatch:
-    cdef leveldb.WriteBatch* _write_batch
-    cdef WriteOptions write_options
-    cdef DB db
-    cdef bytes prefix
-    cdef c_bool transaction
-
     def __init__(self, DB db not None, bytes prefix, bool transaction, sync):
         self.db = db
-        self.prefix = prefix
+        if prefix is not None:
+            self.key_prefix = prefix
         self.transaction = transaction
 
+        if db.hot_cache is not None:
+            self.keys = []
+        if db.log_changes:
+            self.changes = []
+
         self.write_options = WriteOptions()
         if sync is not None:
             self.write_options.sync = sync
@@ -588,70 +3274,185 @@ cdef class WriteBatch:
         del self._write_batch
 
     def put(self, bytes key not None, value not None):
-        if self.db._db is NULL:
-            raise RuntimeError("Database is closed")
-
-        if self.prefix is not None:
-            key = self.prefix + key
-
         cdef Slice key_slice = Slice(key, len(key))
         cdef Py_buffer value_buffer
         PyObject_GetBuffer(value, &value_buffer, PyBUF_SIMPLE)
         try:
-            with nogil:
-                self._write_batch.Put(
-                    key_slice,
-                    Slice(<const_char *>value_buffer.buf, value_buffer.len))
+            self.c_put(
+                key_slice,
+                Slice(<const_char *>value_buffer.buf, value_buffer.len))
         finally:
             PyBuffer_Release(&value_buffer)
 
     def delete(self, bytes key not None):
-        if self.db._db is NULL:
-            raise RuntimeError("Database is closed")
+        self.c_delete(Slice(key, len(key)))
+
+    cdef int c_put(self, Slice key, Slice value) except -1 nogil:
+        cdef string prefixed_key
+        cdef string encoded
+
+        if self.db.guard.IsClosed():
+            with gil:
+                raise RuntimeError("Database is closed")
+
+        if not self.key_prefix.empty():
+            prefixed_key = self.key_prefix
+            prefixed_key.append(key.data(), key.size())
+            key = Slice(prefixed_key)
+
+        if self.db.codec is not NULL:
+            self.db.codec.Encode(value, &encoded)
+            value = Slice(encoded)
+
+        self._write_batch.Put(key, value)
+
+        if self.keys is not None:
+            with gil:
+                self.keys.append(key.data()[:key.size()])
+        if self.changes is not None:
+            with gil:
+                self.changes.append(encode_change(
+                    key.data()[:key.size()], value.data()[:value.size()]))
+        return 0
 
-        if self.prefix is not None:
-            key = self.prefix + key
+    cdef int c_delete(self, Slice key) except -1 nogil:
+        cdef string prefixed_key
 
-        cdef Slice key_slice = Slice(key, len(key))
-        with nogil:
-            self._write_batch.Delete(key_slice)
+        if self.db.guard.IsClosed():
+            with gil:
+                raise RuntimeError("Database is closed")
+
+        if not self.key_prefix.empty():
+            prefixed_key = self.key_prefix
+            prefixed_key.append(key.data(), key.size())
+            key = Slice(prefixed_key)
+
+        self._write_batch.Delete(key)
+
+        if self.keys is not None:
+            with gil:
+                self.keys.append(key.data()[:key.size()])
+        if self.changes is not None:
+            with gil:
+                self.changes.append(
+                    encode_change(key.data()[:key.size()], None))
+        return 0
 
     def clear(self):
-        if self.db._db is NULL:
+        if self.db.guard.IsClosed():
             raise RuntimeError("Database is closed")
 
         with nogil:
             self._write_batch.Clear()
 
+        if self.keys is not None:
+            del self.keys[:]
+        if self.changes is not None:
+            del self.changes[:]
+
     def write(self):
-        if self.db._db is NULL:
+        if self.db.guard.IsClosed():
             raise RuntimeError("Database is closed")
 
+        cdef Instrumentation instrumentation = self.db.instrumentation
+        cdef TraceState trace
+        if instrumentation is None:
+            with nogil:
+                self.c_write()
+            return
+
+        token = instrumentation.begin(OP_WRITE, None, &trace)
+        try:
+            with nogil:
+                self.c_write()
+        except BaseException as exc:
+            instrumentation.end(OP_WRITE, &trace, token, 0, exc)
+            raise
+        instrumentation.end(OP_WRITE, &trace, token,
+                            self._write_batch.ApproximateSize(), None)
+
+    cdef int c_write(self, c_bool locked=False) except -1 nogil:
         cdef Status st
-        with nogil:
-            st = self.db._db.Write(self.write_options, self._write_batch)
-        raise_for_status(st)
+        cdef uint64_t start
+        cdef c_bool tracked = locked
+
+        if not locked:
+            if self.db.merge_buffer.count.load() > 0:
+                # Pending merge operands must be applied before the
+                # batch, which may overwrite their keys.
+                with gil:
+                    db_flush_merges(self.db, False)
+            tracked = self.db.write_tracker.WriteBegin()
+
+        try:
+            if self.changes is not None:
+                with gil:
+                    db_write_logged(self.db, self._write_batch,
+                                    self.changes, self.write_options.sync)
+            else:
+                if not self.db.guard.Enter():
+                    with gil:
+                        raise RuntimeError("Database is closed")
+                start = PlyvelTimerStart(self.db.counters)
+                st = self.db._db.Write(self.write_options, self._write_batch)
+                PlyvelTimerStop(start)
+                self.db.guard.Exit()
+
+                if not st.ok():
+                    with gil:
+                        raise_for_status(st)
+            if tracked:
+                self.db.write_tracker.RecordBatch(self._write_batch[0])
+        finally:
+            self.db.write_tracker.WriteEnd(tracked)
+
+        self.db.write_seq.fetch_add(1)
+        if self.keys is not None:
+            with gil:
+                for key in self.keys:
+                    if key is None:
+                        self.db.hot_cache.clear()
+                    else:
+                        self.db.hot_cache.invalidate(key)
+        return 0
 
     def approximate_size(self):
-        if self.db._db is NULL:
+        if self.db.guard.IsClosed():
             raise RuntimeError("Database is closed")
 
         return self._write_batch.ApproximateSize()
 
     def append(self, WriteBatch source not None):
-        if self.db._db is NULL:
+        if self.db.guard.IsClosed():
             raise RuntimeError("Database is closed")
 
+        if self.changes is not None:
+            if source.changes is None:
+                raise ValueError(
+                    "Cannot append a batch without change log entries to a "
+                    "batch of a database with a change log")
+
         self._write_batch.Append(source._write_batch[0])
 
+        if self.changes is not None:
+            self.changes.extend(source.changes)
+
+        if self.keys is not None:
+            if source.keys is None:
+                # The keys in the source batch are unknown, so the
+                # complete hot key cache is dropped after writing.
+                self.keys.append(None)
+            else:
+                self.keys.extend(source.keys)
+
     def __enter__(self):
-        if self.db._db is NULL:
+        if self.db.guard.IsClosed():
             raise RuntimeError("Database is closed")
 
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.db._db is NULL:
+        if self.db.guard.IsClosed():
             raise RuntimeError("Database is closed")
 
         if self.transaction and exc_type is not None:
@@ -664,56 +3465,278 @@ cdef class WriteBatch:
 
 
 #
-# Iterator
+# Iterator filters
 #
 
-cdef enum IteratorState:
-    BEFORE_START
-    AFTER_STOP
-    IN_BETWEEN
-    IN_BETWEEN_ALREADY_POSITIONED
+cdef dict FILTER_OPERATORS = {
+    '==': PLYVEL_FILTER_EQ,
+    '!=': PLYVEL_FILTER_NE,
+    '<': PLYVEL_FILTER_LT,
+    '<=': PLYVEL_FILTER_LE,
+    '>': PLYVEL_FILTER_GT,
+    '>=': PLYVEL_FILTER_GE,
+}
 
 
-cdef enum IteratorDirection:
-    FORWARD
-    REVERSE
+# Filters are compiled and evaluated recursively, so deeper trees could
+# overflow the stack.
+cdef enum:
+    MAX_FILTER_DEPTH = 1000
 
 
-cdef class BaseIterator:
-    cdef DB db
-    cdef leveldb.Iterator* _iter
+cdef Filter new_filter(tuple spec, int depth=1):
+    if depth > MAX_FILTER_DEPTH:
+        raise ValueError(
+            "Filters cannot be nested more than %d levels deep"
+            % MAX_FILTER_DEPTH)
+    cdef Filter f = Filter.__new__(Filter)
+    f.spec = spec
+    f.depth = depth
+    return f
+
+
+@cython.final
+cdef class Filter:
+    cdef tuple spec
+    cdef int depth
+
+    def __init__(self):
+        raise TypeError("Filters are created using the static methods")
+
+    @staticmethod
+    def prefix(bytes value not None, *, size_t offset=0):
+        return new_filter(('prefix', value, offset))
+
+    @staticmethod
+    def suffix(bytes value not None):
+        return new_filter(('suffix', value))
+
+    @staticmethod
+    def contains(bytes value not None, *, size_t offset=0):
+        return new_filter(('contains', value, offset))
+
+    @staticmethod
+    def integer(str op not None, value, *, size_t offset=0, int size=8,
+                str byteorder='big', bool signed=False):
+        if op not in FILTER_OPERATORS:
+            raise ValueError("Invalid operator: %r" % op)
+        if size not in (1, 2, 4, 8):
+            raise ValueError("'size' must be 1, 2, 4, or 8")
+        if byteorder not in ('big', 'little'):
+            raise ValueError("'byteorder' must be 'big' or 'little'")
+        if not isinstance(value, int):
+            raise TypeError("'value' must be an integer")
+
+        bits = 8 * size
+        if signed:
+            fits = -(1 << (bits - 1)) <= value < (1 << (bits - 1))
+        else:
+            fits = 0 <= value < (1 << bits)
+        if not fits:
+            raise OverflowError("'value' does not fit in %d bytes" % size)
+
+        return new_filter((
+            'integer', FILTER_OPERATORS[op], value & 0xffffffffffffffff,
+            offset, size, byteorder == 'big', signed))
+
+    @staticmethod
+    def regex(bytes pattern not None):
+        cdef PlyvelFilter f
+        try:
+            f.AddRegex(pattern)
+        except RuntimeError as exc:
+            raise ValueError(
+                "Invalid regular expression: %s" % exc) from None
+        return new_filter(('regex', pattern))
+
+    @staticmethod
+    def stride(uint64_t n, *, uint64_t offset=0):
+        if n < 1:
+            raise ValueError("'n' must be at least 1")
+        if offset >= n:
+            raise ValueError("'offset' must be between 0 and n - 1")
+        return new_filter(('stride', n, offset))
+
+    def __and__(self, other):
+        if not isinstance(other, Filter):
+            return NotImplemented
+        return new_filter(('and', self, other),
+                          1 + max(self.depth, (<Filter>other).depth))
+
+    def __or__(self, other):
+        if not isinstance(other, Filter):
+            return NotImplemented
+        return new_filter(('or', self, other),
+                          1 + max(self.depth, (<Filter>other).depth))
+
+    def __invert__(self):
+        return new_filter(('not', self), 1 + self.depth)
+
+
+cdef int compile_filter(PlyvelFilter* f, Filter flt,
+                        c_bool is_key_filter) except -1:
+    """Add the nodes for a filter; return the index of its root node."""
+    cdef tuple spec = flt.spec
+    kind = spec[0]
+    if kind == 'prefix':
+        return f.AddPrefix(spec[1], spec[2])
+    if kind == 'suffix':
+        return f.AddSuffix(spec[1])
+    if kind == 'contains':
+        return f.AddContains(spec[1], spec[2])
+    if kind == 'integer':
+        return f.AddInteger(spec[1], spec[2], spec[3], spec[4], spec[5],
+                            spec[6])
+    if kind == 'regex':
+        if not is_key_filter:
+            # Values are often too large to match (see filter.h).
+            raise ValueError(
+                "Regular expression filters can only be used for keys")
+        return f.AddRegex(spec[1])
+    if kind == 'stride':
+        return f.AddStride(spec[1], spec[2])
+    if kind == 'and':
+        return f.AddAnd(compile_filter(f, spec[1], is_key_filter),
+                        compile_filter(f, spec[2], is_key_filter))
+    if kind == 'or':
+        return f.AddOr(compile_filter(f, spec[1], is_key_filter),
+                       compile_filter(f, spec[2], is_key_filter))
+    return f.AddNot(compile_filter(f, spec[1], is_key_filter))
+
+
+cdef int raise_for_filter(PlyvelFilter* f) except -1:
+    if f.Failed():
+        raise ValueError(
+            "Keys longer than %d bytes cannot be matched by a regular "
+            "expression filter" % PLYVEL_FILTER_MAX_REGEX_SIZE)
+    return 0
+
 
-    # Iterators need to be weak referencable to ensure a proper cleanup
-    # from DB.close()
-    cdef object __weakref__
+#
+# Iterator
+#
 
+@cython.no_gc_clear
+cdef class BaseIterator:
     def __init__(self, DB db, bool verify_checksums, bool fill_cache,
-                 Snapshot snapshot):
-        if db._db is NULL:
+                 Snapshot snapshot, bool pooled=False):
+        if db.guard.IsClosed():
             raise RuntimeError("Database or iterator is closed")
 
         self.db = db
 
-        cdef ReadOptions read_options
-        read_options.verify_checksums = verify_checksums
-        read_options.fill_cache = fill_cache
+        self.read_options.verify_checksums = verify_checksums
+        self.read_options.fill_cache = fill_cache
         if snapshot is not None:
-            read_options.snapshot = snapshot._snapshot
+            self.read_options.snapshot = snapshot._snapshot
+
+        # Only iterators with default read options can be pooled, since
+        # the pool is shared.
+        self.pooled = (
+            pooled and db.iterator_pool_size > 0 and snapshot is None
+            and not verify_checksums and fill_cache)
+
+        cdef TraceState trace
+        if db.instrumentation is not None:
+            token = db.instrumentation.begin(OP_ITERATOR, None, &trace)
+            try:
+                db_enter(db)
+            except BaseException as exc:
+                db.instrumentation.end(OP_ITERATOR, &trace, token, 0, exc)
+                raise
+        else:
+            db_enter(db)
+        self.new_iterator()
+        with db.lock:
+            db.link_iterator(&self.handle)
+        db.guard.Exit()
 
-        with nogil:
-            self._iter = db._db.NewIterator(read_options)
+        if db.instrumentation is not None:
+            db.instrumentation.end(OP_ITERATOR, &trace, token, 0, None)
+
+    cdef int acquire(self) except -1:
+        """Start using the iterator from the current thread.
+
+        Each successful call must be paired with a release() call. This
+        is an internal helper function that is not exposed in the
+        external Python API.
+        """
+        if self.busy.exchange(True):
+            raise RuntimeError("Iterator is already in use by another thread")
+
+        if not self.db.guard.Enter():
+            self.busy.store(False)
+            raise RuntimeError("Database or iterator is closed")
+
+        if self.handle.iter is NULL:
+            self.release()
+            raise RuntimeError("Database or iterator is closed")
+
+        return 0
+
+    cdef void release(self) noexcept nogil:
+        self.db.guard.Exit()
+        self.busy.store(False)
+
+    cdef void new_iterator(self):
+        """Set up the underlying LevelDB iterator.
+
+        The caller must have registered with the database guard.
+        """
+        # Obtain the write sequence number before creating the iterator,
+        # so that writes racing with the creation make it look stale.
+        self.write_seq = self.db.write_seq.load()
+
+        cdef leveldb.Iterator* it = NULL
+        cdef uint64_t start
+        if self.pooled:
+            with self.db.lock:
+                it = self.db.take_pooled_iterator(self.write_seq)
+
+        if it is NULL:
+            with nogil:
+                start = PlyvelTimerStart(self.db.counters)
+                it = self.db._db.NewIterator(self.read_options)
+                PlyvelTimerStop(start)
 
-        # Store a weak reference on the db (needed when closing db)
-        iterator_id = id(self)
-        ref_dict = db.iterators
-        ref_dict[iterator_id] = weakref_ref(
-            self,
-            lambda wr: ref_dict.pop(iterator_id))
+        self.handle.iter = it
+
+    cdef void delete_iterator(self):
+        """Delete the underlying LevelDB iterator (if any).
+
+        The iterator stays linked into the list of open iterators.
+        """
+        cdef leveldb.Iterator* it
+        with self.db.lock:
+            it = self.handle.iter
+            self.handle.iter = NULL
+            if it is not NULL:
+                if self.pooled:
+                    self.db.release_pooled_iterator(it, self.write_seq)
+                else:
+                    del it
 
     cpdef close(self):
-        if self._iter is not NULL:
-            del self._iter
-            self._iter = NULL
+        if self.db is None:
+            return  # constructor failed
+
+        if self.busy.exchange(True):
+            raise RuntimeError("Iterator is in use by another thread")
+
+        # While the handle is linked, the DB has not been deleted yet, and
+        # DB.close() cannot proceed without the lock, so the underlying
+        # iterator can be safely deleted.
+        cdef leveldb.Iterator* it
+        with self.db.lock:
+            it = self.handle.iter
+            if self.pooled:
+                self.handle.iter = NULL
+            delete_iterator_handle(&self.handle)
+            if self.pooled and it is not NULL:
+                self.db.release_pooled_iterator(it, self.write_seq)
+            self.db.unlink_iterator(&self.handle)
+
+        self.busy.store(False)
 
     def __dealloc__(self):
         self.close()
@@ -732,33 +3755,21 @@ cdef class BaseIterator:
 
 @cython.final
 cdef class Iterator(BaseIterator):
-    cdef IteratorDirection direction
-    cdef IteratorState state
-    cdef Comparator* comparator
-    cdef bytes start
-    cdef bytes stop
-    cdef Slice start_slice
-    cdef Slice stop_slice
-    cdef c_bool include_start
-    cdef c_bool include_stop
-    cdef c_bool include_key
-    cdef c_bool include_value
-    cdef bytes db_prefix
-    cdef size_t db_prefix_len
-
     def __init__(self, DB db, bytes db_prefix, bool reverse, bytes start,
                  bytes stop, bool include_start, bool include_stop,
                  bytes prefix, bool include_key, bool include_value,
-                 bool verify_checksums, bool fill_cache, Snapshot snapshot):
+                 bool verify_checksums, bool fill_cache, Snapshot snapshot,
+                 size_t readahead=0, Filter key_filter=None,
+                 Filter value_filter=None):
 
         super(Iterator, self).__init__(
             db=db,
             verify_checksums=verify_checksums,
             fill_cache=fill_cache,
-            snapshot=snapshot)
+            snapshot=snapshot,
+            pooled=True)
 
         self.comparator = <leveldb.Comparator*>db.options.comparator
-        self.direction = FORWARD if not reverse else REVERSE
 
         if db_prefix is None:
             self.db_prefix_len = 0
@@ -767,6 +3778,59 @@ cdef class Iterator(BaseIterator):
             self.db_prefix = db_prefix
             self.db_prefix_len = len(db_prefix)
 
+        self.include_key = include_key
+        self.include_value = include_value
+        self.readahead_size = readahead
+
+        if key_filter is not None or value_filter is not None:
+            self.filter = new PlyvelFilter()
+            if key_filter is not None:
+                self.filter.SetKeyRoot(
+                    compile_filter(self.filter, key_filter, True))
+            if value_filter is not None:
+                self.filter.SetValueRoot(
+                    compile_filter(self.filter, value_filter, False))
+
+        self.acquire()
+        try:
+            self.set_range(reverse, start, stop, include_start, include_stop,
+                           prefix)
+        finally:
+            self.release()
+
+    def __dealloc__(self):
+        del self.filter
+
+    def reset(self, *, reverse=False, start=None, stop=None,
+              include_start=True, include_stop=False, prefix=None):
+        self.acquire()
+        try:
+            self.stop_readahead()
+            if (self.read_options.snapshot is NULL
+                    and self.write_seq != self.db.write_seq.load()):
+                # The database changed since the underlying iterator was
+                # created, so it needs to be replaced by a fresh one.
+                self.delete_iterator()
+                self.new_iterator()
+
+            self.set_range(reverse, start, stop, include_start, include_stop,
+                           prefix)
+        finally:
+            self.release()
+
+    cdef int set_range(self, bool reverse, bytes start, bytes stop,
+                       bool include_start, bool include_stop,
+                       bytes prefix) except -1:
+        """Configure the iterator range and position it.
+
+        This is an internal helper function that is not exposed in the
+        external Python API.
+        """
+        cdef bytes db_prefix = self.db_prefix
+
+        self.direction = FORWARD if not reverse else REVERSE
+
+        if db_prefix is not None:
             # Transform args so that the database key prefix is taken
             # into account.
             if prefix is not None:
@@ -798,29 +3862,107 @@ cdef class Iterator(BaseIterator):
             include_start = True
             include_stop = False
 
+        self.start = start
         if start is not None:
-            self.start = start
             self.start_slice = Slice(start, len(start))
 
+        self.stop = stop
         if stop is not None:
-            self.stop = stop
             self.stop_slice = Slice(stop, len(stop))
 
         self.include_start = include_start
         self.include_stop = include_stop
-        self.include_key = include_key
-        self.include_value = include_value
 
+        if self.filter is not NULL:
+            self.filter.Reset()
+
+        self.stop_readahead()
         if self.direction == FORWARD:
-            self.seek_to_start()
+            self.state = BEFORE_START
         else:
-            self.seek_to_stop()
+            self.state = AFTER_STOP
 
-        raise_for_status(self._iter.status())
+        raise_for_status(self.handle.iter.status())
 
     def __iter__(self):
         return self
 
+    cdef void start_readahead(self):
+        cdef Slice* start_slice = NULL
+        cdef Slice* stop_slice = NULL
+        if self.start is not None:
+            start_slice = &self.start_slice
+        if self.stop is not None:
+            stop_slice = &self.stop_slice
+        # Value filters need the values, even if they are not returned.
+        cdef c_bool include_value = self.include_value or (
+            self.filter is not NULL and self.filter.HasValueFilter())
+        self.handle.readahead = new PlyvelReadahead(
+            self.handle.iter, self.comparator, self.readahead_size,
+            include_value, start_slice, self.include_start, stop_slice,
+            self.include_stop)
+        self.readahead_has_key = False
+        self.state = READING_AHEAD
+
+    cdef void stop_readahead(self) noexcept:
+        """Stop the read-ahead thread (if any).
+
+        Afterwards, the iterator is positioned as if the entries returned
+        so far were obtained without read-ahead.
+        """
+        if self.handle.readahead is NULL:
+            return
+
+        with nogil:
+            del self.handle.readahead
+        self.handle.readahead = NULL
+
+        if self.state != READING_AHEAD:
+            return
+
+        if self.readahead_has_key:
+            with nogil:
+                self.handle.iter.Seek(Slice(self.readahead_key.data(),
+                                      self.readahead_key.size()))
+            self.state = IN_BETWEEN
+        else:
+            self.state = BEFORE_START
+
+    cdef int readahead_pop(self) except -1:
+        cdef c_bool found
+        cdef Status st
+
+        with nogil:
+            found = self.handle.readahead.Pop(&self.readahead_key,
+                                              &self.readahead_value)
+
+        if not found:
+            st = self.handle.readahead.status()
+            with nogil:
+                del self.handle.readahead
+            self.handle.readahead = NULL
+            self.state = AFTER_STOP
+            raise_for_status(st)
+            return 0
+
+        self.readahead_has_key = True
+        return 1
+
+    cdef void entry(self, Slice* key, Slice* value) noexcept:
+        """Point `key` and `value` to the current entry.
+
+        This is an internal helper function that is not exposed in the
+        external Python API. The db prefix (for PrefixedDB iterators) is
+        chopped off.
+        """
+        if self.state == READING_AHEAD:
+            key[0] = Slice(self.readahead_key)
+            value[0] = Slice(self.readahead_value)
+        else:
+            key[0] = self.handle.iter.key()
+            value[0] = self.handle.iter.value()
+        key.remove_prefix(self.db_prefix_len)
+
     cdef object current(self):
         """Return the current iterator key/value.
 
@@ -832,15 +3974,17 @@ cdef class Iterator(BaseIterator):
         cdef Slice value_slice
         cdef bytes value = None
 
-        # Only build Python strings that will be returned. Also chop off
-        # the db prefix (for PrefixedDB iterators).
+        # Only build Python strings that will be returned.
+        self.entry(&key_slice, &value_slice)
+
         if self.include_key:
-            key_slice = self._iter.key()
-            key = key_slice.data()[self.db_prefix_len:key_slice.size()]
+            key = key_slice.data()[:key_slice.size()]
 
         if self.include_value:
-            value_slice = self._iter.value()
-            value = value_slice.data()[:value_slice.size()]
+            if self.db.codec is NULL:
+                value = value_slice.data()[:value_slice.size()]
+            else:
+                value = codec_decode(self.db.codec, value_slice)
 
         if self.include_key and self.include_value:
             return (key, value)
@@ -856,126 +4000,356 @@ cdef class Iterator(BaseIterator):
         Note: Cython will also create a .next() method that does the
         same as this method.
         """
-        if self.direction == FORWARD:
-            return self.real_next()
-        else:
-            return self.real_prev()
+        self.acquire()
+        try:
+            if self.direction == FORWARD:
+                return self.real_next()
+            else:
+                return self.real_prev()
+        finally:
+            self.release()
 
     def prev(self):
-        if self.direction == FORWARD:
-            return self.real_prev()
-        else:
-            return self.real_next()
+        self.acquire()
+        try:
+            if self.direction == FORWARD:
+                return self.real_prev()
+            else:
+                return self.real_next()
+        finally:
+            self.release()
+
+    def next_batch(self, Py_ssize_t size):
+        cdef list entries = []
+        cdef c_bool forward = self.direction == FORWARD
+
+        if size < 0:
+            raise ValueError("'size' must not be negative")
+
+        if self.include_value and self.db.codec is not NULL:
+            return self.next_batch_decoded(size)
+
+        self.acquire()
+        try:
+            while len(entries) < size:
+                if forward:
+                    if not self.move_next():
+                        break
+                    entries.append(self.current())
+                else:
+                    if not self.move_prev():
+                        break
+                    entries.append(self.current())
+                    self.finish_prev()
+        finally:
+            self.release()
+
+        return entries
+
+    cdef list next_batch_decoded(self, Py_ssize_t size):
+        """Like next_batch(), but decoding all values in a single pass
+        without the GIL.
+
+        This is an internal helper function that is not exposed in the
+        external Python API.
+        """
+        cdef list keys = []
+        cdef vector[string] values
+        cdef c_bool forward = self.direction == FORWARD
+        cdef Slice key
+        cdef Slice value
+        cdef size_t i
+
+        self.acquire()
+        try:
+            while <Py_ssize_t>values.size() < size:
+                if forward:
+                    if not self.move_next():
+                        break
+                elif not self.move_prev():
+                    break
+                self.entry(&key, &value)
+                if self.include_key:
+                    keys.append(key.data()[:key.size()])
+                values.push_back(value.ToString())
+                if not forward:
+                    self.finish_prev()
+        finally:
+            self.release()
+
+        with nogil:
+            for i in range(values.size()):
+                codec_decode_in_place(self.db.codec, &values[i])
+
+        if self.include_key:
+            return [(keys[i], values[i]) for i in range(values.size())]
+        return [values[i] for i in range(values.size())]
+
+    cdef int c_next(self, Slice* key, Slice* value) except -1:
+        self.acquire()
+        try:
+            return self.step(self.direction == FORWARD, key, value)
+        finally:
+            self.release()
+
+    cdef int c_prev(self, Slice* key, Slice* value) except -1:
+        self.acquire()
+        try:
+            return self.step(self.direction == REVERSE, key, value)
+        finally:
+            self.release()
+
+    cdef int c_seek(self, Slice target) except -1:
+        self.acquire()
+        try:
+            return self.real_seek(target)
+        finally:
+            self.release()
+
+    cdef int step(self, c_bool forward, Slice* key, Slice* value) except -1:
+        if forward:
+            if not self.move_next():
+                return 0
+            self.entry(key, value)
+            if self.include_value and self.db.codec is not NULL:
+                self.entry_value.assign(value.data(), value.size())
+                codec_decode_in_place(self.db.codec, &self.entry_value)
+                value[0] = Slice(self.entry_value)
+            return 1
+
+        if not self.move_prev():
+            return 0
+
+        # Moving backwards invalidates the current entry, so copy it.
+        self.entry(key, value)
+        self.entry_key.assign(key.data(), key.size())
+        self.entry_value.assign(value.data(), value.size())
+        self.finish_prev()
+        if self.include_value and self.db.codec is not NULL:
+            codec_decode_in_place(self.db.codec, &self.entry_value)
+        key[0] = Slice(self.entry_key)
+        value[0] = Slice(self.entry_value)
+        return 1
+
+    cdef real_next(self):
+        if not self.move_next():
+            raise StopIteration
+        return self.current()
+
+    cdef real_prev(self):
+        if not self.move_prev():
+            raise StopIteration
+
+        # Unlike .real_next(), first obtain the value, then move the
+        # iterator pointer (not the other way around), so that
+        # repeatedly calling it.prev() and next(it) will work as
+        # designed.
+        out = self.current()
+        self.finish_prev()
+        return out
+
+    cdef int entry_matches(self) except -1:
+        """Return whether the current entry matches the filters (if any)."""
+        cdef Slice key
+        cdef Slice value
+
+        if self.filter is NULL:
+            return 1
+
+        self.entry(&key, &value)
+        if self.db.codec is not NULL and self.filter.HasValueFilter():
+            # Filters apply to decoded values.
+            self.entry_value.assign(value.data(), value.size())
+            codec_decode_in_place(self.db.codec, &self.entry_value)
+            value = Slice(self.entry_value)
+        matches = self.filter.Matches(key, value)
+        raise_for_filter(self.filter)
+        return matches
+
+    cdef int move_next(self) except -1:
+        """Move to the next entry (in forward direction) that matches the
+        filters (if any).
+
+        Returns 1 if the iterator is positioned at an entry, and 0 if
+        there are no more entries. This is an internal helper function
+        that is not exposed in the external Python API.
+        """
+        cdef c_bool found
+        cdef Slice* stop_slice = NULL
+
+        if not self.move_next_any():
+            return 0
+
+        while not self.entry_matches():
+            if self.state == IN_BETWEEN and (
+                    self.db.codec is NULL or not self.filter.HasValueFilter()):
+                # Skip non-matching entries without the GIL.
+                if self.stop is not None:
+                    stop_slice = &self.stop_slice
+                with nogil:
+                    found = self.filter.SkipForward(
+                        self.handle.iter, self.comparator, stop_slice,
+                        self.include_stop, self.db_prefix_len)
+                if found:
+                    raise_for_filter(self.filter)
+                    return 1
+                self.state = AFTER_STOP
+                raise_for_status(self.handle.iter.status())
+                return 0
+
+            if not self.move_next_any():
+                return 0
+
+        return 1
+
+    cdef int move_prev(self) except -1:
+        """Move to the previous entry (in forward direction) that matches
+        the filters (if any).
+
+        Returns 1 if the iterator is positioned at an entry, and 0 if
+        there are no more entries. After using the entry, finish_prev()
+        must be called.
+        """
+        while self.move_prev_any():
+            if self.entry_matches():
+                return 1
+            self.finish_prev()
+        return 0
+
+    cdef int move_next_any(self) except -1:
+        """Move to the next entry (in forward direction), regardless of
+        the filters.
 
-    cdef real_next(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
+        Returns 1 if the iterator is positioned at an entry, and 0 if
+        there are no more entries.
+        """
+        if (self.state == BEFORE_START and self.readahead_size > 0
+                and self.direction == FORWARD):
+            self.start_readahead()
+
+        if self.state == READING_AHEAD:
+            return self.readahead_pop()
 
         if self.state == IN_BETWEEN:
             with nogil:
-                self._iter.Next()
-            if not self._iter.Valid():
+                self.handle.iter.Next()
+            if not self.handle.iter.Valid():
                 self.state = AFTER_STOP
-                raise StopIteration
+                return 0
         elif self.state == IN_BETWEEN_ALREADY_POSITIONED:
             self.state = IN_BETWEEN
         elif self.state == BEFORE_START:
             if self.start is None:
                 with nogil:
-                    self._iter.SeekToFirst()
+                    self.handle.iter.SeekToFirst()
             else:
                 with nogil:
-                    self._iter.Seek(self.start_slice)
-            if not self._iter.Valid():
+                    self.handle.iter.Seek(self.start_slice)
+            if not self.handle.iter.Valid():
                 # Iterator is empty
-                raise StopIteration
+                return 0
             if self.start is not None and not self.include_start:
                 # Start key is excluded, so skip past it if the db
                 # contains it.
-                if self.comparator.Compare(self._iter.key(),
+                if self.comparator.Compare(self.handle.iter.key(),
                                            self.start_slice) == 0:
                     with nogil:
-                        self._iter.Next()
-                    if not self._iter.Valid():
-                        raise StopIteration
+                        self.handle.iter.Next()
+                    if not self.handle.iter.Valid():
+                        return 0
             self.state = IN_BETWEEN
         elif self.state == AFTER_STOP:
-            raise StopIteration
+            return 0
 
-        raise_for_status(self._iter.status())
+        raise_for_status(self.handle.iter.status())
 
         # Check range boundaries
         if self.stop is not None:
             n = 1 if self.include_stop else 0
-            if self.comparator.Compare(self._iter.key(), self.stop_slice) >= n:
+            if self.comparator.Compare(self.handle.iter.key(), self.stop_slice) >= n:
                 self.state = AFTER_STOP
-                raise StopIteration
+                return 0
 
-        return self.current()
+        return 1
 
-    cdef real_prev(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
+    cdef int move_prev_any(self) except -1:
+        """Move to the previous entry (in forward direction), regardless
+        of the filters.
+
+        Returns 1 if the iterator is positioned at an entry, and 0 if
+        there are no more entries. After using the entry, finish_prev()
+        must be called.
+        """
+        self.stop_readahead()
 
         if self.state == IN_BETWEEN:
             pass
         elif self.state == IN_BETWEEN_ALREADY_POSITIONED:
-            assert self._iter.Valid()
+            assert self.handle.iter.Valid()
             with nogil:
-                self._iter.Prev()
-            if not self._iter.Valid():
+                self.handle.iter.Prev()
+            if not self.handle.iter.Valid():
                 # The .seek() resulted in the first key in the database
                 self.state = BEFORE_START
-                raise StopIteration
-            raise_for_status(self._iter.status())
+                return 0
+            if self.start is not None:
+                # The .seek() resulted in the first key in the range
+                n = 0 if self.include_start else 1
+                if self.comparator.Compare(
+                        self.handle.iter.key(), self.start_slice) < n:
+                    self.state = BEFORE_START
+                    return 0
+            raise_for_status(self.handle.iter.status())
         elif self.state == BEFORE_START:
-            raise StopIteration
+            return 0
         elif self.state == AFTER_STOP:
             if self.stop is None:
                 # No stop key, seek to last entry
                 with nogil:
-                    self._iter.SeekToLast()
+                    self.handle.iter.SeekToLast()
             else:
                 # Seek to stop key
                 with nogil:
-                    self._iter.Seek(self.stop_slice)
+                    self.handle.iter.Seek(self.stop_slice)
 
-                if self._iter.Valid():
+                if self.handle.iter.Valid():
                     # Move one step back if stop is exclusive.
                     if not self.include_stop:
                         with nogil:
-                            self._iter.Prev()
+                            self.handle.iter.Prev()
                 else:
                     # Stop key did not exist; position at the last
                     # database entry instead.
                     with nogil:
-                        self._iter.SeekToLast()
+                        self.handle.iter.SeekToLast()
 
                 # Make sure the iterator is not past the stop key
-                if self._iter.Valid() and self.comparator.Compare(self._iter.key(), self.stop_slice) > 0:
+                if self.handle.iter.Valid() and self.comparator.Compare(self.handle.iter.key(), self.stop_slice) > 0:
                     with nogil:
-                        self._iter.Prev()
+                        self.handle.iter.Prev()
 
-            if not self._iter.Valid():
+            if not self.handle.iter.Valid():
                 # No entries left
-                raise StopIteration
+                return 0
 
             # After all the stepping back, we might even have ended up
             # *before* the start key. In this case the iterator does not
             # yield any items.
-            if self.start is not None and self.comparator.Compare(self.start_slice, self._iter.key()) >= 0:
-                raise StopIteration
+            if self.start is not None:
+                n = 1 if self.include_start else 0
+                if self.comparator.Compare(
+                        self.start_slice, self.handle.iter.key()) >= n:
+                    return 0
 
-            raise_for_status(self._iter.status())
+            raise_for_status(self.handle.iter.status())
 
-        # Unlike .real_next(), first obtain the value, then move the
-        # iterator pointer (not the other way around), so that
-        # repeatedly calling it.prev() and next(it) will work as
-        # designed.
-        out = self.current()
+        return 1
+
+    cdef int finish_prev(self) except -1:
+        """Move the iterator pointer back after move_prev()."""
         with nogil:
-            self._iter.Prev()
-        if not self._iter.Valid():
+            self.handle.iter.Prev()
+        if not self.handle.iter.Valid():
             # Moved before the first key in the database
             self.state = BEFORE_START
         else:
@@ -986,7 +4360,7 @@ cdef class Iterator(BaseIterator):
                 # Check range boundaries
                 n = 0 if self.include_start else 1
                 if self.comparator.Compare(
-                        self._iter.key(), self.start_slice) >= n:
+                        self.handle.iter.key(), self.start_slice) >= n:
                     # Iterator is valid and within range boundaries
                     self.state = IN_BETWEEN
                 else:
@@ -994,164 +4368,483 @@ cdef class Iterator(BaseIterator):
                     # 'start' key
                     self.state = BEFORE_START
 
-        raise_for_status(self._iter.status())
-        return out
+        raise_for_status(self.handle.iter.status())
+        return 0
 
     def seek_to_start(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
+        self.acquire()
+        self.stop_readahead()
         self.state = BEFORE_START
+        self.release()
 
     def seek_to_stop(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
+        self.acquire()
+        self.stop_readahead()
         self.state = AFTER_STOP
+        self.release()
 
     def seek(self, bytes target not None):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
+        self.c_seek(Slice(target, len(target)))
 
-        if self.db_prefix is not None:
-            target = self.db_prefix + target
+    cdef int real_seek(self, Slice target) except -1:
+        cdef string prefixed_target
 
-        cdef Slice target_slice = Slice(target, len(target))
+        self.stop_readahead()
+
+        if self.db_prefix is not None:
+            prefixed_target = self.db_prefix
+            prefixed_target.append(target.data(), target.size())
+            target = Slice(prefixed_target)
 
         # Seek only within the start/stop boundaries
         if self.start is not None and self.comparator.Compare(
-                target_slice, self.start_slice) < 0:
-            target_slice = self.start_slice
+                target, self.start_slice) < 0:
+            target = self.start_slice
         if self.stop is not None and self.comparator.Compare(
-                target_slice, self.stop_slice) > 0:
-            target_slice = self.stop_slice
+                target, self.stop_slice) > 0:
+            target = self.stop_slice
 
         with nogil:
-            self._iter.Seek(target_slice)
-        if not self._iter.Valid():
+            self.handle.iter.Seek(target)
+        if not self.handle.iter.Valid():
             # Moved past the end (or empty database)
             self.state = AFTER_STOP
-            return
+            return 0
 
         self.state = IN_BETWEEN_ALREADY_POSITIONED
-        raise_for_status(self._iter.status())
+        raise_for_status(self.handle.iter.status())
+        return 0
 
 
 @cython.final
 cdef class RawIterator(BaseIterator):
     def valid(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
-        return self._iter.Valid()
+        self.acquire()
+        valid = self.handle.iter.Valid()
+        self.release()
+        return valid
 
     def seek_to_first(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
+        cdef Status st
+        self.acquire()
         with nogil:
-            self._iter.SeekToFirst()
+            self.handle.iter.SeekToFirst()
+            st = self.handle.iter.status()
+            self.release()
 
-        raise_for_status(self._iter.status())
+        raise_for_status(st)
 
     def seek_to_last(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
+        cdef Status st
+        self.acquire()
         with nogil:
-            self._iter.SeekToLast()
+            self.handle.iter.SeekToLast()
+            st = self.handle.iter.status()
+            self.release()
 
-        raise_for_status(self._iter.status())
+        raise_for_status(st)
 
     def seek(self, bytes target not None):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
         cdef Slice target_slice = Slice(target, len(target))
+        cdef Status st
+        self.acquire()
         with nogil:
-            self._iter.Seek(target_slice)
+            self.handle.iter.Seek(target_slice)
+            st = self.handle.iter.status()
+            self.release()
 
-        raise_for_status(self._iter.status())
+        raise_for_status(st)
 
     def next(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
-        if not self._iter.Valid():
+        cdef Status st
+        self.acquire()
+        if not self.handle.iter.Valid():
+            self.release()
             raise IteratorInvalidError()
 
         with nogil:
-            self._iter.Next()
+            self.handle.iter.Next()
+            st = self.handle.iter.status()
+            self.release()
 
-        raise_for_status(self._iter.status())
+        raise_for_status(st)
 
     def prev(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
-        if not self._iter.Valid():
+        cdef Status st
+        self.acquire()
+        if not self.handle.iter.Valid():
+            self.release()
             raise IteratorInvalidError()
 
         with nogil:
-            self._iter.Prev()
+            self.handle.iter.Prev()
+            st = self.handle.iter.status()
+            self.release()
 
-        raise_for_status(self._iter.status())
+        raise_for_status(st)
 
     cpdef key(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
-
-        if not self._iter.Valid():
-            raise IteratorInvalidError()
-
         cdef Slice key_slice
-        key_slice = self._iter.key()
-        return key_slice.data()[:key_slice.size()]
-
-    cpdef value(self):
-        if self._iter is NULL:
-            raise RuntimeError("Database or iterator is closed")
+        self.acquire()
+        try:
+            if not self.handle.iter.Valid():
+                raise IteratorInvalidError()
 
-        if not self._iter.Valid():
-            raise IteratorInvalidError()
+            key_slice = self.handle.iter.key()
+            return key_slice.data()[:key_slice.size()]
+        finally:
+            self.release()
 
+    cpdef value(self):
         cdef Slice value_slice
-        value_slice = self._iter.value()
-        return value_slice.data()[:value_slice.size()]
+        self.acquire()
+        try:
+            if not self.handle.iter.Valid():
+                raise IteratorInvalidError()
+
+            value_slice = self.handle.iter.value()
+            if self.db.codec is not NULL:
+                return codec_decode(self.db.codec, value_slice)
+            return value_slice.data()[:value_slice.size()]
+        finally:
+            self.release()
 
     def item(self):
         return self.key(), self.value()
 
 
+#
+# Merging iterators
+#
+
+cdef enum MergeMode:
+    MERGE_UNION
+    MERGE_INTERSECT
+    MERGE_DIFFERENCE
+
+
+cdef dict MERGE_MODES = {
+    'union': MERGE_UNION,
+    'intersect': MERGE_INTERSECT,
+    'difference': MERGE_DIFFERENCE,
+}
+
+
+# Number of Next() calls to try before falling back to Seek() when
+# skipping ahead to a key; stepping is cheaper for small gaps.
+cdef enum:
+    MERGE_STEPS_BEFORE_SEEK = 8
+
+
+def merge_iterators(*iterators, mode='union', bool dedupe=True,
+                    bool include_key=True, bool include_value=True):
+    return MergeIterator(iterators, mode, dedupe, include_key, include_value)
+
+
+@cython.final
+cdef class MergeIterator:
+    cdef list iterators
+    cdef MergeMode mode
+    cdef c_bool dedupe
+    cdef c_bool include_key
+    cdef c_bool include_value
+    cdef c_bool forward
+    cdef c_bool started
+    cdef Comparator* comparator
+
+    # Copies of the current entry of each input iterator, since moving
+    # one iterator must not invalidate the entries of the others. Values
+    # are only copied when they can be returned.
+    cdef vector[string] keys
+    cdef vector[string] values
+    cdef vector[c_bool] valid
+
+    def __init__(self, tuple iterators, mode, bool dedupe, bool include_key,
+                 bool include_value):
+        cdef Iterator it
+
+        if not iterators:
+            raise TypeError("At least one iterator is required")
+        for obj in iterators:
+            if not isinstance(obj, Iterator):
+                raise TypeError(
+                    "Only iterators created by DB.iterator() (or similar) "
+                    "can be merged")
+        if len(set(map(id, iterators))) != len(iterators):
+            raise ValueError("The same iterator cannot be merged twice")
+        if mode not in MERGE_MODES:
+            raise ValueError(
+                "'mode' must be one of %s" % ', '.join(MERGE_MODES))
+
+        it = iterators[0]
+        self.forward = it.direction == FORWARD
+        self.comparator = it.comparator
+        for obj in iterators[1:]:
+            it = obj
+            if (it.direction == FORWARD) != self.forward:
+                raise ValueError(
+                    "Merged iterators must all iterate in the same direction")
+            if string(it.comparator.Name()) != string(self.comparator.Name()):
+                raise ValueError("Merged iterators must use the same comparator")
+
+        if include_value:
+            # Read-ahead only copies values for iterators that return them.
+            for i, obj in enumerate(iterators):
+                it = obj
+                if (it.readahead_size > 0 and not it.include_value
+                        and (mode == 'union' or i == 0)):
+                    raise ValueError(
+                        "Iterators with read-ahead must use "
+                        "'include_value=True' if values are merged")
+
+        self.iterators = list(iterators)
+        self.mode = MERGE_MODES[mode]
+        self.dedupe = dedupe
+        self.include_key = include_key
+        self.include_value = include_value
+
+        self.keys.resize(len(iterators))
+        self.values.resize(len(iterators))
+        self.valid.resize(len(iterators))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cdef int i
+
+        self.acquire()
+        try:
+            i = self.find_next()
+            if i < 0:
+                raise StopIteration
+            out = self.current(i)
+            self.consume(i)
+            return out
+        finally:
+            self.release(len(self.iterators))
+
+    def next_batch(self, Py_ssize_t size):
+        cdef list entries = []
+        cdef int i
+
+        if size < 0:
+            raise ValueError("'size' must not be negative")
+
+        self.acquire()
+        try:
+            while len(entries) < size:
+                i = self.find_next()
+                if i < 0:
+                    break
+                entries.append(self.current(i))
+                self.consume(i)
+        finally:
+            self.release(len(self.iterators))
+
+        return entries
+
+    def close(self):
+        for it in self.iterators:
+            it.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False  # propagate exceptions
+
+    cdef int acquire(self) except -1:
+        """Start using all input iterators from the current thread."""
+        cdef size_t i
+        for i in range(len(self.iterators)):
+            try:
+                (<Iterator>self.iterators[i]).acquire()
+            except BaseException:
+                self.release(i)
+                raise
+        return 0
+
+    cdef void release(self, size_t n) noexcept:
+        cdef size_t i
+        for i in range(n):
+            (<Iterator>self.iterators[i]).release()
+
+    cdef int compare(self, const string& a, const string& b) noexcept:
+        # Compare keys in iteration order
+        cdef int result = self.comparator.Compare(Slice(a), Slice(b))
+        return result if self.forward else -result
+
+    cdef int fetch(self, size_t i) except -1:
+        """Move input iterator i to its next entry."""
+        cdef Iterator it = self.iterators[i]
+        cdef Slice key
+        cdef Slice value
+
+        self.valid[i] = it.step(self.forward, &key, &value)
+        if self.valid[i]:
+            self.keys[i].assign(key.data(), key.size())
+            if self.include_value and (self.mode == MERGE_UNION or i == 0):
+                self.values[i].assign(value.data(), value.size())
+        return 0
+
+    cdef int skip_to(self, size_t i, const string& target) except -1:
+        """Move input iterator i to the first entry at or after target."""
+        cdef Iterator it = self.iterators[i]
+        cdef int steps = 0
+
+        while self.valid[i] and self.compare(self.keys[i], target) < 0:
+            if self.forward and steps == MERGE_STEPS_BEFORE_SEEK:
+                # Leapfrog using a seek instead of stepping further.
+                it.real_seek(Slice(target))
+            self.fetch(i)
+            steps += 1
+        return 0
+
+    cdef int find_next(self) except -2:
+        """Find the input whose current entry comes next.
+
+        Returns the index of the input iterator, or -1 if there are no
+        more entries.
+        """
+        cdef size_t i
+        cdef size_t n = len(self.iterators)
+        cdef int best = -1
+        cdef string target
+        cdef c_bool matched
+
+        if not self.started:
+            for i in range(n):
+                self.fetch(i)
+            self.started = True
+
+        if self.mode == MERGE_UNION:
+            for i in range(n):
+                if self.valid[i] and (
+                        best < 0 or self.compare(self.keys[i], self.keys[best]) < 0):
+                    best = i
+            return best
+
+        if self.mode == MERGE_INTERSECT:
+            while True:
+                for i in range(n):
+                    if not self.valid[i]:
+                        return -1
+                    if i == 0 or self.compare(self.keys[i], target) > 0:
+                        target = self.keys[i]
+
+                matched = True
+                for i in range(n):
+                    self.skip_to(i, target)
+                    if not self.valid[i]:
+                        return -1
+                    if self.compare(self.keys[i], target) != 0:
+                        matched = False
+                if matched:
+                    return 0
+
+        # Difference: entries of the first input not in any other input.
+        while self.valid[0]:
+            target = self.keys[0]
+            matched = False
+            for i in range(1, n):
+                self.skip_to(i, target)
+                if self.valid[i] and self.compare(self.keys[i], target) == 0:
+                    matched = True
+                    break
+            if not matched:
+                return 0
+            self.fetch(0)
+        return -1
+
+    cdef int consume(self, size_t i) except -1:
+        """Move past the entry returned for input iterator i."""
+        cdef size_t j
+        cdef size_t n = len(self.iterators)
+
+        if self.mode == MERGE_UNION:
+            if self.dedupe:
+                # Skip the same key in the other inputs; their entries
+                # are shadowed by the one from the earlier input.
+                for j in range(i + 1, n):
+                    if self.valid[j] and self.compare(self.keys[j], self.keys[i]) == 0:
+                        self.fetch(j)
+            self.fetch(i)
+        elif self.mode == MERGE_INTERSECT:
+            for j in range(n):
+                self.fetch(j)
+        else:
+            self.fetch(0)
+        return 0
+
+    cdef object current(self, size_t i):
+        """Return the current entry of input iterator i."""
+        cdef bytes key = None
+        cdef bytes value = None
+
+        if self.include_key:
+            key = self.keys[i]
+        if self.include_value:
+            value = self.values[i]
+
+        if self.include_key and self.include_value:
+            return (key, value)
+        if self.include_key:
+            return key
+        if self.include_value:
+            return value
+        return None
+
+
 #
 # Snapshot
 #
 
 @cython.final
 cdef class Snapshot:
-    cdef leveldb.Snapshot* _snapshot
-    cdef DB db
-    cdef bytes prefix
-
     def __init__(self, *, DB db not None, bytes prefix=None):
-        if db._db is NULL:
+        if not db.guard.Enter():
             raise RuntimeError("Cannot operate on closed LevelDB database")
 
+        cdef TraceState trace
+        cdef uint64_t start
+        if db.instrumentation is not None:
+            try:
+                token = db.instrumentation.begin(OP_SNAPSHOT, None, &trace)
+            except BaseException:
+                db.guard.Exit()
+                raise
+
         self.db = db
         self.prefix = prefix
+        if prefix is not None:
+            self.key_prefix = prefix
         with nogil:
+            start = PlyvelTimerStart(db.counters)
             self._snapshot = <leveldb.Snapshot*>db._db.GetSnapshot()
+            PlyvelTimerStop(start)
+            db.guard.Exit()
+        self.guard.Open()
+
+        if db.instrumentation is not None:
+            db.instrumentation.end(OP_SNAPSHOT, &trace, token, 0, None)
 
     def __dealloc__(self):
         self.close()
 
     cpdef close(self):
-        if self.db._db is NULL or self._snapshot is NULL:
+        cdef c_bool was_open
+        with nogil:
+            was_open = self.guard.Close()
+        if not was_open:
             return  # nothing to do
 
-        with nogil:
-            self.db._db.ReleaseSnapshot(self._snapshot)
-            self._snapshot = NULL
+        if self.db.guard.Enter():
+            with nogil:
+                self.db._db.ReleaseSnapshot(self._snapshot)
+                self.db.guard.Exit()
+        self._snapshot = NULL
 
     def release(self):
         self.close()
@@ -1165,18 +4858,92 @@ cdef class Snapshot:
 
     def get(self, bytes key not None, default=None, *,
             bool verify_checksums=False, bool fill_cache=True):
-        if self.db._db is NULL or self._snapshot is NULL:
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+
+        cdef Slice key_slice = Slice(key, len(key))
+        cdef string value
+        cdef int found
+        with nogil:
+            found = self.c_get(key_slice, &value, &read_options)
+
+        if not found:
+            return default
+
+        return value
+
+    def get_many(self, keys, default=None, *, bool verify_checksums=False,
+                 bool fill_cache=True):
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+
+        if self.db.guard.IsClosed() or not self.guard.Enter():
+            raise RuntimeError("Database or snapshot is closed")
+        try:
+            read_options.snapshot = self._snapshot
+            return db_get_many(
+                self.db, self.prefix, keys, default, read_options)
+        finally:
+            self.guard.Exit()
+
+    def lookup_sorted(self, keys, default=None, *,
+                      bool verify_checksums=False, bool fill_cache=True):
+        cdef ReadOptions read_options
+        read_options.verify_checksums = verify_checksums
+        read_options.fill_cache = fill_cache
+
+        if self.db.guard.IsClosed() or not self.guard.Enter():
             raise RuntimeError("Database or snapshot is closed")
+        try:
+            read_options.snapshot = self._snapshot
+            return db_lookup_sorted(
+                self.db, self.prefix, keys, default, read_options)
+        finally:
+            self.guard.Exit()
+
+    def exists(self, bytes key not None, *, bool verify_checksums=False,
+               bool fill_cache=True):
+        return self.exists_many(
+            (key,), verify_checksums=verify_checksums,
+            fill_cache=fill_cache)[0]
 
+    def exists_many(self, keys, *, bool verify_checksums=False,
+                    bool fill_cache=True):
         cdef ReadOptions read_options
         read_options.verify_checksums = verify_checksums
         read_options.fill_cache = fill_cache
-        read_options.snapshot = self._snapshot
 
-        if self.prefix is not None:
-            key = self.prefix + key
+        if self.db.guard.IsClosed() or not self.guard.Enter():
+            raise RuntimeError("Database or snapshot is closed")
+        try:
+            read_options.snapshot = self._snapshot
+            return db_exists_many(self.db, self.prefix, keys, read_options)
+        finally:
+            self.guard.Exit()
+
+    cdef int c_get(self, Slice key, string* value,
+                   ReadOptions* read_options=NULL) except -1 nogil:
+        cdef ReadOptions snapshot_read_options
+        cdef string prefixed_key
 
-        return db_get(self.db, key, default, read_options)
+        if read_options is not NULL:
+            snapshot_read_options = read_options[0]
+
+        if not self.key_prefix.empty():
+            prefixed_key = self.key_prefix
+            prefixed_key.append(key.data(), key.size())
+            key = Slice(prefixed_key)
+
+        if not self.guard.Enter():
+            with gil:
+                raise RuntimeError("Database or snapshot is closed")
+        try:
+            snapshot_read_options.snapshot = self._snapshot
+            return self.db.c_get(key, value, &snapshot_read_options)
+        finally:
+            self.guard.Exit()
 
     def __contains__(self, key):
         contains_is_unsupported()
@@ -1187,24 +4954,199 @@ cdef class Snapshot:
     def iterator(self, *, reverse=False, start=None, stop=None,
                  include_start=True, include_stop=False, prefix=None,
                  include_key=True, include_value=True,
-                 bool verify_checksums=False, bool fill_cache=True):
-        if self.db._db is NULL or self._snapshot is NULL:
+                 bool verify_checksums=False, bool fill_cache=True,
+                 size_t readahead=0, Filter key_filter=None,
+                 Filter value_filter=None):
+        if self.db.guard.IsClosed() or not self.guard.Enter():
             raise RuntimeError("Database or snapshot is closed")
-
-        return Iterator(
-            db=self.db, db_prefix=self.prefix, reverse=reverse, start=start,
-            stop=stop, include_start=include_start, include_stop=include_stop,
-            prefix=prefix, include_key=include_key,
-            include_value=include_value, verify_checksums=verify_checksums,
-            fill_cache=fill_cache, snapshot=self)
+        try:
+            return Iterator(
+                db=self.db, db_prefix=self.prefix, reverse=reverse,
+                start=start, stop=stop, include_start=include_start,
+                include_stop=include_stop, prefix=prefix,
+                include_key=include_key, include_value=include_value,
+                verify_checksums=verify_checksums, fill_cache=fill_cache,
+                snapshot=self, readahead=readahead, key_filter=key_filter,
+                value_filter=value_filter)
+        finally:
+            self.guard.Exit()
 
     def raw_iterator(self, *, bool verify_checksums=False,
                      bool fill_cache=True):
-        if self.db._db is NULL or self._snapshot is NULL:
+        if self.db.guard.IsClosed() or not self.guard.Enter():
             raise RuntimeError("Database or snapshot is closed")
+        try:
+            return RawIterator(
+                db=self.db,
+                verify_checksums=verify_checksums,
+                fill_cache=fill_cache,
+                snapshot=self)
+        finally:
+            self.guard.Exit()
 
-        return RawIterator(
-            db=self.db,
-            verify_checksums=verify_checksums,
-            fill_cache=fill_cache,
-            snapshot=self)
+    def distinct_prefixes(self, bytes delimiter not None=b'/', int depth=1, *,
+                          bytes start=None, bytes stop=None):
+        cdef ReadOptions read_options
+        if self.db.guard.IsClosed() or not self.guard.Enter():
+            raise RuntimeError("Database or snapshot is closed")
+        try:
+            read_options.snapshot = self._snapshot
+            return db_distinct_prefixes(
+                self.db, self.prefix, read_options, delimiter, depth, start,
+                stop)
+        finally:
+            self.guard.Exit()
+
+
+#
+# Transactions
+#
+
+@cython.final
+cdef class Transaction:
+    """Optimistic read-modify-write transaction.
+
+    Reads come from a snapshot, and the keys read are remembered. Writes
+    are buffered in a write batch (and are visible to reads of the same
+    transaction). Committing checks whether any key that was read has been
+    written since the snapshot was taken, using the write tracker of the
+    database, and writes the batch unless it has.
+    """
+    cdef DB db
+    cdef bytes prefix
+    cdef Snapshot snapshot
+    cdef WriteBatch batch
+    cdef dict writes  # values written, or None for deleted keys
+    cdef PlyvelReadSet* reads
+    cdef uint64_t start
+    cdef c_bool active
+
+    def __init__(self, *, DB db not None, bytes prefix=None, bool sync=False):
+        if db.guard.IsClosed():
+            raise RuntimeError("Database is closed")
+
+        self.db = db
+        self.prefix = prefix
+        self.writes = {}
+        self.reads = new PlyvelReadSet()
+
+        # Writes are tracked from here on, so writes that happen before
+        # the snapshot is taken may only cause spurious conflicts.
+        with nogil:
+            self.start = db.write_tracker.Begin()
+        self.active = True
+        try:
+            self.snapshot = Snapshot(db=db, prefix=prefix)
+            self.batch = WriteBatch(db, prefix, False, sync)
+        except BaseException:
+            self.finish()
+            raise
+
+    def __dealloc__(self):
+        self.finish()
+        del self.reads
+
+    cdef void finish(self) noexcept:
+        if not self.active:
+            return
+        self.active = False
+        with nogil:
+            self.db.write_tracker.End(self.start)
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+    property closed:
+        def __get__(self):
+            return not self.active
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False  # propagate exceptions
+
+    def get(self, bytes key not None, default=None):
+        if not self.active:
+            raise RuntimeError("Transaction is closed")
+
+        if key in self.writes:
+            value = self.writes[key]
+            return default if value is None else value
+
+        cdef bytes full_key = key if self.prefix is None else self.prefix + key
+        self.reads.Add(Slice(full_key, len(full_key)))
+        return self.snapshot.get(key, default)
+
+    def put(self, bytes key not None, value not None):
+        if not self.active:
+            raise RuntimeError("Transaction is closed")
+
+        self.batch.put(key, value)
+        self.writes[key] = bytes(value)
+
+    def delete(self, bytes key not None):
+        if not self.active:
+            raise RuntimeError("Transaction is closed")
+
+        self.batch.delete(key)
+        self.writes[key] = None
+
+    def commit(self):
+        if not self.active:
+            raise RuntimeError("Transaction is closed")
+
+        cdef DB db = self.db
+        cdef c_bool conflict
+        try:
+            if db.guard.IsClosed():
+                raise RuntimeError("Database is closed")
+
+            if not self.writes:
+                # Reads from a snapshot are consistent by themselves.
+                return
+
+            if db.merge_buffer.count.load() > 0:
+                db_flush_merges(db, False)
+
+            # No other write can happen between checking for conflicts
+            # and writing the batch, which releases the lock.
+            with nogil:
+                db.write_tracker.Lock()
+            conflict = db.write_tracker.Conflicts(self.start, self.reads[0])
+            if conflict:
+                db.write_tracker.Unlock()
+                raise TransactionConflictError(
+                    "Keys read by the transaction were written since it "
+                    "started")
+            with nogil:
+                self.batch.c_write(True)
+        finally:
+            self.finish()
+
+    def rollback(self):
+        self.finish()
+
+
+cdef object run_transaction(DB db, bytes prefix, func, int max_attempts,
+                            c_bool sync):
+    """Call func() with a new transaction until it commits."""
+    cdef Transaction transaction
+    if max_attempts < 1:
+        raise ValueError("'max_attempts' must be at least 1")
+
+    for attempt in range(max_attempts):
+        transaction = Transaction(db=db, prefix=prefix, sync=sync)
+        try:
+            result = func(transaction)
+            transaction.commit()
+        except TransactionConflictError:
+            if attempt == max_attempts - 1:
+                raise
+            continue
+        finally:
+            transaction.rollback()
+        return result
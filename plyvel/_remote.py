@@ -0,0 +1,406 @@
+"""
+Client for the Plyvel server (see plyvel.server), and the protocol used
+between both.
+
+Requests and responses are frames consisting of a 4 byte length and a
+payload. Request payloads start with an opcode byte, and response
+payloads with a status byte. Both continue with a sequence of fields,
+which are length-prefixed byte strings (or None). The server handles the
+requests of a connection in order, so clients can send multiple requests
+before reading the responses (pipelining).
+"""
+
+import socket
+import struct
+import threading
+
+from ._plyvel import Error
+
+_length = struct.Struct('>I')
+_NONE = 0xffffffff
+
+# Largest frame the server accepts by default
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Opcodes
+GET = 1
+GET_MANY = 2
+PUT = 3
+DELETE = 4
+WRITE = 5
+ITERATOR = 6
+ITERATOR_NEXT = 7
+ITERATOR_CLOSE = 8
+SNAPSHOT = 9
+SNAPSHOT_CLOSE = 10
+
+# Response status
+OK = 0
+ERROR = 1
+
+
+class ProtocolError(Error):
+    pass
+
+
+# Exceptions that are raised as is on the client side; others are raised
+# as plyvel.Error.
+_EXCEPTIONS = {
+    exc.__name__: exc
+    for exc in (KeyError, RuntimeError, TypeError, ValueError, ProtocolError)
+}
+
+
+def pack_fields(fields):
+    parts = []
+    for field in fields:
+        if field is None:
+            parts.append(_length.pack(_NONE))
+        else:
+            parts.append(_length.pack(len(field)))
+            parts.append(field)
+    return b''.join(parts)
+
+
+def unpack_fields(data, offset=0):
+    fields = []
+    while offset < len(data):
+        n, = _length.unpack_from(data, offset)
+        offset += _length.size
+        if n == _NONE:
+            fields.append(None)
+        else:
+            fields.append(data[offset:offset + n])
+            offset += n
+    return fields
+
+
+def pack_int(n):
+    return n.to_bytes(8, 'big')
+
+
+def unpack_int(field):
+    return int.from_bytes(field, 'big')
+
+
+def pack_bool(b):
+    return b'\x01' if b else b''
+
+
+def pack_value(value):
+    # Values can be any bytes-like object, like for DB.put(); bytes()
+    # would turn an integer into zero bytes.
+    return bytes(memoryview(value))
+
+
+def frame(payload):
+    return _length.pack(len(payload)) + payload
+
+
+def read_frame(rfile, max_size=None):
+    """Read a frame; return its payload, or None at end of file.
+
+    Frames larger than `max_size` bytes raise ProtocolError without
+    reading their payload.
+    """
+    header = rfile.read(_length.size)
+    if not header:
+        return None
+    if len(header) != _length.size:
+        raise ConnectionError("Connection closed while reading a frame")
+    n, = _length.unpack(header)
+    if max_size is not None and n > max_size:
+        raise ProtocolError(
+            "Frame of %d bytes exceeds the maximum size of %d bytes"
+            % (n, max_size))
+    payload = rfile.read(n)
+    if len(payload) != n:
+        raise ConnectionError("Connection closed while reading a frame")
+    return payload
+
+
+class RemoteDB:
+    def __init__(self, path, *, timeout=None):
+        self.path = path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.connect(path)
+        except BaseException:
+            self._sock.close()
+            raise
+        self._rfile = self._sock.makefile('rb')
+        # Requests and their responses must not be interleaved.
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __repr__(self):
+        return '<plyvel.RemoteDB with path %r%s at 0x%s>' % (
+            self.path,
+            ' (closed)' if self._closed else '',
+            hex(id(self)),
+        )
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._rfile.close()
+            self._sock.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _requests(self, requests):
+        """Send (opcode, fields) requests; return the response fields."""
+        data = b''.join(
+            frame(bytes([opcode]) + pack_fields(fields))
+            for opcode, fields in requests)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Connection is closed")
+            try:
+                self._sock.sendall(data)
+                payloads = [read_frame(self._rfile) for _ in requests]
+            except BaseException:
+                # After a timeout (or other failure) the responses can no
+                # longer be matched to requests.
+                self._closed = True
+                self._rfile.close()
+                self._sock.close()
+                raise
+
+        results = []
+        error = None
+        for payload in payloads:
+            if payload is None:
+                raise ConnectionError("Connection closed by server")
+            fields = unpack_fields(payload, 1)
+            if payload[0] == ERROR and error is None:
+                name, message = (f.decode('utf-8') for f in fields)
+                error = _EXCEPTIONS.get(name, Error)(message)
+            results.append(fields)
+        if error is not None:
+            raise error
+        return results
+
+    def _request(self, opcode, *fields):
+        return self._requests([(opcode, fields)])[0]
+
+    def get(self, key, default=None):
+        value, = self._request(GET, key, None)
+        return default if value is None else value
+
+    def get_many(self, keys, default=None):
+        values = self._request(GET_MANY, None, *keys)
+        return [default if value is None else value for value in values]
+
+    def put(self, key, value, *, sync=False):
+        self._request(PUT, key, pack_value(value), pack_bool(sync))
+
+    def delete(self, key, *, sync=False):
+        self._request(DELETE, key, pack_bool(sync))
+
+    def write_batch(self, *, transaction=False, sync=False):
+        return RemoteWriteBatch(self, transaction, sync)
+
+    def pipeline(self):
+        return RemotePipeline(self)
+
+    def __iter__(self):
+        return self.iterator()
+
+    def iterator(self, **kwargs):
+        return RemoteIterator(self, None, **kwargs)
+
+    def snapshot(self):
+        snapshot_id, = self._request(SNAPSHOT)
+        return RemoteSnapshot(self, snapshot_id)
+
+
+class RemoteWriteBatch:
+    def __init__(self, db, transaction, sync):
+        self.db = db
+        self.transaction = transaction
+        self.sync = sync
+        self._fields = []
+
+    def put(self, key, value):
+        self._fields.extend((b'p', key, pack_value(value)))
+
+    def delete(self, key):
+        self._fields.extend((b'd', key, None))
+
+    def clear(self):
+        self._fields.clear()
+
+    def write(self):
+        # The whole batch is sent as a single request.
+        self.db._request(WRITE, pack_bool(self.sync), *self._fields)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.transaction and exc_type is not None:
+            # Exception occurred in transaction; do not write the batch
+            self.clear()
+            return
+
+        self.write()
+        self.clear()
+
+
+class RemotePipeline:
+    """Queue of requests that are sent together."""
+
+    def __init__(self, db):
+        self.db = db
+        self._requests = []
+        self._handlers = []
+
+    def get(self, key, default=None):
+        self._requests.append((GET, (key, None)))
+        self._handlers.append(
+            lambda fields: default if fields[0] is None else fields[0])
+
+    def put(self, key, value, *, sync=False):
+        self._requests.append(
+            (PUT, (key, pack_value(value), pack_bool(sync))))
+        self._handlers.append(lambda fields: None)
+
+    def delete(self, key, *, sync=False):
+        self._requests.append((DELETE, (key, pack_bool(sync))))
+        self._handlers.append(lambda fields: None)
+
+    def execute(self):
+        """Send all queued requests; return a list with their results."""
+        requests, self._requests = self._requests, []
+        handlers, self._handlers = self._handlers, []
+        if not requests:
+            return []
+        responses = self.db._requests(requests)
+        return [handler(fields)
+                for handler, fields in zip(handlers, responses)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+
+class RemoteIterator:
+    def __init__(self, db, snapshot_id, *, reverse=False, start=None,
+                 stop=None, include_start=True, include_stop=False,
+                 prefix=None, include_key=True, include_value=True,
+                 chunk_size=1000):
+        if chunk_size < 1:
+            raise ValueError("'chunk_size' must be at least 1")
+        self.db = db
+        self.include_key = include_key
+        self.include_value = include_value
+        self.chunk_size = chunk_size
+        self._entries = []
+        self._position = 0
+        self._exhausted = False
+        self._iterator_id, = db._request(
+            ITERATOR, snapshot_id, pack_bool(reverse), start, stop,
+            pack_bool(include_start), pack_bool(include_stop), prefix,
+            pack_bool(include_value))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._position == len(self._entries):
+            if self._exhausted:
+                raise StopIteration
+            if self._iterator_id is None:
+                raise RuntimeError("Iterator is closed")
+            self._fetch()
+            if not self._entries:
+                raise StopIteration
+
+        key, value = self._entries[self._position]
+        self._position += 1
+        if self.include_key and self.include_value:
+            return key, value
+        if self.include_key:
+            return key
+        if self.include_value:
+            return value
+        return None
+
+    def _fetch(self):
+        # Entries are streamed in chunks; the server sends key and value
+        # fields for each entry.
+        fields = self.db._request(
+            ITERATOR_NEXT, self._iterator_id, pack_int(self.chunk_size))
+        self._entries = list(zip(fields[::2], fields[1::2]))
+        self._position = 0
+        if len(self._entries) < self.chunk_size:
+            self._exhausted = True
+            self.close()
+
+    def close(self):
+        if self._iterator_id is not None and not self.db.closed:
+            self.db._request(ITERATOR_CLOSE, self._iterator_id)
+        self._iterator_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False  # propagate exceptions
+
+
+class RemoteSnapshot:
+    def __init__(self, db, snapshot_id):
+        self.db = db
+        self._snapshot_id = snapshot_id
+
+    def _id(self):
+        # A snapshot id of None would read from the database instead.
+        if self._snapshot_id is None:
+            raise RuntimeError("Snapshot is closed")
+        return self._snapshot_id
+
+    def get(self, key, default=None):
+        value, = self.db._request(GET, key, self._id())
+        return default if value is None else value
+
+    def get_many(self, keys, default=None):
+        values = self.db._request(GET_MANY, self._id(), *keys)
+        return [default if value is None else value for value in values]
+
+    def __iter__(self):
+        return self.iterator()
+
+    def iterator(self, **kwargs):
+        return RemoteIterator(self.db, self._id(), **kwargs)
+
+    def close(self):
+        if self._snapshot_id is not None and not self.db.closed:
+            self.db._request(SNAPSHOT_CLOSE, self._snapshot_id)
+        self._snapshot_id = None
+
+    def release(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False  # propagate exceptions
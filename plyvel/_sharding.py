@@ -0,0 +1,288 @@
+"""
+Sharded databases, spreading one logical key space over multiple LevelDB
+databases.
+"""
+
+import bisect
+import functools
+import itertools
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from ._plyvel import DB, merge_iterators
+
+PARTITIONERS = ('hash', 'range')
+
+
+def _default_boundaries(n):
+    # Evenly spread over the first byte of the key
+    return [bytes([256 * i // n]) for i in range(1, n)]
+
+
+class ShardedDB:
+    def __init__(self, paths, *, partitioner='hash', boundaries=None,
+                 **options):
+        paths = list(paths)
+        if not paths:
+            raise ValueError("At least one path is required")
+        if partitioner not in PARTITIONERS:
+            raise ValueError(
+                "'partitioner' must be one of %s" % ', '.join(PARTITIONERS))
+
+        # Range boundaries are ordered like the keys in the shards.
+        comparator = options.get('comparator')
+        if comparator is None:
+            self._sort_key = None
+        else:
+            self._sort_key = functools.cmp_to_key(comparator)
+
+        if partitioner == 'range':
+            if boundaries is None:
+                boundaries = sorted(_default_boundaries(len(paths)),
+                                    key=self._sort_key)
+            boundaries = list(boundaries)
+            if len(boundaries) != len(paths) - 1:
+                raise ValueError(
+                    "'boundaries' must contain one key less than 'paths'")
+            if boundaries != sorted(boundaries, key=self._sort_key):
+                raise ValueError("'boundaries' must be sorted")
+            if self._sort_key is None:
+                self._boundary_keys = boundaries
+            else:
+                self._boundary_keys = [self._sort_key(b) for b in boundaries]
+        elif boundaries is not None:
+            raise TypeError(
+                "'boundaries' can only be used with the range partitioner")
+
+        self.partitioner = partitioner
+        self.boundaries = boundaries
+
+        shards = []
+        try:
+            for path in paths:
+                shards.append(DB(path, **options))
+        except BaseException:
+            for db in shards:
+                db.close()
+            raise
+        self.shards = tuple(shards)
+
+        # Used to write batches to (and read from) shards in parallel;
+        # LevelDB releases the GIL, so threads help here.
+        self._executor = ThreadPoolExecutor(max_workers=len(shards))
+
+    def __repr__(self):
+        return '<plyvel.ShardedDB with %d %s shards%s at 0x%s>' % (
+            len(self.shards),
+            self.partitioner,
+            ' (closed)' if self.closed else '',
+            hex(id(self)),
+        )
+
+    def close(self):
+        for db in self.shards:
+            db.close()
+        self._executor.shutdown()
+
+    @property
+    def closed(self):
+        return all(db.closed for db in self.shards)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def shard_index(self, key):
+        """Return the index of the shard responsible for `key`."""
+        if self.partitioner == 'hash':
+            return zlib.crc32(key) % len(self.shards)
+        if self._sort_key is not None:
+            key = self._sort_key(key)
+        return bisect.bisect_right(self._boundary_keys, key)
+
+    def shard(self, key):
+        return self.shards[self.shard_index(key)]
+
+    def get(self, key, default=None, **kwargs):
+        return self.shard(key).get(key, default, **kwargs)
+
+    def put(self, key, value, **kwargs):
+        self.shard(key).put(key, value, **kwargs)
+
+    def delete(self, key, **kwargs):
+        self.shard(key).delete(key, **kwargs)
+
+    def get_many(self, keys, default=None, **kwargs):
+        return _get_many(self, self.shards, keys, default, kwargs)
+
+    def write_batch(self, *, transaction=False, sync=False):
+        return ShardedWriteBatch(self, transaction, sync)
+
+    def snapshot(self):
+        return ShardedSnapshot(self)
+
+    def __iter__(self):
+        return self.iterator()
+
+    def iterator(self, **kwargs):
+        return _iterator(self, self.shards, kwargs)
+
+    def _map(self, func, items):
+        """Call func(item) for all items in parallel; return the results."""
+        if self.closed:
+            raise RuntimeError("Database is closed")
+        items = list(items)
+        if len(items) == 1:
+            return [func(items[0])]
+        return list(self._executor.map(func, items))
+
+
+def _get_many(sharded_db, sources, keys, default, kwargs):
+    keys = list(keys)
+    groups = {}
+    for i, key in enumerate(keys):
+        groups.setdefault(sharded_db.shard_index(key), []).append(i)
+
+    def lookup(group):
+        index, positions = group
+        return sources[index].get_many(
+            [keys[i] for i in positions], default, **kwargs)
+
+    results = [default] * len(keys)
+    groups = list(groups.items())
+    for (_, positions), values in zip(groups, sharded_db._map(lookup, groups)):
+        for i, value in zip(positions, values):
+            results[i] = value
+    return results
+
+
+def _iterator(sharded_db, sources, kwargs):
+    reverse = kwargs.pop('reverse', False)
+    include_key = kwargs.pop('include_key', True)
+    include_value = kwargs.pop('include_value', True)
+
+    if sharded_db.partitioner == 'range':
+        # Shards hold consecutive key ranges, so chaining the shard
+        # iterators yields the keys in order.
+        ordered = sources[::-1] if reverse else sources
+        iterators = [
+            source.iterator(reverse=reverse, include_key=include_key,
+                            include_value=include_value, **kwargs)
+            for source in ordered]
+        return ShardedIterator(iterators, itertools.chain(*iterators))
+
+    iterators = [source.iterator(reverse=reverse, **kwargs)
+                 for source in sources]
+    entries = merge_iterators(*iterators, dedupe=False,
+                              include_key=include_key,
+                              include_value=include_value)
+    return ShardedIterator(iterators, entries)
+
+
+class ShardedIterator:
+    def __init__(self, iterators, entries):
+        self._iterators = iterators
+        self._entries = entries
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._entries)
+
+    def close(self):
+        for it in self._iterators:
+            it.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False  # propagate exceptions
+
+
+class ShardedWriteBatch:
+    def __init__(self, sharded_db, transaction, sync):
+        self.sharded_db = sharded_db
+        self.transaction = transaction
+        self.sync = sync
+        self._batches = {}
+
+    def _batch(self, key):
+        index = self.sharded_db.shard_index(key)
+        wb = self._batches.get(index)
+        if wb is None:
+            if self.transaction and self._batches:
+                # Batches for different shards are written separately, so
+                # a failure could leave only some of them written.
+                raise ValueError(
+                    "Transactional write batches cannot span multiple shards")
+            wb = self.sharded_db.shards[index].write_batch(sync=self.sync)
+            self._batches[index] = wb
+        return wb
+
+    def put(self, key, value):
+        self._batch(key).put(key, value)
+
+    def delete(self, key):
+        self._batch(key).delete(key)
+
+    def clear(self):
+        for wb in self._batches.values():
+            wb.clear()
+        self._batches.clear()
+
+    def write(self):
+        self.sharded_db._map(lambda wb: wb.write(), self._batches.values())
+
+    def approximate_size(self):
+        return sum(wb.approximate_size() for wb in self._batches.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.transaction and exc_type is not None:
+            # Exception occurred in transaction; do not write the batch
+            self.clear()
+            return
+
+        self.write()
+        self.clear()
+
+
+class ShardedSnapshot:
+    def __init__(self, sharded_db):
+        self.sharded_db = sharded_db
+        self.snapshots = tuple(db.snapshot() for db in sharded_db.shards)
+
+    def get(self, key, default=None, **kwargs):
+        index = self.sharded_db.shard_index(key)
+        return self.snapshots[index].get(key, default, **kwargs)
+
+    def get_many(self, keys, default=None, **kwargs):
+        return _get_many(self.sharded_db, self.snapshots, keys, default,
+                         kwargs)
+
+    def __iter__(self):
+        return self.iterator()
+
+    def iterator(self, **kwargs):
+        return _iterator(self.sharded_db, self.snapshots, kwargs)
+
+    def close(self):
+        for snapshot in self.snapshots:
+            snapshot.close()
+
+    def release(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False  # propagate exceptions
@@ -0,0 +1,236 @@
+"""
+Databases with expiring keys.
+"""
+
+import struct
+import sys
+import threading
+import time
+
+from ._plyvel import PrefixedDB, uses_default_comparator
+
+# Keys are stored under two single byte prefixes: the data, and an index
+# ordered by expiry time, which allows finding expired keys without
+# scanning the data.
+DATA_PREFIX = b'v'
+INDEX_PREFIX = b'x'
+
+# Values start with the expiry time in milliseconds since the epoch, or
+# zero for keys that never expire.
+_expiry = struct.Struct('>Q')
+
+
+class TTLDB:
+    def __init__(self, db, *, sweep_interval=1.0, sweep_batch_size=1000,
+                 clock=time.time):
+        if sweep_batch_size < 1:
+            raise ValueError("'sweep_batch_size' must be positive")
+        if sweep_interval is not None and sweep_interval <= 0:
+            raise ValueError("'sweep_interval' must be positive")
+        if not uses_default_comparator(db):
+            # The expiry index is ordered by the big-endian expiry time.
+            raise ValueError("TTL databases require the default comparator")
+
+        self.db = db
+        self.sweep_batch_size = sweep_batch_size
+        self._clock = clock
+
+        # Writes and sweeps are serialized, so that a sweep never deletes
+        # a key that was written after it checked the expiry time.
+        self._lock = threading.Lock()
+
+        self._sweeper = None
+        self._stopping = threading.Event()
+        if sweep_interval is not None:
+            self._sweeper = threading.Thread(
+                target=self._sweep_loop, args=(sweep_interval,),
+                name='plyvel-ttl-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def __repr__(self):
+        return '<plyvel.TTLDB for %r at 0x%s>' % (self.db, hex(id(self)))
+
+    def close(self):
+        """Stop the background sweeper (if any)."""
+        self._stopping.set()
+        if self._sweeper is not None:
+            self._sweeper.join()
+            self._sweeper = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _now(self):
+        return int(self._clock() * 1000)
+
+    def _decode(self, stored, now):
+        """Return the value, or None if it expired."""
+        if stored is None:
+            return None
+        expiry, = _expiry.unpack_from(stored)
+        if expiry and expiry <= now:
+            return None
+        return stored[_expiry.size:]
+
+    def get(self, key, default=None, **kwargs):
+        value = self._decode(self.db.get(DATA_PREFIX + key, **kwargs),
+                             self._now())
+        return default if value is None else value
+
+    def get_many(self, keys, default=None, **kwargs):
+        now = self._now()
+        values = self.db.get_many([DATA_PREFIX + key for key in keys],
+                                  **kwargs)
+        results = []
+        for stored in values:
+            value = self._decode(stored, now)
+            results.append(default if value is None else value)
+        return results
+
+    def ttl(self, key):
+        """Return the remaining time to live of `key` in seconds.
+
+        Returns None if the key does not exist (or expired), and -1 if it
+        never expires.
+        """
+        now = self._now()
+        stored = self.db.get(DATA_PREFIX + key)
+        if self._decode(stored, now) is None:
+            return None
+        expiry, = _expiry.unpack_from(stored)
+        if not expiry:
+            return -1
+        return (expiry - now) / 1000
+
+    def put(self, key, value, *, ttl=None, sync=False):
+        if ttl is None:
+            expiry = 0
+        elif ttl <= 0:
+            raise ValueError("'ttl' must be positive")
+        else:
+            expiry = self._now() + max(1, int(ttl * 1000))
+
+        packed = _expiry.pack(expiry)
+        with self._lock:
+            with self.db.write_batch(sync=sync) as wb:
+                wb.put(DATA_PREFIX + key, packed + value)
+                if expiry:
+                    # An index entry of a previous value is left behind;
+                    # the sweeper removes it once that value would have
+                    # expired, so overwriting a key does not need a read.
+                    wb.put(INDEX_PREFIX + packed + key, b'')
+
+    def delete(self, key, *, sync=False):
+        with self._lock:
+            self.db.delete(DATA_PREFIX + key, sync=sync)
+
+    def __iter__(self):
+        return self.iterator()
+
+    def iterator(self, *, reverse=False, start=None, stop=None,
+                 include_start=True, include_stop=False, prefix=None,
+                 include_key=True, include_value=True):
+        """Iterate over the keys that did not expire."""
+        if prefix is not None:
+            if start is not None or stop is not None:
+                raise TypeError(
+                    "'prefix' cannot be used together with 'start' or 'stop'")
+            prefix = DATA_PREFIX + prefix
+        else:
+            if start is None:
+                start = DATA_PREFIX
+                include_start = True
+            else:
+                start = DATA_PREFIX + start
+            if stop is None:
+                stop = INDEX_PREFIX
+                include_stop = False
+            else:
+                stop = DATA_PREFIX + stop
+
+        now = self._now()
+        with self.db.iterator(reverse=reverse, start=start, stop=stop,
+                              include_start=include_start,
+                              include_stop=include_stop,
+                              prefix=prefix) as it:
+            for key, stored in it:
+                value = self._decode(stored, now)
+                if value is None:
+                    continue
+                key = key[len(DATA_PREFIX):]
+                if include_key and include_value:
+                    yield key, value
+                elif include_key:
+                    yield key
+                elif include_value:
+                    yield value
+                else:
+                    yield None
+
+    def sweep(self, limit=None):
+        """Delete expired keys; return the number of deleted keys.
+
+        Keys are deleted in write batches of at most `sweep_batch_size`
+        keys. The cost is proportional to the number of expired keys.
+        """
+        deleted = 0
+        while limit is None or deleted < limit:
+            size = self.sweep_batch_size
+            if limit is not None:
+                size = min(size, limit - deleted)
+            n, more = self._sweep_batch(size)
+            deleted += n
+            if not more:
+                break
+        return deleted
+
+    def _sweep_batch(self, size):
+        """Delete up to `size` expired index entries (and their keys).
+
+        Returns the number of deleted keys, and whether there may be more
+        expired index entries.
+        """
+        stop = INDEX_PREFIX + _expiry.pack(self._now() + 1)
+        with self._lock:
+            with self.db.iterator(start=INDEX_PREFIX, stop=stop,
+                                  include_value=False) as it:
+                index_keys = it.next_batch(size)
+            if not index_keys:
+                return 0, False
+
+            # Index keys consist of the prefix, the expiry time, and the key.
+            n = len(INDEX_PREFIX) + _expiry.size
+            data_keys = [
+                DATA_PREFIX + index_key[n:] for index_key in index_keys]
+            values = self.db.get_many(data_keys)
+
+            deleted = 0
+            with self.db.write_batch() as wb:
+                for index_key, data_key, stored in zip(
+                        index_keys, data_keys, values):
+                    wb.delete(index_key)
+                    # Only delete the key if it was not overwritten with a
+                    # different expiry time (or deleted) in the meantime.
+                    packed = index_key[len(INDEX_PREFIX):n]
+                    if stored is not None and stored[:_expiry.size] == packed:
+                        wb.delete(data_key)
+                        deleted += 1
+
+        return deleted, len(index_keys) == size
+
+    def _sweep_loop(self, interval):
+        # Delete at most one batch per interval, which bounds the rate of
+        # background writes.
+        db = self.db.db if isinstance(self.db, PrefixedDB) else self.db
+        while not self._stopping.wait(interval):
+            try:
+                self._sweep_batch(self.sweep_batch_size)
+            except Exception:
+                if db.closed:
+                    return
+                # Report the error, and try again in the next interval, so
+                # that expiry does not stop silently.
+                sys.excepthook(*sys.exc_info())
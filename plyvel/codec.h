@@ -0,0 +1,222 @@
+#ifndef PLYVEL_CODEC_H
+#define PLYVEL_CODEC_H
+
+#include <atomic>
+#include <climits>
+#include <cstdint>
+#include <cstring>
+#include <string>
+
+#include <leveldb/slice.h>
+#include <zlib.h>
+
+#define PLYVEL_CODEC_MAX_VERSION 255
+
+/*
+ * Value codec that compresses each value separately using zlib (raw
+ * deflate) with a preset dictionary. Small values hardly compress on
+ * their own, but compress well with a dictionary of content that many
+ * values have in common.
+ *
+ * Encoded values start with a header byte, which is 0 for values that
+ * are stored as is. Otherwise it is the version of the dictionary that
+ * was used, and it is followed by the decoded size (as a varint) and the
+ * compressed data. New values are compressed with the latest dictionary;
+ * older dictionaries are kept to decode existing values.
+ */
+class PlyvelCodec
+{
+public:
+
+    PlyvelCodec() : version(0)
+    {
+        for (int i = 0; i <= PLYVEL_CODEC_MAX_VERSION; i++)
+            dictionaries[i].store(NULL);
+    }
+
+    ~PlyvelCodec()
+    {
+        for (int i = 0; i <= PLYVEL_CODEC_MAX_VERSION; i++)
+            delete dictionaries[i].load();
+    }
+
+    /* Returns false if zlib could not be initialised. Each version can
+     * only be added once. Must not be called concurrently with itself;
+     * encoding and decoding in other threads is fine. */
+    bool AddDictionary(int v, const char* data, size_t size)
+    {
+        Dictionary* dictionary = new Dictionary(data, size);
+        if (!dictionary->ok || dictionaries[v].load() != NULL) {
+            delete dictionary;
+            return false;
+        }
+        dictionaries[v].store(dictionary, std::memory_order_release);
+        if (v > version.load())
+            version.store(v, std::memory_order_release);
+        return true;
+    }
+
+    int Version() const
+    {
+        return version.load(std::memory_order_acquire);
+    }
+
+    void Encode(const leveldb::Slice& value, std::string* out) const
+    {
+        int v = Version();
+        if (v > 0 && !value.empty() && value.size() < UINT_MAX / 2
+                && Compress(v, value, out))
+            return;
+        out->assign(1, '\0');
+        out->append(value.data(), value.size());
+    }
+
+    /* Returns false if `value` is not a valid encoded value. */
+    bool Decode(const leveldb::Slice& value, std::string* out) const
+    {
+        const unsigned char* p = (const unsigned char*) value.data();
+        const unsigned char* end = p + value.size();
+        if (p == end)
+            return false;
+
+        int v = *p++;
+        if (v == 0) {
+            out->assign((const char*) p, end - p);
+            return true;
+        }
+
+        const Dictionary* dictionary = dictionaries[v].load(
+            std::memory_order_acquire);
+        if (dictionary == NULL)
+            return false;
+
+        uint64_t size = 0;
+        for (int shift = 0; ; shift += 7) {
+            if (p == end || shift > 28)
+                return false;
+            size |= (uint64_t) (*p & 0x7f) << shift;
+            if (!(*p++ & 0x80))
+                break;
+        }
+        // Deflate cannot compress by more than a factor of 1032, so
+        // larger sizes indicate corruption.
+        if (size > (uint64_t) (end - p) * 1032)
+            return false;
+
+        z_stream* stream = Inflater();
+        if (stream == NULL || inflateReset(stream) != Z_OK
+                || inflateSetDictionary(
+                    stream, (const Bytef*) dictionary->data.data(),
+                    dictionary->data.size()) != Z_OK)
+            return false;
+
+        out->resize(size);
+        stream->next_in = (Bytef*) p;
+        stream->avail_in = end - p;
+        stream->next_out = (Bytef*) &(*out)[0];
+        stream->avail_out = size;
+        return (inflate(stream, Z_FINISH) == Z_STREAM_END
+                && stream->avail_in == 0 && stream->avail_out == 0);
+    }
+
+private:
+
+    struct Dictionary {
+        std::string data;
+
+        // Deflate stream primed with the dictionary. Priming is costly
+        // for a single small value, so each value is compressed with a
+        // copy of this stream instead.
+        z_stream deflater;
+        bool ok;
+
+        Dictionary(const char* d, size_t n) : data(d, n)
+        {
+            // A small window (and memory level) makes copying the
+            // stream cheap; the window only needs to fit the dictionary.
+            // (The last few hundred bytes of the window are reserved for
+            // lookahead, so zlib may not use the start of a dictionary
+            // that fills the whole window, which hardly matters.)
+            int window_bits = 9;
+            while (window_bits < 15 && (1u << window_bits) < n)
+                window_bits++;
+            // With a good dictionary, higher compression levels hardly
+            // compress small values better, but they are slower.
+            memset(&deflater, 0, sizeof(deflater));
+            ok = (deflateInit2(&deflater, 3, Z_DEFLATED, -window_bits, 4,
+                               Z_DEFAULT_STRATEGY) == Z_OK
+                  && deflateSetDictionary(&deflater, (const Bytef*) d,
+                                          n) == Z_OK);
+        }
+
+        ~Dictionary()
+        {
+            deflateEnd(&deflater);
+        }
+    };
+
+    bool Compress(int v, const leveldb::Slice& value, std::string* out) const
+    {
+        const Dictionary* dictionary = dictionaries[v].load(
+            std::memory_order_acquire);
+        z_stream stream;
+        if (deflateCopy(&stream, const_cast<z_stream*>(
+                &dictionary->deflater)) != Z_OK)
+            return false;
+
+        out->assign(1, (char) v);
+        for (size_t n = value.size(); ; n >>= 7) {
+            if (n < 0x80) {
+                out->push_back((char) n);
+                break;
+            }
+            out->push_back((char) (n | 0x80));
+        }
+
+        size_t header = out->size();
+        size_t bound = deflateBound(&stream, value.size());
+        out->resize(header + bound);
+        stream.next_in = (Bytef*) value.data();
+        stream.avail_in = value.size();
+        stream.next_out = (Bytef*) &(*out)[header];
+        stream.avail_out = bound;
+        int status = deflate(&stream, Z_FINISH);
+        size_t size = header + bound - stream.avail_out;
+        deflateEnd(&stream);
+
+        // Store values as is if compression does not pay off.
+        if (status != Z_STREAM_END || size > value.size())
+            return false;
+        out->resize(size);
+        return true;
+    }
+
+    /* Inflate stream of the current thread, or NULL if zlib could not be
+     * initialised. */
+    static z_stream* Inflater()
+    {
+        struct Stream {
+            z_stream stream;
+            bool ok;
+
+            Stream()
+            {
+                memset(&stream, 0, sizeof(stream));
+                ok = inflateInit2(&stream, -15) == Z_OK;
+            }
+
+            ~Stream()
+            {
+                if (ok)
+                    inflateEnd(&stream);
+            }
+        };
+        static thread_local Stream inflater;
+        return inflater.ok ? &inflater.stream : NULL;
+    }
+
+    std::atomic<Dictionary*> dictionaries[PLYVEL_CODEC_MAX_VERSION + 1];
+    std::atomic<int> version;
+};
+
+#endif
@@ -0,0 +1,17 @@
+# distutils: language = c++
+
+from libcpp cimport bool
+from libcpp.string cimport string
+
+from .leveldb cimport Slice
+
+cdef extern from "codec.h":
+
+    enum:
+        PLYVEL_CODEC_MAX_VERSION
+
+    cdef cppclass PlyvelCodec:
+        bool AddDictionary(int version, const char* data, size_t size) nogil
+        int Version() nogil
+        void Encode(const Slice& value, string* out) nogil
+        bool Decode(const Slice& value, string* out) nogil
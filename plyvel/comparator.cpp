@@ -12,6 +12,10 @@
 #include "comparator.h"
 
 
+/* Number of comparator callbacks running in the current thread. */
+static thread_local int callback_depth = 0;
+
+
 class PlyvelCallbackComparator : public leveldb::Comparator
 {
 public:
@@ -62,7 +66,9 @@ public:
         }
 
         /* Invoke comparator callable */
+        callback_depth++;
         compare_result = PyObject_CallFunctionObjArgs(comparator, bytes_a, bytes_b, 0);
+        callback_depth--;
 
         if (compare_result == NULL) {
             this->bailout("Exception raised from custom Plyvel comparator");
@@ -104,9 +110,14 @@ private:
 
 
 /*
- * This function is the only API used by the Plyvel Cython code.
+ * These functions are the only API used by the Plyvel Cython code.
  */
 leveldb::Comparator* NewPlyvelCallbackComparator(const char* name, PyObject* comparator)
 {
     return new PlyvelCallbackComparator(name, comparator);
 }
+
+bool PlyvelInComparatorCallback()
+{
+    return callback_depth > 0;
+}
@@ -4,5 +4,6 @@
 #include <leveldb/comparator.h>
 
 leveldb::Comparator* NewPlyvelCallbackComparator(const char* name, PyObject* comparator);
+bool PlyvelInComparatorCallback();
 
 #endif
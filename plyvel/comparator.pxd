@@ -1,9 +1,11 @@
 # distutils: language = c++
 
 from libc.string cimport const_char
+from libcpp cimport bool
 
 from .leveldb cimport Comparator
 
 cdef extern from "comparator.h":
 
     Comparator* NewPlyvelCallbackComparator(const_char* name, object comparator) nogil
+    bool PlyvelInComparatorCallback() nogil
@@ -0,0 +1,28 @@
+#ifndef PLYVEL_COMPRESSION_H
+#define PLYVEL_COMPRESSION_H
+
+#include <leveldb/options.h>
+
+/*
+ * Zstandard compression is only available in recent LevelDB versions,
+ * which declare kZstdCompression and Options::zstd_compression_level.
+ * There is no version macro for this, so setup.py inspects the LevelDB
+ * headers and defines PLYVEL_HAVE_ZSTD if they support it.
+ */
+
+/* Returns false if Zstandard compression is not supported. */
+static inline bool PlyvelSetZstdCompression(leveldb::Options* options,
+                                            int level)
+{
+#ifdef PLYVEL_HAVE_ZSTD
+    options->compression = leveldb::kZstdCompression;
+    options->zstd_compression_level = level;
+    return true;
+#else
+    (void) options;
+    (void) level;
+    return false;
+#endif
+}
+
+#endif
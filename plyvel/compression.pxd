@@ -0,0 +1,9 @@
+# distutils: language = c++
+
+from libcpp cimport bool
+
+from .leveldb cimport Options
+
+cdef extern from "compression.h":
+
+    bool PlyvelSetZstdCompression(Options* options, int level) nogil
@@ -0,0 +1,271 @@
+#ifndef PLYVEL_FILTER_H
+#define PLYVEL_FILTER_H
+
+#include <algorithm>
+#include <cstdint>
+#include <cstring>
+#include <memory>
+#include <regex>
+#include <string>
+#include <vector>
+
+#include <leveldb/comparator.h>
+#include <leveldb/iterator.h>
+#include <leveldb/slice.h>
+
+#define PLYVEL_FILTER_EQ 0
+#define PLYVEL_FILTER_NE 1
+#define PLYVEL_FILTER_LT 2
+#define PLYVEL_FILTER_LE 3
+#define PLYVEL_FILTER_GT 4
+#define PLYVEL_FILTER_GE 5
+
+// libstdc++ matches regular expressions recursively, using stack space for
+// each byte of the input, so longer inputs are not matched (see Failed()).
+#define PLYVEL_FILTER_MAX_REGEX_SIZE 1024
+
+/*
+ * Predicates on the keys and values of iterator entries. A filter is a
+ * tree of nodes: predicates on the raw bytes (prefix, suffix, contains,
+ * integer comparison, regular expression, and stride sampling) combined
+ * with and, or, and not. Nodes are evaluated left to right, and and/or
+ * short-circuit, so a stride node only counts the entries that reach it.
+ *
+ * A filter is used by a single iterator at a time; stride nodes keep a
+ * counter, which Reset() sets back to zero.
+ */
+class PlyvelFilter
+{
+public:
+
+    PlyvelFilter() : key_root(-1), value_root(-1), failed(false) {}
+
+    /* Each of these adds a node and returns its index. */
+
+    int AddPrefix(const std::string& data, size_t offset)
+    {
+        Node node(PREFIX);
+        node.data = data;
+        node.offset = offset;
+        return Add(node);
+    }
+
+    int AddSuffix(const std::string& data)
+    {
+        Node node(SUFFIX);
+        node.data = data;
+        return Add(node);
+    }
+
+    int AddContains(const std::string& data, size_t offset)
+    {
+        Node node(CONTAINS);
+        node.data = data;
+        node.offset = offset;
+        return Add(node);
+    }
+
+    /* `value` holds the bit pattern of the integer to compare with
+     * (sign-extended to 64 bits for signed integers). */
+    int AddInteger(int op, uint64_t value, size_t offset, int size,
+                   bool big_endian, bool is_signed)
+    {
+        Node node(INTEGER);
+        node.op = op;
+        node.value = value;
+        node.offset = offset;
+        node.size = size;
+        node.big_endian = big_endian;
+        node.is_signed = is_signed;
+        return Add(node);
+    }
+
+    /* Throws std::regex_error for invalid patterns. */
+    int AddRegex(const std::string& pattern)
+    {
+        Node node(REGEX);
+        node.regex = std::make_shared<std::regex>(
+            pattern, std::regex::ECMAScript | std::regex::nosubs
+                | std::regex::optimize);
+        return Add(node);
+    }
+
+    /* Matches every `n`th entry, starting with entry number `offset`. */
+    int AddStride(uint64_t n, uint64_t offset)
+    {
+        Node node(STRIDE);
+        node.value = n;
+        node.offset = offset;
+        return Add(node);
+    }
+
+    int AddAnd(int left, int right) { return AddBranch(AND, left, right); }
+    int AddOr(int left, int right) { return AddBranch(OR, left, right); }
+    int AddNot(int child) { return AddBranch(NOT, child, -1); }
+
+    void SetKeyRoot(int node) { key_root = node; }
+    void SetValueRoot(int node) { value_root = node; }
+    bool HasValueFilter() const { return value_root >= 0; }
+
+    /* Whether the last Matches() call evaluated a regular expression node
+     * on an input longer than PLYVEL_FILTER_MAX_REGEX_SIZE, in which case
+     * its result must not be used. */
+    bool Failed() const { return failed; }
+
+    void Reset()
+    {
+        for (size_t i = 0; i < nodes.size(); i++)
+            nodes[i].count = 0;
+    }
+
+    bool Matches(const leveldb::Slice& key, const leveldb::Slice& value)
+    {
+        failed = false;
+        return ((key_root < 0 || Eval(key_root, key))
+                && (value_root < 0 || Eval(value_root, value)));
+    }
+
+    /* Moves `it` forward until it is at an entry that matches (or until
+     * Failed()). Returns false if it ends up invalid or past the stop key
+     * (if any) instead. The first `prefix_len` bytes of keys are not
+     * matched. */
+    bool SkipForward(leveldb::Iterator* it,
+                     const leveldb::Comparator* comparator,
+                     const leveldb::Slice* stop, bool include_stop,
+                     size_t prefix_len)
+    {
+        int n = include_stop ? 1 : 0;
+        for (it->Next(); it->Valid(); it->Next()) {
+            leveldb::Slice key = it->key();
+            if (stop != NULL && comparator->Compare(key, *stop) >= n)
+                return false;
+            key.remove_prefix(prefix_len);
+            if (Matches(key, it->value()) || failed)
+                return true;
+        }
+        return false;
+    }
+
+private:
+
+    enum Kind { PREFIX, SUFFIX, CONTAINS, INTEGER, REGEX, STRIDE, AND, OR,
+                NOT };
+
+    struct Node {
+        Kind kind;
+        std::string data;
+        size_t offset;
+        int op;
+        uint64_t value;
+        int size;
+        bool big_endian;
+        bool is_signed;
+        std::shared_ptr<std::regex> regex;
+        uint64_t count;
+        int left;
+        int right;
+
+        explicit Node(Kind kind) :
+            kind(kind), offset(0), op(PLYVEL_FILTER_EQ), value(0), size(0),
+            big_endian(true), is_signed(false), count(0), left(-1),
+            right(-1) {}
+    };
+
+    int Add(const Node& node)
+    {
+        nodes.push_back(node);
+        return (int) nodes.size() - 1;
+    }
+
+    int AddBranch(Kind kind, int left, int right)
+    {
+        Node node(kind);
+        node.left = left;
+        node.right = right;
+        return Add(node);
+    }
+
+    template <typename T>
+    static bool Compare(int op, T a, T b)
+    {
+        switch (op) {
+        case PLYVEL_FILTER_EQ: return a == b;
+        case PLYVEL_FILTER_NE: return a != b;
+        case PLYVEL_FILTER_LT: return a < b;
+        case PLYVEL_FILTER_LE: return a <= b;
+        case PLYVEL_FILTER_GT: return a > b;
+        default: return a >= b;
+        }
+    }
+
+    bool Eval(int i, const leveldb::Slice& s)
+    {
+        Node& node = nodes[i];
+        const char* data = s.data();
+        size_t size = s.size();
+
+        switch (node.kind) {
+        case PREFIX:
+            return (node.offset <= size
+                    && size - node.offset >= node.data.size()
+                    && memcmp(data + node.offset, node.data.data(),
+                              node.data.size()) == 0);
+
+        case SUFFIX:
+            return (size >= node.data.size()
+                    && memcmp(data + size - node.data.size(),
+                              node.data.data(), node.data.size()) == 0);
+
+        case CONTAINS:
+            return (node.offset <= size
+                    && (node.data.empty()
+                        || std::search(data + node.offset, data + size,
+                                       node.data.begin(), node.data.end())
+                           != data + size));
+
+        case INTEGER: {
+            if (node.offset > size || size - node.offset < (size_t) node.size)
+                return false;
+            const unsigned char* p = (const unsigned char*) data + node.offset;
+            uint64_t x = 0;
+            for (int j = 0; j < node.size; j++) {
+                int shift = 8 * (node.big_endian ? node.size - 1 - j : j);
+                x |= (uint64_t) p[j] << shift;
+            }
+            if (!node.is_signed)
+                return Compare<uint64_t>(node.op, x, node.value);
+            if (node.size < 8 && (x >> (8 * node.size - 1)) & 1)
+                x |= ~(uint64_t) 0 << (8 * node.size);
+            return Compare<int64_t>(node.op, (int64_t) x,
+                                    (int64_t) node.value);
+        }
+
+        case REGEX:
+            if (size > PLYVEL_FILTER_MAX_REGEX_SIZE) {
+                failed = true;
+                return false;
+            }
+            return std::regex_search(data, data + size, *node.regex);
+
+        case STRIDE:
+            return node.count++ % node.value == node.offset;
+
+        case AND:
+            return Eval(node.left, s) && Eval(node.right, s);
+
+        case OR:
+            return Eval(node.left, s) || Eval(node.right, s);
+
+        case NOT:
+            return !Eval(node.left, s);
+        }
+        return false;
+    }
+
+    std::vector<Node> nodes;
+    int key_root;
+    int value_root;
+    bool failed;
+};
+
+#endif
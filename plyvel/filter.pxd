@@ -0,0 +1,39 @@
+# distutils: language = c++
+
+from libc.stdint cimport uint64_t
+from libcpp cimport bool
+from libcpp.string cimport string
+
+from .leveldb cimport Comparator, Iterator, Slice
+
+cdef extern from "filter.h":
+
+    enum:
+        PLYVEL_FILTER_EQ
+        PLYVEL_FILTER_NE
+        PLYVEL_FILTER_LT
+        PLYVEL_FILTER_LE
+        PLYVEL_FILTER_GT
+        PLYVEL_FILTER_GE
+        PLYVEL_FILTER_MAX_REGEX_SIZE
+
+    cdef cppclass PlyvelFilter:
+        int AddPrefix(const string& data, size_t offset)
+        int AddSuffix(const string& data)
+        int AddContains(const string& data, size_t offset)
+        int AddInteger(int op, uint64_t value, size_t offset, int size,
+                       bool big_endian, bool is_signed)
+        int AddRegex(const string& pattern) except +
+        int AddStride(uint64_t n, uint64_t offset)
+        int AddAnd(int left, int right)
+        int AddOr(int left, int right)
+        int AddNot(int child)
+        void SetKeyRoot(int node)
+        void SetValueRoot(int node)
+        bool HasValueFilter() nogil
+        bool Failed() nogil
+        void Reset() nogil
+        bool Matches(const Slice& key, const Slice& value) nogil
+        bool SkipForward(Iterator* it, const Comparator* comparator,
+                         const Slice* stop, bool include_stop,
+                         size_t prefix_len) nogil
@@ -0,0 +1,71 @@
+#ifndef PLYVEL_GUARD_H
+#define PLYVEL_GUARD_H
+
+#include <atomic>
+#include <condition_variable>
+#include <mutex>
+
+/*
+ * Guard against closing an object (e.g. a database) while other threads
+ * are still using it. Operations call Enter() and Exit() around their use
+ * of the object; Close() prevents new operations from entering and waits
+ * until all in-flight operations have finished. Operations only use
+ * atomic counters, so they never block each other; the last operation to
+ * exit after Close() wakes up the waiting thread.
+ */
+class PlyvelGuard
+{
+public:
+
+    PlyvelGuard() : active(0), closed(true) {}
+
+    void Open()
+    {
+        closed.store(false);
+    }
+
+    /* Returns false if the object is closed. */
+    bool Enter()
+    {
+        active.fetch_add(1);
+        if (closed.load()) {
+            Exit();
+            return false;
+        }
+        return true;
+    }
+
+    void Exit()
+    {
+        if (active.fetch_sub(1) == 1 && closed.load()) {
+            // Taking the mutex makes sure Close() is either still before
+            // its check of the counter, or already waiting.
+            std::lock_guard<std::mutex> lock(mutex);
+            idle.notify_all();
+        }
+    }
+
+    /* Returns false if the object was already closed. Must be called
+     * without holding the GIL, since in-flight operations may need it. */
+    bool Close()
+    {
+        bool was_closed = closed.exchange(true);
+        std::unique_lock<std::mutex> lock(mutex);
+        idle.wait(lock, [this] { return active.load() == 0; });
+        return !was_closed;
+    }
+
+    bool IsClosed() const
+    {
+        return closed.load();
+    }
+
+private:
+
+    std::atomic<long> active;
+    std::atomic<bool> closed;
+    std::mutex mutex;
+    std::condition_variable idle;
+};
+
+#endif
@@ -0,0 +1,12 @@
+# distutils: language = c++
+
+from libcpp cimport bool
+
+cdef extern from "guard.h":
+
+    cdef cppclass PlyvelGuard:
+        void Open() nogil
+        bool Enter() nogil
+        void Exit() nogil
+        bool Close() nogil
+        bool IsClosed() nogil
@@ -0,0 +1,127 @@
+#ifndef PLYVEL_LOOKUP_H
+#define PLYVEL_LOOKUP_H
+
+#include <algorithm>
+#include <string>
+#include <vector>
+
+#include <leveldb/comparator.h>
+#include <leveldb/db.h>
+#include <leveldb/iterator.h>
+#include <leveldb/options.h>
+#include <leveldb/slice.h>
+#include <leveldb/status.h>
+
+#define PLYVEL_LOOKUP_MIN_STEPS 1
+#define PLYVEL_LOOKUP_MAX_STEPS 64
+#define PLYVEL_LOOKUP_MAX_SEEKS 4
+#define PLYVEL_LOOKUP_PROBE_INTERVAL 32
+
+/*
+ * Looks up many keys, visiting them in sorted order. Dense keys are
+ * looked up with a single iterator that only moves forward: if the next
+ * key is close to the current position, Next() gets there without
+ * repeating the index block and table lookups of a Seek(), and otherwise
+ * the iterator seeks to it. The number of Next() steps tried before
+ * seeking doubles each time stepping reaches a key, and halves each time
+ * it does not.
+ *
+ * A Seek() positions the iterator in every table and in the memtable,
+ * which is slower than a Get() that can stop at the first match, so for
+ * sparse keys (several seeks in a row) this switches to Get() calls. It
+ * tries the iterator again after a number of keys, in case the keys
+ * became dense again.
+ *
+ * The values of keys that were found are stored in `values`, at the same
+ * positions as in `keys`.
+ */
+static inline leveldb::Status PlyvelLookupSorted(
+    leveldb::DB* db, const leveldb::ReadOptions& options,
+    const leveldb::Comparator* comparator,
+    const std::vector<leveldb::Slice>& keys,
+    std::vector<std::string>* values, std::vector<bool>* found)
+{
+    std::vector<size_t> order(keys.size());
+    for (size_t i = 0; i < order.size(); i++)
+        order[i] = i;
+    std::stable_sort(order.begin(), order.end(), [&](size_t a, size_t b) {
+        return comparator->Compare(keys[a], keys[b]) < 0;
+    });
+
+    leveldb::Iterator* it = db->NewIterator(options);
+    leveldb::Status status;
+    bool positioned = false;
+    int budget = PLYVEL_LOOKUP_MIN_STEPS;
+    int seeks = 0;  // consecutive seeks with the minimum budget
+    int gets = 0;   // keys looked up with Get() since switching to it
+
+    for (size_t i = 0; i < order.size(); i++) {
+        const leveldb::Slice& key = keys[order[i]];
+        bool use_get = false;
+
+        if (gets > 0) {
+            if (gets < PLYVEL_LOOKUP_PROBE_INTERVAL) {
+                use_get = true;
+                gets++;
+            } else {
+                // Try the iterator again.
+                gets = 0;
+                positioned = false;
+            }
+        }
+
+        if (!use_get && !positioned) {
+            it->Seek(key);
+            positioned = true;
+        } else if (!use_get) {
+            int steps = 0;
+            while (it->Valid() && steps < budget
+                    && comparator->Compare(it->key(), key) < 0) {
+                it->Next();
+                steps++;
+            }
+            if (it->Valid() && comparator->Compare(it->key(), key) < 0) {
+                if (budget == PLYVEL_LOOKUP_MIN_STEPS
+                        && ++seeks >= PLYVEL_LOOKUP_MAX_SEEKS) {
+                    use_get = true;
+                    gets = 1;
+                    seeks = 0;
+                } else {
+                    it->Seek(key);
+                    budget = std::max(budget / 2, PLYVEL_LOOKUP_MIN_STEPS);
+                }
+            } else {
+                seeks = 0;
+                if (steps > 0)
+                    budget = std::min(budget * 2, PLYVEL_LOOKUP_MAX_STEPS);
+            }
+        }
+
+        if (use_get) {
+            status = db->Get(options, key, &(*values)[order[i]]);
+            if (status.ok())
+                (*found)[order[i]] = true;
+            else if (!status.IsNotFound())
+                break;
+            status = leveldb::Status::OK();
+            continue;
+        }
+
+        // Past the last entry, none of the remaining keys exist.
+        if (!it->Valid())
+            break;
+
+        if (comparator->Compare(it->key(), key) == 0) {
+            (*values)[order[i]].assign(it->value().data(),
+                                       it->value().size());
+            (*found)[order[i]] = true;
+        }
+    }
+
+    if (status.ok())
+        status = it->status();
+    delete it;
+    return status;
+}
+
+#endif
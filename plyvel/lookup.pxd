@@ -0,0 +1,15 @@
+# distutils: language = c++
+
+from libcpp cimport bool
+from libcpp.string cimport string
+from libcpp.vector cimport vector
+
+from .leveldb cimport Comparator, DB, ReadOptions, Slice, Status
+
+cdef extern from "lookup.h":
+
+    Status PlyvelLookupSorted(DB* db, const ReadOptions& options,
+                              const Comparator* comparator,
+                              const vector[Slice]& keys,
+                              vector[string]* values,
+                              vector[bool]* found) nogil
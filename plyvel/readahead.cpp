@@ -0,0 +1,109 @@
+/*
+ * Background iterator read-ahead support code for Plyvel.
+ */
+
+#include "readahead.h"
+
+
+PlyvelReadahead::PlyvelReadahead(
+        leveldb::Iterator* iter, const leveldb::Comparator* comparator,
+        size_t capacity, bool include_value,
+        const leveldb::Slice* start, bool include_start,
+        const leveldb::Slice* stop, bool include_stop) :
+    iter(iter),
+    comparator(comparator),
+    capacity(capacity),
+    include_value(include_value),
+    has_start(start != NULL),
+    include_start(include_start),
+    has_stop(stop != NULL),
+    include_stop(include_stop),
+    done(false),
+    stopping(false)
+{
+    if (has_start)
+        this->start = start->ToString();
+    if (has_stop)
+        this->stop = stop->ToString();
+
+    thread = std::thread(&PlyvelReadahead::Run, this);
+}
+
+
+PlyvelReadahead::~PlyvelReadahead()
+{
+    {
+        std::lock_guard<std::mutex> lock(mutex);
+        stopping = true;
+    }
+    not_full.notify_all();
+    thread.join();
+}
+
+
+void PlyvelReadahead::Run()
+{
+    leveldb::Slice start_slice(start);
+    leveldb::Slice stop_slice(stop);
+    int n;
+
+    if (has_start) {
+        iter->Seek(start_slice);
+        /* Start key is excluded, so skip past it if the db contains it. */
+        if (!include_start && iter->Valid()
+                && comparator->Compare(iter->key(), start_slice) == 0)
+            iter->Next();
+    } else {
+        iter->SeekToFirst();
+    }
+
+    n = include_stop ? 1 : 0;
+    for (; iter->Valid(); iter->Next()) {
+        if (has_stop && comparator->Compare(iter->key(), stop_slice) >= n)
+            break;
+
+        Entry entry;
+        entry.key.assign(iter->key().data(), iter->key().size());
+        if (include_value)
+            entry.value.assign(iter->value().data(), iter->value().size());
+
+        std::unique_lock<std::mutex> lock(mutex);
+        not_full.wait(lock, [this] {
+            return stopping || buffer.size() < capacity;
+        });
+        if (stopping)
+            return;
+        buffer.push_back(std::move(entry));
+        lock.unlock();
+        not_empty.notify_one();
+    }
+
+    {
+        std::lock_guard<std::mutex> lock(mutex);
+        final_status = iter->status();
+        done = true;
+    }
+    not_empty.notify_one();
+}
+
+
+bool PlyvelReadahead::Pop(std::string* key, std::string* value)
+{
+    std::unique_lock<std::mutex> lock(mutex);
+    not_empty.wait(lock, [this] { return done || !buffer.empty(); });
+    if (buffer.empty())
+        return false;
+    key->swap(buffer.front().key);
+    value->swap(buffer.front().value);
+    buffer.pop_front();
+    lock.unlock();
+    not_full.notify_one();
+    return true;
+}
+
+
+leveldb::Status PlyvelReadahead::status()
+{
+    std::lock_guard<std::mutex> lock(mutex);
+    return final_status;
+}
@@ -0,0 +1,74 @@
+#ifndef PLYVEL_READAHEAD_H
+#define PLYVEL_READAHEAD_H
+
+#include <condition_variable>
+#include <deque>
+#include <mutex>
+#include <string>
+#include <thread>
+
+#include <leveldb/comparator.h>
+#include <leveldb/iterator.h>
+#include <leveldb/status.h>
+
+/*
+ * Background read-ahead for forward iteration. A worker thread advances
+ * a LevelDB iterator and copies the entries into a bounded buffer, from
+ * which the consumer pops them. While the worker is running, the
+ * iterator must not be used by anything else.
+ */
+class PlyvelReadahead
+{
+public:
+
+    PlyvelReadahead(leveldb::Iterator* iter,
+                    const leveldb::Comparator* comparator,
+                    size_t capacity,
+                    bool include_value,
+                    const leveldb::Slice* start, bool include_start,
+                    const leveldb::Slice* stop, bool include_stop);
+
+    /* Stops the worker thread. Must be called without holding the GIL,
+     * since the worker may need it for custom comparators. */
+    ~PlyvelReadahead();
+
+    /* Pops the next entry into key and value. Returns false when the
+     * range is exhausted (or an error occurred; see status()). Blocks
+     * until an entry is available; must be called without holding the
+     * GIL. */
+    bool Pop(std::string* key, std::string* value);
+
+    leveldb::Status status();
+
+private:
+
+    struct Entry {
+        std::string key;
+        std::string value;
+    };
+
+    void Run();
+
+    leveldb::Iterator* iter;
+    const leveldb::Comparator* comparator;
+    size_t capacity;
+    bool include_value;
+    bool has_start;
+    std::string start;
+    bool include_start;
+    bool has_stop;
+    std::string stop;
+    bool include_stop;
+
+    std::mutex mutex;
+    std::condition_variable not_empty;
+    std::condition_variable not_full;
+    std::deque<Entry> buffer;
+    bool done;
+    bool stopping;
+    leveldb::Status final_status;
+
+    std::thread thread;
+};
+
+#endif
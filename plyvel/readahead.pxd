@@ -0,0 +1,16 @@
+# distutils: language = c++
+
+from libcpp cimport bool
+from libcpp.string cimport string
+
+from .leveldb cimport Comparator, Iterator, Slice, Status
+
+cdef extern from "readahead.h":
+
+    cdef cppclass PlyvelReadahead:
+        PlyvelReadahead(Iterator* iter, Comparator* comparator,
+                        size_t capacity, bool include_value,
+                        Slice* start, bool include_start,
+                        Slice* stop, bool include_stop) except +
+        bool Pop(string* key, string* value) nogil
+        Status status() nogil
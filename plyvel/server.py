@@ -0,0 +1,209 @@
+"""
+Server that shares a database with other processes over a Unix socket.
+
+LevelDB databases can only be opened by a single process. This server
+owns the database, and other processes use it through plyvel.RemoteDB:
+
+    python -m plyvel.server /path/to/db /path/to/socket
+"""
+
+import argparse
+import itertools
+import os
+import socketserver
+
+from ._plyvel import DB
+from ._remote import (
+    DEFAULT_MAX_FRAME_SIZE,
+    DELETE,
+    ERROR,
+    GET,
+    GET_MANY,
+    ITERATOR,
+    ITERATOR_CLOSE,
+    ITERATOR_NEXT,
+    OK,
+    PUT,
+    SNAPSHOT,
+    SNAPSHOT_CLOSE,
+    WRITE,
+    ProtocolError,
+    frame,
+    pack_fields,
+    pack_int,
+    read_frame,
+    unpack_fields,
+    unpack_int,
+)
+
+
+def _error_response(exc):
+    return bytes([ERROR]) + pack_fields((
+        type(exc).__name__.encode('utf-8'),
+        str(exc).encode('utf-8')))
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.db = self.server.db
+        # Iterators and snapshots of this connection, by id
+        self.objects = {}
+        self.key_iterators = set()
+        self.ids = itertools.count(1)
+
+    def handle(self):
+        while True:
+            try:
+                payload = read_frame(self.rfile, self.server.max_frame_size)
+            except ProtocolError as exc:
+                # The rest of the stream cannot be parsed, so report the
+                # error and drop the connection.
+                self.wfile.write(frame(_error_response(exc)))
+                break
+            if payload is None:
+                break
+            try:
+                handler = self.handlers[payload[0]]
+                fields = handler(self, *unpack_fields(payload, 1))
+                response = bytes([OK]) + pack_fields(fields)
+            except Exception as exc:
+                response = _error_response(exc)
+            self.wfile.write(frame(response))
+
+    def finish(self):
+        for obj in self.objects.values():
+            obj.close()
+        self.objects.clear()
+        super().finish()
+
+    def add(self, obj):
+        obj_id = pack_int(next(self.ids))
+        self.objects[obj_id] = obj
+        return obj_id
+
+    def source(self, snapshot_id):
+        return self.db if snapshot_id is None else self.objects[snapshot_id]
+
+    def get(self, key, snapshot_id):
+        return [self.source(snapshot_id).get(key)]
+
+    def get_many(self, snapshot_id, *keys):
+        return self.source(snapshot_id).get_many(keys)
+
+    def put(self, key, value, sync):
+        self.db.put(key, value, sync=bool(sync))
+        return []
+
+    def delete(self, key, sync):
+        self.db.delete(key, sync=bool(sync))
+        return []
+
+    def write(self, sync, *ops):
+        with self.db.write_batch(sync=bool(sync)) as wb:
+            for i in range(0, len(ops), 3):
+                op, key, value = ops[i:i + 3]
+                if op == b'p':
+                    wb.put(key, value)
+                else:
+                    wb.delete(key)
+        return []
+
+    def iterator(self, snapshot_id, reverse, start, stop, include_start,
+                 include_stop, prefix, include_value):
+        it = self.source(snapshot_id).iterator(
+            reverse=bool(reverse), start=start, stop=stop,
+            include_start=bool(include_start),
+            include_stop=bool(include_stop), prefix=prefix,
+            include_value=bool(include_value))
+        iterator_id = self.add(it)
+        if not include_value:
+            self.key_iterators.add(iterator_id)
+        return [iterator_id]
+
+    def iterator_next(self, iterator_id, size):
+        entries = self.objects[iterator_id].next_batch(unpack_int(size))
+        fields = []
+        if iterator_id in self.key_iterators:
+            for key in entries:
+                fields.append(key)
+                fields.append(None)
+        else:
+            for key, value in entries:
+                fields.append(key)
+                fields.append(value)
+        return fields
+
+    def close_object(self, obj_id):
+        obj = self.objects.pop(obj_id, None)
+        self.key_iterators.discard(obj_id)
+        if obj is not None:
+            obj.close()
+        return []
+
+    def snapshot(self):
+        return [self.add(self.db.snapshot())]
+
+    handlers = {
+        GET: get,
+        GET_MANY: get_many,
+        PUT: put,
+        DELETE: delete,
+        WRITE: write,
+        ITERATOR: iterator,
+        ITERATOR_NEXT: iterator_next,
+        ITERATOR_CLOSE: close_object,
+        SNAPSHOT: snapshot,
+        SNAPSHOT_CLOSE: close_object,
+    }
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve a database over a Unix socket, with a thread per client."""
+
+    daemon_threads = True
+
+    def __init__(self, db, path, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        self.db = db
+        self.path = path
+        self.max_frame_size = max_frame_size
+        super().__init__(path, _Handler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def serve(db, path, *, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """Create a server for `db`; call its serve_forever() to run it."""
+    return Server(db, path, max_frame_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m plyvel.server',
+        description="Serve a LevelDB database over a Unix socket.")
+    parser.add_argument('db', help="database directory")
+    parser.add_argument('socket', help="path of the Unix socket")
+    parser.add_argument('--create-if-missing', action='store_true',
+                        help="create the database if it does not exist")
+    parser.add_argument('--max-frame-size', type=int,
+                        default=DEFAULT_MAX_FRAME_SIZE,
+                        help="largest request size in bytes "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    with DB(args.db, create_if_missing=args.create_if_missing) as db:
+        with serve(db, args.socket,
+                   max_frame_size=args.max_frame_size) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#ifndef PLYVEL_STATS_H
+#define PLYVEL_STATS_H
+
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+
+#define PLYVEL_STATS_OPERATIONS 8
+#define PLYVEL_STATS_BUCKETS 32
+
+/*
+ * Per-operation counters and latency histograms. Bucket 0 counts
+ * durations below 1 microsecond, and bucket i counts durations of at
+ * least 2^(i-1) and less than 2^i microseconds; the last bucket also
+ * counts all longer durations. Counters are updated with relaxed atomic
+ * operations, so recording never blocks other threads.
+ */
+class PlyvelStats
+{
+public:
+
+    PlyvelStats()
+    {
+        Reset();
+    }
+
+    void Record(int op, uint64_t time_ns, uint64_t nogil_ns, uint64_t bytes,
+                bool error)
+    {
+        Counters& c = counters[op];
+        c.count.fetch_add(1, std::memory_order_relaxed);
+        if (error)
+            c.errors.fetch_add(1, std::memory_order_relaxed);
+        c.bytes.fetch_add(bytes, std::memory_order_relaxed);
+        c.time_ns.fetch_add(time_ns, std::memory_order_relaxed);
+        c.nogil_ns.fetch_add(nogil_ns, std::memory_order_relaxed);
+        c.buckets[Bucket(time_ns)].fetch_add(1, std::memory_order_relaxed);
+    }
+
+    void Reset()
+    {
+        for (int op = 0; op < PLYVEL_STATS_OPERATIONS; op++) {
+            Counters& c = counters[op];
+            c.count.store(0, std::memory_order_relaxed);
+            c.errors.store(0, std::memory_order_relaxed);
+            c.bytes.store(0, std::memory_order_relaxed);
+            c.time_ns.store(0, std::memory_order_relaxed);
+            c.nogil_ns.store(0, std::memory_order_relaxed);
+            for (int i = 0; i < PLYVEL_STATS_BUCKETS; i++)
+                c.buckets[i].store(0, std::memory_order_relaxed);
+        }
+    }
+
+    uint64_t Count(int op) const { return Load(counters[op].count); }
+    uint64_t Errors(int op) const { return Load(counters[op].errors); }
+    uint64_t Bytes(int op) const { return Load(counters[op].bytes); }
+    uint64_t TimeNs(int op) const { return Load(counters[op].time_ns); }
+    uint64_t NogilNs(int op) const { return Load(counters[op].nogil_ns); }
+    uint64_t BucketCount(int op, int i) const
+    {
+        return Load(counters[op].buckets[i]);
+    }
+
+private:
+
+    struct Counters {
+        std::atomic<uint64_t> count;
+        std::atomic<uint64_t> errors;
+        std::atomic<uint64_t> bytes;
+        std::atomic<uint64_t> time_ns;
+        std::atomic<uint64_t> nogil_ns;
+        std::atomic<uint64_t> buckets[PLYVEL_STATS_BUCKETS];
+    };
+
+    static uint64_t Load(const std::atomic<uint64_t>& counter)
+    {
+        return counter.load(std::memory_order_relaxed);
+    }
+
+    static int Bucket(uint64_t time_ns)
+    {
+        uint64_t us = time_ns / 1000;
+        int i = 0;
+        while (us > 0 && i < PLYVEL_STATS_BUCKETS - 1) {
+            us >>= 1;
+            i++;
+        }
+        return i;
+    }
+
+    Counters counters[PLYVEL_STATS_OPERATIONS];
+};
+
+static inline uint64_t PlyvelNow()
+{
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(
+        std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+/*
+ * Time spent without the GIL by the current thread. Instrumented
+ * operations read this before and after they run, which attributes the
+ * time spent in LevelDB calls to the operation that made them.
+ */
+static inline uint64_t& PlyvelNogilTime()
+{
+    static thread_local uint64_t nogil_ns = 0;
+    return nogil_ns;
+}
+
+/* Returns 0 (and does nothing) if statistics are not collected. */
+static inline uint64_t PlyvelTimerStart(const PlyvelStats* stats)
+{
+    return stats == NULL ? 0 : PlyvelNow();
+}
+
+static inline void PlyvelTimerStop(uint64_t start)
+{
+    if (start != 0)
+        PlyvelNogilTime() += PlyvelNow() - start;
+}
+
+#endif
@@ -0,0 +1,26 @@
+# distutils: language = c++
+
+from libc.stdint cimport uint64_t
+from libcpp cimport bool
+
+cdef extern from "stats.h":
+
+    enum:
+        PLYVEL_STATS_OPERATIONS
+        PLYVEL_STATS_BUCKETS
+
+    cdef cppclass PlyvelStats:
+        void Record(int op, uint64_t time_ns, uint64_t nogil_ns,
+                    uint64_t bytes, bool error) nogil
+        void Reset() nogil
+        uint64_t Count(int op) nogil
+        uint64_t Errors(int op) nogil
+        uint64_t Bytes(int op) nogil
+        uint64_t TimeNs(int op) nogil
+        uint64_t NogilNs(int op) nogil
+        uint64_t BucketCount(int op, int i) nogil
+
+    uint64_t PlyvelNow() nogil
+    uint64_t& PlyvelNogilTime() nogil
+    uint64_t PlyvelTimerStart(const PlyvelStats* stats) nogil
+    void PlyvelTimerStop(uint64_t start) nogil
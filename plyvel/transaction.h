@@ -0,0 +1,221 @@
+#ifndef PLYVEL_TRANSACTION_H
+#define PLYVEL_TRANSACTION_H
+
+#include <atomic>
+#include <cstdint>
+#include <deque>
+#include <mutex>
+#include <set>
+#include <thread>
+#include <unordered_set>
+#include <utility>
+#include <vector>
+
+#include <leveldb/slice.h>
+#include <leveldb/write_batch.h>
+
+#define PLYVEL_READ_SET_EXACT_SIZE 4096
+#define PLYVEL_READ_SET_BLOOM_HASHES 6
+
+static inline uint64_t PlyvelKeyHash(const leveldb::Slice& key)
+{
+    // FNV-1a, followed by the MurmurHash3 finaliser to mix the bits.
+    uint64_t h = 14695981039346656037ULL;
+    for (size_t i = 0; i < key.size(); i++) {
+        h ^= (unsigned char) key[i];
+        h *= 1099511628211ULL;
+    }
+    h ^= h >> 33;
+    h *= 0xff51afd7ed558ccdULL;
+    h ^= h >> 33;
+    h *= 0xc4ceb9fe1a85ec53ULL;
+    h ^= h >> 33;
+    return h;
+}
+
+/*
+ * Hashes of the keys read by a transaction. Small read sets are exact;
+ * once a read set grows beyond PLYVEL_READ_SET_EXACT_SIZE keys, it is
+ * compacted into a Bloom filter. Hash collisions and Bloom filter false
+ * positives can only cause spurious conflicts.
+ */
+class PlyvelReadSet
+{
+public:
+
+    void Add(const leveldb::Slice& key)
+    {
+        uint64_t h = PlyvelKeyHash(key);
+        if (bloom.empty()) {
+            hashes.insert(h);
+            if (hashes.size() > PLYVEL_READ_SET_EXACT_SIZE)
+                Compact();
+        } else {
+            BloomAdd(h);
+        }
+    }
+
+    bool MayContain(uint64_t h) const
+    {
+        if (bloom.empty())
+            return hashes.count(h) > 0;
+        uint64_t bits = bloom.size() * 64;
+        uint64_t delta = (h >> 32) | 1;
+        for (int i = 0; i < PLYVEL_READ_SET_BLOOM_HASHES; i++, h += delta) {
+            uint64_t bit = h % bits;
+            if (!(bloom[bit / 64] & (1ULL << (bit % 64))))
+                return false;
+        }
+        return true;
+    }
+
+    bool IsCompacted() const { return !bloom.empty(); }
+
+private:
+
+    void Compact()
+    {
+        // About 10 bits per key for 8 times as many keys as the read set
+        // has now, so the false positive rate stays low for a while.
+        bloom.assign(hashes.size() * 80 / 64 + 1, 0);
+        for (uint64_t h : hashes)
+            BloomAdd(h);
+        std::unordered_set<uint64_t>().swap(hashes);
+    }
+
+    void BloomAdd(uint64_t h)
+    {
+        uint64_t bits = bloom.size() * 64;
+        uint64_t delta = (h >> 32) | 1;
+        for (int i = 0; i < PLYVEL_READ_SET_BLOOM_HASHES; i++, h += delta) {
+            uint64_t bit = h % bits;
+            bloom[bit / 64] |= 1ULL << (bit % 64);
+        }
+    }
+
+    std::unordered_set<uint64_t> hashes;
+    std::vector<uint64_t> bloom;
+};
+
+/*
+ * Tracks the keys written while transactions are open, so that commits
+ * can detect conflicts.
+ *
+ * Writes call WriteBegin() and WriteEnd(). Without open transactions,
+ * this only updates an atomic counter of writes in flight. With open
+ * transactions, writes hold the mutex while writing, and record the
+ * hashes of their keys with a new sequence number. Begin() waits for
+ * writes in flight (which did not see the transaction) to finish, so
+ * any write that happens after Begin() returns is recorded.
+ *
+ * Transactions commit while holding the mutex: no write can happen
+ * between checking for conflicts and writing.
+ */
+class PlyvelWriteTracker
+{
+public:
+
+    PlyvelWriteTracker() : active(0), inflight(0), seq(0) {}
+
+    /* Returns the sequence number the transaction starts at. */
+    uint64_t Begin()
+    {
+        active.fetch_add(1);
+        while (inflight.load() > 0)
+            std::this_thread::yield();
+        std::lock_guard<std::mutex> lock(mutex);
+        starts.insert(seq);
+        return seq;
+    }
+
+    void End(uint64_t start)
+    {
+        {
+            std::lock_guard<std::mutex> lock(mutex);
+            starts.erase(starts.find(start));
+            // Drop records that no open transaction needs.
+            while (!records.empty()
+                    && (starts.empty()
+                        || records.front().first <= *starts.begin()))
+                records.pop_front();
+        }
+        active.fetch_sub(1);
+    }
+
+    /* Returns true if the write must be recorded; then the mutex is
+     * held until WriteEnd(). */
+    bool WriteBegin()
+    {
+        inflight.fetch_add(1);
+        if (active.load() == 0)
+            return false;
+        inflight.fetch_sub(1);
+        mutex.lock();
+        return true;
+    }
+
+    void WriteEnd(bool tracked)
+    {
+        if (!tracked) {
+            inflight.fetch_sub(1);
+            return;
+        }
+        seq++;
+        mutex.unlock();
+    }
+
+    /* Lock and Unlock() are used for commits; a commit that writes
+     * finishes with WriteEnd(true) instead of Unlock(). */
+    void Lock() { mutex.lock(); }
+    void Unlock() { mutex.unlock(); }
+
+    /* The following must be called while holding the mutex. */
+
+    void Record(const leveldb::Slice& key)
+    {
+        records.push_back(std::make_pair(seq + 1, PlyvelKeyHash(key)));
+    }
+
+    void RecordBatch(const leveldb::WriteBatch& batch)
+    {
+        Recorder recorder(this);
+        batch.Iterate(&recorder);
+    }
+
+    bool Conflicts(uint64_t start, const PlyvelReadSet& reads) const
+    {
+        for (auto it = records.rbegin();
+                it != records.rend() && it->first > start; ++it) {
+            if (reads.MayContain(it->second))
+                return true;
+        }
+        return false;
+    }
+
+private:
+
+    class Recorder : public leveldb::WriteBatch::Handler
+    {
+    public:
+        explicit Recorder(PlyvelWriteTracker* tracker) : tracker(tracker) {}
+        void Put(const leveldb::Slice& key, const leveldb::Slice&)
+        {
+            tracker->Record(key);
+        }
+        void Delete(const leveldb::Slice& key)
+        {
+            tracker->Record(key);
+        }
+    private:
+        PlyvelWriteTracker* tracker;
+    };
+
+    std::atomic<int> active;
+    std::atomic<int> inflight;
+    std::mutex mutex;
+    uint64_t seq;
+    std::multiset<uint64_t> starts;
+    std::deque<std::pair<uint64_t, uint64_t>> records;
+};
+
+#endif
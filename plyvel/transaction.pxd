@@ -0,0 +1,26 @@
+# distutils: language = c++
+
+from libc.stdint cimport uint64_t
+from libcpp cimport bool
+
+from .leveldb cimport Slice, WriteBatch
+
+cdef extern from "transaction.h":
+
+    cdef cppclass PlyvelReadSet:
+        void Add(const Slice& key)
+        bool IsCompacted()
+
+    # The tracker mutex may be held while taking the GIL, so it must
+    # only be waited for without holding the GIL (Begin(), End(),
+    # WriteBegin() and Lock()).
+    cdef cppclass PlyvelWriteTracker:
+        uint64_t Begin() nogil
+        void End(uint64_t start) nogil
+        bool WriteBegin() nogil
+        void WriteEnd(bool tracked) nogil
+        void Lock() nogil
+        void Unlock() nogil
+        void Record(const Slice& key) nogil
+        void RecordBatch(const WriteBatch& batch) nogil
+        bool Conflicts(uint64_t start, const PlyvelReadSet& reads) nogil
@@ -1,3 +1,4 @@
+import os
 from os.path import join, dirname
 from setuptools import setup
 from setuptools.extension import Extension
@@ -14,16 +15,44 @@ def get_file_contents(filename):
         return fp.read()
 
 
+def leveldb_has_zstd():
+    """Check whether the LevelDB headers support Zstandard compression."""
+    include_dirs = [
+        path
+        for name in ('CPATH', 'CPLUS_INCLUDE_PATH')
+        for path in os.environ.get(name, '').split(os.pathsep) if path]
+    include_dirs += [
+        flag[2:] for flag in os.environ.get('CFLAGS', '').split()
+        if flag.startswith('-I')]
+    include_dirs += ['/usr/local/include', '/opt/homebrew/include',
+                     '/usr/include']
+    for include_dir in include_dirs:
+        path = join(include_dir, 'leveldb', 'options.h')
+        if os.path.exists(path):
+            with open(path) as fp:
+                return 'kZstdCompression' in fp.read()
+    return False
+
+
 extra_compile_args = ['-Wall', '-g', '-x', 'c++', '-std=c++11']
 
+define_macros = []
+if leveldb_has_zstd():
+    define_macros.append(('PLYVEL_HAVE_ZSTD', '1'))
+
 if platform.system() == 'Darwin':
     extra_compile_args += ['-stdlib=libc++']
 
 ext_modules = [
     Extension(
         'plyvel._plyvel',
-        sources=['plyvel/_plyvel.cpp', 'plyvel/comparator.cpp'],
-        libraries=['leveldb'],
+        sources=[
+            'plyvel/_plyvel.cpp',
+            'plyvel/comparator.cpp',
+            'plyvel/readahead.cpp',
+        ],
+        libraries=['leveldb', 'z'],
+        define_macros=define_macros,
         extra_compile_args=extra_compile_args,
     )
 ]
@@ -38,6 +67,7 @@ setup(
     author_email="wouter@bolsterl.ee",
     ext_modules=ext_modules,
     packages=['plyvel'],
+    package_data={'plyvel': ['*.pxd', '*.h']},
     license="BSD License",
     classifiers=[
         "Development Status :: 5 - Production/Stable",
@@ -50,6 +80,7 @@ setup(
         "Programming Language :: Cython",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: Free Threading :: 2 - Beta",
         "Topic :: Database",
         "Topic :: Database :: Database Engines/Servers",
         "Topic :: Software Development :: Libraries :: Python Modules",
@@ -8,6 +8,7 @@ import os
 import random
 import shutil
 import stat
+import struct
 import sys
 import tempfile
 import threading
@@ -100,6 +101,20 @@ def test_invalid_open(db_dir):
     with pytest.raises(ValueError):
         plyvel.DB(db_dir, compression='invalid', create_if_missing=True)
 
+    with pytest.raises(ValueError):
+        plyvel.DB(db_dir, compression_level=3, create_if_missing=True)
+
+
+def test_open_zstd_compression(db_dir):
+    try:
+        db = plyvel.DB(db_dir, compression='zstd', compression_level=3,
+                       create_if_missing=True)
+    except ValueError:
+        pytest.skip("LevelDB does not support zstd compression")
+    db.put(b'key', b'value' * 100)
+    assert db.get(b'key') == b'value' * 100
+    db.close()
+
 
 @pytest.mark.skipif(sys.getfilesystemencoding() != 'utf-8',
                     reason="requires UTF-8 file system encoding")
@@ -209,6 +224,73 @@ def test_delete(db):
     db.delete(key, sync=True)
 
 
+def test_hot_cache(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, hot_cache_size=64)
+    cache = db.hot_cache
+    assert cache.capacity == 64
+
+    db.put(b'key', b'value')
+    assert db.get(b'key') == b'value'
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert db.get(b'key') == b'value'
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(cache) == 1
+    assert cache.size == len(b'key') + len(b'value')
+
+    # Missing keys are not cached
+    assert db.get(b'missing', b'default') == b'default'
+    assert len(cache) == 1
+
+    # Writes invalidate cached entries
+    db.put(b'key', b'other-value')
+    assert db.get(b'key') == b'other-value'
+    db.delete(b'key')
+    assert db.get(b'key') is None
+
+    # ... also through write batches and prefixed databases
+    db.put(b'key', b'value')
+    assert db.get(b'key') == b'value'
+    with db.write_batch() as wb:
+        wb.put(b'key', b'batch-value')
+    assert db.get(b'key') == b'batch-value'
+    prefixed_db = db.prefixed_db(b'k')
+    assert prefixed_db.get(b'ey') == b'batch-value'
+    prefixed_db.put(b'ey', b'prefixed-value')
+    assert db.get(b'key') == b'prefixed-value'
+    with prefixed_db.write_batch() as wb:
+        wb.delete(b'ey')
+    assert db.get(b'key') is None
+
+    # Snapshots bypass the cache
+    db.put(b'key', b'value')
+    snapshot = db.snapshot()
+    assert db.get(b'key') == b'value'
+    db.put(b'key', b'new-value')
+    assert snapshot.get(b'key') == b'value'
+
+    # Entries are evicted in least recently used order
+    cache.clear()
+    assert len(cache) == 0 and cache.size == 0
+    for i in range(10):
+        db.put(b'key-%d' % i, b'x' * 10)
+        db.get(b'key-%d' % i)
+    assert cache.size <= cache.capacity
+    assert cache.evictions > 0
+    assert db.get(b'key-9') == b'x' * 10
+
+    # Values larger than the cache are never cached
+    db.put(b'large', b'x' * 100)
+    assert db.get(b'large') == b'x' * 100
+    assert db.get(b'large') == b'x' * 100
+    assert cache.size <= cache.capacity
+
+    db.close()
+
+    db = plyvel.DB(db_dir)
+    assert db.hot_cache is None
+    db.close()
+
+
 def test_null_bytes(db):
     key = b'key\x00\x01'
     value = b'\x00\x00\x01'
@@ -347,6 +429,417 @@ def test_iterator_closing(db):
     pytest.raises(RuntimeError, next, it)
 
 
+def test_hot_cache_edge_cases(db_dir):
+    with pytest.raises(OverflowError):
+        plyvel.DB(db_dir, create_if_missing=True, hot_cache_size=-1)
+
+    # An empty cache never stores anything
+    db = plyvel.DB(db_dir, create_if_missing=True, hot_cache_size=0)
+    db.put(b'key', b'value')
+    assert db.get(b'key') == db.get(b'key') == b'value'
+    assert (len(db.hot_cache), db.hot_cache.hits) == (0, 0)
+    db.close()
+
+    db = plyvel.DB(db_dir, hot_cache_size=1024)
+    cache = db.hot_cache
+
+    # Reads that do not fill the block cache or that verify checksums do
+    # not use the cache
+    assert db.get(b'key', fill_cache=False) == b'value'
+    assert len(cache) == 0
+    db.get(b'key')
+    assert db.get(b'key', verify_checksums=True) == b'value'
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # Closing the database empties the cache
+    db.close()
+    assert len(cache) == 0 and cache.size == 0
+    with pytest.raises(RuntimeError):
+        db.get(b'key')
+
+    # Cached keys are looked up by their bytes, not using the comparator
+    def comparator(a, b):
+        return (a.lower() > b.lower()) - (a.lower() < b.lower())
+
+    db = plyvel.DB(db_dir + '-comparator', create_if_missing=True,
+                   comparator=comparator, comparator_name=b'CaseInsensitive',
+                   hot_cache_size=1024)
+    db.put(b'key', b'1')
+    assert db.get(b'key') == b'1'
+    db.put(b'KEY', b'2')
+    assert db.get(b'key') == db.get(b'KEY') == b'2'
+    db.close()
+
+    # Keys written internally (change log truncation, value codec
+    # dictionaries) are invalidated as well
+    prefix = b'\xff\xfflog'
+    db = plyvel.DB(db_dir + '-internal', create_if_missing=True,
+                   hot_cache_size=1024, change_log_prefix=prefix)
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    log_keys = [prefix + seq.to_bytes(8, 'big') for seq in (1, 2)]
+    assert all(db.get(key) is not None for key in log_keys)
+    assert db.get(prefix) is None
+    assert db.truncate_changes(2) == 2
+    assert [db.get(key) for key in log_keys] == [None, None]
+    assert db.get(prefix) == (2).to_bytes(8, 'big')
+    db.close()
+
+    codec_prefix = b'\xff\xffcodec'
+    db = plyvel.DB(db_dir + '-codec', create_if_missing=True,
+                   hot_cache_size=1024, value_codec_prefix=codec_prefix)
+    db.put(b'a', b'value')
+    assert db.get(codec_prefix + b'\x01') is None
+    assert db.train_value_codec() == 1
+    assert db.get(codec_prefix + b'\x01') is not None
+    db.close()
+
+
+def test_iterator_closing_database(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    db.put(b'k', b'v')
+    iterators = [db.iterator() for _ in range(10)]
+    del iterators[::2]  # garbage collected iterators unregister themselves
+    iterators[0].close()
+    raw_it = db.raw_iterator()
+    db.close()
+    for it in iterators:
+        pytest.raises(RuntimeError, next, it)
+    pytest.raises(RuntimeError, raw_it.seek_to_first)
+
+
+def test_iterator_reset(db):
+    for key in (b'a1', b'a2', b'b1', b'b2', b'c1'):
+        db.put(key, b'')
+
+    it = db.iterator(include_value=False)
+    assert list(it) == [b'a1', b'a2', b'b1', b'b2', b'c1']
+    it.reset(prefix=b'b')
+    assert list(it) == [b'b1', b'b2']
+    it.reset(start=b'a2', stop=b'c1', include_start=False, reverse=True)
+    assert list(it) == [b'b2', b'b1']
+    it.reset(start=b'b')
+    assert list(it) == [b'b1', b'b2', b'c1']
+    pytest.raises(TypeError, it.reset, prefix=b'a', start=b'a')
+
+    # Writes made after creating the iterator are visible after a reset
+    db.put(b'b3', b'')
+    it.reset(prefix=b'b')
+    assert list(it) == [b'b1', b'b2', b'b3']
+
+    # ... but not for snapshot iterators
+    snapshot = db.snapshot()
+    snapshot_it = snapshot.iterator(include_value=False)
+    db.put(b'b4', b'')
+    snapshot_it.reset(prefix=b'b')
+    assert list(snapshot_it) == [b'b1', b'b2', b'b3']
+
+    prefixed_it = db.prefixed_db(b'b').iterator(include_value=False)
+    prefixed_it.reset(start=b'2', reverse=True)
+    assert list(prefixed_it) == [b'4', b'3', b'2']
+
+    it.close()
+    pytest.raises(RuntimeError, it.reset)
+
+
+def test_iterator_next_batch(db):
+    for i in range(10):
+        db.put(b'%02d' % i, b'')
+
+    it = db.iterator(include_value=False)
+    assert it.next_batch(4) == [b'00', b'01', b'02', b'03']
+    assert it.next_batch(0) == []
+    assert it.next_batch(100) == [b'04', b'05', b'06', b'07', b'08', b'09']
+    assert it.next_batch(4) == []
+    pytest.raises(ValueError, it.next_batch, -1)
+
+    it = db.iterator(include_value=False, reverse=True, start=b'05')
+    assert it.next_batch(3) == [b'09', b'08', b'07']
+    assert it.next_batch(3) == [b'06', b'05']
+
+
+def test_merge_iterators(db):
+    a = db.prefixed_db(b'a')
+    b = db.prefixed_db(b'b')
+    c = db.prefixed_db(b'c')
+    for i in range(0, 30, 2):
+        a.put(b'%02d' % i, b'a')
+    for i in range(0, 30, 3):
+        b.put(b'%02d' % i, b'b')
+    c.put(b'12', b'c')
+    c.put(b'24', b'c')
+
+    def merge(*dbs, reverse=False, **kwargs):
+        iterators = [d.iterator(reverse=reverse) for d in dbs]
+        return list(plyvel.merge_iterators(*iterators, **kwargs))
+
+    expected = sorted(
+        {b'%02d' % i for i in range(30) if i % 2 == 0 or i % 3 == 0})
+    assert merge(a, b, include_value=False) == expected
+    assert merge(a, b, include_value=False, reverse=True) == expected[::-1]
+    assert merge(b, a)[:3] == [(b'00', b'b'), (b'02', b'a'), (b'03', b'b')]
+    assert merge(a, b, include_key=False, dedupe=False)[:3] == [
+        b'a', b'b', b'a']
+
+    assert merge(a, b, c, mode='intersect') == [
+        (b'12', b'a'), (b'24', b'a')]
+    assert merge(b, a, mode='intersect', include_value=False) == [
+        b'00', b'06', b'12', b'18', b'24']
+    assert merge(a, b, mode='intersect', include_value=False,
+                 reverse=True) == [b'24', b'18', b'12', b'06', b'00']
+    assert merge(b, a, c, mode='difference', include_value=False) == [
+        b'03', b'09', b'15', b'21', b'27']
+    assert merge(c, b, mode='difference', reverse=True) == []
+
+    # Chunked output
+    it = plyvel.merge_iterators(
+        a.iterator(), b.iterator(), mode='intersect', include_value=False)
+    assert it.next_batch(3) == [b'00', b'06', b'12']
+    assert it.next_batch(3) == [b'18', b'24']
+    assert it.next_batch(3) == []
+    it.close()
+
+    with pytest.raises(TypeError):
+        plyvel.merge_iterators()
+    with pytest.raises(TypeError):
+        plyvel.merge_iterators(db.raw_iterator())
+    it = db.iterator()
+    with pytest.raises(ValueError):
+        plyvel.merge_iterators(it, it)
+    with pytest.raises(ValueError):
+        plyvel.merge_iterators(it, mode='xor')
+    with pytest.raises(ValueError):
+        plyvel.merge_iterators(it, db.iterator(reverse=True))
+
+
+def test_merge_iterators_edge_cases(db_dir):
+    def comparator(a, b):
+        return (a < b) - (a > b)
+
+    dbs = [plyvel.DB(os.path.join(db_dir, str(n)), create_if_missing=True,
+                     comparator=comparator, comparator_name=b'Reverse')
+           for n in range(2)]
+    for i in range(5):
+        dbs[0].put(b'%d' % i, b'a')
+    for i in range(2, 8):
+        dbs[1].put(b'%d' % i, b'b')
+
+    def merge(reverse=False, **kwargs):
+        iterators = [d.iterator(reverse=reverse) for d in dbs]
+        return list(plyvel.merge_iterators(*iterators, **kwargs))
+
+    # Keys are merged in comparator order
+    assert merge(include_value=False) == [b'%d' % i for i in range(7, -1, -1)]
+    assert merge(mode='intersect', include_value=False) == [b'4', b'3', b'2']
+    assert merge(mode='difference', reverse=True) == [
+        (b'0', b'a'), (b'1', b'a')]
+
+    other = plyvel.DB(os.path.join(db_dir, 'other'), create_if_missing=True)
+    with pytest.raises(ValueError):
+        plyvel.merge_iterators(dbs[0].iterator(), other.iterator())
+    other.close()
+
+    # Values of iterators with read-ahead must be included
+    with pytest.raises(ValueError):
+        plyvel.merge_iterators(
+            dbs[0].iterator(readahead=4, include_value=False))
+    assert list(plyvel.merge_iterators(
+        dbs[0].iterator(readahead=4, include_value=False),
+        include_value=False))[:2] == [b'4', b'3']
+    assert list(plyvel.merge_iterators(
+        dbs[0].iterator(), dbs[1].iterator(readahead=4, include_value=False),
+        mode='intersect'))[:1] == [(b'4', b'a')]
+
+    it = plyvel.merge_iterators(dbs[0].iterator(), dbs[1].iterator())
+    assert next(it) == (b'7', b'b')
+    pytest.raises(ValueError, it.next_batch, -1)
+    pytest.raises(TypeError, it.next_batch, 'a')
+
+    # Merging stops when one of the databases is closed
+    dbs[1].close()
+    pytest.raises(RuntimeError, next, it)
+    pytest.raises(RuntimeError, it.next_batch, 2)
+    it.close()
+
+    closed = dbs[0].iterator()
+    closed.close()
+    pytest.raises(RuntimeError, next, plyvel.merge_iterators(closed))
+    dbs[0].close()
+
+
+def test_iterator_pool(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, iterator_pool_size=2)
+    db.put(b'a', b'1')
+
+    iterators = [db.iterator() for _ in range(3)]
+    for it in iterators:
+        assert list(it) == [(b'a', b'1')]
+        it.close()
+
+    # Pooled iterators must not hide writes
+    with db.iterator(prefix=b'a') as it:
+        assert list(it) == [(b'a', b'1')]
+    db.put(b'a', b'2')
+    with db.iterator(prefix=b'a') as it:
+        assert list(it) == [(b'a', b'2')]
+    with db.write_batch() as wb:
+        wb.put(b'b', b'3')
+    with db.iterator() as it:
+        assert list(it) == [(b'a', b'2'), (b'b', b'3')]
+    db.delete(b'b')
+    with db.iterator(reverse=True) as it:
+        assert list(it) == [(b'a', b'2')]
+
+    # Snapshot iterators are never pooled
+    snapshot = db.snapshot()
+    db.put(b'c', b'4')
+    with snapshot.iterator() as it:
+        assert list(it) == [(b'a', b'2')]
+    with db.iterator() as it:
+        assert list(it) == [(b'a', b'2'), (b'c', b'4')]
+
+    db.close()
+
+
+def test_iterator_pool_edge_cases(db_dir):
+    with pytest.raises(OverflowError):
+        plyvel.DB(db_dir, create_if_missing=True, iterator_pool_size=-1)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, iterator_pool_size=1)
+    it = db.iterator(include_value=False)
+    pytest.raises(TypeError, it.reset, start='a')
+    pytest.raises(TypeError, it.reset, prefix=1)
+    pytest.raises(TypeError, it.reset, include_value=False)
+    it.close()
+
+    # Pooled iterators see writes made in any way
+    def keys():
+        with db.iterator(include_value=False) as it:
+            return list(it)
+
+    db.put(b'a', b'')
+    assert keys() == [b'a']
+    with db.transaction() as txn:
+        txn.put(b'b', b'')
+    assert keys() == [b'a', b'b']
+    db.put_many({b'c': b''})
+    assert keys() == [b'a', b'b', b'c']
+    db.counter_add(b'd')
+    db.flush_merges()
+    assert keys() == [b'a', b'b', b'c', b'd']
+    db.prefixed_db(b'e').delete(b'')
+    db.prefixed_db(b'a').delete(b'')
+    assert keys() == [b'b', b'c', b'd']
+
+    it = db.iterator()
+    db.close()
+    pytest.raises(RuntimeError, it.reset)
+    pytest.raises(RuntimeError, db.iterator)
+
+
+def test_iterator_reset_comparator(db_dir):
+    def comparator(a, b):
+        return (a < b) - (a > b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'Reverse', iterator_pool_size=1)
+    for key in (b'a1', b'a2', b'b1', b'b2', b'c1'):
+        db.put(key, b'')
+    it = db.iterator(include_value=False)
+    assert list(it) == [b'c1', b'b2', b'b1', b'a2', b'a1']
+    it.reset(start=b'b2', stop=b'a1')
+    assert list(it) == [b'b2', b'b1', b'a2']
+    it.reset(start=b'b2', stop=b'a1', include_start=False, reverse=True)
+    assert list(it) == [b'a2', b'b1']
+    it.close()
+    with db.iterator(start=b'b1', include_value=False) as it:
+        assert list(it) == [b'b1', b'a2', b'a1']
+    db.close()
+
+
+def test_iterator_readahead(db):
+    keys = [b'key-%03d' % i for i in range(200)]
+    for key in keys:
+        db.put(key, key + b'-value')
+
+    with db.iterator(readahead=8) as it:
+        assert list(it) == [(k, k + b'-value') for k in keys]
+
+    with db.iterator(readahead=1, include_value=False, start=b'key-010',
+                     stop=b'key-020', include_start=False,
+                     include_stop=True) as it:
+        assert list(it) == keys[11:21]
+
+    with db.prefixed_db(b'key-1').iterator(readahead=4) as it:
+        assert next(it) == (b'00', b'key-100-value')
+
+    snapshot = db.snapshot()
+    db.delete(b'key-000')
+    with snapshot.iterator(readahead=4, include_value=False) as it:
+        assert list(it) == keys
+
+    # Moving around stops read-ahead, and leaves the iterator where
+    # it would have been without read-ahead.
+    it = db.iterator(readahead=16, include_value=False)
+    assert next(it) == b'key-001'
+    assert next(it) == b'key-002'
+    assert it.prev() == b'key-002'
+    assert it.prev() == b'key-001'
+    assert next(it) == b'key-001'
+    it.seek(b'key-150')
+    assert next(it) == b'key-150'
+    it.seek_to_start()
+    assert next(it) == b'key-001'
+    it.close()
+
+    # Closing the database stops read-ahead threads
+    it = db.iterator(readahead=2)
+    next(it)
+
+
+def test_iterator_readahead_comparator(db_dir):
+    def comparator(a, b):
+        a, b = a[::-1], b[::-1]
+        return (a > b) - (a < b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'Reverse')
+    for key in (b'a1', b'b2', b'c3', b'a4'):
+        db.put(key, b'')
+    with db.iterator(readahead=2, include_value=False, stop=b'a4') as it:
+        assert list(it) == [b'a1', b'b2', b'c3']
+    db.close()
+
+
+def test_iterator_readahead_edge_cases(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    keys = [b'%03d' % i for i in range(100)]
+    for key in keys:
+        db.put(key, b'')
+    pytest.raises(OverflowError, db.iterator, readahead=-1)
+
+    # Read-ahead continues from where batches and resets leave off, and
+    # does not see writes made after the iterator was created.
+    it = db.iterator(readahead=4, include_value=False)
+    assert next(it) == b'000'
+    db.put(b'0005', b'')
+    assert it.next_batch(5) == keys[1:6]
+    it.reset(start=b'050')
+    assert list(it) == keys[50:]
+
+    # Reverse iterators do not read ahead, but do work.
+    with db.iterator(readahead=4, reverse=True, include_value=False) as it:
+        assert [next(it) for _ in range(3)] == keys[:-4:-1]
+
+    # Iterators with read-ahead fail cleanly after closing the database.
+    it = db.iterator(readahead=3)
+    next(it)
+    db.close()
+    pytest.raises(RuntimeError, next, it)
+    pytest.raises(RuntimeError, it.next_batch, 3)
+    it.close()
+
+
 def test_iterator_return(db):
     db.put(b'key', b'value')
 
@@ -596,6 +1089,13 @@ def test_iterator_single_entry(db):
     with pytest.raises(StopIteration):
         next(it)
 
+    # Reverse iteration with the entry as (inclusive) start key
+    db.put(b'other', b'')
+    assert list(db.iterator(reverse=True, start=key, stop=b'l',
+                            include_value=False)) == [key]
+    assert list(db.iterator(reverse=True, start=key, stop=b'l',
+                            include_start=False)) == []
+
 
 def test_iterator_seeking(db):
     db.put(b'1', b'1')
@@ -753,6 +1253,287 @@ def test_iterator_prefix(db):
       prefix=b'a', include_start=False, include_stop=True)
 
 
+def test_iterator_filters(db):
+    from plyvel import Filter
+
+    for i in range(100):
+        tag = b'A' if i % 3 == 0 else b'B'
+        db.put(b'k%03d' % i, tag + struct.pack('>i', i - 50) + b'...')
+
+    def t(expected, **kwargs):
+        kwargs.update(include_value=False)
+        assert [int(k[1:]) for k in db.iterator(**kwargs)] == expected
+
+    t(list(range(0, 100, 3)), value_filter=Filter.prefix(b'A'))
+    t([7, 17, 27], stop=b'k030', key_filter=Filter.suffix(b'7'))
+    t([15, 25], key_filter=Filter.regex(rb'^k0[12]5$'))
+    t([99], value_filter=Filter.contains(b'1...', offset=1))
+    t([46, 47], value_filter=Filter.integer(
+        '<', -2, offset=1, size=4, signed=True) & Filter.integer(
+        '>', 0xfffffffb, offset=1, size=4))
+    t([0, 25, 50, 75], key_filter=Filter.stride(25))
+    t([96, 71, 46, 21], key_filter=Filter.stride(25, offset=3), reverse=True)
+    t([1, 2, 4, 5], stop=b'k006', key_filter=~Filter.suffix(b'3'),
+      value_filter=~Filter.prefix(b'A') | Filter.suffix(b'x'))
+    t([1, 11, 21], stop=b'k030', key_filter=Filter.suffix(b'1'),
+      readahead=4)
+    t([21, 51, 81], key_filter=Filter.suffix(b'1'),
+      value_filter=Filter.prefix(b'A'), readahead=4)
+    t([10, 11, 15], key_filter=Filter.prefix(b'01', offset=1) & Filter.stride(
+        5, offset=0) | Filter.suffix(b'11'), start=b'k010', stop=b'k020')
+
+    with db.iterator(key_filter=Filter.suffix(b'5'),
+                     value_filter=Filter.prefix(b'B')) as it:
+        assert next(it)[0] == b'k005'
+        assert next(it)[0] == b'k025'
+        assert it.prev()[0] == b'k025'
+        assert it.prev()[0] == b'k005'
+        assert it.next_batch(2) == [
+            (b'k005', b'B\xff\xff\xff\xd3...'),
+            (b'k025', b'B\xff\xff\xff\xe7...')]
+        it.reset(start=b'k070')
+        assert it.next_batch(10)[0][0] == b'k085'
+
+    prefixed_db = db.prefixed_db(b'k09')
+    assert list(prefixed_db.iterator(
+        key_filter=Filter.prefix(b'9'), include_value=False)) == [b'9']
+    with db.snapshot() as sn:
+        assert list(sn.iterator(
+            key_filter=Filter.suffix(b'99'), include_value=False)) == [
+            b'k099']
+
+    pytest.raises(TypeError, Filter)
+    pytest.raises(TypeError, db.iterator, key_filter=b'k')
+    pytest.raises(ValueError, Filter.regex, b'[')
+    pytest.raises(ValueError, Filter.integer, '=', 1)
+    pytest.raises(ValueError, Filter.integer, '==', 1, size=3)
+    pytest.raises(OverflowError, Filter.integer, '==', 256, size=1)
+    pytest.raises(OverflowError, Filter.integer, '==', -1)
+    pytest.raises(ValueError, Filter.stride, 0)
+    pytest.raises(ValueError, Filter.stride, 2, offset=2)
+
+
+def test_iterator_filters_regex_limits(db):
+    Filter = plyvel.Filter
+    db.put(b'0', b'x')
+    db.put(b'a' * 200000, b'a' * 200000)
+    db.put(b'b' * 1024, b'x')
+    db.put(b'c', b'x')
+
+    # Regular expressions cannot be used on values, which can be large.
+    pattern = Filter.regex(b'^(a|b)*$')
+    for value_filter in (pattern, ~pattern, Filter.prefix(b'x') | pattern):
+        with pytest.raises(ValueError):
+            db.iterator(value_filter=value_filter)
+
+    # Long keys are not matched, even in negations, nor in the fast path
+    # that skips entries without the GIL.
+    for key_filter in (pattern, ~pattern):
+        with pytest.raises(ValueError):
+            list(db.iterator(key_filter=key_filter, include_value=False))
+    with db.iterator(start=b'b', key_filter=pattern,
+                     include_value=False) as it:
+        assert next(it) == b'b' * 1024
+        with pytest.raises(StopIteration):
+            next(it)
+
+    # Filters that exclude long keys first do not fail.
+    assert list(db.iterator(
+        key_filter=Filter.prefix(b'b') & pattern, include_value=False)) == [
+        b'b' * 1024]
+    assert list(db.iterator(
+        reverse=True, key_filter=Filter.prefix(b'c') & ~pattern,
+        include_value=False)) == [b'c']
+
+
+def test_iterator_filters_edge_cases(db_dir):
+    Filter = plyvel.Filter
+
+    # Deeply nested filters are rejected instead of overflowing the stack
+    f = Filter.prefix(b'0')
+    for _ in range(998):
+        f = f | Filter.prefix(b'1')
+    f = ~f
+    with pytest.raises(ValueError):
+        ~f
+    with pytest.raises(ValueError):
+        f & Filter.prefix(b'0')
+    with pytest.raises(ValueError):
+        Filter.prefix(b'0') | f
+
+    pytest.raises(TypeError, Filter.stride, 'a')
+    pytest.raises(OverflowError, Filter.stride, -1)
+    pytest.raises(OverflowError, Filter.stride, 2, offset=-1)
+    pytest.raises(OverflowError, Filter.prefix, b'', offset=-1)
+    pytest.raises(TypeError, Filter.prefix, 'a')
+    pytest.raises(TypeError, Filter.integer, '==', b'1')
+    pytest.raises(ValueError, Filter.integer, '==', 1, byteorder='middle')
+    pytest.raises(OverflowError, Filter.integer, '<', -129, size=1,
+                  signed=True)
+    with pytest.raises(TypeError):
+        Filter.prefix(b'a') & b'a'
+    with pytest.raises(TypeError):
+        b'a' | Filter.prefix(b'a')
+
+    db = plyvel.DB(db_dir, create_if_missing=True, iterator_pool_size=2,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    db.put_many((b'%02d' % i, bytes([i])) for i in range(100))
+
+    def t(expected, it):
+        assert [k for k, _ in it] == expected
+
+    assert len(list(db.iterator(key_filter=f))) == 80
+    nines = [b'99', b'89', b'79', b'69', b'59', b'49']
+    t(nines, db.iterator(key_filter=Filter.suffix(b'9'),
+                         value_filter=Filter.integer('>', 40, size=1),
+                         stop=b'40'))
+    t(nines, db.iterator(key_filter=Filter.regex(b'9$') & ~Filter.regex(
+        b'^[0-3]'), value_filter=Filter.integer('>', 0, size=1), readahead=2,
+        start=b'99', stop=b'40'))
+    t([b'00', b'09'], db.iterator(key_filter=Filter.stride(9), reverse=True,
+                                  start=b'09'))
+    t([], db.iterator(value_filter=Filter.integer('==', 1, size=2)))
+    t([b'00'], db.iterator(value_filter=Filter.integer('==', 0, size=1),
+                           key_filter=Filter.contains(b'')))
+    with db.snapshot() as sn:
+        db.delete(b'77')
+        t([b'77'], sn.iterator(key_filter=Filter.prefix(b'77')))
+        t([], db.iterator(key_filter=Filter.prefix(b'77')))
+
+    with pytest.raises(ValueError):
+        db.iterator(value_filter=Filter.prefix(b'a') | Filter.regex(b'a'))
+
+    it = db.iterator(key_filter=Filter.suffix(b'5'))
+    assert next(it)[0] == b'95'
+    db.close()
+    with pytest.raises(RuntimeError):
+        next(it)
+    with pytest.raises(RuntimeError):
+        db.iterator(key_filter=Filter.suffix(b'5'))
+
+
+def test_distinct_prefixes(db):
+    keys = [
+        b'a', b'a/1', b'a/2/x', b'a/2/y', b'b/1', b'b/1/z', b'c//d',
+        b'\xff/1', b'\xff/2',
+    ]
+    for key in keys:
+        db.put(key, b'')
+
+    # Keys with fewer delimiters (such as b'a') are skipped.
+    assert db.distinct_prefixes() == [b'a/', b'b/', b'c/', b'\xff/']
+    assert db.distinct_prefixes(depth=2) == [b'a/2/', b'b/1/', b'c//']
+    assert db.distinct_prefixes(b'//') == [b'c//']
+    assert db.distinct_prefixes(start=b'a/', stop=b'c') == [b'a/', b'b/']
+    pytest.raises(ValueError, db.distinct_prefixes, b'')
+    pytest.raises(ValueError, db.distinct_prefixes, depth=0)
+
+    prefixed_db = db.prefixed_db(b'a/')
+    assert prefixed_db.distinct_prefixes() == [b'2/']
+    assert prefixed_db.distinct_prefixes(start=b'2') == [b'2/']
+
+    snapshot = db.snapshot()
+    db.put(b'd/1', b'')
+    assert b'd/' in db.distinct_prefixes()
+    assert snapshot.distinct_prefixes() == [b'a/', b'b/', b'c/', b'\xff/']
+
+    empty = db.prefixed_db(b'nothing-here')
+    assert empty.distinct_prefixes() == []
+
+
+def test_distinct_prefixes_edge_cases(db_dir):
+    def comparator(a, b):
+        # Reverse order, so groups are not contiguous in bytewise order.
+        return (a < b) - (a > b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'Reverse')
+    for key in (b'a/1', b'a/2', b'a', b'b/1/x', b'b/2', b'c', b'p/a/1',
+                b'p/b'):
+        db.put(key, b'')
+
+    # Custom comparators scan all keys, in the order of the comparator.
+    assert db.distinct_prefixes() == [b'p/', b'b/', b'a/']
+    assert db.distinct_prefixes(depth=2) == [b'p/a/', b'b/1/']
+    assert db.distinct_prefixes(start=b'b/2') == [b'b/', b'a/']
+    assert db.prefixed_db(b'p/').distinct_prefixes() == [b'a/']
+    assert db.distinct_prefixes(b'-') == []
+
+    # Sampling cannot interpolate keys with a custom comparator.
+    assert db.sample_keys(5) == [b'p/b']
+    assert db.sample_keys(5, start=b'b/2', stop=b'a/1') == [b'b/2']
+    assert db.sample_keys(5, start=b'a/1', stop=b'b') == []
+
+    db.close()
+    with pytest.raises(RuntimeError):
+        db.distinct_prefixes()
+    with pytest.raises(RuntimeError):
+        db.sample_keys(1)
+
+
+def test_distinct_prefixes_delimiters(db):
+    for key in (b'\xff', b'\xff\xff', b'\xff\xff\xff', b'\xff\xffa\xff',
+                b'a\xff', b'a\xffb', b'//', b'///x', b'x//y//z'):
+        db.put(key, b'')
+
+    # Prefixes consisting of 0xff bytes cannot be incremented to skip them
+    assert db.distinct_prefixes(b'\xff') == [b'a\xff', b'\xff']
+    assert db.distinct_prefixes(b'\xff', 2) == [b'\xff\xff']
+    assert db.distinct_prefixes(b'\xff\xff') == [b'\xff\xff']
+    assert db.prefixed_db(b'\xff').distinct_prefixes(b'\xff') == [b'\xff']
+    assert db.prefixed_db(b'\xff\xff').distinct_prefixes(b'a') == [b'a']
+    assert db.distinct_prefixes(b'\xff', stop=b'a\xff') == []
+
+    # Multi-byte delimiters do not overlap
+    assert db.distinct_prefixes(b'//') == [b'//', b'x//']
+    assert db.distinct_prefixes(b'//', 2) == [b'x//y//']
+    assert db.distinct_prefixes(depth=100) == []
+    assert db.distinct_prefixes(start=b'z', stop=b'a') == []
+    assert db.sample_keys(3, start=b'z', stop=b'a') == []
+
+    pytest.raises(TypeError, db.distinct_prefixes, '/')
+    pytest.raises(TypeError, db.distinct_prefixes, None)
+    pytest.raises(ValueError, db.distinct_prefixes, depth=-1)
+    pytest.raises(ValueError, db.sample_keys, -1)
+
+    snapshot = db.snapshot()
+    snapshot.close()
+    with pytest.raises(RuntimeError):
+        snapshot.distinct_prefixes()
+    snapshot = db.snapshot()
+    db.close()
+    with pytest.raises(RuntimeError):
+        snapshot.distinct_prefixes()
+    with pytest.raises(RuntimeError):
+        db.prefixed_db(b'a').distinct_prefixes()
+
+
+def test_sample_keys(db):
+    assert db.sample_keys(5) == []
+    pytest.raises(ValueError, db.sample_keys, 0)
+
+    keys = [b'key-%05d' % i for i in range(10000)]
+    with db.write_batch() as wb:
+        for key in keys:
+            wb.put(key, b'x' * 100)
+
+    for compact in (False, True):
+        if compact:
+            db.compact_range()
+        sample = db.sample_keys(10)
+        assert 1 < len(sample) <= 10
+        assert sample == sorted(set(sample))
+        assert all(key in keys for key in sample)
+        assert sample[0] < b'key-02000' and sample[-1] > b'key-08000'
+
+        sample = db.sample_keys(4, start=b'key-05', stop=b'key-06')
+        assert sample
+        assert all(b'key-05000' <= key < b'key-06000' for key in sample)
+
+    assert db.sample_keys(3, start=b'zzz') == []
+
+
 def test_snapshot(db):
     db.put(b'a', b'a')
     db.put(b'b', b'b')
@@ -806,6 +1587,154 @@ def test_snapshot_closing_context_manager(db):
         snapshot.get(b'a')
 
 
+def test_transaction(db):
+    db.put(b'a', b'1')
+
+    # Reads see the snapshot and the transaction's own writes
+    t1 = db.transaction()
+    t2 = db.transaction()
+    assert t1.get(b'a') == b'1'
+    t1.put(b'a', b'2')
+    t1.delete(b'b')
+    assert t1.get(b'a') == b'2'
+    assert t1.get(b'b', b'x') == b'x'
+    assert db.get(b'a') == b'1'
+    t1.commit()
+    assert t1.closed
+    assert db.get(b'a') == b'2'
+
+    # t2 read a key that t1 wrote
+    assert t2.get(b'a') == b'1'
+    t2.put(b'a', b'3')
+    with pytest.raises(plyvel.TransactionConflictError):
+        t2.commit()
+    assert db.get(b'a') == b'2'
+    with pytest.raises(RuntimeError):
+        t2.get(b'a')
+
+    # Other writes conflict as well; blind writes do not
+    with pytest.raises(plyvel.TransactionConflictError):
+        with db.transaction() as t:
+            t.get(b'a')
+            with db.write_batch() as wb:
+                wb.put(b'a', b'4')
+            t.put(b'c', b'1')
+    with db.transaction() as t:
+        t.get(b'c')
+        db.put(b'a', b'5')
+        t.put(b'a', b'6')
+    assert db.get(b'a') == b'6'
+
+    # Large read sets
+    with db.transaction() as t:
+        for i in range(10000):
+            t.get(b'key-%d' % i)
+        t.put(b'c', b'1')
+    assert db.get(b'c') == b'1'
+
+    # Rolled back on exceptions
+    with pytest.raises(ValueError):
+        with db.prefixed_db(b'p-').transaction() as t:
+            t.put(b'a', b'1')
+            raise ValueError()
+    assert db.get(b'p-a') is None
+
+
+def test_run_transaction(db):
+    def increment(t):
+        value = int(t.get(b'counter', b'0')) + 1
+        t.put(b'counter', b'%d' % value)
+        return value
+
+    def run():
+        for i in range(100):
+            db.run_transaction(increment, max_attempts=1000)
+
+    threads = [threading.Thread(target=run) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db.get(b'counter') == b'400'
+
+    def conflict(t):
+        t.get(b'counter')
+        db.put(b'counter', b'0')
+        t.put(b'other', b'1')
+
+    with pytest.raises(plyvel.TransactionConflictError):
+        db.run_transaction(conflict, max_attempts=3)
+    assert db.get(b'other') is None
+    with pytest.raises(ValueError):
+        db.run_transaction(increment, max_attempts=0)
+
+
+def test_transaction_edge_cases(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, hot_cache_size=10,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    db.put(b'a', b'1')
+    assert db.get(b'a') == b'1'
+
+    with db.transaction() as t:
+        with pytest.raises(TypeError):
+            t.get('a')
+        with pytest.raises(TypeError):
+            t.put(b'a', 'str')
+        with pytest.raises(TypeError):
+            t.put(None, b'1')
+        with pytest.raises(TypeError):
+            t.delete(1)
+        t.put(b'a', memoryview(b'2'))
+        assert t.get(b'a') == b'2'
+    # The hot cache is invalidated by commits
+    assert db.get(b'a') == b'2'
+
+    # Merge operands flushed after the transaction started conflict
+    db.merge(b'n', 1, op='add')
+    with pytest.raises(plyvel.TransactionConflictError):
+        with db.transaction() as t:
+            t.get(b'n')
+            t.put(b'other', b'1')
+    assert db.get(b'other') is None
+    with db.transaction() as t:
+        assert t.get(b'n') == (1).to_bytes(8, 'little')
+        t.put(b'other', b'1')
+
+    t = db.transaction()
+    t.rollback()
+    t.rollback()
+    assert t.closed
+    for call in [t.commit, lambda: t.get(b'a'), lambda: t.put(b'a', b''),
+                 lambda: t.delete(b'a')]:
+        with pytest.raises(RuntimeError):
+            call()
+
+    # Exceptions raised by the function roll the transaction back
+    with pytest.raises(KeyError):
+        db.run_transaction(lambda t: {}[t.put(b'a', b'3')])
+    assert db.get(b'a') == b'2'
+    with pytest.raises(ValueError):
+        db.prefixed_db(b'p').run_transaction(lambda t: None, max_attempts=-1)
+
+    reader = db.transaction()
+    reader.get(b'a')
+    writer = db.transaction()
+    writer.put(b'x', b'1')
+    db.close()
+    with pytest.raises(RuntimeError):
+        reader.get(b'a')
+    with pytest.raises(RuntimeError):
+        reader.commit()
+    with pytest.raises(RuntimeError):
+        writer.commit()
+    assert reader.closed and writer.closed
+    with pytest.raises(RuntimeError):
+        db.transaction()
+    with pytest.raises(RuntimeError):
+        db.prefixed_db(b'p').run_transaction(lambda t: None)
+
+
 def test_property(db):
     with pytest.raises(TypeError):
         db.get_property()
@@ -831,59 +1760,527 @@ def test_compaction(db):
     db.compact_range(stop=b'b')
 
 
-def test_approximate_sizes(db_dir):
-    # Write some data to a fresh database
-    db = plyvel.DB(db_dir, create_if_missing=True, error_if_exists=True)
-    value = b'a' * 100
-    with db.write_batch() as wb:
-        for i in range(1000):
-            key = bytes(i) * 100
-            wb.put(key, value)
-
-    # Close and reopen the database
-    db.close()
-    del wb, db
-    db = plyvel.DB(db_dir, create_if_missing=False)
-
-    with pytest.raises(TypeError):
-        db.approximate_size(1, 2)
+def test_compact_range_async(db_dir):
+    import concurrent.futures
 
-    with pytest.raises(TypeError):
-        db.approximate_sizes(None)
+    def files_size():
+        return sum(os.path.getsize(os.path.join(db_dir, name))
+                   for name in os.listdir(db_dir) if name.endswith('.ldb'))
 
-    with pytest.raises(TypeError):
-        db.approximate_sizes((1, 2))
+    db = plyvel.DB(db_dir, create_if_missing=True, compression=None)
+    value = b'x' * 100
+    for prefix in (b'a/', b'b/'):
+        with db.write_batch() as wb:
+            for i in range(20000):
+                wb.put(prefix + b'%08d' % i, value)
+    db.compact_range()
+    size = files_size()
+    assert size > 4000000
 
-    # Test single range
-    assert db.approximate_size(b'1', b'2') >= 0
+    with db.write_batch() as wb:
+        for i in range(20000):
+            wb.delete(b'a/%08d' % i)
+    task = db.compact_range_async(part_size=100000)
+    callback_tasks = []
+    task.add_done_callback(callback_tasks.append)
+    assert task.result(timeout=60) is None
+    assert task.done() and not task.cancelled()
+    assert task.bytes_done == task.bytes_total > 0
+    assert task.bytes_remaining == 0 and task.progress == 1.0
+    assert callback_tasks == [task]
+    assert task.cancel() is False
+    assert files_size() < size * 0.75
 
-    # Test multiple ranges
-    assert db.approximate_sizes() == []
-    assert db.approximate_sizes((b'1', b'2'))[0] >= 0
+    with db.write_batch() as wb:
+        for i in range(20000):
+            wb.delete(b'b/%08d' % i)
+    task = db.prefixed_db(b'b/').compact_async(part_size=100000)
+    assert task.cancel() is True
+    with pytest.raises(concurrent.futures.CancelledError):
+        task.result()
+    assert task.cancelled()
+    assert task.bytes_done < task.bytes_total
+
+    db.prefixed_db(b'b/').compact()
+    assert files_size() < size * 0.25
+    assert db.prefixed_db(b'c/').compact_async().result() is None
 
-    ranges = [
-        (b'1', b'3'),
-        (b'', b'\xff'),
-    ]
-    assert len(db.approximate_sizes(*ranges)) == len(ranges)
+    with pytest.raises(ValueError):
+        db.compact_range_async(part_size=0)
+    db.close()
 
 
-def test_repair_db(db_dir):
+def test_compact_range_async_edge_cases(db_dir, monkeypatch):
     db = plyvel.DB(db_dir, create_if_missing=True)
-    db.put(b'foo', b'bar')
-    db.close()
-    del db
+    with db.write_batch() as wb:
+        for i in range(20000):
+            wb.put(b'%08d' % i, b'x' * 100)
+    with pytest.raises(OverflowError):
+        db.compact_range_async(part_size=-1)
+
+    # Empty and reversed ranges
+    for start, stop in ((b'1', b'1'), (b'2', b'1')):
+        task = db.compact_range_async(start=start, stop=stop)
+        assert task.result(timeout=60) is None
+        assert task.bytes_total == 0 and task.progress == 1.0
+
+    # Failing callbacks are reported, and do not affect other callbacks
+    reported = []
+    monkeypatch.setattr(sys, 'excepthook',
+                        lambda *exc_info: reported.append(exc_info[0]))
+    called = []
+    task = db.compact_range_async(part_size=100000)
+    task.add_done_callback(lambda task: 1 / 0)
+    task.add_done_callback(called.append)
+    task.result(timeout=60)
+    task.add_done_callback(lambda task: 1 / 0)
+    task.add_done_callback(called.append)
+    assert called == [task, task]
+    assert reported == [ZeroDivisionError, ZeroDivisionError]
 
-    plyvel.repair_db(db_dir)
-    db = plyvel.DB(db_dir)
-    assert db.get(b'foo') == b'bar'
+    db.close()
+    pytest.raises(RuntimeError, db.compact_range_async)
+    pytest.raises(RuntimeError, db.prefixed_db(b'a').compact_async)
+
+    # Prefixes are not ranges with a custom comparator
+    db = plyvel.DB(os.path.join(db_dir, 'comparator'), create_if_missing=True,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    db.put(b'a', b'')
+    assert db.compact_range_async(start=b'b', stop=b'a').result() is None
+    pytest.raises(ValueError, db.prefixed_db(b'a').compact)
+    pytest.raises(ValueError, db.prefixed_db(b'a').compact_async)
+    db.close()
 
 
-def test_destroy_db(db_dir):
-    db_dir = os.path.join(db_dir, 'subdir')
+def test_warm(db_dir):
     db = plyvel.DB(db_dir, create_if_missing=True)
-    db.put(b'foo', b'bar')
-    db.close()
+    value = b'x' * 100
+    for prefix in (b'a/', b'b/'):
+        with db.write_batch() as wb:
+            for i in range(20000):
+                wb.put(prefix + b'%08d' % i, value)
+    db.compact_range()
+
+    task = db.warm(part_size=100000, threads=3)
+    callback_tasks = []
+    task.add_done_callback(callback_tasks.append)
+    assert task.result(timeout=60) is None
+    assert task.done() and not task.cancelled()
+    assert task.parts_done == task.parts_total > 1
+    assert task.progress == 1.0
+    assert task.bytes_read == 40000 * 110
+    assert callback_tasks == [task]
+
+    # Byte budget, ranges, and prefixed databases
+    task = db.warm((b'a/', b'b/'), b'b/', max_bytes=1000, threads=1,
+                   part_size=100000)
+    task.result(timeout=60)
+    assert 900 < task.bytes_read <= 1000
+    assert task.parts_done == task.parts_total
+    task = db.prefixed_db(b'b/').warm((None, b'00010000'))
+    task.result(timeout=60)
+    assert task.bytes_read == 10000 * 110
+    assert db.prefixed_db(b'c/').warm().result() is None
+
+    with pytest.raises(ValueError):
+        db.warm(threads=0)
+    with pytest.raises(ValueError):
+        db.warm(max_bytes=-1)
+    db.close()
+    with pytest.raises(RuntimeError):
+        db.warm()
+
+
+def test_warm_budget(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    with db.write_batch() as wb:
+        for i in range(20000):
+            wb.put(b'%08d' % i, b'x' * 100)
+    # Entries larger than the parts of the budget the threads take
+    large = b'y' * (4 * 1024 * 1024)
+    db.put(b'z1', large)
+    db.put(b'z2', large)
+    db.compact_range()
+
+    # The threads share the budget without exceeding it
+    for max_bytes in (0, 1, 109, 110, 12345, 500000):
+        task = db.warm(b'0', max_bytes=max_bytes, threads=8, part_size=10000)
+        task.result(timeout=60)
+        assert max_bytes - 110 < task.bytes_read <= max_bytes
+        assert task.parts_done == task.parts_total > 8
+
+    task = db.warm(b'z', max_bytes=len(large) * 3 // 2, threads=2)
+    task.result(timeout=60)
+    assert task.bytes_read == len(large) + 2
+    task = db.warm(b'z', threads=2)
+    task.result(timeout=60)
+    assert task.bytes_read == 2 * (len(large) + 2)
+    db.close()
+
+
+def test_warm_edge_cases(db_dir):
+    import concurrent.futures
+
+    def comparator(a, b):
+        return (a < b) - (a > b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'Reverse')
+    with db.write_batch() as wb:
+        for i in range(5000):
+            wb.put(b'%08d' % i, b'x' * 100)
+    db.compact_range()
+
+    # Ranges are in comparator order
+    task = db.warm(threads=2)
+    task.result(timeout=60)
+    assert task.bytes_read == 5000 * 108
+    task = db.warm((b'00004000', b'00003000'), threads=2)
+    task.result(timeout=60)
+    assert task.bytes_read == 1000 * 108
+    task = db.warm((b'00003000', b'00004000'))
+    task.result(timeout=60)
+    assert task.bytes_read == 0
+    task = db.warm(max_bytes=5000, threads=4)
+    task.result(timeout=60)
+    assert 5000 - 108 < task.bytes_read <= 5000
+
+    with pytest.raises(ValueError):
+        db.warm(b'0000')
+    with pytest.raises(ValueError):
+        db.prefixed_db(b'0').warm()
+    with pytest.raises(TypeError):
+        db.warm((1, 2))
+    with pytest.raises(TypeError):
+        db.warm((b'a',))
+    with pytest.raises(OverflowError):
+        db.warm(part_size=-1)
+
+    task = db.warm(threads=1)
+    task.cancel()
+    try:
+        task.result(timeout=60)
+    except concurrent.futures.CancelledError:
+        assert task.cancelled()
+    assert task.done()
+    db.close()
+
+
+def test_put_many(db):
+    assert db.write_pressure() == 0.0
+    assert db.put_many({b'a': b'1', b'b': b'2'}) == 2
+    assert db.put_many(((b'%03d' % i, b'x') for i in range(10)),
+                       batch_size=3, throttle=True) == 10
+    assert db.get(b'a') == b'1'
+    assert db.get(b'009') == b'x'
+
+    prefixed_db = db.prefixed_db(b'p/')
+    prefixed_db.put_many([(b'c', b'3')], sync=True)
+    assert db.get(b'p/c') == b'3'
+
+    with pytest.raises(ValueError):
+        db.put_many({}, batch_size=0)
+    with pytest.raises(TypeError):
+        db.put_many([(b'key', None)])
+
+
+def test_put_many_edge_cases(db_dir):
+    db = plyvel.DB(os.path.join(db_dir, 'default'), create_if_missing=True)
+    assert db.put_many([]) == 0
+    assert db.put_many(iter([(b'a', b'1')]), batch_size=1) == 1
+
+    for kwargs in [dict(target_pressure=-0.1), dict(target_pressure=1.5),
+                   dict(target_pressure=float('nan')),
+                   dict(max_delay=-1.0), dict(max_delay=float('nan'))]:
+        with pytest.raises(ValueError):
+            db.put_many([(b'b', b'2')], throttle=True, **kwargs)
+    assert db.get(b'b') is None
+
+    with pytest.raises(TypeError):
+        db.put_many(5)
+    with pytest.raises(TypeError):
+        db.put_many([(1, b'v')])
+    with pytest.raises(TypeError):
+        db.put_many([(b'k', 'v')])
+    with pytest.raises(TypeError):
+        db.put_many([b'ab'])
+
+    # Completed batches stay written when the iterable fails
+    def failing_items():
+        yield b'c1', b'1'
+        yield b'c2', b'2'
+        raise KeyError('boom')
+    with pytest.raises(KeyError):
+        db.put_many(failing_items(), batch_size=1)
+    assert db.get(b'c1') == b'1'
+    assert db.get(b'c2') == b'2'
+
+    def closing_items():
+        yield b'd1', b'1'
+        db.close()
+        yield b'd2', b'2'
+    with pytest.raises(RuntimeError):
+        db.put_many(closing_items())
+    with pytest.raises(RuntimeError):
+        db.put_many([])
+    with pytest.raises(RuntimeError):
+        db.prefixed_db(b'p/').put_many([])
+    with pytest.raises(RuntimeError):
+        db.write_pressure()
+
+    db = plyvel.DB(os.path.join(db_dir, 'reverse'), create_if_missing=True,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    assert db.put_many(((b'%02d' % i, b'x') for i in range(10)),
+                       batch_size=4, throttle=True) == 10
+    assert db.prefixed_db(b'p/').put_many({b'a': b'1'}) == 1
+    assert [k for k, _ in db][:2] == [b'p/a', b'09']
+    db.close()
+
+
+def test_write_pressure(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True,
+                   write_buffer_size=64 * 1024, compression=None)
+    value = b'x' * 1000
+    pressure = 0.0
+    for i in range(5000):
+        db.put(b'%08d' % (i * 7919 % 5000), value)
+        if i % 100 == 0:
+            pressure = max(pressure, db.write_pressure())
+    assert 0.0 < pressure <= 1.0
+    db.close()
+
+
+def test_approximate_sizes(db_dir):
+    # Write some data to a fresh database
+    db = plyvel.DB(db_dir, create_if_missing=True, error_if_exists=True)
+    value = b'a' * 100
+    with db.write_batch() as wb:
+        for i in range(1000):
+            key = bytes(i) * 100
+            wb.put(key, value)
+
+    # Close and reopen the database
+    db.close()
+    del wb, db
+    db = plyvel.DB(db_dir, create_if_missing=False)
+
+    with pytest.raises(TypeError):
+        db.approximate_size(1, 2)
+
+    with pytest.raises(TypeError):
+        db.approximate_sizes(None)
+
+    with pytest.raises(TypeError):
+        db.approximate_sizes((1, 2))
+
+    # Test single range
+    assert db.approximate_size(b'1', b'2') >= 0
+
+    # Test multiple ranges
+    assert db.approximate_sizes() == []
+    assert db.approximate_sizes((b'1', b'2'))[0] >= 0
+
+    ranges = [
+        (b'1', b'3'),
+        (b'', b'\xff'),
+    ]
+    assert len(db.approximate_sizes(*ranges)) == len(ranges)
+
+
+def test_approximate_sizes_prefixes(db):
+    value = b'a' * 100
+    for prefix in (b'a', b'b', b'c'):
+        with db.write_batch() as wb:
+            for i in range(1000 if prefix == b'b' else 100):
+                wb.put(prefix + b'%04d' % i, value)
+    db.compact_range()
+
+    size_a, size_b = db.approximate_sizes(b'a', b'b')
+    assert 0 <= size_a < size_b
+    assert db.approximate_size(prefix=b'b') == size_b
+    assert db.approximate_size() >= size_a + size_b
+    assert db.approximate_size(b'b') == db.approximate_sizes((b'b', None))[0]
+    assert db.approximate_sizes((None, b'a')) == [0]
+    assert db.approximate_size(prefix=b'x') == 0
+    pytest.raises(TypeError, db.approximate_size, b'a', prefix=b'a')
+    pytest.raises(TypeError, db.approximate_sizes, (b'a', 1))
+
+    prefixed_db = db.prefixed_db(b'b')
+    assert prefixed_db.approximate_size() == size_b
+    assert prefixed_db.approximate_sizes(b'', (None, None)) == [size_b] * 2
+    assert prefixed_db.approximate_size(b'0500') <= size_b
+
+
+def test_estimate_count(db):
+    assert db.estimate_count() == 0
+
+    value = b'a' * 100
+    for prefix in (b'a', b'b'):
+        with db.write_batch() as wb:
+            for i in range(10 if prefix == b'a' else 20000):
+                wb.put(prefix + b'%05d' % i, value)
+
+    # Small ranges are counted exactly
+    assert db.estimate_count(prefix=b'a') == 10
+    assert db.estimate_counts(b'a', (b'a00002', b'a00005')) == [10, 3]
+    assert db.estimate_count(prefix=b'c') == 0
+
+    db.compact_range()
+    estimate = db.estimate_count(prefix=b'b')
+    assert 10000 < estimate < 40000
+    estimate = db.estimate_count(b'b05000', b'b15000', sample_size=100)
+    assert 5000 < estimate < 20000
+
+    prefixed_db = db.prefixed_db(b'a')
+    assert prefixed_db.estimate_count() == 10
+    assert prefixed_db.estimate_counts((b'00005', None), b'0000') == [5, 10]
+
+
+def test_estimate_count_edge_cases(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    for i in range(50):
+        db.put(b'a%03d' % i, b'x')
+    assert db.estimate_count(b'a040', b'a010') == 0
+    assert db.approximate_size(b'a040', b'a010') == 0
+    assert db.estimate_count(prefix=b'') == 50
+    assert db.estimate_count(prefix=b'\xff') == 0
+    pytest.raises(ValueError, db.estimate_count, sample_size=0)
+    pytest.raises(OverflowError, db.estimate_count, sample_size=-1)
+    pytest.raises(TypeError, db.estimate_count, b'a', prefix=b'a')
+    pytest.raises(TypeError, db.estimate_counts, 1)
+    db.close()
+    for func in (db.estimate_count, db.approximate_size,
+                 db.prefixed_db(b'a').estimate_count,
+                 db.prefixed_db(b'a').approximate_size):
+        pytest.raises(RuntimeError, func)
+
+
+def test_estimate_count_comparator(db_dir):
+    def comparator(a, b):
+        return (a < b) - (a > b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'Reverse')
+    assert db.estimate_count() == db.approximate_size() == 0
+    for i in range(50):
+        db.put(b'a%03d' % i, b'x')
+    db.put(b'b', b'x')
+
+    # Unbounded ranges cover all keys in the order of the comparator.
+    assert db.estimate_count() == 51
+    assert db.estimate_counts((None, b'a010'), (b'a010', None)) == [40, 11]
+    assert db.estimate_count(b'a040', b'a010') == 30
+    db.compact_range()
+    assert db.approximate_size() > 0
+    assert db.approximate_size(b'a010', b'a040') == 0
+
+    # Prefixes assume the default key order.
+    pytest.raises(ValueError, db.estimate_count, prefix=b'a')
+    pytest.raises(ValueError, db.approximate_sizes, b'a')
+    pytest.raises(ValueError, db.prefixed_db(b'a').estimate_count)
+    pytest.raises(ValueError, db.prefixed_db(b'a').approximate_size)
+    db.close()
+
+
+def test_repair_db(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    db.put(b'foo', b'bar')
+    db.close()
+    del db
+
+    plyvel.repair_db(db_dir)
+    db = plyvel.DB(db_dir)
+    assert db.get(b'foo') == b'bar'
+
+
+def test_recompress_db(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, compression=None)
+    with db.write_batch() as wb:
+        for i in range(10000):
+            wb.put(b'%05d' % i, b'value %05d ' % i * 10)
+    db.delete(b'00000')
+    db.compact_range()
+    size = db.approximate_size(b'', b'\xff')
+    db.close()
+
+    new_db_dir = os.path.join(db_dir, 'recompressed')
+    plyvel.recompress_db(db_dir, new_db_dir, compression='snappy',
+                         block_size=8192)
+    with pytest.raises(plyvel.Error):
+        # The new database must not exist yet
+        plyvel.recompress_db(db_dir, new_db_dir)
+    with pytest.raises(ValueError):
+        plyvel.recompress_db(db_dir, new_db_dir, compression='invalid')
+
+    old_db = plyvel.DB(db_dir)
+    new_db = plyvel.DB(new_db_dir)
+    assert list(new_db) == list(old_db)
+    assert new_db.get(b'00000') is None
+    assert new_db.approximate_size(b'', b'\xff') < size / 2
+    new_db.close()
+    old_db.close()
+
+
+def test_recompress_db_edge_cases(db_dir):
+    src = os.path.join(db_dir, 'src')
+    db = plyvel.DB(src, create_if_missing=True)
+    db.put(b'a', b'1')
+    db.close()
+
+    new = os.path.join(db_dir, 'new')
+    with pytest.raises(ValueError):
+        plyvel.recompress_db(src, new, batch_size=0)
+    with pytest.raises(ValueError):
+        plyvel.recompress_db(src, new, compression_level=3)
+    with pytest.raises(TypeError):
+        plyvel.recompress_db(src, new, compression=5)
+    with pytest.raises(TypeError):
+        plyvel.recompress_db(src, new, bogus=1)
+    with pytest.raises(plyvel.Error):
+        plyvel.recompress_db(os.path.join(db_dir, 'missing'), new)
+    with pytest.raises(plyvel.Error):
+        plyvel.recompress_db(src, new, comparator=lambda a, b: 0,
+                             comparator_name=b'Other')
+    # Invalid arguments do not leave a new database behind
+    assert not os.path.exists(new)
+
+    db = plyvel.DB(src)
+    with pytest.raises(plyvel.IOError):
+        # The source database must not be open
+        plyvel.recompress_db(src, new)
+    db.close()
+
+    plyvel.recompress_db(src, new, compression=None)
+    with pytest.raises(plyvel.Error):
+        plyvel.recompress_db(src, new)
+    new_db = plyvel.DB(new)
+    assert list(new_db) == [(b'a', b'1')]
+    new_db.close()
+
+    # Custom comparators must be passed for both databases
+    comparator = lambda a, b: (a < b) - (a > b)  # noqa: E731
+    src = os.path.join(db_dir, 'reverse')
+    db = plyvel.DB(src, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'Reverse')
+    db.put_many((b'%d' % i, b'x') for i in range(5))
+    db.close()
+    new = os.path.join(db_dir, 'reverse-new')
+    plyvel.recompress_db(src, new, comparator=comparator,
+                         comparator_name=b'Reverse', compression=b'snappy',
+                         batch_size=2)
+    new_db = plyvel.DB(new, comparator=comparator, comparator_name=b'Reverse')
+    assert list(new_db.iterator(include_value=False)) == [
+        b'4', b'3', b'2', b'1', b'0']
+    new_db.close()
+
+
+def test_destroy_db(db_dir):
+    db_dir = os.path.join(db_dir, 'subdir')
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    db.put(b'foo', b'bar')
+    db.close()
     del db
 
     plyvel.destroy_db(db_dir)
@@ -939,6 +2336,1411 @@ def test_threading(db):
         t.join()
 
 
+def test_get_many(db):
+    db.put(b'a', b'1')
+    db.put(b'p/b', b'2')
+    assert db.get_many([b'a', b'b', b'p/b']) == [b'1', None, b'2']
+    assert db.get_many(iter([b'b']), default=b'') == [b'']
+    assert db.get_many([]) == []
+    pytest.raises(TypeError, db.get_many, [b'a', 'b'])
+    assert db.prefixed_db(b'p/').get_many([b'a', b'b']) == [None, b'2']
+    with db.snapshot() as sn:
+        db.put(b'a', b'3')
+        assert sn.get_many([b'a']) == [b'1']
+
+
+def test_lookup_sorted(db):
+    with db.write_batch() as wb:
+        for i in range(0, 1000, 2):
+            wb.put(b'key-%04d' % i, b'value-%d' % i)
+    keys = [b'key-%04d' % i for i in range(300, 100, -3)]
+    keys += [b'key-%04d' % i for i in range(900, 1010, 5)]
+    keys += [b'key-0600', b'', b'key-0600', b'zzz']
+    assert db.lookup_sorted(keys) == db.get_many(keys)
+    assert db.lookup_sorted(keys, default=b'')[-4:] == [
+        b'value-600', b'', b'value-600', b'']
+    assert db.lookup_sorted([]) == []
+    pytest.raises(TypeError, db.lookup_sorted, [b'a', None])
+
+    # Sparse keys (looked up without the iterator), then dense keys again
+    keys = [b'key-%04d' % i for i in range(0, 1000, 15)]
+    keys += [b'key-%04d' % i for i in range(997, 980, -1)]
+    assert db.lookup_sorted(keys) == db.get_many(keys)
+
+    db.merge(b'key-0001', b'x', op='append')
+    assert db.lookup_sorted([b'key-0002', b'key-0001']) == [
+        b'value-2', b'x']
+
+    prefixed_db = db.prefixed_db(b'key-')
+    assert prefixed_db.lookup_sorted([b'0004', b'0003']) == [
+        b'value-4', None]
+
+    with db.snapshot() as sn:
+        db.delete(b'key-0004')
+        assert db.lookup_sorted([b'key-0004']) == [None]
+        assert sn.lookup_sorted([b'key-0004']) == [b'value-4']
+
+
+def test_lookup_sorted_comparator(db_dir):
+    def reverse_comparator(a, b):
+        return (a < b) - (a > b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True,
+                   comparator=reverse_comparator, comparator_name=b'Reverse')
+    for i in range(100):
+        db.put(b'%03d' % i, b'%d' % i)
+    keys = [b'%03d' % i for i in (5, 50, 51, 52, 150, 7, 99)]
+    assert db.lookup_sorted(keys) == [
+        b'5', b'50', b'51', b'52', None, b'7', b'99']
+    db.close()
+
+
+def test_lookup_sorted_edge_cases(db_dir):
+    db = plyvel.DB(os.path.join(db_dir, 'default'), create_if_missing=True,
+                   write_buffer_size=64 * 1024)
+    rnd = random.Random(1)
+    for i in range(5000):
+        key = b'%05d' % rnd.randrange(10000)
+        if rnd.random() < 0.2:
+            db.delete(key)
+        else:
+            db.put(key, b'v' * rnd.randrange(50))
+    for _ in range(20):
+        n = rnd.choice([1, 5, 50, 500])
+        start = rnd.randrange(10000)
+        keys = [b'%05d' % (start + rnd.randrange(2 * n)) for _ in range(n)]
+        keys += [b'%05d' % rnd.randrange(10000) for _ in range(n // 5)]
+        assert db.lookup_sorted(keys) == db.get_many(keys)
+    assert db.lookup_sorted(iter([b'99999'])) == [None]
+
+    for keys in [['a'], [1], [bytearray(b'a')], 1]:
+        with pytest.raises(TypeError):
+            db.lookup_sorted(keys)
+
+    def closing_keys():
+        yield b'00001'
+        db.close()
+        yield b'00002'
+    with pytest.raises(RuntimeError):
+        db.lookup_sorted(closing_keys())
+    with pytest.raises(RuntimeError):
+        db.lookup_sorted([])
+    with pytest.raises(RuntimeError):
+        db.prefixed_db(b'0').lookup_sorted([])
+
+    db = plyvel.DB(os.path.join(db_dir, 'reverse'), create_if_missing=True,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    db.put_many((b'%02d' % i, b'%d' % i) for i in range(50))
+    db.merge(b'10', b'+', op='append')
+    prefixed_db = db.prefixed_db(b'1')
+    assert prefixed_db.lookup_sorted([b'0', b'9', b'x'], default=b'') == [
+        b'10+', b'19', b'']
+    sn = db.snapshot()
+    db.delete(b'19')
+    assert db.lookup_sorted([b'19', b'18']) == [None, b'18']
+    assert sn.lookup_sorted([b'19', b'18']) == [b'19', b'18']
+    sn.close()
+    with pytest.raises(RuntimeError):
+        sn.lookup_sorted([b'18'])
+    sn = db.snapshot()
+    db.close()
+    with pytest.raises(RuntimeError):
+        sn.lookup_sorted([b'18'])
+
+
+def test_exists(db):
+    db.put(b'a', b'1')
+    db.put(b'b', b'')
+    db.put(b'p/c', b'x' * 100000)
+    assert db.exists(b'a')
+    assert db.exists(b'b')
+    assert not db.exists(b'c')
+    assert db.exists_many([b'p/c', b'a', b'c', b'b', b'']) == [
+        True, True, False, True, False]
+    assert db.exists_many(iter([])) == []
+    pytest.raises(TypeError, db.exists_many, [b'a', None])
+
+    db.merge(b'd', 1, op='add')
+    assert db.exists(b'd')
+
+    prefixed_db = db.prefixed_db(b'p/')
+    assert prefixed_db.exists(b'c')
+    assert prefixed_db.exists_many([b'a', b'c']) == [False, True]
+
+    with db.snapshot() as sn:
+        db.delete(b'a')
+        assert not db.exists(b'a')
+        assert sn.exists(b'a')
+        assert sn.exists_many([b'a', b'c']) == [True, False]
+
+    db.close()
+    pytest.raises(RuntimeError, db.exists, b'a')
+
+
+def test_exists_edge_cases(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, iterator_pool_size=2,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    db.put_many((b'%d' % i, b'x') for i in range(10))
+    assert db.exists_many([b'3', b'1', b'9', b'x', b'']) == [
+        True, True, True, False, False]
+    assert db.exists_many([b'1', b'1']) == [True, True]
+    assert db.prefixed_db(b'1').exists_many([b'', b'0']) == [True, False]
+
+    # Pooled iterators do not return stale results
+    assert db.exists(b'3')
+    db.delete(b'3')
+    assert not db.exists(b'3')
+    db.put(b'3', b'')
+    assert db.exists(b'3')
+
+    db.merge(b'm', 1, op='add')
+    assert db.exists(b'm')
+    with db.snapshot() as sn:
+        assert sn.exists(b'm')
+        db.merge(b'n', 1, op='add')
+        # Merges after the snapshot was taken are not visible
+        assert not sn.exists(b'n')
+    assert db.exists(b'n')
+
+    for key in ['3', 3, bytearray(b'3'), None]:
+        with pytest.raises(TypeError):
+            db.exists_many([key])
+        with pytest.raises(TypeError):
+            db.exists(key)
+    with pytest.raises(TypeError):
+        db.exists_many(3)
+
+    sn = db.snapshot()
+    sn.close()
+    with pytest.raises(RuntimeError):
+        sn.exists(b'1')
+    sn = db.snapshot()
+    db.close()
+    with pytest.raises(RuntimeError):
+        sn.exists_many([b'1'])
+    with pytest.raises(RuntimeError):
+        db.exists_many([])
+    with pytest.raises(RuntimeError):
+        db.prefixed_db(b'1').exists(b'')
+
+
+def test_merge(db_dir):
+    def counter(value):
+        return int.from_bytes(value, 'little', signed=True)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, merge_buffer_size=3,
+                   merge_flush_interval=0)
+    for _ in range(5):
+        db.counter_add(b'count')
+    db.counter_add(b'count', -2)
+    db.merge(b'log', b'a', op='append')
+    db.merge(b'log', b'b', op='append')
+
+    # Pending operands are visible, but not written yet
+    assert list(db.iterator()) == []
+    assert counter(db.get(b'count')) == 3
+    assert db.get_many([b'log', b'other']) == [b'ab', None]
+
+    db.merge(b'high', 7, op='max')  # three pending keys; flushes
+    db.merge(b'high', 3, op='max')
+    db.merge(b'low', 7, op='min')
+    db.merge(b'low', 3, op='min')
+    assert db.get(b'log') == b'ab'
+    assert counter(db.get(b'high')) == 7
+    assert counter(db.get(b'low')) == 3
+
+    # Writes and batches apply pending operands first
+    db.counter_add(b'count', 10)
+    db.put(b'count', (100).to_bytes(8, 'little'))
+    db.merge(b'log', b'c', op='append')
+    with db.write_batch() as wb:
+        wb.delete(b'log')
+    assert counter(db.get(b'count')) == 100
+    assert db.get(b'log') is None
+
+    prefixed_db = db.prefixed_db(b'p/')
+    prefixed_db.counter_add(b'n', 2 ** 63 - 1)
+    prefixed_db.counter_add(b'n', 2)  # wraps around
+    assert counter(prefixed_db.get(b'n')) == -2 ** 63 + 1
+    assert prefixed_db.get_many([b'n']) == [db.get(b'p/n')]
+
+    pytest.raises(ValueError, db.merge, b'x', 1, op='multiply')
+    pytest.raises(TypeError, db.merge, b'x', b'1', op='add')
+    pytest.raises(OverflowError, db.counter_add, b'x', 2 ** 63)
+    db.put(b'text', b'abc')
+    db.counter_add(b'text')
+    pytest.raises(ValueError, db.get, b'text')
+    pytest.raises(ValueError, db.flush_merges)
+    db.flush_merges()
+    assert db.get(b'text') == b'abc'
+
+    db.counter_add(b'count')
+    db.close()
+    db = plyvel.DB(db_dir)
+    assert counter(db.get(b'count')) == 101
+    db.close()
+
+
+def test_merge_edge_cases(db_dir):
+    def counter(value):
+        return int.from_bytes(value, 'little', signed=True)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, merge_flush_interval=0)
+    pytest.raises(TypeError, db.merge, b'a', 3, op='append')
+    pytest.raises(TypeError, db.merge, b'a', 'abc', op='append')
+    pytest.raises(TypeError, db.merge, b'a', None, op='append')
+    pytest.raises(TypeError, db.merge, None, b'', op='append')
+    pytest.raises(OverflowError, db.counter_add, b'a', -2 ** 63 - 1)
+    pytest.raises(ValueError, db.merge, b'a', 1, op=None)
+    db.merge(b'a', bytearray(b'x'), op='append')
+    db.merge(b'a', memoryview(b'y'), op='append')
+    assert db.get(b'a') == b'xy'
+
+    # A different operation for the same key flushes the pending operands
+    db.counter_add(b'n', 5)
+    db.merge(b'n', 3, op='min')
+    assert counter(db.get(b'n')) == 3
+    assert db.exists(b'n')
+    with db.snapshot() as sn:
+        assert sn.get(b'a') == b'xy'
+    db.close()
+    pytest.raises(RuntimeError, db.counter_add, b'n')
+    pytest.raises(RuntimeError, db.flush_merges)
+
+    # With a custom comparator, equal keys can differ in their bytes.
+    def comparator(a, b):
+        a = a.lower()
+        b = b.lower()
+        return (a > b) - (a < b)
+
+    db = plyvel.DB(os.path.join(db_dir, 'comparator'), create_if_missing=True,
+                   comparator=comparator, comparator_name=b'CaseInsensitive',
+                   merge_flush_interval=0)
+    db.merge(b'a', b'x', op='append')
+    assert db.get(b'A') == b'x'
+    db.merge(b'a', b'y', op='append')
+    assert db.exists(b'A')
+    db.merge(b'a', b'z', op='append')
+    assert db.get_many([b'A']) == [b'xyz']
+    db.merge(b'a', b'!', op='append')
+    db.put(b'A', b'new')
+    db.flush_merges()
+    assert db.get(b'a') == b'new'
+    db.close()
+
+    # Closing finishes even if pending operands cannot be applied
+    path = os.path.join(db_dir, 'invalid')
+    with pytest.raises(ValueError):
+        with plyvel.DB(path, create_if_missing=True) as db:
+            db.put(b'k', b'abc')
+            db.merge(b'k', 1, op='add')
+            db.counter_add(b'n', 2)
+    assert db.closed
+    db = plyvel.DB(path)
+    assert db.get(b'k') == b'abc'
+    assert counter(db.get(b'n')) == 2
+    db.close()
+
+
+@pytest.mark.parametrize('partitioner', ['hash', 'range'])
+def test_sharded_db(db_dir, partitioner):
+    paths = [os.path.join(db_dir, str(n)) for n in range(3)]
+    with plyvel.ShardedDB(paths, partitioner=partitioner,
+                          create_if_missing=True) as sdb:
+        keys = [bytes([n]) + b'key' for n in range(0, 256, 5)]
+        with sdb.write_batch() as wb:
+            for key in keys:
+                wb.put(key, key.upper())
+        sdb.put(b'\x01', b'v')
+        sdb.delete(keys[0])
+        keys = sorted(keys[1:] + [b'\x01'])
+
+        # All shards are used, and keys can be found
+        assert all(next(iter(db), None) is not None for db in sdb.shards)
+        assert sdb.get(b'\x01') == b'v'
+        assert sdb.get(keys[-1]) == keys[-1].upper()
+        assert sdb.get_many([keys[3], b'missing', b'\x01']) == [
+            keys[3].upper(), None, b'v']
+
+        # Iteration is ordered across shards
+        assert list(sdb.iterator(include_value=False)) == keys
+        assert list(sdb.iterator(reverse=True, include_value=False)) == \
+            keys[::-1]
+        assert list(sdb.iterator(start=keys[2], stop=keys[5])) == [
+            (k, sdb.get(k)) for k in keys[2:5]]
+
+        with sdb.snapshot() as sn:
+            sdb.put(b'\x01', b'w')
+            assert sn.get(b'\x01') == b'v'
+            assert sn.get_many([b'\x01']) == [b'v']
+            assert len(list(sn)) == len(keys)
+
+        with pytest.raises(ValueError):
+            with sdb.write_batch(transaction=True) as wb:
+                wb.put(b'\x02', b'')
+                raise ValueError()
+        assert sdb.get(b'\x02') is None
+
+        # Transactions cannot span shards, but batches can be reused
+        other = next(k for k in keys
+                     if sdb.shard_index(k) != sdb.shard_index(b'\x02'))
+        with pytest.raises(ValueError):
+            with sdb.write_batch(transaction=True) as wb:
+                wb.put(b'\x02', b'')
+                wb.delete(other)
+        assert sdb.get(b'\x02') is None
+        assert sdb.get(other) is not None
+        with sdb.write_batch(transaction=True) as wb:
+            wb.put(b'\x02', b'')
+            wb.clear()
+            wb.delete(other)
+        assert sdb.get(other) is None
+
+    assert sdb.closed
+    pytest.raises(RuntimeError, sdb.get, b'\x01')
+
+
+def test_sharded_db_arguments(db_dir):
+    paths = [os.path.join(db_dir, str(n)) for n in range(2)]
+    with pytest.raises(ValueError):
+        plyvel.ShardedDB(paths, partitioner='invalid')
+    with pytest.raises(ValueError):
+        plyvel.ShardedDB(paths, partitioner='range', boundaries=[])
+    with pytest.raises(TypeError):
+        plyvel.ShardedDB(paths, boundaries=[b'm'])
+    with pytest.raises(plyvel.Error):
+        plyvel.ShardedDB(paths)  # shards do not exist
+
+
+def test_sharded_db_edge_cases(db_dir):
+    with pytest.raises(ValueError):
+        plyvel.ShardedDB([])
+    with pytest.raises(ValueError):
+        plyvel.ShardedDB(['a', 'b', 'c'], partitioner='range',
+                         boundaries=[b'n', b'm'])
+
+    def comparator(a, b):
+        return (a < b) - (a > b)
+
+    # Range boundaries are ordered using the comparator.
+    for partitioner in ('hash', 'range'):
+        paths = [os.path.join(db_dir, partitioner + str(n)) for n in range(3)]
+        sdb = plyvel.ShardedDB(paths, partitioner=partitioner,
+                               create_if_missing=True, comparator=comparator,
+                               comparator_name=b'Reverse')
+        keys = [bytes([n]) for n in range(0, 256, 17)]
+        for key in keys:
+            sdb.put(key, b'')
+        assert all(next(iter(db), None) is not None for db in sdb.shards)
+        assert list(sdb.iterator(include_value=False)) == keys[::-1]
+        assert list(sdb.iterator(reverse=True, include_value=False)) == keys
+        assert list(sdb.iterator(start=b'\x88', include_value=False)) == [
+            k for k in keys[::-1] if k <= b'\x88']
+        sdb.close()
+
+        assert sdb.closed
+        pytest.raises(RuntimeError, sdb.get_many, keys)
+        pytest.raises(RuntimeError, sdb.snapshot)
+        with pytest.raises(RuntimeError):
+            with sdb.write_batch() as wb:
+                wb.put(keys[0], b'')
+        sdb.close()
+
+    with pytest.raises(ValueError):
+        plyvel.ShardedDB(paths, partitioner='range', comparator=comparator,
+                         comparator_name=b'Reverse', boundaries=[b'a', b'b'])
+
+
+def test_ttl_db(db):
+    now = [1000.0]
+    ttl_db = plyvel.TTLDB(db.prefixed_db(b'ttl/'), sweep_interval=None,
+                          sweep_batch_size=2, clock=lambda: now[0])
+    ttl_db.put(b'a', b'1', ttl=10)
+    ttl_db.put(b'b', b'2', ttl=20)
+    ttl_db.put(b'c', b'3')
+    ttl_db.put(b'd', b'4', ttl=5)
+    ttl_db.put(b'd', b'4', ttl=30)  # leaves a stale index entry
+    ttl_db.put(b'e', b'5', ttl=5)
+    ttl_db.delete(b'e')
+    pytest.raises(ValueError, ttl_db.put, b'x', b'', ttl=0)
+
+    assert ttl_db.get(b'a') == b'1'
+    assert ttl_db.ttl(b'a') == 10
+    assert ttl_db.ttl(b'c') == -1
+    assert ttl_db.ttl(b'e') is None
+    assert ttl_db.sweep() == 0
+
+    now[0] += 15
+    assert ttl_db.get(b'a') is None
+    assert ttl_db.get(b'a', b'default') == b'default'
+    assert ttl_db.get_many([b'a', b'b', b'c']) == [None, b'2', b'3']
+    assert list(ttl_db) == [(b'b', b'2'), (b'c', b'3'), (b'd', b'4')]
+    assert list(ttl_db.iterator(start=b'c', include_value=False)) == [
+        b'c', b'd']
+
+    # Only 'a' really expired; the index entries of 'd' and 'e' are stale.
+    assert ttl_db.sweep() == 1
+    assert list(db.iterator(include_value=False)) == [
+        b'ttl/vb', b'ttl/vc', b'ttl/vd',
+        b'ttl/x' + struct.pack('>Q', 1020000) + b'b',
+        b'ttl/x' + struct.pack('>Q', 1030000) + b'd']
+
+    now[0] += 100
+    assert ttl_db.sweep(limit=1) == 1
+    assert ttl_db.sweep() == 1
+    assert list(ttl_db) == [(b'c', b'3')]
+    ttl_db.close()
+
+
+def test_ttl_db_sweeper(db):
+    with plyvel.TTLDB(db, sweep_interval=0.01) as ttl_db:
+        ttl_db.put(b'a', b'1', ttl=0.01)
+        ttl_db.put(b'b', b'2')
+        for _ in range(500):
+            if db.get(b'va') is None:
+                break
+            time.sleep(0.01)
+        assert list(db.iterator(include_value=False)) == [b'vb']
+
+
+def test_ttl_db_edge_cases(db_dir, monkeypatch):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    with pytest.raises(ValueError):
+        plyvel.TTLDB(db, sweep_batch_size=0)
+    with pytest.raises(ValueError):
+        plyvel.TTLDB(db, sweep_interval=0)
+
+    now = [1000.0]
+    ttl_db = plyvel.TTLDB(db, sweep_interval=None, clock=lambda: now[0])
+    pytest.raises(ValueError, ttl_db.put, b'a', b'', ttl=-1)
+    with pytest.raises(TypeError):
+        list(ttl_db.iterator(prefix=b'a', start=b'a'))
+
+    # Very short TTLs are rounded up to a millisecond
+    ttl_db.put(b'a', b'1', ttl=1e-6)
+    ttl_db.put(b'b', b'2', ttl=1)
+    assert ttl_db.get(b'a') == b'1'
+    now[0] += 0.001
+    assert ttl_db.get(b'a') is None
+    assert ttl_db.ttl(b'a') is None
+    assert list(ttl_db.iterator(reverse=True)) == [(b'b', b'2')]
+    assert list(ttl_db.iterator(prefix=b'b', include_key=False)) == [b'2']
+    assert ttl_db.sweep(limit=0) == 0
+    assert ttl_db.sweep() == 1
+
+    # The sweeper reports errors and keeps running
+    errors = []
+    monkeypatch.setattr(sys, 'excepthook', lambda *exc: errors.append(exc))
+    prefixed_db = db.prefixed_db(b'ttl/')
+    plyvel.TTLDB(prefixed_db, sweep_interval=None,
+                 clock=lambda: now[0]).put(b'c', b'3', ttl=1)
+    now[0] += 2
+    fail = [True]
+
+    def failing_clock():
+        if fail[0]:
+            fail[0] = False
+            raise KeyError('clock')
+        return now[0]
+
+    ttl_db = plyvel.TTLDB(prefixed_db, sweep_interval=0.01,
+                          clock=failing_clock)
+    deadline = time.monotonic() + 10
+    while prefixed_db.get(b'vc') is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    ttl_db.close()
+    assert [exc[0] for exc in errors] == [KeyError]
+
+    # The sweeper stops when the database is closed
+    with plyvel.TTLDB(db, sweep_interval=0.01) as ttl_db:
+        db.close()
+        ttl_db._sweeper.join(10)
+        assert not ttl_db._sweeper.is_alive()
+        pytest.raises(RuntimeError, ttl_db.get, b'b')
+        pytest.raises(RuntimeError, ttl_db.put, b'b', b'')
+    pytest.raises(RuntimeError, plyvel.TTLDB, db)
+
+    db = plyvel.DB(os.path.join(db_dir, 'comparator'), create_if_missing=True,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    with pytest.raises(ValueError):
+        plyvel.TTLDB(db)
+    with pytest.raises(ValueError):
+        plyvel.TTLDB(db.prefixed_db(b'ttl/'))
+    db.close()
+
+
+def test_indexed_collection(db):
+    users = plyvel.IndexedCollection(db.prefixed_db(b'users/'), indexes={
+        'country': slice(0, 2),
+        'tags': lambda value: value[3:].split(b',') if value[3:] else None,
+    })
+    assert users.indexes == ('country', 'tags')
+    users.put(b'alice', b'nl:a,b')
+    users.put(b'bob', b'de:b')
+    with users.write_batch() as wb:
+        wb.put(b'carol', b'nl:')
+        wb.put(b'dave', b'be:a')
+        wb.put(b'eve', b'us:c')
+        wb.delete(b'eve')
+    users.put(b'bob', b'nl:c')  # moves bob to other index entries
+    users.delete(b'dave')
+
+    assert users.get(b'bob') == b'nl:c'
+    assert list(users.lookup('country', b'nl')) == [
+        (b'alice', b'nl:a,b'), (b'bob', b'nl:c'), (b'carol', b'nl:')]
+    assert list(users.lookup('country', b'de')) == []
+    assert [k for k, v in users.lookup('tags', b'b')] == [b'alice']
+    assert [k for k, v in users.range('tags', b'b')] == [b'alice', b'bob']
+    assert [k for k, v in users.range('tags', hi=b'c', reverse=True)] == [
+        b'alice', b'alice']
+    pytest.raises(ValueError, users.lookup, 'missing', b'')
+
+    index_entries = list(db.iterator(prefix=b'users/i', include_value=False))
+    assert len(index_entries) == 6
+    db.delete(index_entries[0])
+    users.max_workers = 4
+    users.rebuild_indexes()
+    assert list(db.iterator(prefix=b'users/i', include_value=False)) == \
+        index_entries
+
+
+def test_indexed_collection_rebuild(db):
+    items = plyvel.IndexedCollection(db.prefixed_db(b'items/'), indexes={
+        'first': slice(0, 1),
+        'last': slice(-1, None),
+    })
+    with items.write_batch() as wb:
+        for i in range(2500):
+            wb.put(b'%05d' % i, b'%05d' % (i * 7))
+    index_entries = list(db.iterator(prefix=b'items/i', include_value=False))
+    assert len(index_entries) == 5000
+
+    # Stale entries are removed in chunks, only for the rebuilt index
+    bases = sorted({k[:len(b'items/i') + 1] for k in index_entries})
+    first, last = [[k for k in index_entries if k.startswith(base)]
+                   for base in bases]
+    with db.write_batch() as wb:
+        for key in first + last:
+            wb.put(key + b'stale', b'')
+    items.rebuild_indexes('first')
+    entries = list(db.iterator(prefix=b'items/i', include_value=False))
+    assert entries == sorted(first + last + [k + b'stale' for k in last])
+
+    items.max_workers = 3
+    items.rebuild_indexes()
+    assert list(db.iterator(prefix=b'items/i', include_value=False)) == \
+        index_entries
+    pytest.raises(ValueError, items.rebuild_indexes, 'missing')
+
+
+def test_indexed_collection_edge_cases(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    with pytest.raises(ValueError):
+        plyvel.IndexedCollection(db, {})
+    with pytest.raises(ValueError):
+        plyvel.IndexedCollection(db, {'': slice(0, 1)})
+    with pytest.raises(ValueError):
+        plyvel.IndexedCollection(db, {'a\x00': slice(0, 1)})
+    with pytest.raises(TypeError):
+        plyvel.IndexedCollection(db, {'a': 1})
+    with pytest.raises(ValueError):
+        plyvel.IndexedCollection(db, {'a': slice(0, 1)}, max_workers=-1)
+
+    items = plyvel.IndexedCollection(db, {
+        'first': slice(0, 1),
+        'length': len,
+    })
+    pytest.raises(ValueError, items.lookup, 'unknown', b'a')
+    pytest.raises(ValueError, items.range, 'unknown')
+    pytest.raises(ValueError, items.rebuild_indexes, 'unknown')
+    pytest.raises(TypeError, items.lookup, 'first', 'a')
+
+    # Invalid index values do not write anything
+    pytest.raises(TypeError, items.put, b'k1', b'a,x')
+    assert list(db) == []
+
+    items = plyvel.IndexedCollection(db, {
+        'first': slice(0, 1),
+        'tags': lambda value: value.split(b',')[1:] or None,
+    })
+    items.put(b'k1', b'a,\x00,x')
+    items.put(b'k2', b'b')
+    with pytest.raises(ValueError):
+        with items.write_batch(transaction=True) as wb:
+            wb.put(b'k3', b'a')
+            raise ValueError()
+    assert list(items.lookup('first', b'a')) == [(b'k1', b'a,\x00,x')]
+    assert list(items.lookup('tags', b'\x00')) == [(b'k1', b'a,\x00,x')]
+    assert list(items.lookup('tags', b'')) == []
+    assert list(items.range('first', b'b', b'a')) == []
+    assert list(items.range('tags', reverse=True)) == [
+        (b'k1', b'a,\x00,x'), (b'k1', b'a,\x00,x')]
+
+    # Prefixed databases with an empty prefix are sampled like others
+    items = plyvel.IndexedCollection(db.prefixed_db(b''), {
+        'first': slice(0, 1),
+    }, max_workers=4)
+    items.rebuild_indexes()
+    assert [k for k, _ in items.range('first')] == [b'k1', b'k2']
+
+    db.close()
+    pytest.raises(RuntimeError, items.put, b'k1', b'')
+    pytest.raises(RuntimeError, list, items.lookup('first', b'a'))
+    pytest.raises(RuntimeError, items.rebuild_indexes)
+
+    db = plyvel.DB(os.path.join(db_dir, 'comparator'), create_if_missing=True,
+                   comparator=lambda a, b: (a < b) - (a > b),
+                   comparator_name=b'Reverse')
+    with pytest.raises(ValueError):
+        plyvel.IndexedCollection(db, {'first': slice(0, 1)})
+    db.close()
+
+
+def test_changes(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True,
+                   change_log_prefix=b'\xff/changes/')
+    db.put(b'a', b'1')
+    db.delete(b'b')
+    with db.write_batch() as wb:
+        wb.put(b'c', b'3')
+        wb.delete(b'a')
+    db.counter_add(b'n')
+    db.flush_merges()
+
+    assert db.change_seq == 5
+    changes = list(db.changes())
+    assert changes == [
+        (1, b'a', b'1'), (2, b'b', None), (3, b'c', b'3'), (4, b'a', None),
+        (5, b'n', (1).to_bytes(8, 'little'))]
+    assert list(db.changes(since=3, chunk_size=1)) == changes[3:]
+
+    assert db.truncate_changes(2) == 2
+    assert list(db.changes()) == changes[2:]
+    assert db.truncate_changes(100) == 3
+    assert list(db.changes()) == []
+
+    # Numbering continues after reopening, even with an empty log
+    db.close()
+    db = plyvel.DB(db_dir, change_log_prefix=b'\xff/changes/')
+    assert db.change_seq == 5
+
+    feed = db.changes(since=5, wait=True, timeout=10)
+
+    def write():
+        time.sleep(0.05)
+        db.put(b'd', b'4')
+        time.sleep(0.05)
+        db.close()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    assert list(feed) == [(6, b'd', b'4')]  # ends when the db is closed
+    thread.join()
+
+    db = plyvel.DB(db_dir)
+    pytest.raises(RuntimeError, db.changes)
+    db.close()
+
+
+def test_changes_edge_cases(db_dir):
+    import asyncio
+
+    with pytest.raises(ValueError):
+        plyvel.DB(db_dir, create_if_missing=True, change_log_prefix=b'')
+    with pytest.raises(TypeError):
+        plyvel.DB(db_dir, create_if_missing=True, change_log_prefix='c/')
+    with pytest.raises(ValueError):
+        plyvel.DB(db_dir, create_if_missing=True, change_log_prefix=b'c/',
+                  comparator=lambda a, b: (a < b) - (a > b),
+                  comparator_name=b'Reverse')
+
+    db = plyvel.DB(db_dir, create_if_missing=True,
+                   change_log_prefix=b'\xff/changes/')
+    pytest.raises(ValueError, db.changes, since=-1)
+    pytest.raises(ValueError, db.changes, chunk_size=0)
+    pytest.raises(ValueError, db.changes, wait=True, timeout=-1)
+    pytest.raises(ValueError, db.truncate_changes, -1)
+    assert db.truncate_changes(0) == 0
+    assert list(db.changes(wait=True, timeout=0)) == []
+
+    # All kinds of writes are logged, with their full keys
+    db.put_many({b'a': b'1'})
+    db.prefixed_db(b'p/').put(b'b', b'2')
+    with db.transaction() as tx:
+        tx.put(b'c', b'3')
+    assert list(db.changes()) == [
+        (1, b'a', b'1'), (2, b'p/b', b'2'), (3, b'c', b'3')]
+    assert list(db.changes(since=100)) == []
+    assert db.truncate_changes(100) == 3
+    assert db.change_seq == 3
+
+    async def read():
+        return [change async for change in db.changes()]
+
+    db.put(b'd', b'4')
+    assert asyncio.run(read()) == [(4, b'd', b'4')]
+
+    feed = db.changes(wait=True)
+    db.close()
+    pytest.raises(RuntimeError, db.changes)
+    pytest.raises(RuntimeError, db.truncate_changes, 1)
+    pytest.raises(RuntimeError, list, feed)
+
+
+def test_changes_truncate_iterator_pool(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, iterator_pool_size=2,
+                   change_log_prefix=b'\xff/changes/')
+    for i in range(5):
+        db.put(b'%d' % i, b'x')
+    assert [seq for seq, _, _ in db.changes()] == [1, 2, 3, 4, 5]
+
+    # Pooled iterators created before truncating must not be reused.
+    assert db.truncate_changes(2) == 2
+    assert [seq for seq, _, _ in db.changes()] == [3, 4, 5]
+    assert list(db.iterator(
+        start=b'\xff/changes/' + (1).to_bytes(8, 'big'),
+        stop=b'\xff/changes/' + (3).to_bytes(8, 'big'))) == []
+    assert db.truncate_changes(5) == 3
+    assert list(db.changes()) == []
+
+    db.close()
+    with pytest.raises(RuntimeError):
+        db.truncate_changes(1)
+
+
+def test_stats(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, instrument=True)
+    events = []
+
+    def begin(operation, key):
+        events.append((operation, key))
+        return operation
+
+    def end(context, error):
+        events.append((context, type(error)))
+
+    db.put(b'a', b'123')
+    db.set_trace_hooks(begin, end)
+    assert db.get(b'a') == b'123'
+    assert db.get(b'b', b'default') == b'default'
+    db.get_many([b'a', b'b'])
+    db.delete(b'a')
+    with db.write_batch() as wb:
+        wb.put(b'c', b'3')
+    db.prefixed_db(b'c').get(b'')
+    with db.iterator() as it:
+        list(it)
+    db.snapshot().close()
+    db.set_trace_hooks()
+    db.get(b'a')
+
+    assert events == [
+        ('get', b'a'), ('get', type(None)),
+        ('get', b'b'), ('get', type(None)),
+        ('get_many', [b'a', b'b']), ('get_many', type(None)),
+        ('delete', b'a'), ('delete', type(None)),
+        ('write', None), ('write', type(None)),
+        ('get', b'c'), ('get', type(None)),
+        ('iterator', None), ('iterator', type(None)),
+        ('snapshot', None), ('snapshot', type(None)),
+    ]
+
+    stats = db.stats()
+    assert stats['get']['count'] == 4
+    assert stats['get']['bytes'] == 1 + 3 + 1 + 1 + 1 + 1
+    assert stats['put']['count'] == 1
+    assert stats['put']['bytes'] == 4
+    assert stats['get_many']['bytes'] == 1 + 3 + 1
+    assert stats['write']['count'] == 1
+    for operation in ('get', 'put', 'delete', 'snapshot'):
+        entry = stats[operation]
+        assert entry['errors'] == 0
+        assert 0 < entry['nogil_time'] <= entry['time']
+        assert sum(entry['histogram'].values()) == entry['count']
+
+    db.reset_stats()
+    assert db.stats()['get']['count'] == 0
+
+    with pytest.raises(TypeError):
+        db.set_trace_hooks(begin)
+    db.close()
+    with pytest.raises(RuntimeError):
+        db.get(b'a')
+
+    db = plyvel.DB(db_dir)
+    pytest.raises(RuntimeError, db.stats)
+    pytest.raises(RuntimeError, db.set_trace_hooks, begin, end)
+    db.close()
+
+
+def test_stats_edge_cases(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, instrument=True,
+                   merge_flush_interval=0)
+    events = []
+
+    def failing_begin(operation, key):
+        raise KeyError(operation)
+
+    def end(context, error):
+        events.append((context, type(error)))
+
+    def failing_end(context, error):
+        raise KeyError(context)
+
+    with pytest.raises(TypeError):
+        db.set_trace_hooks(1, 2)
+    with pytest.raises(TypeError):
+        db.set_trace_hooks(end=end)
+
+    # Exceptions raised by hooks propagate
+    db.set_trace_hooks(failing_begin, end)
+    pytest.raises(KeyError, db.put, b'a', b'1')
+    db.set_trace_hooks(lambda operation, key: operation, failing_end)
+    pytest.raises(KeyError, db.put, b'b', b'2')
+    db.set_trace_hooks()
+    assert db.get(b'a') is None
+    assert db.get(b'b') == b'2'
+    assert events == []
+
+    # Errors raised by operations are counted and passed to the end hook
+    db.reset_stats()
+    db.set_trace_hooks(lambda operation, key: operation, end)
+    db.put(b'text', b'abc')
+    db.counter_add(b'text')
+    pytest.raises(ValueError, db.get, b'text')
+    pytest.raises(ValueError, db.get_many, [b'text'])
+    assert events == [
+        ('put', type(None)), ('get', ValueError), ('get_many', ValueError)]
+    stats = db.stats()
+    assert (stats['get']['count'], stats['get']['errors']) == (1, 1)
+    assert (stats['get_many']['count'], stats['get_many']['errors']) == (1, 1)
+    assert stats['put']['errors'] == 0
+    pytest.raises(ValueError, db.flush_merges)
+
+    # Statistics remain available after closing
+    db.close()
+    assert db.stats()['put']['count'] == 1
+    db.reset_stats()
+    assert db.stats()['put']['count'] == 0
+
+
+def test_trace_hooks_replaced(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, instrument=True)
+    events = []
+
+    def begin(operation, key):
+        # Replacing the hooks while an operation is traced does not
+        # affect the end hook called for it.
+        db.set_trace_hooks(other_begin, other_end)
+        events.append(('begin', operation))
+        return operation
+
+    def end(context, error):
+        events.append(('end', context))
+
+    def other_begin(operation, key):
+        db.set_trace_hooks()
+        events.append(('other_begin', operation))
+        return len(events)
+
+    def other_end(context, error):
+        events.append(('other_end', context))
+
+    db.set_trace_hooks(begin, end)
+    db.put(b'a', b'1')
+    db.get(b'a')
+    db.get(b'a')
+    assert events == [
+        ('begin', 'put'), ('end', 'put'),
+        ('other_begin', 'get'), ('other_end', 3),
+    ]
+    db.close()
+
+
+def test_value_codec(db_dir):
+    prefix = b'\xff/codec/'
+    db = plyvel.DB(db_dir, create_if_missing=True, value_codec_prefix=prefix)
+    records = {
+        b'record-%04d' % i:
+        b'{"id": %d, "name": "user %d", "email": "user%d@example.com", '
+        b'"active": true, "tags": ["a", "b"]}' % (i, i * 7, i * 13)
+        for i in range(1000)}
+    db.put_many(records)
+    assert db.get(b'record-0001') == records[b'record-0001']
+
+    assert db.train_value_codec(sample_size=100) == 1
+    db.put(b'new', records[b'record-0001'])
+    with db.write_batch() as wb:
+        wb.put(b'batch', records[b'record-0002'])
+    db.counter_add(b'counter', 3)
+    db.flush_merges()
+    db.put(b'empty', b'')
+
+    assert db.get(b'new') == records[b'record-0001']
+    assert db.get_many([b'batch', b'empty', b'missing']) == [
+        records[b'record-0002'], b'', None]
+    assert db.get(b'counter') == (3).to_bytes(8, 'little')
+    with db.snapshot() as snapshot:
+        assert snapshot.get(b'new') == records[b'record-0001']
+    with db.iterator(prefix=b'record-') as it:
+        assert dict(it) == records
+    with db.iterator(prefix=b'record-', reverse=True) as it:
+        assert it.next_batch(2) == sorted(records.items())[:-3:-1]
+    with db.raw_iterator() as it:
+        it.seek(b'new')
+        assert it.value() == records[b'record-0001']
+
+    # Training again adds a dictionary; values compressed with older
+    # dictionaries stay readable.
+    prefixed_db = db.prefixed_db(b'record-')
+    assert prefixed_db.train_value_codec(sample_size=100) == 2
+    prefixed_db.put(b'0001', b'updated')
+    assert prefixed_db.get(b'0001') == b'updated'
+    assert db.get(b'new') == records[b'record-0001']
+    db.close()
+
+    # Values are stored with a header, and (mostly) compressed
+    db = plyvel.DB(db_dir)
+    assert db.get(b'record-0003') == b'\0' + records[b'record-0003']
+    assert db.get(b'empty') == b'\0'
+    assert db.get(b'new')[:1] == b'\x01'
+    assert len(db.get(b'new')) < len(records[b'record-0001']) / 2
+    db.close()
+
+    db = plyvel.DB(db_dir, value_codec_prefix=prefix)
+    assert db.get(b'new') == records[b'record-0001']
+    assert db.get(b'record-0001') == b'updated'
+    db.close()
+
+    db = plyvel.DB(db_dir)
+    pytest.raises(RuntimeError, db.train_value_codec)
+    db.close()
+    with pytest.raises(ValueError):
+        plyvel.DB(db_dir, value_codec_prefix=b'')
+
+    # Copying into a new database compresses existing values
+    plain_db_dir = os.path.join(db_dir, 'plain')
+    new_db_dir = os.path.join(db_dir, 'recompressed')
+    with plyvel.DB(plain_db_dir, create_if_missing=True) as plain_db:
+        plain_db.put_many(records)
+    plyvel.recompress_db(plain_db_dir, new_db_dir, value_codec_prefix=prefix)
+    with plyvel.DB(new_db_dir) as new_db:
+        assert new_db.get(b'record-0003')[:1] == b'\x01'
+    with plyvel.DB(new_db_dir, value_codec_prefix=prefix) as new_db:
+        assert new_db.get(b'record-0003') == records[b'record-0003']
+    with pytest.raises(ValueError):
+        plyvel.DB(db_dir, value_codec_prefix=prefix,
+                  change_log_prefix=b'\xff/changes/')
+
+
+def test_value_codec_edge_cases(db_dir):
+    prefix = b'\xff/codec/'
+    with pytest.raises(ValueError):
+        plyvel.DB(db_dir, create_if_missing=True, value_codec_prefix=prefix,
+                  change_log_prefix=b'\xff/changes/')
+    with pytest.raises(ValueError):
+        plyvel.DB(db_dir, create_if_missing=True, value_codec_prefix=prefix,
+                  comparator=lambda a, b: (a > b) - (a < b),
+                  comparator_name=b'Custom')
+
+    db = plyvel.DB(db_dir, create_if_missing=True, value_codec_prefix=prefix)
+    with pytest.raises(ValueError):
+        # No values yet
+        db.train_value_codec()
+    db.put(b'empty', b'')
+    with pytest.raises(ValueError):
+        # Empty values are not used for training
+        db.train_value_codec()
+    db.put(b'key', b'value')
+    with pytest.raises(ValueError):
+        db.train_value_codec(sample_size=0)
+    with pytest.raises(ValueError):
+        db.train_value_codec(dictionary_size=0)
+    with pytest.raises(ValueError):
+        db.train_value_codec(dictionary_size=32769)
+    with pytest.raises(OverflowError):
+        db.train_value_codec(sample_size=-1)
+    with pytest.raises(ValueError):
+        db.prefixed_db(b'missing-').train_value_codec()
+    assert db.train_value_codec(dictionary_size=1) == 1
+    assert db.get(b'key') == b'value'
+    assert db.get(b'empty') == b''
+    db.close()
+
+    with pytest.raises(RuntimeError):
+        db.train_value_codec()
+    with pytest.raises(RuntimeError):
+        db.prefixed_db(b'p').train_value_codec()
+
+    # Without dictionaries, only values stored uncompressed can be read
+    db = plyvel.DB(db_dir)
+    db.delete(prefix + b'\x01')
+    db.close()
+    db = plyvel.DB(db_dir, value_codec_prefix=prefix)
+    assert db.get(b'empty') == b''
+    db.put(b'plain', b'value')
+    assert db.get(b'plain') == b'value'
+    db.close()
+
+    db = plyvel.DB(db_dir)
+    db.put(prefix + b'invalid', b'')
+    db.close()
+    with pytest.raises(plyvel.CorruptionError):
+        plyvel.DB(db_dir, value_codec_prefix=prefix)
+
+
+def test_remote_db(db, tmp_path):
+    from plyvel.server import serve
+
+    path = str(tmp_path / 'socket')
+    server = serve(db, path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with plyvel.RemoteDB(path) as remote:
+            remote.put(b'a', b'1')
+            with remote.write_batch() as wb:
+                for i in range(10):
+                    wb.put(b'b%d' % i, b'%d' % i)
+                wb.delete(b'b9')
+            remote.delete(b'missing')
+            assert db.get(b'b1') == b'1'
+            assert remote.get(b'a') == b'1'
+            assert remote.get(b'missing', b'default') == b'default'
+            assert remote.get_many([b'a', b'x']) == [b'1', None]
+
+            keys = list(remote.iterator(include_value=False, chunk_size=3))
+            assert keys == [b'a'] + [b'b%d' % i for i in range(9)]
+            assert list(remote.iterator(prefix=b'b', reverse=True))[:2] == [
+                (b'b8', b'8'), (b'b7', b'7')]
+
+            snapshot = remote.snapshot()
+            remote.put(b'a', b'2')
+            assert snapshot.get(b'a') == b'1'
+            assert list(snapshot.iterator(stop=b'b')) == [(b'a', b'1')]
+            snapshot.close()
+
+            pipeline = remote.pipeline()
+            pipeline.put(b'c', b'3')
+            pipeline.get(b'c')
+            pipeline.get(b'missing', b'')
+            pipeline.delete(b'c')
+            assert pipeline.execute() == [None, b'3', b'', None]
+
+            with pytest.raises(TypeError):
+                remote.get(None)
+            # The connection is still usable after errors
+            assert remote.get(b'a') == b'2'
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_remote_db_edge_cases(db, tmp_path):
+    import socket
+    from plyvel.server import serve
+
+    path = str(tmp_path / 'socket')
+    server = serve(db, path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with plyvel.RemoteDB(path) as remote:
+            # Values must be bytes-like, like for DB.put()
+            with pytest.raises(TypeError):
+                remote.put(b'a', 3)
+            with pytest.raises(TypeError):
+                remote.put(b'a', 'text')
+            with pytest.raises(TypeError):
+                remote.write_batch().put(b'a', 3)
+            remote.put(b'a', bytearray(b'1'))
+            remote.put(b'b', memoryview(b'2'))
+
+            with pytest.raises(ValueError):
+                remote.iterator(chunk_size=0)
+            with pytest.raises(TypeError):
+                remote.iterator(prefix=b'a', start=b'a')
+            with pytest.raises(ValueError):
+                with remote.write_batch(transaction=True) as wb:
+                    wb.put(b'c', b'3')
+                    raise ValueError()
+            assert remote.get(b'c') is None
+
+            # Closed snapshots and iterators cannot be used
+            snapshot = remote.snapshot()
+            remote.put(b'a', b'2')
+            snapshot.close()
+            pytest.raises(RuntimeError, snapshot.get, b'a')
+            pytest.raises(RuntimeError, snapshot.get_many, [b'a'])
+            pytest.raises(RuntimeError, snapshot.iterator)
+            it = remote.iterator(chunk_size=1)
+            assert next(it) == (b'a', b'2')
+            it.close()
+            pytest.raises(RuntimeError, next, it)
+
+        pytest.raises(RuntimeError, remote.get, b'a')
+        remote.close()
+
+        db.close()
+        with plyvel.RemoteDB(path) as remote:
+            pytest.raises(RuntimeError, remote.get, b'a')
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    # A connection is closed after a timeout
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(path)
+        sock.listen()
+        remote = plyvel.RemoteDB(path, timeout=0.05)
+        with pytest.raises(socket.timeout):
+            remote.get(b'a')
+        assert remote.closed
+        pytest.raises(RuntimeError, remote.get, b'a')
+
+
+def test_remote_db_max_frame_size(db, tmp_path):
+    from plyvel.server import serve
+
+    path = str(tmp_path / 'socket')
+    server = serve(db, path, max_frame_size=1000)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with plyvel.RemoteDB(path) as remote:
+            remote.put(b'a', b'x' * 900)
+            with pytest.raises(plyvel.ProtocolError):
+                remote.put(b'b', b'x' * 1000)
+            # The server drops the connection after a protocol error
+            with pytest.raises(ConnectionError):
+                remote.get(b'a')
+        assert db.get(b'b') is None
+
+        with plyvel.RemoteDB(path) as remote:
+            assert remote.get(b'a') == b'x' * 900
+            with pytest.raises(plyvel.ProtocolError):
+                with remote.write_batch() as wb:
+                    for i in range(100):
+                        wb.put(b'%d' % i, b'')
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_threading_close(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True, iterator_pool_size=4,
+                   hot_cache_size=1024)
+    for n in range(1000):
+        db.put(b'%05d' % n, b'v' * 100)
+
+    errors = []
+    started = threading.Barrier(4)
+
+    def run(func):
+        started.wait()
+        try:
+            while True:
+                func()
+        except RuntimeError:
+            pass
+        except Exception as exc:  # pragma: no cover
+            errors.append(exc)
+
+    def put():
+        db.put(b'%05d' % random.randint(0, 1000), b'w' * 100)
+
+    def get():
+        db.get(b'%05d' % random.randint(0, 1000))
+
+    def iterate():
+        start = b'%05d' % random.randint(0, 1000)
+        readahead = random.choice((0, 16))
+        with db.iterator(start=start, readahead=readahead) as it:
+            list(itertools.islice(it, 100))
+
+    threads = [threading.Thread(target=run, args=(func,))
+               for func in (put, get, iterate)]
+    for t in threads:
+        t.start()
+
+    # Closing the database while other threads use it makes their next
+    # operation fail, instead of crashing.
+    started.wait()
+    time.sleep(0.2)
+    db.close()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert db.closed
+
+
+def test_close_waits_without_spinning(db_dir):
+    entered = threading.Event()
+    slow = []
+
+    def comparator(a, b):
+        if slow:
+            slow.pop()
+            entered.set()
+            time.sleep(0.5)
+        return (a > b) - (a < b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'SlowComparator')
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    slow.append(True)
+    thread = threading.Thread(target=db.get, args=(b'a',))
+    thread.start()
+    assert entered.wait(10)
+
+    # close() waits for the get() to finish, without using the CPU.
+    wall, cpu = time.monotonic(), time.process_time()
+    db.close()
+    wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    thread.join()
+    assert wall > 0.2
+    assert cpu < wall / 2
+    assert db.closed
+
+
+def test_close_during_compaction_with_comparator(db_dir):
+    import subprocess
+    import textwrap
+
+    # Closing waits for the background compaction, which needs the GIL to
+    # call the comparator. Run this in another process, so that a deadlock
+    # makes the test fail instead of hang.
+    script = textwrap.dedent("""
+        import sys
+        import threading
+        import time
+        import plyvel
+
+        compacting = threading.Event()
+
+        def comparator(a, b):
+            if threading.current_thread() is not threading.main_thread():
+                compacting.set()
+                time.sleep(0.001)
+            return (a > b) - (a < b)
+
+        db = plyvel.DB(sys.argv[1], create_if_missing=True,
+                       comparator=comparator, comparator_name=b'Slow',
+                       write_buffer_size=64 * 1024)
+        for i in range(2000):
+            db.put(b'%08d' % i, b'x' * 100)
+            if compacting.is_set():
+                break
+        assert compacting.wait(30)
+        db.close()
+    """)
+    subprocess.run([sys.executable, '-c', script, db_dir], check=True,
+                   timeout=60)
+
+
+def test_close_cancels_background_tasks(db_dir):
+    import concurrent.futures
+
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    with db.write_batch() as wb:
+        for i in range(20000):
+            wb.put(b'%08d' % i, b'x' * 100)
+    db.compact_range()
+
+    tasks = [db.compact_range_async(part_size=1000),
+             db.warm(part_size=1000, threads=2)]
+    db.close()
+    for task in tasks:
+        assert task.done()
+        if task.cancelled():
+            with pytest.raises(concurrent.futures.CancelledError):
+                task.result()
+        else:
+            assert task.exception() is None
+    assert tasks[0].cancelled()
+
+    # Tasks that already finished are not affected.
+    db = plyvel.DB(db_dir)
+    task = db.warm()
+    task.result(timeout=60)
+    db.close()
+    assert task.done() and not task.cancelled()
+
+
+def test_close_edge_cases(db_dir):
+    db = plyvel.DB(db_dir, create_if_missing=True)
+    db.put(b'a', b'1')
+    wb = db.write_batch()
+    wb.put(b'b', b'2')
+
+    # Closing from several threads at once, and closing again, is fine.
+    threads = [threading.Thread(target=db.close) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db.close()
+    assert db.closed
+
+    with pytest.raises(RuntimeError):
+        wb.write()
+    with pytest.raises(RuntimeError):
+        db.snapshot()
+    with pytest.raises(RuntimeError):
+        db.get_many([b'a'])
+    with pytest.raises(RuntimeError):
+        db.put_many({b'a': b'2'})
+
+    # Closing from within a comparator would wait for itself.
+    closing = []
+
+    def comparator(a, b):
+        if closing:
+            closing.pop()
+            with pytest.raises(RuntimeError):
+                db.close()
+        return (a > b) - (a < b)
+
+    db = plyvel.DB(os.path.join(db_dir, 'comparator'), create_if_missing=True,
+                   comparator=comparator, comparator_name=b'Close')
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    closing.append(True)
+    assert db.get(b'a') == b'1'
+    assert not closing
+    assert not db.closed
+    db.close()
+
+
+def test_iterator_concurrent_use(db_dir):
+    inner = []
+
+    def comparator(a, b):
+        if inner:
+            # Called while the iterator is in use (seeking)
+            with pytest.raises(RuntimeError):
+                next(inner.pop())
+        return (a > b) - (a < b)
+
+    db = plyvel.DB(db_dir, create_if_missing=True, comparator=comparator,
+                   comparator_name=b'CheckIteratorReuse')
+    db.put(b'a', b'1')
+    db.put(b'b', b'2')
+    it = db.iterator(start=b'b')
+    inner.append(it)
+    assert next(it) == (b'b', b'2')
+    assert not inner
+    db.close()
+
+
 def test_invalid_comparator(db_dir):
     with pytest.raises(ValueError):
         plyvel.DB(db_dir, comparator=None, comparator_name=b'invalid')
@@ -1205,3 +4007,177 @@ def test_in_operator(db):
         key in iterator
     with raises():
         key not in iterator
+
+
+CYTHON_API_MODULE = '''
+# distutils: language = c++
+# distutils: libraries = leveldb
+
+from libcpp.string cimport string
+
+from plyvel._plyvel cimport DB, Iterator, Snapshot, WriteBatch
+from plyvel.leveldb cimport Slice
+
+
+def write(DB db, WriteBatch wb):
+    with nogil:
+        db.c_put(Slice(b'a', 1), Slice(b'1', 1))
+        wb.c_put(Slice(b'b', 1), Slice(b'2', 1))
+        wb.c_delete(Slice(b'c', 1))
+        wb.c_write()
+
+
+def get(DB db, bytes key):
+    cdef string value
+    if db.c_get(Slice(key, len(key)), &value):
+        return value
+    return None
+
+
+def put(DB db, bytes key, bytes value):
+    db.c_put(Slice(key, len(key)), Slice(value, len(value)))
+
+
+def delete(DB db, bytes key):
+    db.c_delete(Slice(key, len(key)))
+
+
+def write_put(WriteBatch wb, bytes key, bytes value):
+    wb.c_put(Slice(key, len(key)), Slice(value, len(value)))
+    wb.c_write()
+
+
+def snapshot_get(Snapshot sn, bytes key):
+    cdef string value
+    if sn.c_get(Slice(key, len(key)), &value):
+        return value
+    return None
+
+
+def read(Iterator it, bytes target, bint reverse):
+    cdef Slice key
+    cdef Slice value
+    result = []
+    it.c_seek(Slice(target, len(target)))
+    while it.c_prev(&key, &value) if reverse else it.c_next(&key, &value):
+        result.append((key.data()[:key.size()], value.data()[:value.size()]))
+    return result
+'''
+
+
+def test_cython_api(db, tmp_path):
+    pytest.importorskip('Cython')
+    from Cython.Build import cythonize
+    from setuptools import Distribution, Extension
+
+    source = tmp_path / 'plyvel_cython_api_test.pyx'
+    source.write_text(CYTHON_API_MODULE)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(plyvel.__file__)))
+    ext = Extension(
+        'plyvel_cython_api_test', [str(source)],
+        include_dirs=[plyvel.get_include()], extra_compile_args=['-std=c++11'])
+    dist = Distribution({'ext_modules': cythonize(
+        [ext], include_path=[root], quiet=True)})
+    cmd = dist.get_command_obj('build_ext')
+    cmd.build_lib = str(tmp_path)
+    cmd.build_temp = str(tmp_path)
+    dist.run_command('build_ext')
+
+    sys.path.insert(0, str(tmp_path))
+    try:
+        import plyvel_cython_api_test as api
+    finally:
+        sys.path.remove(str(tmp_path))
+
+    db.put(b'p/c', b'3')
+    db.put(b'p/d', b'4')
+    pdb = db.prefixed_db(b'p/')
+    api.write(db, pdb.write_batch())
+    assert api.get(db, b'a') == b'1'
+    assert api.get(db, b'p/b') == b'2'
+    assert api.get(db, b'p/c') is None
+
+    assert api.read(pdb.iterator(), b'b', False) == [
+        (b'b', b'2'), (b'd', b'4')]
+    assert api.read(pdb.iterator(), b'c', True) == [(b'b', b'2')]
+    assert api.read(db.iterator(reverse=True), b'p/b', False) == [
+        (b'a', b'1')]
+
+    # Moving back from the first key in a prefixed db stays in range
+    it = pdb.iterator()
+    it.seek(b'b')
+    pytest.raises(StopIteration, it.prev)
+
+    # Writes through the C API invalidate the hot key cache, and
+    # snapshots read through it see the state they were created with.
+    cached = plyvel.DB(str(tmp_path / 'cached'), create_if_missing=True,
+                       hot_cache_size=1024)
+    cached.put(b'a', b'1')
+    assert cached.get(b'a') == b'1'
+    sn = cached.snapshot()
+    api.put(cached, b'a', b'2')
+    assert cached.get(b'a') == b'2'
+    api.write_put(cached.write_batch(), b'a', b'3')
+    assert cached.get(b'a') == b'3'
+    api.delete(cached, b'a')
+    assert cached.get(b'a') is None
+    assert api.snapshot_get(sn, b'a') == b'1'
+    assert api.snapshot_get(sn, b'b') is None
+    sn.close()
+    pytest.raises(RuntimeError, api.snapshot_get, sn, b'a')
+    cached.close()
+
+    wb = db.write_batch()
+    it = db.iterator()
+    db.close()
+    pytest.raises(RuntimeError, api.get, db, b'a')
+    pytest.raises(RuntimeError, api.put, db, b'a', b'1')
+    pytest.raises(RuntimeError, api.delete, db, b'a')
+    pytest.raises(RuntimeError, api.write_put, wb, b'a', b'1')
+    pytest.raises(RuntimeError, api.read, it, b'a', False)
+
+
+def test_benchmark_suite(tmp_path, capsys):
+    import importlib.util
+    import json
+
+    path = os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks',
+                        'suite.py')
+    spec = importlib.util.spec_from_file_location('benchmark_suite', path)
+    suite = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(suite)
+
+    # A quick run of all benchmarks on a tiny dataset
+    args = ['--scale', '0.01', '--repeat', '1']
+    output = str(tmp_path / 'results.json')
+    assert suite.main(args + ['--output', output]) == 0
+    with open(output) as fp:
+        data = json.load(fp)
+    assert data['scale'] == 0.01
+    assert data['leveldb'] == plyvel.__leveldb_version__
+    assert set(data['results']) == {name for name, _, _, _ in suite.BENCHMARKS}
+    assert all(ops > 0 for ops in data['results'].values())
+
+    # Comparing against a baseline
+    capsys.readouterr()
+    assert suite.main(args + ['-k', 'get_hit', '--baseline', output,
+                              '--threshold', '100']) == 0
+    out = capsys.readouterr().out
+    assert 'get_hit' in out.split('change')[1]
+    assert 'REGRESSION' not in out
+
+    data['results']['get_hit'] *= 1000
+    baseline = str(tmp_path / 'baseline.json')
+    with open(baseline, 'w') as fp:
+        json.dump(data, fp)
+    assert suite.main(args + ['-k', 'get_hit', '--baseline', baseline]) == 1
+    assert 'REGRESSION' in capsys.readouterr().out
+
+    # Results of different scales are not compared
+    assert suite.main(['-k', 'get_hit', '--baseline', output]) == 1
+
+    # Invalid arguments
+    assert suite.main(args + ['-k', 'no_such_benchmark']) == 1
+    for invalid in (['--repeat', '0'], ['--scale', '0'], ['--scale', '-1']):
+        with pytest.raises(SystemExit):
+            suite.main(invalid)